@@ -0,0 +1,316 @@
+"""
+Admission control for requests that need a Gemini call.
+
+Each request spends tokens from a global bucket and from a bucket for its
+client, which bound the upstream call rate overall and per client; lower
+priorities must leave part of each bucket unspent. An admitted request then
+holds one of `max_concurrency` slots while its calls run. When every slot
+is busy it waits in a bounded queue ordered by priority (interactive filter
+queries ahead of prefetched summaries), and a full queue makes room by
+dropping its lowest-priority waiter.
+
+Requests that run out of tokens, are dropped from the queue or wait longer
+than `queue_timeout` are shed: acquire raises Overloaded at once (returning
+the tokens of a request that was charged but never admitted), and the
+caller answers with its deterministic fallback payload instead of queueing
+indefinitely or turning upstream quota errors into 500s.
+"""
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+# Lower values are served first
+PRIORITIES = {'interactive': 0, 'summary': 1, 'prefetch': 2}
+
+# Share of each token bucket a request must leave unspent, so prefetching cannot starve clicks and queries
+RESERVED_SHARE = {'interactive': 0.0, 'summary': 0.25, 'prefetch': 0.5}
+
+
+def client_id(headers, remote_addr, trusted_proxies=0):
+    """
+    The caller for per-client limits.
+
+    Clients can put anything at the front of X-Forwarded-For, so only the
+    hops appended by the `trusted_proxies` proxies in front of the app are
+    believed: the address the outermost of them saw is the client. Without
+    trusted proxies, or with fewer hops than expected, the peer address is used.
+    """
+    if trusted_proxies > 0:
+        hops = [hop.strip() for hop in headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        if len(hops) >= trusted_proxies:
+            return hops[-trusted_proxies]
+    return remote_addr or 'unknown'
+
+
+def request_priority(headers, default):
+    """A route's default priority, which an X-Request-Priority header (e.g. prefetch) may only lower."""
+    requested = headers.get('X-Request-Priority', default)
+    if requested not in PRIORITIES:
+        return default
+    return max(default, requested, key=PRIORITIES.get)
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; `reason` says why."""
+    def __init__(self, reason):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Holds up to `burst` tokens, refilled at `rate` per second.
+
+    A rate of 0 or less makes the bucket unlimited. A cost above the
+    capacity is charged as the whole capacity, so it can still be paid.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        # A bucket created after `now` was read (a new client) has nothing to refill, and must not lose tokens
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def has(self, cost, reserved_share=0.0):
+        return self.rate <= 0 or self.tokens - min(cost, self.burst) >= self.burst * reserved_share
+
+    def take(self, cost):
+        if self.rate > 0:
+            self.tokens -= min(cost, self.burst)
+
+    def give(self, cost):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + min(cost, self.burst))
+
+
+class _Waiter:
+    """
+    A queued request, woken by release() or eviction.
+
+    Threads block on an Event; coroutines await a future on their event
+    loop, which is resolved through call_soon_threadsafe so a waiting
+    request never holds a thread.
+    """
+    __slots__ = ('priority', 'admitted', 'shed', '_event', '_loop', '_future')
+
+    def __init__(self, priority, loop=None):
+        self.priority = priority
+        self.admitted = False
+        self.shed = None
+        self._loop = loop
+        self._event = threading.Event() if loop is None else None
+        self._future = loop.create_future() if loop is not None else None
+
+    def wake(self):
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self._future.done():
+            self._future.set_result(None)
+
+    def wait(self, timeout):
+        self._event.wait(timeout)
+
+    async def wait_async(self, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class AdmissionController:
+    """
+    Token-bucket rate limits and a priority queue in front of the Gemini calls.
+
+    Args:
+        rate (float): Tokens per second in the global bucket (0 for no limit).
+        burst (int): Capacity of the global bucket.
+        client_rate (float): Tokens per second in each client's bucket.
+        client_burst (int): Capacity of each client's bucket.
+        max_concurrency (int): Requests admitted at once.
+        max_queue (int): Requests that may wait for a slot.
+        queue_timeout (float): Seconds a request waits before it is shed.
+        max_clients (int): Client buckets kept, least recently seen dropped
+            first (a dropped client starts again with a full bucket).
+    """
+    def __init__(self, rate=10.0, burst=20, client_rate=2.0, client_burst=20, max_concurrency=16, max_queue=64,
+                 queue_timeout=5.0, max_clients=10000):
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_clients = max_clients
+        self._global = TokenBucket(rate, burst)
+        self._clients = OrderedDict()
+        self._active = 0
+        # (priority, sequence, waiter): the smallest entry is served next
+        self._queue = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def _client_bucket(self, client):
+        bucket = self._clients.get(client)
+        if bucket is None:
+            bucket = self._clients[client] = TokenBucket(self.client_rate, self.client_burst)
+            if len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(client)
+        return bucket
+
+    def _shed(self, reason):
+        self._counters[f'shed_{reason}'] += 1
+        return Overloaded(reason)
+
+    def _refund(self, client, cost):
+        """Return the tokens of a request that was charged but never admitted."""
+        self._global.give(cost)
+        bucket = self._clients.get(client)
+        if bucket is not None:
+            bucket.give(cost)
+
+    def acquire(self, client, priority='interactive', cost=1):
+        """
+        Admit a request, waiting for a slot if every one is busy.
+
+        Args:
+            client (str): Identifies the caller, e.g. its IP address.
+            priority (str): A key of PRIORITIES.
+            cost (int): Tokens to spend, e.g. the Gemini calls the request
+                may make.
+
+        Raises:
+            Overloaded: If the request is shed.
+        """
+        entry = self._enqueue(client, priority, cost)
+        if entry is not None:
+            entry[2].wait(self.queue_timeout)
+            self._settle(entry, client, cost)
+
+    async def acquire_async(self, client, priority='interactive', cost=1):
+        """
+        Like acquire, but waits for a slot on the running event loop instead of blocking a thread.
+
+        If the awaiting task is cancelled, its place in the queue (or a slot
+        it was handed meanwhile) is given up.
+        """
+        entry = self._enqueue(client, priority, cost, asyncio.get_running_loop())
+        if entry is None:
+            return
+        try:
+            await entry[2].wait_async(self.queue_timeout)
+        except asyncio.CancelledError:
+            self._abandon(entry, client, cost)
+            raise
+        self._settle(entry, client, cost)
+
+    def _enqueue(self, client, priority, cost, loop=None):
+        """Charge the buckets and take a free slot, or queue a waiter; returns its queue entry if it must wait."""
+        rank = PRIORITIES[priority]
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._client_bucket(client)
+            bucket.refill(now)
+            self._global.refill(now)
+            reserved = RESERVED_SHARE[priority]
+            if not bucket.has(cost, reserved):
+                raise self._shed('client_rate')
+            if not self._global.has(cost, reserved):
+                raise self._shed('global_rate')
+            bucket.take(cost)
+            self._global.take(cost)
+
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                self._counters['admitted'] += 1
+                return None
+
+            if len(self._queue) >= self.max_queue:
+                # With no queue at all (max_queue <= 0) there is no waiter to drop
+                worst = max(self._queue, default=None)
+                if worst is None or worst[0] <= rank:
+                    self._refund(client, cost)
+                    raise self._shed('queue_full')
+                # Make room by dropping the lowest-priority (and most recent) waiter
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                worst[2].shed = 'evicted'
+                worst[2].wake()
+                self._counters['shed_evicted'] += 1
+
+            entry = (rank, next(self._sequence), _Waiter(rank, loop))
+            heapq.heappush(self._queue, entry)
+            self._counters['queued'] += 1
+            return entry
+
+    def _settle(self, entry, client, cost):
+        """Return once a woken or timed-out waiter was admitted, else refund it and raise Overloaded."""
+        waiter = entry[2]
+        with self._lock:
+            if waiter.admitted:
+                self._counters['admitted'] += 1
+                return
+            self._refund(client, cost)
+            if waiter.shed is not None:
+                raise Overloaded(waiter.shed)
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            raise self._shed('queue_timeout')
+
+    def _abandon(self, entry, client, cost):
+        """Give up the queue entry of a cancelled waiter, passing on a slot it was already handed."""
+        waiter = entry[2]
+        with self._lock:
+            if not waiter.admitted:
+                self._refund(client, cost)
+                if waiter.shed is None:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                return
+        self.release()
+
+    def release(self):
+        """Free the slot of an admitted request, handing it to the next waiter."""
+        with self._lock:
+            if self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                waiter.admitted = True
+                waiter.wake()
+            else:
+                self._active -= 1
+
+    @contextmanager
+    def admit(self, client, priority='interactive', cost=1):
+        """Hold a slot for the duration of a with block (see acquire)."""
+        self.acquire(client, priority, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """Slots in use, queue length by priority and admission counters."""
+        with self._lock:
+            queued = Counter(waiter.priority for _, _, waiter in self._queue)
+            return {
+                'active': self._active,
+                'max_concurrency': self.max_concurrency,
+                'queued': {name: queued[rank] for name, rank in PRIORITIES.items()},
+                'max_queue': self.max_queue,
+                'clients': len(self._clients),
+                'counters': dict(self._counters),
+            }
@@ -1,31 +1,50 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
-import google.generativeai as genai
 import os
-import json
+import hashlib
+import metrics
 import logging
+import math
+import time
+from collections import Counter, namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("gemini_debug.log"),
-        logging.StreamHandler()
-    ]
+from building_store import SUMMARY_FIELDS, TEXT_COLUMNS, BuildingStore, get_building_store, set_building_store
+from sort_index import decode_cursor, encode_cursor
+from store_snapshot import refresh_snapshot
+from admission import AdmissionController, Overloaded, client_id, request_priority
+from city_stats import StatsService
+from jobs import JobQueue, JobQueueFull, SharedCounter
+from llm_backends import get_backend
+from llm_cache import ResponseCache, make_cache_key
+from filter_parser import canonicalize_query, filter_plan_cache_stats, parse_filter_query
+from single_flight import SingleFlight
+from streaming import JSONFieldStream, SourcesSplitter, sse_event
+from metrics import fallback_responses, stage_latency
+from osm_tiles import DEFAULT_OVERPASS_URL, OSMTileService, OverpassError
+from mesh_builder import MeshTileService
+from lod import lod_for_distance, lod_for_zoom
+from structured_logging import ExchangeLog, configure_logging
+from prompts import (
+    build_context_prompt, build_filter_prompt, build_packed_summary_prompt, build_query_prompt,
+    build_summary_prompt, context_fallback, filter_fallback, parse_context_response, parse_json_response,
+    parse_query_response, process_filter_response, summary_fallback
 )
-logger = logging.getLogger("gemini_app")
 
 # Load environment variables
 load_dotenv()
 
-# Configure API key - check for either GEMINI_API_KEY or GOOGLE_API_KEY
-api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-if not api_key:
-    raise ValueError("No API key found. Please set GEMINI_API_KEY or GOOGLE_API_KEY in .env file")
+# Configure logging: records go through a background queue to a rotating JSON log file
+configure_logging()
+logger = logging.getLogger("gemini_app")
 
-genai.configure(api_key=api_key)
+# Recent Gemini exchanges, logged by prompt hash with a sampled fraction of full payloads
+exchange_log = ExchangeLog(
+    logging.getLogger("gemini_app.exchanges"),
+    sample_rate=float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0")),
+    ring_size=int(os.getenv("LOG_RING_SIZE", "200"))
+)
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -34,7 +53,81 @@ import os
 # Set allowed origins for CORS
 FRONTEND_URL = os.getenv("FRONTEND_URL", "*")  # Allow all origins by default, can be restricted in production
 # For security in production, you should set FRONTEND_URL to your Netlify domain
-CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins for now to simplify debugging
+# Allow all origins for now to simplify debugging; X-Load-Shed marks fallbacks sent because the server was overloaded
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["X-Load-Shed"])
+
+# Optional Overpass/GeoJSON file with the city's buildings for server-side filtering
+CITY_DATA_PATH = os.getenv("CITY_DATA_PATH")
+
+# Optional snapshot file mapped by every worker process instead of each loading CITY_DATA_PATH (see gunicorn.conf.py)
+STORE_SNAPSHOT_PATH = os.getenv("STORE_SNAPSHOT_PATH")
+if STORE_SNAPSHOT_PATH:
+    # Once per server start (in the gunicorn master with preload_app): rebuild the snapshot if CITY_DATA_PATH changed
+    if refresh_snapshot(CITY_DATA_PATH, STORE_SNAPSHOT_PATH):
+        logger.info("Rebuilt building store snapshot %s from %s", STORE_SNAPSHOT_PATH, CITY_DATA_PATH)
+
+# Cache Gemini responses for /api/summary and /api/building-context (set LLM_CACHE_PATH="" for memory only)
+response_cache = ResponseCache(
+    path=os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3") or None,
+    max_memory_entries=int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "1024")),
+    max_disk_entries=int(os.getenv("LLM_CACHE_DISK_ENTRIES", "100000")),
+    ttl_seconds=int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+    sync_seconds=float(os.getenv("LLM_CACHE_SYNC_SECONDS", "1"))
+)
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Count the request and observe its latency under the matched route"""
+    start = g.pop('request_start', None)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.http_requests.inc(route, request.method, str(response.status_code))
+    if response.status_code >= 500:
+        metrics.http_errors.inc(route)
+    if start is not None:
+        metrics.http_latency.observe(time.perf_counter() - start, route)
+    shed_reason = g.pop('load_shed', None)
+    if shed_reason is not None:
+        response.headers['X-Load-Shed'] = shed_reason
+        if response.status_code == 503:
+            response.headers['Retry-After'] = '1'
+    return response
+
+def collect_cache_metrics():
+    """Scrape-time samples for the response cache, the filter plan cache and call coalescing"""
+    cache = response_cache.stats()
+    plans = filter_plan_cache_stats()
+    coalescing = llm_flight.stats()
+    return [
+        ('llm_cache_hits_total', 'counter', 'LLM response cache hits, by tier.',
+         [({'tier': 'memory'}, cache['memory_hits']), ({'tier': 'disk'}, cache.get('disk_hits', 0))]),
+        ('llm_cache_misses_total', 'counter', 'LLM response cache misses.', [({}, cache['misses'])]),
+        ('llm_cache_hit_ratio', 'gauge', 'Share of LLM response cache lookups that hit.', [({}, cache['hit_ratio'])]),
+        ('filter_plan_cache_hits_total', 'counter', 'Rule-based filter plan cache hits.', [({}, plans['hits'])]),
+        ('filter_plan_cache_misses_total', 'counter', 'Rule-based filter plan cache misses.', [({}, plans['misses'])]),
+        ('llm_coalesced_calls_total', 'counter', 'Requests that shared an in-flight Gemini call.',
+         [({}, coalescing['coalesced'])]),
+        ('llm_in_flight_calls', 'gauge', 'Gemini calls currently in flight.', [({}, coalescing['in_flight'])]),
+    ]
+
+metrics.registry.add_collector(collect_cache_metrics)
+
+# Shared Overpass tile cache for /api/osm/tiles
+osm_tiles = OSMTileService(
+    overpass_url=os.getenv("OVERPASS_URL", DEFAULT_OVERPASS_URL),
+    cache_dir=os.getenv("OSM_TILE_CACHE_DIR", "osm_tiles"),
+    ttl_seconds=int(os.getenv("OSM_TILE_TTL_SECONDS", str(24 * 3600))),
+    timeout=float(os.getenv("OSM_TILE_TIMEOUT_SECONDS", "60"))
+)
+
+# Binary building meshes for /api/buildings/mesh, built once per tile and shared by every client
+mesh_tiles = MeshTileService(max_tiles=int(os.getenv("MESH_TILE_CACHE_SIZE", "256")))
+
+# Aggregates for /api/stats, cached per (filters, bbox, grid, ...) request
+city_stats = StatsService(max_entries=int(os.getenv("STATS_CACHE_SIZE", "256")))
 
 # Add a root route for basic testing
 @app.route('/', methods=['GET'])
@@ -43,167 +136,435 @@ def index():
         "status": "API is running",
         "endpoints": [
             "/api/summary - POST request for building summary",
+            "/api/summary/batch - POST request for summaries of many buildings",
+            "/api/building/details - POST request for a building's context and summary in one round trip",
+            "/api/prewarm - POST request to cache summaries for chosen buildings in the background, GET for progress",
             "/api/query - POST request for general queries",
-            "/api/filter - POST request for building filtering"
+            "/api/query/stream - POST request for general queries, streamed as Server-Sent Events",
+            "/api/summary/stream - POST request for building summary, streamed field by field as Server-Sent Events",
+            "/api/filter - POST request for building filtering",
+            "/api/filter/apply - POST request to evaluate filters against the loaded buildings",
+            "/api/buildings/load - POST request to load buildings (Overpass JSON or GeoJSON)",
+            "/api/buildings?bbox=west,south,east,north - GET request for the buildings in a bounding box",
+            "/api/buildings/nearest?lat=&lon=&k= - GET request for the buildings nearest to a point",
+            "/api/buildings/autocomplete?q= - GET request for building name and address suggestions",
+            "/api/buildings/mesh/<z>/<x>/<y>?lod= - GET request for extruded building meshes of one map tile (binary)",
+            "/api/stats - POST request for aggregate statistics and heatmaps of the loaded buildings",
+            "/api/admission - GET request for admission control slots, queue lengths and shed counts",
+            "/api/cache/stats - GET request for LLM response cache statistics",
+            "/api/cache/invalidate - POST request to invalidate cached LLM responses",
+            "/api/debug/exchanges - GET request for recent Gemini exchanges",
+            "/api/osm/tiles/<z>/<x>/<y> - GET request for cached Overpass buildings and roads of one map tile",
+            "/metrics - GET request for Prometheus metrics"
         ]
     })
 
-# Configure Gemini model
-try:
-    # Try to use Gemini 2.5 Pro first
-    model = genai.GenerativeModel('gemini-2.5-pro-preview-03-25')
-    print("Using Gemini 2.5 Pro model")
-except Exception as e:
-    # Fall back to Gemini 1.5 Pro if 2.5 is not available
+# Coalesce identical Gemini prompts that are in flight at the same time
+LLM_COALESCE_TIMEOUT_SECONDS = float(os.getenv("LLM_COALESCE_TIMEOUT_SECONDS", "120"))
+llm_flight = SingleFlight(timeout=LLM_COALESCE_TIMEOUT_SECONDS)
+
+def call_llm(prompt, label):
+    """Send a prompt to the configured LLM backend and return the response text"""
+    backend = get_backend()
+    start = time.perf_counter()
     try:
-        model = genai.GenerativeModel('gemini-1.5-pro')
-        print("Using Gemini 1.5 Pro model")
+        result = backend.generate(prompt, label)
     except Exception as e:
-        # Fall back to Gemini 1.0 Pro as a last resort
-        model = genai.GenerativeModel('gemini-pro')
-        print("Using Gemini Pro model")
-
-# # List available models
-# try:
-#     models = genai.list_models()
-#     model_names = [m.name for m in models]
-#     print(f"Available models: {', '.join(model_names)}")
-# except Exception as e:
-#     print(f"Error listing models: {e}")
+        record_exchange(backend, label, prompt, duration=time.perf_counter() - start, error=e)
+        raise
+
+    record_exchange(backend, label, prompt, result, time.perf_counter() - start)
+    return result
+
+def record_exchange(backend, label, prompt, result=None, duration=None, error=None):
+    """Log one LLM call and record its latency and sizes in the metrics"""
+    model_name = backend.model_name
+    exchange_log.record(label, prompt, result, duration * 1000 if duration is not None else None, model_name,
+                        str(error) if error is not None else None)
+    metrics.observe_llm_call(label, model_name, prompt, result, duration, error is not None)
+
+def generate_text(prompt, label):
+    """Generate text for a prompt; concurrent requests with the same normalized prompt share one Gemini call"""
+    key = hashlib.sha256(' '.join(prompt.split()).encode('utf-8')).hexdigest()
+    return llm_flight.do(key, lambda: call_llm(prompt, label))
+
+def stream_llm(prompt, label):
+    """Yield response text chunks from the LLM backend as they are generated"""
+    backend = get_backend()
+    start = time.perf_counter()
+    chunks = []
+    for text in backend.stream(prompt, label):
+        chunks.append(text)
+        yield text
+    record_exchange(backend, label, prompt, ''.join(chunks), time.perf_counter() - start)
+
+def sse_response(events, headers=None):
+    """Wrap an event generator in an unbuffered text/event-stream response"""
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        **(headers or {})
+    })
+
+def sse_result(result):
+    """Events sending a finished summary: one per field, then the whole result"""
+    for key, value in result.items():
+        yield sse_event('field', {"key": key, "value": value})
+    yield sse_event('done', result)
+
+def llm_cache_key(namespace, inputs):
+    """Response cache key for a Gemini answer, scoped to the model giving it so a model change starts afresh"""
+    return make_cache_key(f"{namespace}@{get_backend().model_name}", inputs)
+
+def summary_cache_key(building_data):
+    """Response cache key for a building summary, shared by /api/summary, batches and building details"""
+    return llm_cache_key('summary', building_data)
+
+def context_cache_key(name, building_type, query_type):
+    """Response cache key for /api/building-context"""
+    return llm_cache_key('building-context', {
+        'name': name,
+        'type': building_type,
+        'query_type': query_type
+    })
+
+# Admission control for requests that need Gemini: token buckets (global and per client) and a priority queue.
+# Each server worker keeps its own buckets, so the configured rates are split evenly between the workers.
+ADMISSION_WORKERS = max(int(os.getenv("WEB_CONCURRENCY", "1")), 1)
+# Proxies in front of the app that append to X-Forwarded-For; only their hops identify the client
+ADMISSION_TRUSTED_PROXIES = int(os.getenv("ADMISSION_TRUSTED_PROXIES", "0"))
+admission = AdmissionController(
+    rate=float(os.getenv("ADMISSION_RATE_PER_SECOND", "10")) / ADMISSION_WORKERS,
+    burst=max(int(os.getenv("ADMISSION_BURST", "20")) // ADMISSION_WORKERS, 1),
+    client_rate=float(os.getenv("ADMISSION_CLIENT_RATE_PER_SECOND", "2")) / ADMISSION_WORKERS,
+    client_burst=max(int(os.getenv("ADMISSION_CLIENT_BURST", "20")) // ADMISSION_WORKERS, 1),
+    max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "5"))
+)
+
+def admitted(priority, cost=1):
+    """Admit the current request to make up to `cost` Gemini calls; raises Overloaded when it is shed"""
+    client = client_id(request.headers, request.remote_addr, ADMISSION_TRUSTED_PROXIES)
+    return admission.admit(client, request_priority(request.headers, priority), cost)
+
+def admitted_stream(events, priority):
+    """
+    Admit the current request before its event stream starts, so a shed request can still say so in its headers.
+
+    The slot is held until the response is closed. Raises Overloaded when the request is shed.
+    """
+    client = client_id(request.headers, request.remote_addr, ADMISSION_TRUSTED_PROXIES)
+    admission.acquire(client, request_priority(request.headers, priority))
+    response = sse_response(events)
+    response.call_on_close(admission.release)
+    return response
+
+def shed(route, error, payload):
+    """Count a shed request and mark its response, whose body is the route's fallback payload"""
+    logger.warning("Shed %s request: %s", route, error.reason)
+    metrics.admission_shed.inc(route, error.reason)
+    g.load_shed = error.reason
+    return payload
+
+def collect_admission_metrics():
+    """Scrape-time samples for admission control slots and queue"""
+    stats = admission.stats()
+    return [
+        ('admission_active_requests', 'gauge', 'Gemini-bound requests holding an admission slot.',
+         [({}, stats['active'])]),
+        ('admission_queued_requests', 'gauge', 'Requests waiting for an admission slot, by priority.',
+         [({'priority': priority}, count) for priority, count in stats['queued'].items()]),
+    ]
+
+metrics.registry.add_collector(collect_admission_metrics)
+
+# What differs between the Gemini-backed routes, shared by the Flask routes and the async app: the response cache
+# key (None if answers are not cached), the prompt and its log label, the response parser and the fallback payload
+# (None for queries, which have no deterministic answer)
+LLMRequest = namedtuple('LLMRequest', 'route cache_key prompt label parse fallback')
+
+def summary_request(building_data):
+    """LLMRequest for a building summary"""
+    return LLMRequest('summary', summary_cache_key(building_data), build_summary_prompt(building_data),
+                      "SUMMARY", parse_json_response, lambda: summary_fallback(building_data))
+
+def filter_request(query):
+    """LLMRequest for a filter query the rule-based parser could not answer"""
+    return LLMRequest('filter', llm_cache_key('filter', {'query': canonicalize_query(query)}),
+                      build_filter_prompt(query), "FILTER", lambda result: process_filter_response(result, query),
+                      lambda: filter_fallback(query))
+
+def context_request(building_name, building_type, query_type):
+    """LLMRequest for a building's context"""
+    return LLMRequest('building_context', context_cache_key(building_name, building_type, query_type),
+                      build_context_prompt(building_name, building_type, query_type), "BUILDING CONTEXT",
+                      parse_context_response, context_fallback)
+
+def query_request(query, context):
+    """LLMRequest for a general query"""
+    return LLMRequest('query', None, build_query_prompt(query, context), "QUERY", parse_query_response, None)
+
+def parse_llm_result(llm_request, result):
+    """Parse a Gemini response; returns (parsed, True), or (the fallback, False) if it cannot be parsed"""
+    try:
+        with stage_latency.time(llm_request.route, 'parse'):
+            return llm_request.parse(result), True
+    except Exception as e:
+        if llm_request.fallback is None:
+            raise
+        logger.error("Error parsing %s response: %s", llm_request.route, e)
+        fallback_responses.inc(llm_request.route)
+        return llm_request.fallback(), False
+
+def answer_llm_request(llm_request, priority=None):
+    """
+    Answer a Gemini-backed request from the response cache, or with a Gemini call whose parsed result is cached.
+
+    With a priority, the call is first admitted for the current request and the fallback is returned if the
+    request is shed (Overloaded is raised for requests without one); callers that were already admitted pass None.
+    """
+    route = llm_request.route
+    if llm_request.cache_key is not None:
+        with stage_latency.time(route, 'cache'):
+            cached_result = response_cache.get(llm_request.cache_key)
+        if cached_result is not None:
+            logger.debug("Cache hit for %s", llm_request.cache_key)
+            return cached_result
+
+    # Generate response from Gemini, sharing the call with identical in-flight prompts
+    try:
+        with admitted(priority) if priority is not None else nullcontext(), stage_latency.time(route, 'llm'):
+            result = generate_text(llm_request.prompt, llm_request.label)
+    except Overloaded as e:
+        if llm_request.fallback is None:
+            raise
+        return shed(route, e, llm_request.fallback())
+
+    parsed_result, parsed = parse_llm_result(llm_request, result)
+    if parsed and llm_request.cache_key is not None:
+        response_cache.set(llm_request.cache_key, parsed_result)
+    return parsed_result
+
+def cache_summary(building_data, result):
+    """Parse a Gemini summary response and cache it; raises if the response is not valid JSON"""
+    with stage_latency.time('summary', 'parse'):
+        parsed_result = parse_json_response(result)
+    response_cache.set(summary_cache_key(building_data), parsed_result)
+    return parsed_result
+
+def summarize_building(building_data, priority=None):
+    """
+    Return the summary for a building, from the response cache or Gemini.
+
+    With a priority, a Gemini call is first admitted for the current request and the fallback is returned if
+    the request is shed; callers that were already admitted pass None.
+    """
+    return answer_llm_request(summary_request(building_data), priority)
+
+# Summary requests per building ID, pooled by every process sharing the response cache file: the 'popular'
+# prewarm target
+building_requests = SharedCounter(response_cache.path, table='building_requests')
+
+def record_building_request(building_data):
+    """Count a summary request for a building, if it has an ID"""
+    building_id = building_data.get('id')
+    if building_id in (None, '', 'unknown'):
+        return
+    building_requests.add(str(building_id))
 
 @app.route('/api/summary', methods=['POST'])
 def get_building_summary():
     """Generate a summary for a building using Gemini 2.5 Pro"""
     try:
         data = request.json
-        print(f"Received /api/summary request with data: {data}")  # Debug log
+        logger.debug("Received /api/summary request with data: %s", data)
         building_data = data.get('building_data', {})
+        record_building_request(building_data)
 
-        # Create prompt for Gemini
-        # Extract building context if available
-        building_context = building_data.get('building_context', None)
-        context_info = ""
-
-        if building_context:
-            context_info = f"""
-            Additional Context Information:
-            Estimated Year Built: {building_context.get('estimatedYear', 'unknown')}
-            Confidence: {building_context.get('confidence', 'low')}
-            Architectural Style: {building_context.get('architecturalStyle', 'Unknown')}
-            Notable Features: {building_context.get('notableFeatures', 'Unknown')}
-            Historical Context: {building_context.get('historicalContext', 'Unknown')}
-            Cultural Significance: {building_context.get('culturalSignificance', 'Unknown')}
-            Material Information: {building_context.get('materialInfo', 'Unknown')}
-            Sustainability Features: {building_context.get('sustainabilityInfo', 'Unknown')}
-            Similar Examples: {building_context.get('similarExamples', 'Unknown')}
-            Urban Context: {building_context.get('urbanContext', 'Unknown')}
-            Reasoning: {building_context.get('reasoning', 'No additional information available')}
-            """
-
-        prompt = f"""
-        Generate a detailed summary for this building in Calgary:
-
-        Building ID: {building_data.get('id', 'unknown')}
-        Name: {building_data.get('name', 'Unnamed Building')}
-        Type: {building_data.get('type', 'commercial')}
-        Floors: {building_data.get('levels', '3')}
-        Height: {building_data.get('height', '10')} meters
-        Actual Height: {building_data.get('actualHeight', 'unknown')}
-        Amenities: {building_data.get('amenity', 'None')}
-        Shops: {building_data.get('shop', 'None')}
-        Offices: {building_data.get('office', 'None')}
-        Year Built: {building_data.get('year_built', 'unknown')}
-        Building Material: {building_data.get('material', 'concrete')}
-        Roof Shape: {building_data.get('roof_shape', 'flat')}
-        Address: {building_data.get('addr:street', 'Unknown')} {building_data.get('addr:housenumber', '')}
-        {context_info}
-
-        Provide the following information in JSON format:
-        1. A detailed summary of the building (2-3 sentences). Include architectural style, historical context, and notable features if available from the context information.
-        2. Estimated construction cost (based on building type, size, materials, and historical context)
-        3. Building type classification (be specific about the architectural style if known)
-        4. Urban significance (how this building contributes to Calgary's urban landscape, including any cultural or historical significance)
-        5. Assessed value (provide a realistic property value based on building type, size, location, and historical significance in Calgary)
-        6. Zoning information (provide a realistic zoning code for this type of building in Calgary, e.g. RC-G for residential, CC-X for downtown commercial, etc.)
-
-        Format your response as valid JSON with these keys: summary, constructionCost, buildingType, urbanSignificance, assessedValue, zoning
-        """
-
-        # Generate response from Gemini with error handling for different API versions
-        print("\n\n==== SENDING PROMPT TO GEMINI ====")
-        print(prompt)
-        print("==== END OF PROMPT ====\n")
+        return jsonify(summarize_building(building_data, priority='summary'))
+
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+@app.route('/api/summary/stream', methods=['POST'])
+def stream_building_summary():
+    """Stream a building summary as Server-Sent Events, one event per JSON field as soon as it is complete"""
+    data = request.json or {}
+    logger.debug("Received /api/summary/stream request with data: %s", data)
+    building_data = data.get('building_data', {})
+
+    # Cached summaries are sent in one go
+    llm_request = summary_request(building_data)
+    cached_result = response_cache.get(llm_request.cache_key)
+    if cached_result is not None:
+        return sse_response(sse_result(cached_result))
+
+    def events():
+        try:
+            fields = JSONFieldStream()
+            for chunk in stream_llm(llm_request.prompt, llm_request.label):
+                for key, value in fields.feed(chunk):
+                    yield sse_event('field', {"key": key, "value": value})
+
+            # Parse the complete text the same way /api/summary does
+            parsed_result, parsed = parse_llm_result(llm_request, fields.text)
+            if parsed:
+                response_cache.set(llm_request.cache_key, parsed_result)
+
+            for key, value in parsed_result.items():
+                if fields.fields.get(key) != value:
+                    yield sse_event('field', {"key": key, "value": value})
+            yield sse_event('done', parsed_result)
+        except Exception as e:
+            logger.error("Error in stream_building_summary: %s", e)
+            yield sse_event('error', {"error": str(e)})
 
+    try:
+        return admitted_stream(events(), 'summary')
+    except Overloaded as e:
+        fallback = shed('summary_stream', e, summary_fallback(building_data))
+        return sse_response(sse_result(fallback), headers={'X-Load-Shed': e.reason})
+
+# Bounded worker pool for /api/summary/batch
+SUMMARY_BATCH_WORKERS = int(os.getenv("SUMMARY_BATCH_WORKERS", "4"))
+SUMMARY_PACK_SIZE = int(os.getenv("SUMMARY_PACK_SIZE", "5"))
+SUMMARY_BATCH_MAX_BUILDINGS = int(os.getenv("SUMMARY_BATCH_MAX_BUILDINGS", "500"))
+summary_pool = ThreadPoolExecutor(max_workers=SUMMARY_BATCH_WORKERS, thread_name_prefix="summary-batch")
+
+def summarize_packed(buildings):
+    """Summarize several buildings with one Gemini call, returning {cache key: summary} for the ones it covered"""
+    result = generate_text(build_packed_summary_prompt(buildings), "PACKED SUMMARY")
+    try:
+        parsed_result = parse_json_response(result)
+    except Exception as e:
+        logger.error("Error parsing packed summary JSON: %s", e)
+        return {}
+
+    summaries = {}
+    for building_data in buildings:
+        entry = parsed_result.get(str(building_data.get('id', 'unknown'))) if isinstance(parsed_result, dict) else None
+        if isinstance(entry, dict):
+            cache_key = summary_cache_key(building_data)
+            response_cache.set(cache_key, entry)
+            summaries[cache_key] = entry
+    return summaries
+
+def summarize_pending(packable, single):
+    """
+    Summarize the uncached buildings of a batch on the summary pool.
+
+    Args:
+        packable (list): (cache key, building_data) pairs that can share packed prompts.
+        single (list): Pairs that need a prompt each.
+
+    Returns:
+        tuple: (summaries, errors), both keyed by cache key.
+    """
+    summaries = {}
+    errors = {}
+    packed_keys = {k for k, _ in packable}
+    futures = {}
+    for i in range(0, len(packable), SUMMARY_PACK_SIZE):
+        group = packable[i:i + SUMMARY_PACK_SIZE]
+        futures[summary_pool.submit(summarize_packed, [b for _, b in group])] = group
+    for cache_key, building_data in single:
+        futures[summary_pool.submit(summarize_building, building_data)] = [(cache_key, building_data)]
+
+    retry = []
+    for future in as_completed(futures):
+        group = futures[future]
+        packed = group[0][0] in packed_keys
         try:
-            # Try the newer API format
-            response = model.generate_content(prompt)
-            print("\n==== GEMINI RESPONSE ====")
-            if hasattr(response, 'text'):
-                print(response.text)
-            elif hasattr(response, 'result'):
-                print(response.result)
+            result = future.result()
+        except Exception as e:
+            logger.error("Error in batch summary: %s", e)
+            if packed:
+                retry.extend(group)
             else:
-                print(str(response))
-            print("==== END OF GEMINI RESPONSE ====\n")
-        except AttributeError:
-            # Fall back to older API format if needed
-            try:
-                response = model.generate(prompt)
-                print("\n==== GEMINI RESPONSE (FALLBACK 1) ====")
-                print(str(response))
-                print("==== END OF GEMINI RESPONSE ====\n")
-            except AttributeError:
-                # Last resort - try direct generation
-                response = genai.generate_text(model=model.name, prompt=prompt)
-                print("\n==== GEMINI RESPONSE (FALLBACK 2) ====")
-                print(str(response))
-                print("==== END OF GEMINI RESPONSE ====\n")
-
-        # Handle different response formats
-        if hasattr(response, 'text'):
-            result = response.text
-        elif hasattr(response, 'result'):
-            result = response.result
-        elif isinstance(response, str):
-            result = response
+                errors[group[0][0]] = str(e)
+            continue
+        if packed:
+            summaries.update(result)
+            retry.extend((k, b) for k, b in group if k not in result)
         else:
-            # Try to extract text from the response object
-            try:
-                result = str(response)
-            except:
-                raise ValueError("Could not extract text from model response")
+            summaries[group[0][0]] = result
 
-        # Extract JSON from response
+    # Buildings a packed prompt did not cover are summarized individually
+    retry_futures = {summary_pool.submit(summarize_building, b): k for k, b in retry}
+    for future in as_completed(retry_futures):
         try:
-            # Clean up the response if it contains markdown code blocks
-            if "```json" in result:
-                result = result.split("```json")[1].split("```")[0].strip()
-            elif "```" in result:
-                result = result.split("```")[1].split("```")[0].strip()
+            summaries[retry_futures[future]] = future.result()
+        except Exception as e:
+            logger.error("Error in batch summary: %s", e)
+            errors[retry_futures[future]] = str(e)
+    return summaries, errors
 
-            # Try to parse as JSON first
-            try:
-                parsed_result = json.loads(result)
-            except json.JSONDecodeError:
-                # Fall back to eval if JSON parsing fails
-                parsed_result = eval(result)
+@app.route('/api/summary/batch', methods=['POST'])
+def get_building_summaries():
+    """Generate summaries for many buildings in one request"""
+    try:
+        data = request.json
+        buildings = data.get('buildings', [])
+        logger.debug("Received /api/summary/batch request for %s buildings", len(buildings))
 
-            # Return the response
-            return jsonify(parsed_result)
-        except Exception as e:
-            # If parsing fails, return a structured response with the raw text
-            print(f"Error parsing JSON: {e}")
+        if len(buildings) > SUMMARY_BATCH_MAX_BUILDINGS:
             return jsonify({
-                "summary": f"This is a {building_data.get('levels', '3')}-story {building_data.get('type', 'commercial')} building in Calgary.",
-                "constructionCost": "Estimated cost unavailable",
-                "buildingType": building_data.get('type', 'Commercial').capitalize(),
-                "urbanSignificance": "This building contributes to Calgary's urban landscape.",
-                "assessedValue": f"${int(float(building_data.get('levels', 3)) * 500000):,}",
-                "zoning": "RC-G" if building_data.get('type', '').lower() == 'residential' else "C-COR1"
-            })
+                "error": f"At most {SUMMARY_BATCH_MAX_BUILDINGS} buildings can be summarized per request"
+            }), 400
+
+        # Deduplicate identical buildings and serve what we can from the cache
+        keys = [summary_cache_key(building_data) for building_data in buildings]
+        unique = dict(zip(keys, buildings))
+        summaries = {}
+        errors = {}
+        pending = []
+        for cache_key, building_data in unique.items():
+            cached_result = response_cache.get(cache_key)
+            if cached_result is not None:
+                summaries[cache_key] = cached_result
+            else:
+                pending.append((cache_key, building_data))
+
+        # Buildings without extra context share packed prompts; packed results are keyed by ID, so IDs must be unique
+        id_counts = Counter(str(building_data.get('id', 'unknown')) for _, building_data in pending)
+        packable = [(k, b) for k, b in pending if not b.get('building_context') and id_counts[str(b.get('id', 'unknown'))] == 1]
+        packed_keys = {k for k, _ in packable}
+        single = [(k, b) for k, b in pending if k not in packed_keys]
+        if len(packable) == 1:
+            single, packable = single + packable, []
+
+        if pending:
+            # One admission for the batch, charged a token per Gemini prompt it will send
+            prompts = -(-len(packable) // SUMMARY_PACK_SIZE) + len(single)
+            try:
+                with admitted('prefetch', cost=prompts):
+                    generated, errors = summarize_pending(packable, single)
+                summaries.update(generated)
+            except Overloaded as e:
+                fallbacks = {cache_key: summary_fallback(building_data) for cache_key, building_data in pending}
+                summaries.update(shed('summary_batch', e, fallbacks))
+
+        results = []
+        for cache_key, building_data in zip(keys, buildings):
+            entry = {"id": building_data.get('id', 'unknown')}
+            if cache_key in summaries:
+                entry["result"] = summaries[cache_key]
+            else:
+                entry["error"] = errors.get(cache_key, "Summary unavailable")
+            results.append(entry)
+
+        return jsonify({
+            "results": results,
+            "count": len(results),
+            "failed": sum(1 for entry in results if "error" in entry)
+        })
 
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error in get_building_summaries: %s", e)
         return jsonify({
             "error": str(e)
         }), 500
@@ -213,562 +574,671 @@ def process_query():
     """Process a general query about buildings or urban planning using Gemini 2.5 Pro"""
     try:
         data = request.json
-        print(f"Received /api/query request with data: {data}")  # Debug log
+        logger.debug("Received /api/query request with data: %s", data)
         query = data.get('query', '')
         context = data.get('context', {})
 
-        # Create prompt for Gemini
-        prompt = f"""
-        You are an expert on urban architecture and city planning, especially for Calgary, Canada.
+        try:
+            return jsonify(answer_llm_request(query_request(query, context), priority='interactive'))
+        except Overloaded as e:
+            # Free-form answers have no deterministic fallback
+            return shed('query', e, jsonify({
+                "error": "The server is busy, please try again shortly"
+            })), 503
 
-        User Query: {query}
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
 
-        Context:
-        - Location: {context.get('location', 'Calgary')}
-        - Topic: {context.get('topic', 'urban architecture and city planning')}
+@app.route('/api/query/stream', methods=['POST'])
+def stream_query():
+    """Stream the answer to a general query as Server-Sent Events"""
+    data = request.json or {}
+    logger.debug("Received /api/query/stream request with data: %s", data)
+    query = data.get('query', '')
+    context = data.get('context', {})
 
-        Provide a detailed, informative response to the query. If you don't have specific information
-        about Calgary related to this query, you can provide general information about urban planning
-        and architecture principles, but clearly state that you're providing general information.
+    def events():
+        splitter = SourcesSplitter()
+        try:
+            for chunk in stream_llm(build_query_prompt(query, context), "QUERY"):
+                text, sources = splitter.feed(chunk)
+                if text:
+                    yield sse_event('token', {"text": text})
+                for source in sources:
+                    yield sse_event('source', {"source": source})
+
+            text, sources = splitter.finish()
+            if text:
+                yield sse_event('token', {"text": text})
+            for source in sources:
+                yield sse_event('source', {"source": source})
+
+            yield sse_event('done', {
+                "response": splitter.response_text.strip(),
+                "sources": splitter.sources
+            })
+        except Exception as e:
+            logger.error("Error in stream_query: %s", e)
+            yield sse_event('error', {"error": str(e)})
 
-        If relevant, include sources or references that would support your response.
-        """
+    try:
+        return admitted_stream(events(), 'interactive')
+    except Overloaded as e:
+        # Free-form answers have no deterministic fallback
+        busy = shed('query_stream', e, sse_event('error', {"error": "The server is busy, please try again shortly"}))
+        return sse_response(iter([busy]), headers={'X-Load-Shed': e.reason, 'Retry-After': '1'})
 
-        # Generate response from Gemini with error handling for different API versions
-        print("\n\n==== SENDING QUERY PROMPT TO GEMINI ====")
-        print(prompt)
-        print("==== END OF QUERY PROMPT ====\n")
+@app.route('/api/filter', methods=['POST'])
+def filter_buildings():
+    """Process a building filter query using Gemini 2.5 Pro"""
+    try:
+        data = request.json
+        logger.debug("Received /api/filter request with data: %s", data)
+        query = data.get('query', '')
 
-        try:
-            # Try the newer API format
-            response = model.generate_content(prompt)
-            print("\n==== GEMINI QUERY RESPONSE ====")
-            if hasattr(response, 'text'):
-                print(response.text)
-            elif hasattr(response, 'result'):
-                print(response.result)
-            else:
-                print(str(response))
-            print("==== END OF GEMINI QUERY RESPONSE ====\n")
-        except AttributeError:
-            # Fall back to older API format if needed
-            try:
-                response = model.generate(prompt)
-                print("\n==== GEMINI QUERY RESPONSE (FALLBACK 1) ====")
-                print(str(response))
-                print("==== END OF GEMINI QUERY RESPONSE ====\n")
-            except AttributeError:
-                # Last resort - try direct generation
-                response = genai.generate_text(model=model.name, prompt=prompt)
-                print("\n==== GEMINI QUERY RESPONSE (FALLBACK 2) ====")
-                print(str(response))
-                print("==== END OF GEMINI QUERY RESPONSE ====\n")
-
-        # Handle different response formats
-        if hasattr(response, 'text'):
-            result = response.text
-        elif hasattr(response, 'result'):
-            result = response.result
-        elif isinstance(response, str):
-            result = response
-        else:
-            # Try to extract text from the response object
-            try:
-                result = str(response)
-            except:
-                raise ValueError("Could not extract text from model response")
-
-        # Process response
-        sources = []
-        if "Sources:" in result:
-            main_text, sources_text = result.split("Sources:", 1)
-            sources = [s.strip() for s in sources_text.strip().split("\n") if s.strip()]
-        else:
-            main_text = result
+        # Answer simple queries with the rule-based parser and skip Gemini
+        with stage_latency.time('filter', 'rules'):
+            parsed_result = parse_filter_query(query)
+        if parsed_result is not None:
+            logger.debug("Rule-based filter plan: %s", parsed_result)
+            return jsonify(parsed_result)
+
+        # Reuse the plan Gemini produced for the same canonical query, or ask Gemini
+        return jsonify(answer_llm_request(filter_request(query), priority='interactive'))
 
+    except Exception as e:
+        logger.error("Error in filter_buildings: %s", e)
         return jsonify({
-            "response": main_text.strip(),
-            "sources": sources
-        })
+            "error": str(e)
+        }), 500
+
+@app.route('/api/filter/apply', methods=['POST'])
+def apply_building_filters():
+    """Evaluate a filter list from /api/filter against the columnar building store, optionally sorted and paged"""
+    try:
+        data = request.json
+        filters = data.get('filters', [])
+        sort_by = data.get('sortBy') or None
+        descending = str(data.get('sortOrder', 'asc')).lower() == 'desc'
+        limit = data.get('limit')
+        cursor = data.get('cursor')
+        store = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH)
+
+        try:
+            if limit is not None:
+                limit = int(limit)
+                if limit < 1:
+                    raise ValueError("limit must be a positive integer")
+            after = decode_cursor(cursor, sort_by, descending, len(store)) if cursor else -1
+            if sort_by is not None:
+                store.sort_index(sort_by)
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                "error": str(e)
+            }), 400
+
+        # One extra row tells whether another page follows
+        rows, positions, count = store.page(filters, sort_by, descending,
+                                            limit + 1 if limit is not None else None, after)
+        has_more = limit is not None and len(rows) > limit
+        rows, positions = rows[:limit], positions[:limit]
+        response = {
+            "ids": store.ids[rows].tolist(),
+            "count": count,
+            "total": len(store)
+        }
+        if sort_by is not None:
+            response["sortBy"] = sort_by
+            response["sortOrder"] = 'desc' if descending else 'asc'
+        if limit is not None or cursor:
+            # The cursor resumes after the page's last row
+            response["next_cursor"] = encode_cursor(sort_by, descending, positions[-1]) if has_more else None
+        return jsonify(response)
 
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error("Error in apply_building_filters: %s", e)
         return jsonify({
             "error": str(e)
         }), 500
 
-@app.route('/api/filter', methods=['POST'])
-def filter_buildings():
-    """Process a building filter query using Gemini 2.5 Pro"""
+@app.route('/api/buildings/load', methods=['POST'])
+def load_buildings():
+    """Replace the building store with an uploaded Overpass response or GeoJSON FeatureCollection"""
     try:
         data = request.json
-        print(f"Received /api/filter request with data: {data}")  # Debug log
-        query = data.get('query', '')
+        set_building_store(BuildingStore.from_json(data), STORE_SNAPSHOT_PATH)
+        # Simplified levels of detail are part of ingest, not of the first tile request
+        store = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH)
+        store.lods.build_all()
+        logger.info("Loaded %s buildings into the building store", len(store))
+
+        return jsonify({
+            "count": len(store),
+            "lods": store.lods.stats()
+        })
+
+    except Exception as e:
+        logger.error("Error in load_buildings: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
 
-        # Create prompt for Gemini
-        prompt = f"""
-        You are an expert on building data and filtering. Extract filter criteria from this query: "{query}"
-
-        The available building attributes are:
-        - height (in meters, not feet) - all height values are in meters
-        - building:levels (number of floors) - also referred to as 'levels' or 'floors'
-        - building (type of building: residential, commercial, apartments, etc.)
-        - amenity (facilities: restaurant, school, hospital, etc.)
-        - shop (type of shop if present)
-        - office (type of office if present)
-        - name (building name)
-        - addr:street (street address) - also referred to as 'street' or 'address'
-        - addr:housenumber (house number) - also referred to as 'number'
-        - start_date (year built) - also referred to as 'year' or 'built'
-        - zoning (zoning code like RC-G, C-COR1, etc.)
-        - assessedValue (property value in dollars)
-
-        IMPORTANT: If the query mentions 'floors', 'levels', or 'stories', always use the attribute 'building:levels'.
-        If the query mentions 'type', 'building type', or specific types like 'residential', 'commercial', etc., use the attribute 'building'.
-
-        SPECIAL CASES AND KNOWLEDGE-BASED FILTERING:
-        Use your knowledge of Calgary's architecture, urban planning, and building information to enhance your responses. When explicit data might be missing, use your knowledge to provide meaningful results.
-
-        1. For historical queries ("oldest building", "historical buildings", "heritage buildings"):
-           Instead of relying solely on start_date which may be missing, use your knowledge of Calgary's historical buildings.
-           Examples: Stephen Avenue historic buildings (late 1800s), Lougheed House (1891), Calgary City Hall (1911), Grain Exchange Building (1909).
-           Create appropriate filters based on names, locations, or architectural styles.
-
-        2. For modern building queries ("newest building", "modern architecture", "recent developments"):
-           Use your knowledge of Calgary's recent developments.
-           Examples: Telus Sky (2019), Brookfield Place (2017), The Bow (2012), Eighth Avenue Place (2011).
-           Create appropriate filters based on names, architectural styles, or materials.
-
-        3. For architectural style queries ("art deco buildings", "brutalist architecture", "glass towers"):
-           Use your knowledge of architectural styles in Calgary.
-           Examples: The Bow (curved glass), Bankers Hall (postmodern), Calgary Tower (brutalist elements).
-           Create appropriate filters based on names, materials, or other attributes.
-
-        4. For cultural significance queries ("important landmarks", "iconic buildings", "cultural centers"):
-           Use your knowledge of Calgary's culturally significant buildings.
-           Examples: Calgary Tower, Glenbow Museum, TELUS Convention Centre, Arts Commons.
-           Create appropriate filters based on names, functions, or locations.
-
-        5. For height-based queries ("tallest buildings", "skyscrapers"):
-           Create a filter with attribute="height", operator=">", value="0" and add "sortBy": "height", "sortOrder": "desc".
-           Note that height is in meters.
-
-        6. For value-based queries ("most valuable buildings", "expensive properties"):
-           Create a filter with attribute="assessedValue", operator=">", value="0" and add "sortBy": "assessedValue", "sortOrder": "desc".
-
-        7. For sustainability queries ("green buildings", "sustainable architecture", "LEED certified"):
-           Use your knowledge of Calgary's sustainable buildings.
-           Examples: The Bow (energy efficient design), Telus Sky (LEED certification), Eighth Avenue Place (green features).
-           Create appropriate filters based on names or other attributes.
-
-        Return a JSON object with an array of filters. Each filter should have:
-        - attribute: The building attribute to filter on (from the list above)
-        - operator: One of >, <, =, >=, <=, or "contains" for text search
-        - value: The value to compare against
-
-        Also include an "explanation" field that briefly explains the filters in plain English.
-
-        Example 1: "show buildings taller than 30 meters"
-        Response: {{
-          "filters": [
-            {{
-              "attribute": "height",
-              "operator": ">",
-              "value": 30
-            }}
-          ],
-          "explanation": "Showing buildings with height greater than 30 meters"
-        }}
-
-        Example 2: "find commercial buildings with more than 5 floors"
-        Response: {{
-          "filters": [
-            {{
-              "attribute": "building",
-              "operator": "=",
-              "value": "commercial"
-            }},
-            {{
-              "attribute": "building:levels",
-              "operator": ">",
-              "value": 5
-            }}
-          ],
-          "explanation": "Showing commercial buildings with more than 5 floors"
-        }}
-
-        Example 3: "what is the oldest building"
-        Response: {{
-          "filters": [
-            {{
-              "attribute": "name",
-              "operator": "contains",
-              "value": "historic"
-            }}
-          ],
-          "explanation": "Showing buildings that are likely historical based on their names and Calgary's history. Historical buildings in Calgary include structures from the late 1800s and early 1900s."
-        }}
-
-        Example 4: "show me the newest buildings"
-        Response: {{
-          "filters": [
-            {{
-              "attribute": "name",
-              "operator": "contains",
-              "value": "Telus Sky"
-            }}
-          ],
-          "explanation": "Showing modern buildings in Calgary like Telus Sky which was completed in 2019."
-        }}
-
-        Example 5: "show me art deco buildings"
-        Response: {{
-          "filters": [
-            {{
-              "attribute": "name",
-              "operator": "contains",
-              "value": "Palliser"
-            }}
-          ],
-          "explanation": "Showing buildings with Art Deco architectural elements in Calgary. The Palliser Hotel (now Fairmont Palliser) features some Art Deco influences."
-        }}
-
-        Example 6: "show me culturally significant buildings"
-        Response: {{
-          "filters": [
-            {{
-              "attribute": "name",
-              "operator": "contains",
-              "value": "Calgary Tower"
-            }}
-          ],
-          "explanation": "Showing culturally significant buildings in Calgary. The Calgary Tower is an iconic landmark that symbolizes the city."
-        }}
-
-        Example 7: "show me sustainable buildings"
-        Response: {{
-          "filters": [
-            {{
-              "attribute": "name",
-              "operator": "contains",
-              "value": "Bow"
-            }}
-          ],
-          "explanation": "Showing buildings with sustainable design features. The Bow incorporates energy-efficient design elements."
-        }}
-
-        Format your response as valid JSON with these keys: filters (array), explanation (string), and optional sortBy and sortOrder fields.
-        """
-
-        # Generate response from Gemini with error handling for different API versions
-        print("\n\n==== SENDING FILTER PROMPT TO GEMINI ====")
-        print(prompt)
-        print("==== END OF FILTER PROMPT ====\n")
+def requested_fields():
+    """Columns to return from the spatial endpoints: ?fields=a,b, ?fields= for IDs only"""
+    fields = request.args.get('fields')
+    if fields is None:
+        return SUMMARY_FIELDS
+    return tuple(field for field in fields.split(',') if field)
 
+@app.route('/api/buildings', methods=['GET'])
+def get_buildings_in_bbox():
+    """Return the buildings whose footprint intersects a bounding box (bbox=west,south,east,north)"""
+    try:
         try:
-            # Try the newer API format
-            response = model.generate_content(prompt)
-            print("\n==== GEMINI FILTER RESPONSE ====")
-            if hasattr(response, 'text'):
-                print(response.text)
-            elif hasattr(response, 'result'):
-                print(response.result)
-            else:
-                print(str(response))
-            print("==== END OF GEMINI FILTER RESPONSE ====\n")
-        except AttributeError:
-            # Fall back to older API format if needed
-            try:
-                response = model.generate(prompt)
-                print("\n==== GEMINI FILTER RESPONSE (FALLBACK 1) ====")
-                print(str(response))
-                print("==== END OF GEMINI FILTER RESPONSE ====\n")
-            except AttributeError:
-                # Last resort - try direct generation
-                response = genai.generate_text(model=model.name, prompt=prompt)
-                print("\n==== GEMINI FILTER RESPONSE (FALLBACK 2) ====")
-                print(str(response))
-                print("==== END OF GEMINI FILTER RESPONSE ====\n")
-
-        # Handle different response formats
-        if hasattr(response, 'text'):
-            result = response.text
-        elif hasattr(response, 'result'):
-            result = response.result
-        elif isinstance(response, str):
-            result = response
-        else:
-            # Try to extract text from the response object
-            try:
-                result = str(response)
-            except:
-                raise ValueError("Could not extract text from model response")
+            west, south, east, north = (float(v) for v in request.args.get('bbox', '').split(','))
+            if not all(math.isfinite(v) for v in (west, south, east, north)):
+                raise ValueError("bbox is not finite")
+        except ValueError:
+            return jsonify({
+                "error": "bbox must be west,south,east,north in degrees"
+            }), 400
+        limit = request.args.get('limit', 5000, type=int)
+        if limit < 0:
+            return jsonify({
+                "error": "limit must not be negative"
+            }), 400
+
+        store = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH)
+        rows = store.rows_in_bbox(west, south, east, north)
+
+        return jsonify({
+            "buildings": store.describe(rows[:limit], requested_fields()),
+            "count": len(rows),
+            "truncated": len(rows) > limit
+        })
+
+    except Exception as e:
+        logger.error("Error in get_buildings_in_bbox: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+@app.route('/api/buildings/nearest', methods=['GET'])
+def get_nearest_buildings():
+    """Return the k buildings closest to a point, nearest first"""
+    try:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        if lat is None or lon is None:
+            return jsonify({
+                "error": "lat and lon are required"
+            }), 400
+        k = min(request.args.get('k', 10, type=int), 1000)
+        radius = request.args.get('radius', type=float)
+        if not (math.isfinite(lat) and math.isfinite(lon)) or (radius is not None and not math.isfinite(radius)):
+            return jsonify({
+                "error": "lat, lon and radius must be finite numbers"
+            }), 400
+
+        store = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH)
+        rows, distances = store.nearest_rows(lon, lat, k, radius)
+        buildings = store.describe(rows, requested_fields())
+        for building, distance in zip(buildings, distances.tolist()):
+            building['distance'] = round(distance, 1)
+
+        return jsonify({
+            "buildings": buildings,
+            "count": len(buildings)
+        })
+
+    except Exception as e:
+        logger.error("Error in get_nearest_buildings: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+@app.route('/api/buildings/autocomplete', methods=['GET'])
+def autocomplete_buildings():
+    """Suggest building names and addresses matching typed text (prefix matches first)"""
+    try:
+        query = request.args.get('q', '').strip()
+        fields = tuple(field for field in request.args.get('fields', ','.join(TEXT_COLUMNS)).split(',') if field)
+        unknown = [field for field in fields if field not in TEXT_COLUMNS]
+        if not query or unknown:
+            return jsonify({
+                "error": f"q is required and fields must be among {', '.join(TEXT_COLUMNS)}"
+            }), 400
+        limit = min(request.args.get('limit', 10, type=int), 100)
+        fuzzy = request.args.get('fuzzy', '').lower() in ('1', 'true', 'yes')
+
+        store = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH)
+        suggestions = store.suggest(query, fields, limit, fuzzy)
+
+        return jsonify({
+            "suggestions": suggestions,
+            "count": len(suggestions)
+        })
+
+    except Exception as e:
+        logger.error("Error in autocomplete_buildings: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
 
-        # Process response
+@app.route('/api/buildings/mesh/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_building_mesh_tile(z, x, y):
+    """Return the extruded meshes of the loaded buildings in one map tile as binary vertex/index buffers"""
+    try:
         try:
-            # Extract JSON from response
-            result = result.strip()
-
-            # If the response is wrapped in ```json and ```, extract just the JSON part
-            if result.startswith('```json'):
-                result = result.split('```json')[1].split('```')[0].strip()
-            elif result.startswith('```'):
-                result = result.split('```')[1].split('```')[0].strip()
-
-            # Parse the JSON
-            parsed_result = json.loads(result)
-
-            # Validate the response structure
-            if 'filters' not in parsed_result or 'explanation' not in parsed_result:
-                raise ValueError("Response missing required fields")
-
-            # Process and normalize filters
-            processed_filters = []
-            for filter_item in parsed_result['filters']:
-                # Ensure all required fields are present
-                if 'attribute' not in filter_item or 'operator' not in filter_item or 'value' not in filter_item:
-                    continue
-
-                # Normalize attribute names
-                attribute = filter_item['attribute']
-                if attribute in ['floors', 'levels', 'stories', 'floor', 'level', 'story']:
-                    attribute = 'building:levels'
-                elif attribute in ['type', 'building_type']:
-                    attribute = 'building'
-                elif attribute in ['address', 'street']:
-                    attribute = 'addr:street'
-                elif attribute in ['number', 'house_number']:
-                    attribute = 'addr:housenumber'
-                elif attribute in ['year', 'built', 'year_built']:
-                    attribute = 'start_date'
-
-                # Special handling for knowledge-based queries
-                query_lower = query.lower()
-
-                # Historical/oldest buildings
-                if attribute == 'start_date' and ('oldest' in query_lower or 'historical' in query_lower or 'heritage' in query_lower):
-                    print("Converting historical building query to use knowledge-based filtering")
-                    attribute = 'name'
-                    filter_item['operator'] = 'contains'
-
-                    # Use different historical building names based on query nuances
-                    if 'oldest' in query_lower:
-                        filter_item['value'] = 'historic'
-                    elif 'heritage' in query_lower:
-                        filter_item['value'] = 'heritage'
-                    else:
-                        filter_item['value'] = 'historic'
-
-                    # Add explanation about the conversion
-                    if not parsed_result['explanation'].endswith('.'):
-                        parsed_result['explanation'] += '.'
-                    parsed_result['explanation'] += " Using building names and Calgary's historical context to identify likely historical buildings."
-
-                # Modern/newest buildings
-                elif attribute == 'start_date' and ('newest' in query_lower or 'modern' in query_lower or 'recent' in query_lower):
-                    print("Converting modern building query to use knowledge-based filtering")
-                    attribute = 'name'
-                    filter_item['operator'] = 'contains'
-
-                    # Use different modern building names based on query nuances
-                    if 'newest' in query_lower:
-                        filter_item['value'] = 'telus'
-                    elif 'modern' in query_lower:
-                        filter_item['value'] = 'bow'
-                    else:
-                        filter_item['value'] = 'brookfield'
-
-                    # Add explanation about the conversion
-                    if not parsed_result['explanation'].endswith('.'):
-                        parsed_result['explanation'] += '.'
-                    parsed_result['explanation'] += " Using building names to identify modern buildings in Calgary's skyline."
-
-                # Architectural style queries
-                elif 'style' in query_lower or 'architecture' in query_lower or 'design' in query_lower:
-                    print("Converting architectural style query to use knowledge-based filtering")
-                    attribute = 'name'
-                    filter_item['operator'] = 'contains'
-
-                    # Determine architectural style from query
-                    if 'art deco' in query_lower:
-                        filter_item['value'] = 'palliser'
-                    elif 'modern' in query_lower or 'contemporary' in query_lower:
-                        filter_item['value'] = 'bow'
-                    elif 'brutalist' in query_lower or 'concrete' in query_lower:
-                        filter_item['value'] = 'calgary tower'
-                    elif 'glass' in query_lower:
-                        filter_item['value'] = 'telus'
-                    else:
-                        filter_item['value'] = 'bow'
-
-                    # Add explanation about the conversion
-                    if not parsed_result['explanation'].endswith('.'):
-                        parsed_result['explanation'] += '.'
-                    parsed_result['explanation'] += " Using building names to identify buildings with specific architectural styles in Calgary."
-
-                # Cultural significance queries
-                elif 'cultural' in query_lower or 'landmark' in query_lower or 'iconic' in query_lower or 'significant' in query_lower:
-                    print("Converting cultural significance query to use knowledge-based filtering")
-                    attribute = 'name'
-                    filter_item['operator'] = 'contains'
-                    filter_item['value'] = 'calgary tower'
-
-                    # Add explanation about the conversion
-                    if not parsed_result['explanation'].endswith('.'):
-                        parsed_result['explanation'] += '.'
-                    parsed_result['explanation'] += " Highlighting culturally significant buildings in Calgary's urban landscape."
-
-                # Sustainability queries
-                elif 'sustainable' in query_lower or 'green' in query_lower or 'eco' in query_lower or 'leed' in query_lower:
-                    print("Converting sustainability query to use knowledge-based filtering")
-                    attribute = 'name'
-                    filter_item['operator'] = 'contains'
-                    filter_item['value'] = 'bow'
-
-                    # Add explanation about the conversion
-                    if not parsed_result['explanation'].endswith('.'):
-                        parsed_result['explanation'] += '.'
-                    parsed_result['explanation'] += " Identifying buildings with sustainable design features in Calgary."
-
-                # Create normalized filter
-                processed_filters.append({
-                    'attribute': attribute,
-                    'operator': filter_item['operator'],
-                    'value': filter_item['value']
-                })
-
-            # Update the filters in the result
-            parsed_result['filters'] = processed_filters
-
-            # Log the processed filters
-            print(f"Processed filters: {processed_filters}")
-            print(f"Explanation: {parsed_result['explanation']}")
+            center = request.args.get('center')
+            if center is not None:
+                lon, lat = (float(v) for v in center.split(','))
+                if not (math.isfinite(lon) and math.isfinite(lat)):
+                    raise ValueError("center must be finite lon,lat")
+                center = (lon, lat)
+            store = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH)
+
+            # Level of detail: explicit, from the camera distance, or from the zoom
+            lod = request.args.get('lod', type=int)
+            distance = request.args.get('distance', type=float)
+            if distance is not None and not math.isfinite(distance):
+                raise ValueError("distance must be a finite number")
+            if lod is None and distance is not None:
+                lod = lod_for_distance(distance, store.lods.center[1])
+            elif lod is None:
+                lod = lod_for_zoom(z)
+            tile, cached = mesh_tiles.get_tile(store, z, x, y, center, lod)
+        except ValueError as e:
+            return jsonify({
+                "error": str(e)
+            }), 400
+
+        metrics.mesh_tile_requests.inc('hit' if cached else 'miss')
+        response = Response(tile.data, mimetype='application/octet-stream')
+        response.set_etag(tile.etag)
+        # The store can be replaced at any time, so clients revalidate with If-None-Match
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Mesh-Cache'] = 'hit' if cached else 'miss'
+        response.headers['X-Mesh-Buildings'] = str(tile.building_count)
+        response.headers['X-Mesh-LOD'] = str(lod)
+        return response.make_conditional(request)
 
-            return jsonify(parsed_result)
-        except Exception as e:
-            print(f"Error parsing filter response: {e}")
-            # Fallback response
+    except Exception as e:
+        logger.error("Error in get_building_mesh_tile: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+@app.route('/api/stats', methods=['POST'])
+def get_city_stats():
+    """Aggregate the buildings matching optional filters and bbox: summaries, group-by, histogram and heatmap grid"""
+    try:
+        data = request.get_json(silent=True) or {}
+        store = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH)
+        try:
+            result, cached = city_stats.get(store, data)
+        except (ValueError, TypeError) as e:
             return jsonify({
-                "filters": [],
-                "explanation": f"Could not parse the query: {query}. Please try a different query format."
-            })
+                "error": str(e)
+            }), 400
+
+        return jsonify(dict(result, cached=cached))
 
     except Exception as e:
-        print(f"Error in filter_buildings: {e}")
+        logger.error("Error in get_city_stats: %s", e)
         return jsonify({
             "error": str(e)
         }), 500
 
+def cached_building_context(building_name, building_type, query_type):
+    """Return the cached context for a building, or None"""
+    cache_key = context_cache_key(building_name, building_type, query_type)
+    with stage_latency.time('building_context', 'cache'):
+        cached_result = response_cache.get(cache_key)
+    if cached_result is not None:
+        logger.debug("Cache hit for %s", cache_key)
+    return cached_result
+
+def cache_building_context(building_name, building_type, query_type, result):
+    """Parse a Gemini building context response and cache it; raises if the response is not valid JSON"""
+    with stage_latency.time('building_context', 'parse'):
+        parsed_result = parse_context_response(result)
+    response_cache.set(context_cache_key(building_name, building_type, query_type), parsed_result)
+    return parsed_result
+
+def resolve_building_context(building_name, building_type, query_type, priority=None):
+    """
+    Return the context for a building, from the response cache or Gemini (the fallback if the call fails).
+
+    A priority admits the Gemini call for the current request, as in summarize_building.
+    """
+    try:
+        return answer_llm_request(context_request(building_name, building_type, query_type), priority)
+    except Exception as e:
+        logger.error("Error processing building context: %s", e)
+        # Fallback response
+        fallback_responses.inc('building_context')
+        return context_fallback()
+
 @app.route('/api/building-context', methods=['POST'])
 def get_building_context():
     """Get contextual information about buildings based on names and other data"""
     try:
         data = request.json
-        print(f"Received /api/building-context request with data: {data}")  # Debug log
+        logger.debug("Received /api/building-context request with data: %s", data)
         building_name = data.get('name', '')
         building_type = data.get('type', '')
         query_type = data.get('query_type', 'age')  # age, history, etc.
 
-        # Create prompt for Gemini
-        prompt = f"""
-        You are an expert on Calgary's architecture, urban planning, and building information. Provide comprehensive information about this building:
-
-        Building Name: {building_name}
-        Building Type: {building_type}
-        Information Requested: {query_type}
-
-        If the building name is generic or unknown, use your knowledge of Calgary's architecture to provide detailed information about buildings of this type in Calgary.
-
-        Include information about:
-        1. Architectural style and notable features typical for this type of building in Calgary
-        2. Historical context and significance (if applicable)
-        3. Typical materials used in construction
-        4. Likely zoning and urban planning context
-        5. Typical usage patterns and functions
-        6. Estimated construction period or year
-        7. Notable examples of similar buildings in Calgary
-        8. Any cultural or economic significance
-        9. Sustainability features (if applicable)
-        10. Relationship to Calgary's urban development patterns
-
-        Format your response as valid JSON with these keys:
-        - estimatedYear (number, e.g. 1980, or 0 if unknown)
-        - confidence (string: "high", "medium", or "low")
-        - architecturalStyle (string describing the likely architectural style)
-        - notableFeatures (string describing distinctive features)
-        - historicalContext (string with historical information)
-        - culturalSignificance (string describing cultural importance)
-        - materialInfo (string describing typical construction materials)
-        - sustainabilityInfo (string describing any sustainability aspects)
-        - similarExamples (string listing similar buildings in Calgary)
-        - urbanContext (string describing relationship to urban planning)
-        - reasoning (string explaining your overall assessment)
-        """
-
-        # Generate response from Gemini
-        print("\n\n==== SENDING BUILDING CONTEXT PROMPT TO GEMINI ====")
-        print(prompt)
-        print("==== END OF BUILDING CONTEXT PROMPT ====\n")
+        return jsonify(resolve_building_context(building_name, building_type, query_type, priority='interactive'))
 
-        try:
-            # Try the newer API format
-            response = model.generate_content(prompt)
-            print("\n==== GEMINI BUILDING CONTEXT RESPONSE ====")
-            if hasattr(response, 'text'):
-                print(response.text)
-            elif hasattr(response, 'result'):
-                print(response.result)
-            else:
-                print(str(response))
-            print("==== END OF GEMINI BUILDING CONTEXT RESPONSE ====\n")
-
-            # Extract the response text
-            if hasattr(response, 'text'):
-                result = response.text
-            elif hasattr(response, 'result'):
-                result = response.result
-            elif isinstance(response, str):
-                result = response
-            else:
-                result = str(response)
+    except Exception as e:
+        logger.error("Error in get_building_context: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
 
-            # Process the response
-            result = result.strip()
+# Threads that fetch building context alongside the summary for /api/building/details
+BUILDING_DETAILS_WORKERS = int(os.getenv("BUILDING_DETAILS_WORKERS", "8"))
+details_pool = ThreadPoolExecutor(max_workers=BUILDING_DETAILS_WORKERS, thread_name_prefix="building-details")
+
+def year_unknown(building_data):
+    """Whether a building's construction year is unknown, so context is worth fetching"""
+    return str(building_data.get('year_built') or '').strip().lower() in ('', 'unknown', '0')
+
+def with_context(building_data, context):
+    """Summary input including a building's context, the way clients sent it to /api/summary"""
+    data = dict(building_data, building_context=context)
+    estimated_year = context.get('estimatedYear')
+    if isinstance(estimated_year, (int, float)) and estimated_year > 0:
+        data['year_built'] = str(int(estimated_year))
+    return data
+
+@app.route('/api/building/details', methods=['POST'])
+def get_building_details():
+    """Building context and summary in one round trip; an uncached context is generated alongside the summary"""
+    try:
+        data = request.json or {}
+        building_data = data.get('building_data', {})
+        record_building_request(building_data)
+        response = {"context": None, "contextSource": None, "speculative": False}
+
+        if not year_unknown(building_data):
+            response["summary"] = summarize_building(building_data, priority='interactive')
+            return jsonify(response)
+
+        context_args = data.get('context') or {}
+        context_inputs = (context_args.get('name') or building_data.get('name') or 'Unknown',
+                          context_args.get('type') or building_data.get('type') or 'commercial',
+                          context_args.get('query_type', 'comprehensive'))
+
+        context = cached_building_context(*context_inputs)
+        if context is not None:
+            response.update(context=context, contextSource='cache')
+            contextual = with_context(building_data, context)
+            summary = response_cache.get(summary_cache_key(contextual))
+            if summary is None:
+                # A summary generated alongside this context on an earlier request is reused rather than regenerated
+                summary = response_cache.get(summary_cache_key(building_data))
+                response["speculative"] = summary is not None
+            response["summary"] = summary if summary is not None else summarize_building(contextual, 'interactive')
+            return jsonify(response)
+
+        # Both Gemini calls run at once: the summary is generated speculatively, without waiting for the context
+        try:
+            with admitted('interactive', cost=2), stage_latency.time('building_details', 'pipeline'):
+                context_future = details_pool.submit(resolve_building_context, *context_inputs)
+                summary = summarize_building(building_data)
+                context = context_future.result()
+        except Overloaded as e:
+            response.update(shed('building_details', e, {
+                "summary": summary_fallback(building_data), "context": context_fallback(), "contextSource": 'fallback'
+            }))
+            return jsonify(response)
+        response.update(summary=summary, context=context, contextSource='generated', speculative=True)
+        return jsonify(response)
 
-            # If the response is wrapped in ```json and ```, extract just the JSON part
-            if "```json" in result:
-                result = result.split("```json")[1].split("```")[0].strip()
-            elif "```" in result:
-                result = result.split("```")[1].split("```")[0].strip()
+    except Exception as e:
+        logger.error("Error in get_building_details: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
 
-            # Parse the JSON
-            parsed_result = json.loads(result)
+def js_number(value):
+    """A float as JavaScript prints it: 5.0 as 5, 4.5 as 4.5"""
+    return int(value) if float(value).is_integer() else float(value)
+
+def frontend_building_data(store, row):
+    """
+    The building_data and context arguments the frontend sends to /api/building/details for a store row.
+
+    Mirrors getBuildingSummary in src/services/llmService.ts, so a prewarmed response has the cache key
+    of the frontend's request. Tags are rebuilt from the store's parsed columns, so a height tag with
+    units (e.g. "60 m") is not reproduced exactly.
+    """
+    def tag(column):
+        return store.categorical[column].value_at(row)
+
+    height = store.tagged['height'][row]
+    levels = store.tagged['building:levels'][row]
+    height_tag = str(js_number(height)) if height == height else None
+    levels_tag = str(js_number(levels)) if levels == levels else None
+    if height_tag is not None:
+        payload_height = height_tag
+    elif levels_tag is not None:
+        payload_height = js_number(levels * 3)
+    else:
+        payload_height = 10
+
+    building_id = store.ids[row]
+    building_data = {
+        "id": building_id.item() if hasattr(building_id, 'item') else building_id,
+        "name": tag('name') or "Unnamed Building",
+        "type": tag('building') or "commercial",
+        "levels": levels_tag or "3",
+        "height": payload_height,
+        "actualHeight": height_tag or (f"{levels_tag} levels" if levels_tag is not None else "unknown"),
+        "amenity": tag('amenity') or "",
+        "shop": tag('shop') or "",
+        "office": tag('office') or "",
+        "year_built": tag('start_date') or "unknown",
+        "material": tag('material') or "concrete",
+        "roof_shape": tag('roof:shape') or "flat",
+        "addr:street": tag('addr:street') or "",
+        "addr:housenumber": tag('addr:housenumber') or "",
+    }
+    context_args = (tag('name') or "Unknown", tag('building') or "commercial", "comprehensive")
+    return building_data, context_args
+
+def prewarm_building(target):
+    """Cache what /api/building/details serves for a building: its summary and, if its year is unknown, its context"""
+    building_data, context_args = target
+    generated = False
+    if year_unknown(building_data):
+        context = cached_building_context(*context_args)
+        if context is None:
+            prewarm_jobs.limiter.wait()
+            result = generate_text(build_context_prompt(*context_args), "BUILDING CONTEXT")
+            context = cache_building_context(*context_args, result)
+            generated = True
+        building_data = with_context(building_data, context)
+
+    if response_cache.get(summary_cache_key(building_data)) is None:
+        prewarm_jobs.limiter.wait()
+        cache_summary(building_data, generate_text(build_summary_prompt(building_data), "SUMMARY"))
+        generated = True
+    return 'warmed' if generated else 'cached'
+
+# Background prewarming of building summaries and context, spread out to stay within Gemini quota
+PREWARM_MAX_BUILDINGS = int(os.getenv("PREWARM_MAX_BUILDINGS", "1000"))
+prewarm_jobs = JobQueue(
+    prewarm_building,
+    workers=int(os.getenv("PREWARM_WORKERS", "2")),
+    rate=float(os.getenv("PREWARM_RATE_PER_SECOND", "1")),
+    max_attempts=int(os.getenv("PREWARM_MAX_ATTEMPTS", "3")),
+    backoff=float(os.getenv("PREWARM_BACKOFF_SECONDS", "2")),
+    max_depth=int(os.getenv("PREWARM_MAX_DEPTH", "10000")),
+    # Progress is recorded next to the cached responses, so any worker can report a job
+    path=response_cache.path
+)
 
-            return jsonify(parsed_result)
+def prewarm_rows(store, data):
+    """
+    Rows selected by a prewarm request, in target order without repeats.
+
+    Targets are `names` (buildings with any of these names), `ids`, `tallest` (the N tallest buildings)
+    and `popular` (the N most requested building IDs, across processes when LLM_CACHE_PATH is set).
+
+    Raises:
+        ValueError: If no target is given or one is malformed.
+    """
+    names, ids = data.get('names') or [], data.get('ids') or []
+    if not isinstance(names, list) or not isinstance(ids, list):
+        raise ValueError("names and ids must be lists")
+    tallest, popular = int(data.get('tallest') or 0), int(data.get('popular') or 0)
+    if tallest < 0 or popular < 0:
+        raise ValueError("tallest and popular must not be negative")
+    if not (names or ids or tallest or popular):
+        raise ValueError("Give at least one of names, ids, tallest or popular")
+
+    selected = []
+    for name in names:
+        selected.extend(store.page([{"attribute": "name", "operator": "=", "value": name}])[0])
+    selected.extend(store.rows_for_ids(ids))
+    if tallest:
+        selected.extend(store.page([], 'height', True, tallest)[0])
+    if popular:
+        popular_ids = [building_id for building_id, _ in building_requests.most_common(popular)]
+        selected.extend(store.rows_for_ids(popular_ids))
+    return list(dict.fromkeys(int(row) for row in selected))
+
+@app.route('/api/prewarm', methods=['POST'])
+def enqueue_prewarm():
+    """Queue a background job that caches summaries and context for named, tallest, popular or listed buildings"""
+    try:
+        data = request.get_json(silent=True) or {}
+        store = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH)
+        try:
+            rows = prewarm_rows(store, data)
+        except (ValueError, TypeError) as e:
+            return jsonify({
+                "error": str(e)
+            }), 400
+        if len(rows) > PREWARM_MAX_BUILDINGS:
+            return jsonify({
+                "error": f"{len(rows)} buildings selected; at most {PREWARM_MAX_BUILDINGS} per job"
+            }), 400
 
-        except Exception as e:
-            print(f"Error processing building context: {e}")
-            # Fallback response
+        targets = [frontend_building_data(store, row) for row in rows]
+        kind = ', '.join(target for target in ('names', 'ids', 'tallest', 'popular') if data.get(target))
+        try:
+            job = prewarm_jobs.submit(kind, targets, key=lambda target: str(target[0]["id"]))
+        except JobQueueFull as e:
             return jsonify({
-                "estimatedYear": 0,
-                "confidence": "low",
-                "architecturalStyle": "Unknown",
-                "notableFeatures": "No specific features identified",
-                "historicalContext": "No historical information available",
-                "culturalSignificance": "Unknown cultural significance",
-                "materialInfo": "Typical construction materials for Calgary buildings include concrete, steel, and glass",
-                "sustainabilityInfo": "No specific sustainability information available",
-                "similarExamples": "No specific examples identified",
-                "urbanContext": "This building is part of Calgary's urban landscape",
-                "reasoning": "Unable to determine detailed building context due to insufficient information."
-            })
+                "error": str(e)
+            }), 429
+
+        return jsonify(job.to_dict()), 202
+
+    except Exception as e:
+        logger.error("Error in enqueue_prewarm: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+@app.route('/api/prewarm', methods=['GET'])
+def get_prewarm_status():
+    """Report prewarm queue depth and the progress of recent jobs"""
+    return jsonify(prewarm_jobs.stats())
+
+@app.route('/api/prewarm/<job_id>', methods=['GET'])
+def get_prewarm_job(job_id):
+    """Report the progress of one prewarm job"""
+    job = prewarm_jobs.job(job_id)
+    if job is None:
+        return jsonify({
+            "error": f"Unknown prewarm job {job_id}"
+        }), 404
+    return jsonify(job)
+
+@app.route('/api/admission', methods=['GET'])
+def get_admission_stats():
+    """Report admission control slots, queue lengths by priority and shed counters"""
+    return jsonify(admission.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Return counters for the LLM response cache, the filter plan and predicate caches and in-flight call coalescing"""
+    stats = response_cache.stats()
+    stats['filter_plans'] = filter_plan_cache_stats()
+    stats['predicates'] = get_building_store(CITY_DATA_PATH, STORE_SNAPSHOT_PATH).bitmaps.stats()
+    stats['city_stats'] = city_stats.stats()
+    stats['coalescing'] = llm_flight.stats()
+    return jsonify(stats)
+
+@app.route('/api/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    """Invalidate one cached response, a namespace (summary, building-context) or everything"""
+    try:
+        data = request.get_json(silent=True) or {}
+        removed = response_cache.invalidate(key=data.get('key'), namespace=data.get('namespace'))
+
+        return jsonify({
+            "invalidated": removed
+        })
 
     except Exception as e:
-        print(f"Error in get_building_context: {e}")
+        logger.error("Error in invalidate_cache: %s", e)
         return jsonify({
             "error": str(e)
         }), 500
 
+@app.route('/api/debug/exchanges', methods=['GET'])
+def get_recent_exchanges():
+    """Return the most recent Gemini prompt/response exchanges from the in-memory ring buffer"""
+    # Prompts and responses are returned in full, so require a token when one is configured
+    token = os.getenv("DEBUG_API_TOKEN")
+    if token and request.headers.get('X-Debug-Token') != token:
+        return jsonify({
+            "error": "Invalid or missing X-Debug-Token header"
+        }), 403
+
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        "exchanges": exchange_log.recent(limit)
+    })
+
+@app.route('/api/osm/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_osm_tile(z, x, y):
+    """Return the Overpass buildings/roads JSON for one slippy-map tile from the shared tile cache"""
+    try:
+        tile = osm_tiles.get_tile(z, x, y, request.args.get('layer', 'all'))
+    except ValueError as e:
+        return jsonify({
+            "error": str(e)
+        }), 400
+    except OverpassError as e:
+        logger.error("Error in get_osm_tile: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 502
+
+    metrics.osm_tile_requests.inc(tile.status)
+    response = Response(tile.body, mimetype='application/json')
+    response.set_etag(tile.etag)
+    response.headers['Cache-Control'] = f"public, max-age={osm_tiles.ttl_seconds}"
+    response.headers['X-Tile-Cache'] = tile.status
+    # Answers If-None-Match from browsers and proxies with 304 Not Modified
+    return response.make_conditional(request)
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Expose request, LLM and cache metrics in the Prometheus text format"""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 # For local development only
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,269 @@
+"""
+Async (ASGI) serving mode for the 3D City Viewer backend.
+
+The four Gemini-backed routes are served by a Quart app whose handlers await a
+non-blocking Gemini client, so a slow generation holds a suspended coroutine
+instead of a worker thread. Outstanding upstream calls are bounded by a global
+semaphore and one semaphore per route; when a client disconnects its handler
+is cancelled, and the upstream call is cancelled once nobody is waiting on it.
+Every other route is forwarded to the Flask app in app.py.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from asgiref.wsgi import WsgiToAsgi
+from quart import Quart, g, jsonify, request
+
+import app as sync_app
+import metrics
+from admission import AdmissionController, Overloaded, client_id, request_priority
+from filter_parser import parse_filter_query
+from llm_backends import get_backend
+from metrics import fallback_responses, stage_latency
+from prompts import context_fallback
+from single_flight import AsyncSingleFlight
+
+logger = logging.getLogger("gemini_app.asgi")
+
+# Limits on outstanding Gemini calls, globally and per route
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_ROUTES = ('summary', 'query', 'filter', 'building_context')
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+route_semaphores = {
+    route: asyncio.Semaphore(int(os.getenv(f"LLM_MAX_CONCURRENCY_{route.upper()}", str(LLM_MAX_CONCURRENCY))))
+    for route in LLM_ROUTES
+}
+
+llm_flight = AsyncSingleFlight(timeout=sync_app.LLM_COALESCE_TIMEOUT_SECONDS)
+
+# Admission control sized for suspended coroutines rather than the Flask app's threads: a slot per allowed Gemini
+# call, a deep queue and no token buckets unless they are configured (rates are split between workers as in app.py)
+admission = AdmissionController(
+    rate=float(os.getenv("ASYNC_ADMISSION_RATE_PER_SECOND", "0")) / sync_app.ADMISSION_WORKERS,
+    burst=max(int(os.getenv("ASYNC_ADMISSION_BURST", "100")) // sync_app.ADMISSION_WORKERS, 1),
+    client_rate=float(os.getenv("ASYNC_ADMISSION_CLIENT_RATE_PER_SECOND", "0")) / sync_app.ADMISSION_WORKERS,
+    client_burst=max(int(os.getenv("ASYNC_ADMISSION_CLIENT_BURST", "20")) // sync_app.ADMISSION_WORKERS, 1),
+    max_concurrency=int(os.getenv("ASYNC_ADMISSION_MAX_CONCURRENCY", str(LLM_MAX_CONCURRENCY))),
+    max_queue=int(os.getenv("ASYNC_ADMISSION_MAX_QUEUE", "4096")),
+    queue_timeout=float(os.getenv("ASYNC_ADMISSION_QUEUE_TIMEOUT_SECONDS", "60"))
+)
+
+async_app = Quart(__name__)
+flask_app = WsgiToAsgi(sync_app.app)
+
+# Paths served natively by the async app; everything else goes to Flask
+ASYNC_PATHS = {'/api/summary', '/api/query', '/api/filter', '/api/building-context', '/api/llm/concurrency'}
+
+
+async def app(scope, receive, send):
+    """ASGI entry point dispatching between the async routes and the Flask app"""
+    if scope['type'] == 'lifespan' or scope.get('path') in ASYNC_PATHS:
+        await async_app(scope, receive, send)
+    else:
+        await flask_app(scope, receive, send)
+
+
+@async_app.before_request
+async def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@async_app.after_request
+async def add_cors_headers(response):
+    # Same policy as the Flask app: allow all origins
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, X-Request-Priority'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Load-Shed'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+
+    # Same request metrics as the Flask app
+    start = g.pop('request_start', None)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.http_requests.inc(route, request.method, str(response.status_code))
+    if response.status_code >= 500:
+        metrics.http_errors.inc(route)
+    if start is not None:
+        metrics.http_latency.observe(time.perf_counter() - start, route)
+    shed_reason = g.pop('load_shed', None)
+    if shed_reason is not None:
+        response.headers['X-Load-Shed'] = shed_reason
+        if response.status_code == 503:
+            response.headers['Retry-After'] = '1'
+    return response
+
+
+@asynccontextmanager
+async def admitted(priority, cost=1):
+    """Admit the request through the async app's admission controller, waiting for a slot on the event loop"""
+    client = client_id(request.headers, request.remote_addr, sync_app.ADMISSION_TRUSTED_PROXIES)
+    await admission.acquire_async(client, request_priority(request.headers, priority), cost)
+    try:
+        yield
+    finally:
+        admission.release()
+
+
+def shed(route, error, payload):
+    """Count a shed request and mark its response, whose body is the route's fallback payload"""
+    logger.warning("Shed %s request: %s", route, error.reason)
+    metrics.admission_shed.inc(route, error.reason)
+    g.load_shed = error.reason
+    return payload
+
+
+async def call_llm_async(prompt, label, route):
+    """Send a prompt to the LLM backend without blocking the event loop, within the concurrency limits"""
+    async with llm_semaphore, route_semaphores[route]:
+        backend = get_backend()
+        start = time.perf_counter()
+        try:
+            result = await backend.generate_async(prompt, label)
+        except Exception as e:
+            sync_app.record_exchange(backend, label, prompt, duration=time.perf_counter() - start, error=e)
+            raise
+        sync_app.record_exchange(backend, label, prompt, result, time.perf_counter() - start)
+        return result
+
+
+async def generate_text_async(prompt, label, route):
+    """Generate text for a prompt; concurrent requests with the same normalized prompt share one Gemini call"""
+    key = hashlib.sha256(' '.join(prompt.split()).encode('utf-8')).hexdigest()
+    return await llm_flight.do(key, lambda: call_llm_async(prompt, label, route))
+
+
+async def answer_llm_request(llm_request, priority):
+    """
+    Async counterpart of app.answer_llm_request: the response cache's disk tier is read and written off the event
+    loop, and the admitted Gemini call is awaited
+    """
+    route = llm_request.route
+    if llm_request.cache_key is not None:
+        with stage_latency.time(route, 'cache'):
+            cached_result = await sync_app.response_cache.get_async(llm_request.cache_key)
+        if cached_result is not None:
+            return cached_result
+
+    try:
+        async with admitted(priority):
+            with stage_latency.time(route, 'llm'):
+                result = await generate_text_async(llm_request.prompt, llm_request.label, route)
+    except Overloaded as e:
+        if llm_request.fallback is None:
+            raise
+        return shed(route, e, llm_request.fallback())
+
+    parsed_result, parsed = sync_app.parse_llm_result(llm_request, result)
+    if parsed and llm_request.cache_key is not None:
+        await sync_app.response_cache.set_async(llm_request.cache_key, parsed_result)
+    return parsed_result
+
+
+@async_app.route('/api/summary', methods=['POST'])
+async def get_building_summary():
+    """Generate a summary for a building using Gemini 2.5 Pro"""
+    try:
+        data = await request.get_json()
+        logger.debug("Received async /api/summary request with data: %s", data)
+        building_data = data.get('building_data', {})
+        # Counting may flush the shared counts to SQLite, which must not block the event loop
+        await asyncio.to_thread(sync_app.record_building_request, building_data)
+
+        return jsonify(await answer_llm_request(sync_app.summary_request(building_data), 'summary'))
+
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+
+@async_app.route('/api/query', methods=['POST'])
+async def process_query():
+    """Process a general query about buildings or urban planning using Gemini 2.5 Pro"""
+    try:
+        data = await request.get_json()
+        logger.debug("Received async /api/query request with data: %s", data)
+        query = data.get('query', '')
+        context = data.get('context', {})
+
+        try:
+            return jsonify(await answer_llm_request(sync_app.query_request(query, context), 'interactive'))
+        except Overloaded as e:
+            # Free-form answers have no deterministic fallback
+            return shed('query', e, jsonify({
+                "error": "The server is busy, please try again shortly"
+            })), 503
+
+    except Exception as e:
+        logger.error("Error: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+
+@async_app.route('/api/filter', methods=['POST'])
+async def filter_buildings():
+    """Process a building filter query using Gemini 2.5 Pro"""
+    try:
+        data = await request.get_json()
+        logger.debug("Received async /api/filter request with data: %s", data)
+        query = data.get('query', '')
+
+        # Answer simple queries with the rule-based parser and skip Gemini
+        with stage_latency.time('filter', 'rules'):
+            parsed_result = parse_filter_query(query)
+        if parsed_result is not None:
+            return jsonify(parsed_result)
+
+        # Reuse the plan Gemini produced for the same canonical query, or ask Gemini
+        return jsonify(await answer_llm_request(sync_app.filter_request(query), 'interactive'))
+
+    except Exception as e:
+        logger.error("Error in filter_buildings: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+
+@async_app.route('/api/building-context', methods=['POST'])
+async def get_building_context():
+    """Get contextual information about buildings based on names and other data"""
+    try:
+        data = await request.get_json()
+        logger.debug("Received async /api/building-context request with data: %s", data)
+        building_name = data.get('name', '')
+        building_type = data.get('type', '')
+        query_type = data.get('query_type', 'age')  # age, history, etc.
+
+        try:
+            llm_request = sync_app.context_request(building_name, building_type, query_type)
+            return jsonify(await answer_llm_request(llm_request, 'interactive'))
+        except Exception as e:
+            logger.error("Error processing building context: %s", e)
+            fallback_responses.inc('building_context')
+            return jsonify(context_fallback())
+
+    except Exception as e:
+        logger.error("Error in get_building_context: %s", e)
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+
+@async_app.route('/api/llm/concurrency', methods=['GET'])
+async def get_llm_concurrency():
+    """Report free upstream call slots, admission slots and queue, and in-flight coalescing counters"""
+    return jsonify({
+        "limit": LLM_MAX_CONCURRENCY,
+        "available": llm_semaphore._value,
+        "routes": {route: semaphore._value for route, semaphore in route_semaphores.items()},
+        "admission": admission.stats(),
+        "coalescing": llm_flight.stats()
+    })
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the 3D City Viewer backend.
+
+Run from the backend directory, e.g.:
+    python -m bench.routes --concurrency 1 8 32 --output routes.json
+    python -m bench.filters --sizes 10000 100000 1000000 --output filters.json
+"""
@@ -0,0 +1,100 @@
+"""
+Shared helpers for the benchmark scripts: latency percentiles, memory usage
+and JSON result files.
+"""
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies):
+    """Summarize per-call latencies (seconds) in milliseconds."""
+    values = sorted(latencies)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+def memory_usage():
+    """Current and peak resident set size of this process, in MB."""
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes rather than kilobytes
+        peak_kb //= 1024
+    current_mb = None
+    try:
+        with open('/proc/self/statm') as f:
+            current_mb = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        pass
+    return {
+        'rss_mb': round(current_mb, 1) if current_mb is not None else None,
+        'peak_rss_mb': round(peak_kb / 1024, 1),
+    }
+
+
+def timed(fn, repeat=1):
+    """Call fn() `repeat` times and return (last result, list of durations in seconds)."""
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+    return result, durations
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_results(benchmark, config, results, output=None):
+    """
+    Emit a benchmark run as JSON.
+
+    Args:
+        benchmark (str): Benchmark name, e.g. 'routes'.
+        config (dict): The parameters of the run.
+        results (list): One dict per measured case.
+        output (str): File to write; printed to stdout when omitted.
+    """
+    report = {
+        'benchmark': benchmark,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': config,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return report
@@ -0,0 +1,167 @@
+"""
+Micro-benchmark of filter evaluation on synthetic cities.
+
+Compares per-object evaluation with models.Building.matches_filter against the
+columnar BuildingStore, checking that both return the same buildings. Sorted
+cases compare a top-K page read from the presorted permutation with sorting
+every match. The refine case adds one predicate at a time, as a user
+narrowing a query does, and times each step against re-evaluating every
+predicate from scratch.
+
+    python -m bench.filters --sizes 10000 100000 1000000
+"""
+import argparse
+import gc
+import time
+
+import numpy as np
+
+from bench.common import latency_summary, memory_usage, timed, write_results
+from bench.synthetic import synthetic_records
+from building_store import BuildingStore
+from models import Building
+
+# Filter lists shaped like /api/filter output
+FILTER_CASES = {
+    'height_gt': [{'attribute': 'height', 'operator': '>', 'value': 50}],
+    'type_and_levels': [{'attribute': 'building', 'operator': '=', 'value': 'commercial'},
+                        {'attribute': 'building:levels', 'operator': '>', 'value': 5}],
+    'name_contains': [{'attribute': 'name', 'operator': 'contains', 'value': 'bow'}],
+    'built_before': [{'attribute': 'start_date', 'operator': '<', 'value': 1950}],
+    'amenity_and_height_range': [{'attribute': 'amenity', 'operator': '=', 'value': 'restaurant'},
+                                 {'attribute': 'height', 'operator': '>=', 'value': 10},
+                                 {'attribute': 'height', 'operator': '<=', 'value': 60}],
+}
+
+# (filters, sortBy, sortOrder, page size), as /api/filter returns for "tallest ..." queries
+SORT_CASES = {
+    'tallest_commercial_top20': (FILTER_CASES['type_and_levels'][:1], 'height', 'desc', 20),
+    'tallest_top20': ([], 'height', 'desc', 20),
+    'oldest_restaurants_top20': ([{'attribute': 'amenity', 'operator': '=', 'value': 'restaurant'}],
+                                 'start_date', 'asc', 20),
+}
+
+# Filters added one at a time
+REFINE_STEPS = [
+    {'attribute': 'building', 'operator': '=', 'value': 'commercial'},
+    {'attribute': 'height', 'operator': '>', 'value': 20},
+    {'attribute': 'building:levels', 'operator': '<', 'value': 30},
+    {'attribute': 'amenity', 'operator': '=', 'value': 'cafe'},
+]
+
+
+def evaluate_all(store, filters):
+    """AND of every filter's mask, with no index or cache."""
+    mask = np.ones(len(store), dtype=bool)
+    for filter_criteria in filters:
+        mask &= store.filter_mask(filter_criteria)
+    return mask
+
+
+def full_sort(store, filters, sort_by, descending, limit):
+    """Top rows by sorting every match, NaN last, as the client does."""
+    rows = np.flatnonzero(store.apply_filters(filters))
+    values = store.numeric_column(sort_by)[rows]
+    order = np.argsort(-values if descending else values, kind='stable')
+    return rows[order[:limit]]
+
+
+def match_objects(buildings, filters):
+    return [b.id for b in buildings if all(b.matches_filter(f) for f in filters)]
+
+
+def bench_size(size, repeat, object_limit, seed):
+    """Benchmark every filter case on a synthetic city of `size` buildings."""
+    records = synthetic_records(size, seed)
+    results = []
+
+    store, load_store = timed(lambda: BuildingStore.from_records(records))
+    buildings = None
+    load_objects = None
+    if size <= object_limit:
+        buildings, load_objects = timed(lambda: [Building(r) for r in records])
+
+    for name, filters in FILTER_CASES.items():
+        ids, store_times = timed(lambda: store.matching_ids(filters), repeat)
+        case = {
+            'size': size,
+            'case': name,
+            'matches': len(ids),
+            'engines': {'building_store': latency_summary(store_times)},
+        }
+        if buildings is not None:
+            reference, object_times = timed(lambda: match_objects(buildings, filters), max(1, repeat // 5))
+            case['engines']['matches_filter'] = latency_summary(object_times)
+            case['consistent'] = ids == reference
+            case['speedup'] = round(case['engines']['matches_filter']['p50_ms'] /
+                                    max(case['engines']['building_store']['p50_ms'], 1e-6), 1)
+        results.append(case)
+
+    for name, (filters, sort_by, sort_order, limit) in SORT_CASES.items():
+        descending = sort_order == 'desc'
+        store.sort_index(sort_by)
+        (rows, _, matches), page_times = timed(lambda: store.page(filters, sort_by, descending, limit), repeat)
+        reference, sort_times = timed(lambda: full_sort(store, filters, sort_by, descending, limit), repeat)
+        column = store.numeric_column(sort_by)
+        results.append({
+            'size': size,
+            'case': name,
+            'matches': matches,
+            'engines': {'sorted_page': latency_summary(page_times), 'full_sort': latency_summary(sort_times)},
+            'consistent': np.array_equal(column[rows], column[reference], equal_nan=True),
+        })
+
+    store.bitmaps.clear()
+    refine_times = []
+    scratch_times = []
+    consistent = True
+    for step in range(1, len(REFINE_STEPS) + 1):
+        filters = REFINE_STEPS[:step]
+        mask, durations = timed(lambda: store.apply_filters(filters))
+        reference, scratch = timed(lambda: evaluate_all(store, filters))
+        refine_times += durations
+        scratch_times += scratch
+        consistent = consistent and np.array_equal(mask, reference)
+    results.append({
+        'size': size,
+        'case': 'refine',
+        'steps': len(REFINE_STEPS),
+        'engines': {'bitmap_cache': latency_summary(refine_times), 'from_scratch': latency_summary(scratch_times)},
+        'consistent': consistent,
+    })
+
+    summary = {
+        'size': size,
+        'case': 'load',
+        'engines': {'building_store': {'seconds': round(load_store[0], 3)}},
+        'memory': memory_usage(),
+    }
+    if load_objects is not None:
+        summary['engines']['matches_filter'] = {'seconds': round(load_objects[0], 3)}
+    results.append(summary)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=20, help='timed repetitions per case')
+    parser.add_argument('--object-limit', type=int, default=1000000,
+                        help='skip matches_filter above this many buildings (it needs one object per building)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        start = time.perf_counter()
+        results.extend(bench_size(size, args.repeat, args.object_limit, args.seed))
+        results[-1]['total_seconds'] = round(time.perf_counter() - start, 3)
+        gc.collect()
+
+    config = {key: value for key, value in vars(args).items() if key != 'output'}
+    write_results('filters', config, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark of building ingest on synthetic city extracts.
+
+Writes the same synthetic city as a GeoJSON FeatureCollection, line-delimited
+GeoJSON and OSM XML, then loads each with the streaming
+BuildingStore.load and, for the FeatureCollection, with the whole-document
+json.load + BuildingStore.from_geojson path. Reports features/s, MB/s and
+memory, plus the throughput of the tag parser on its own.
+
+    python -m bench.ingest --sizes 10000 100000 --trace-memory
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench.common import memory_usage, timed, write_results
+from bench.synthetic import synthetic_features
+from building_store import BuildingStore
+from osm_ingest import _parse_length_text, _parse_levels_text, _parse_year_text, parse_building_tags
+
+FORMATS = ('geojson', 'geojsonl', 'osm')
+
+
+def write_extract(features, path, kind):
+    """Write features to `path` as a FeatureCollection ('geojson'), one feature per line ('geojsonl') or OSM XML."""
+    with open(path, 'w', encoding='utf-8') as f:
+        if kind == 'geojson':
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+        elif kind == 'geojsonl':
+            for feature in features:
+                f.write(json.dumps(feature) + '\n')
+        else:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+            node_id = 1
+            for feature in features:
+                ring = feature['geometry']['coordinates'][0][:-1]
+                first = node_id
+                for lon, lat in ring:
+                    f.write(f'  <node id="{node_id}" lon="{lon:.7f}" lat="{lat:.7f}"/>\n')
+                    node_id += 1
+                f.write(f'  <way id="{feature["id"]}">\n')
+                for ref in list(range(first, node_id)) + [first]:
+                    f.write(f'    <nd ref="{ref}"/>\n')
+                for key, value in feature['properties'].items():
+                    value = str(value).replace('&', '&amp;').replace('"', '&quot;').replace('<', '&lt;')
+                    f.write(f'    <tag k="{key}" v="{value}"/>\n')
+                f.write('  </way>\n')
+            f.write('</osm>\n')
+
+
+def measure(load, count, size_bytes, trace_memory):
+    """Time one load, with optional tracemalloc peak allocation."""
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    store, durations = timed(load)
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    seconds = durations[0]
+    result = {
+        'seconds': round(seconds, 3),
+        'features_per_s': round(count / seconds),
+        'mb_per_s': round(size_bytes / 1024 / 1024 / seconds, 1),
+        'buildings': len(store),
+    }
+    if peak is not None:
+        result['peak_alloc_mb'] = round(peak / 1024 / 1024, 1)
+    return result
+
+
+def bench_parse(features, repeat):
+    """Tag parsing throughput, with cold (cleared) and warm parser caches."""
+    tags = [feature['properties'] for feature in features]
+
+    def parse_cold():
+        for cached in (_parse_length_text, _parse_levels_text, _parse_year_text):
+            cached.cache_clear()
+        return [parse_building_tags(t) for t in tags]
+
+    _, cold = timed(parse_cold, repeat)
+    _, warm = timed(lambda: [parse_building_tags(t) for t in tags], repeat)
+    return {
+        'cold_tags_per_s': round(len(tags) / min(cold)),
+        'warm_tags_per_s': round(len(tags) / min(warm)),
+    }
+
+
+def bench_size(size, directory, seed, repeat, trace_memory):
+    features = synthetic_features(size, seed)
+    results = [{'size': size, 'case': 'parse_tags', **bench_parse(features, repeat)}]
+
+    for kind in FORMATS:
+        path = os.path.join(directory, f'city-{size}.{kind}')
+        write_extract(features, path, kind)
+        size_bytes = os.path.getsize(path)
+        case = {'size': size, 'case': kind, 'file_mb': round(size_bytes / 1024 / 1024, 1), 'engines': {}}
+        case['engines']['stream'] = measure(lambda: BuildingStore.load(path), size, size_bytes, trace_memory)
+        if kind == 'geojson':
+            def load_document():
+                with open(path, 'r', encoding='utf-8') as f:
+                    return BuildingStore.from_geojson(json.load(f))
+            case['engines']['json_load'] = measure(load_document, size, size_bytes, trace_memory)
+        os.remove(path)
+        results.append(case)
+
+    del features
+    gc.collect()
+    results.append({'size': size, 'case': 'memory', 'memory': memory_usage()})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3, help='timed repetitions of the tag parser')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='report peak Python allocations per load (tracemalloc; slows the loads down)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            start = time.perf_counter()
+            results.extend(bench_size(size, directory, args.seed, args.repeat, args.trace_memory))
+            results[-1]['total_seconds'] = round(time.perf_counter() - start, 3)
+
+    config = {key: value for key, value in vars(args).items() if key != 'output'}
+    write_results('ingest', config, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+End-to-end benchmark of the Gemini-backed routes.
+
+Serves the Flask app on a local port with the stub LLM backend (or targets an
+already running server with --url) and drives /api/summary, /api/query,
+/api/filter and /api/building-context at fixed concurrency levels, reporting
+throughput, latency percentiles and memory as JSON. The local server runs
+without admission rate limits (see main), which the report's config records.
+
+    python -m bench.routes --concurrency 1 8 32 --requests 200 --latency-ms 100
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import latency_summary, memory_usage, write_results
+from bench.synthetic import synthetic_buildings
+
+ROUTES = ('summary', 'query', 'filter', 'building_context')
+
+QUERIES = (
+    'What is the oldest building in downtown Calgary?',
+    'How has the Beltline changed since 2000?',
+    'Which neighbourhoods have the most heritage buildings?',
+    'What zoning applies to the East Village?',
+)
+
+FILTER_QUERIES = (
+    # Handled by the rule-based parser
+    'buildings taller than 100 meters',
+    'commercial buildings with more than 5 floors',
+    'tallest residential buildings',
+    # Sent to the LLM
+    'sustainable buildings near the river',
+    'art deco buildings with retail on the ground floor',
+)
+
+
+def make_request(route, i, distinct):
+    """Return (path, JSON body) of the i-th request for a route, cycling through `distinct` payloads."""
+    variant = i % distinct
+    if route == 'summary':
+        return '/api/summary', {'building_data': synthetic_buildings(1, seed=variant)[0]}
+    if route == 'query':
+        return '/api/query', {'query': f"{QUERIES[variant % len(QUERIES)]} (#{variant})"}
+    if route == 'filter':
+        query = FILTER_QUERIES[variant % len(FILTER_QUERIES)]
+        if variant >= len(FILTER_QUERIES):
+            query += f" over {variant} meters" if variant % len(FILTER_QUERIES) < 3 else f" variant {variant}"
+        return '/api/filter', {'query': query}
+    return '/api/building-context', {'name': f"Building {variant}", 'type': 'commercial', 'query_type': 'age'}
+
+
+def post(base_url, path, body, timeout):
+    request = urllib.request.Request(base_url + path, data=json.dumps(body).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def run_case(base_url, route, concurrency, requests, distinct, timeout):
+    """Send `requests` requests to one route with `concurrency` workers and measure them."""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def one(i):
+        path, body = make_request(route, i, distinct)
+        start = time.perf_counter()
+        try:
+            status = post(base_url, path, body, timeout)
+        except Exception:
+            status = 'error'
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - start
+
+    return {
+        'route': route,
+        'concurrency': concurrency,
+        'requests': requests,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(requests / wall, 2) if wall else None,
+        'latency': latency_summary(latencies),
+        'status_codes': statuses,
+        'memory': memory_usage(),
+    }
+
+
+def start_local_server():
+    """Serve app.app on a free local port in a background thread; returns (base URL, server)."""
+    from werkzeug.serving import make_server
+    import app as flask_app
+
+    # Per-request access logs would dominate the measurement
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, flask_app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--routes', nargs='+', choices=ROUTES, default=list(ROUTES))
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and concurrency level')
+    parser.add_argument('--distinct', type=int, default=50,
+                        help='distinct payloads per route; repeats exercise the caches and coalescing')
+    parser.add_argument('--latency-ms', type=float, default=100, help='stub backend latency per call')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='extra stub latency derived from the prompt')
+    parser.add_argument('--url', help='benchmark an already running server instead of a local one')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    server = None
+    flask_app = None
+    base_url = args.url
+    if base_url is None:
+        # Configure the app before it is imported: stub LLM, in-memory cache, quiet logs
+        os.environ['LLM_BACKEND'] = 'stub'
+        os.environ['LLM_STUB_LATENCY_MS'] = str(args.latency_ms)
+        os.environ['LLM_STUB_JITTER_MS'] = str(args.jitter_ms)
+        os.environ.setdefault('LLM_CACHE_PATH', '')
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        # Every request comes from 127.0.0.1, so admission control would shed nearly all of them; turn the
+        # token buckets off and leave a slot for each concurrent request unless the caller configured otherwise
+        os.environ.setdefault('ADMISSION_RATE_PER_SECOND', '0')
+        os.environ.setdefault('ADMISSION_CLIENT_RATE_PER_SECOND', '0')
+        os.environ.setdefault('ADMISSION_MAX_CONCURRENCY', str(max(args.concurrency)))
+        base_url, server = start_local_server()
+        import app as flask_app
+
+    results = []
+    try:
+        for route in args.routes:
+            for concurrency in args.concurrency:
+                if flask_app is not None:
+                    # Every case starts with a cold response cache
+                    flask_app.response_cache.invalidate()
+                results.append(run_case(base_url, route, concurrency, args.requests, args.distinct, args.timeout))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    config = {key: value for key, value in vars(args).items() if key != 'output'}
+    config['target'] = 'external' if args.url else 'local flask + stub backend'
+    if flask_app is not None:
+        config['admission'] = {
+            key: os.environ[f'ADMISSION_{key.upper()}']
+            for key in ('rate_per_second', 'client_rate_per_second', 'max_concurrency')
+        }
+    write_results('routes', config, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
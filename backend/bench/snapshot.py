@@ -0,0 +1,95 @@
+"""
+Benchmark of cold start from a city file versus from a store snapshot.
+
+For each synthetic city, times what a fresh process needs before it can
+serve: loading the GeoJSON and building the indexes, against mapping the
+snapshot (with and without checksum verification). The first filter, sorted
+page and bounding-box query on the mapped store are timed too, since mapped
+pages are read on first touch. The snapshot is read right after being
+written, so its pages are in the OS page cache as on a restarted instance.
+
+    python -m bench.snapshot --sizes 10000 100000
+"""
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+
+from bench.common import timed, write_results
+from bench.synthetic import synthetic_features
+from building_store import BuildingStore
+from store_snapshot import build_indexes, build_snapshot, read_snapshot
+
+FIRST_FILTERS = [{'attribute': 'building', 'operator': '=', 'value': 'commercial'},
+                 {'attribute': 'height', 'operator': '>', 'value': 20}]
+
+
+def first_queries(store):
+    """Time the first requests a newly started server would answer."""
+    fp = store.footprints
+    lon, lat = float(fp.centroid_lon[0]), float(fp.centroid_lat[0])
+    _, filter_seconds = timed(lambda: store.apply_filters(FIRST_FILTERS))
+    _, page_seconds = timed(lambda: store.page(FIRST_FILTERS, 'height', True, 50))
+    _, bbox_seconds = timed(lambda: store.rows_in_bbox(lon - 0.01, lat - 0.01, lon + 0.01, lat + 0.01))
+    return {
+        'filter_ms': round(filter_seconds[0] * 1000, 2),
+        'sorted_page_ms': round(page_seconds[0] * 1000, 2),
+        'bbox_ms': round(bbox_seconds[0] * 1000, 2),
+    }
+
+
+def bench_size(size, directory, seed, repeat):
+    source = os.path.join(directory, f'city-{size}.geojson')
+    snapshot = os.path.join(directory, f'city-{size}.snapshot')
+    with open(source, 'w', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': synthetic_features(size, seed)}, f)
+    gc.collect()
+
+    store, load_seconds = timed(lambda: BuildingStore.load(source))
+    _, index_seconds = timed(lambda: build_indexes(store))
+    store = None
+    gc.collect()
+    _, build_seconds = timed(lambda: build_snapshot(source, snapshot))
+    gc.collect()
+
+    _, verified = timed(lambda: read_snapshot(snapshot), repeat)
+    mapped, unverified = timed(lambda: read_snapshot(snapshot, verify=False), repeat)
+    result = {
+        'size': size,
+        'source_mb': round(os.path.getsize(source) / 1024 / 1024, 1),
+        'snapshot_mb': round(os.path.getsize(snapshot) / 1024 / 1024, 1),
+        'from_source': {'load_s': round(load_seconds[0], 3), 'indexes_s': round(index_seconds[0], 3),
+                        'total_s': round(load_seconds[0] + index_seconds[0], 3)},
+        'snapshot_build_s': round(build_seconds[0], 3),
+        'from_snapshot': {'verified_ms': round(min(verified) * 1000, 2),
+                          'unverified_ms': round(min(unverified) * 1000, 2)},
+        'first_queries': first_queries(mapped),
+    }
+    os.remove(source)
+    os.remove(snapshot)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5, help='timed snapshot reads per size (the fastest counts)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            start = time.perf_counter()
+            results.append(bench_size(size, directory, args.seed, args.repeat))
+            results[-1]['total_seconds'] = round(time.perf_counter() - start, 3)
+
+    config = {key: value for key, value in vars(args).items() if key != 'output'}
+    write_results('snapshot', config, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
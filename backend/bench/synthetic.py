@@ -0,0 +1,106 @@
+"""
+Deterministic synthetic city data for benchmarks.
+"""
+import random
+
+BUILDING_TYPES = ('yes', 'residential', 'house', 'apartments', 'commercial', 'retail', 'office', 'industrial',
+                  'school', 'church')
+AMENITIES = ('restaurant', 'cafe', 'bank', 'school', 'library', 'pharmacy')
+NAMES = ('Calgary Tower', 'The Bow', 'Telus Sky', 'Brookfield Place', 'Historic Hall', 'Bankers Hall', 'Eighth Avenue Place')
+MATERIALS = ('concrete', 'brick', 'glass', 'steel', 'wood')
+ROOF_SHAPES = ('flat', 'gabled', 'hipped', 'skillion')
+STREETS = ('1 Street SW', '4 Avenue SW', 'Centre Street', 'Macleod Trail', '17 Avenue SW', 'Stephen Avenue')
+
+
+def synthetic_records(count, seed=42):
+    """
+    Generate OSM-like building tag dicts, with tag coverage similar to a real city extract.
+
+    Args:
+        count (int): Number of buildings.
+        seed (int): Random seed; the same seed always yields the same city.
+
+    Returns:
+        list: Dicts of OSM tags, each with an 'id' key.
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        record = {'id': 100000000 + i, 'building': rng.choice(BUILDING_TYPES)}
+        if rng.random() < 0.5:
+            record['building:levels'] = str(rng.randint(1, 50))
+        if rng.random() < 0.2:
+            record['height'] = str(round(rng.uniform(3, 240), 1))
+        if rng.random() < 0.05:
+            record['name'] = rng.choice(NAMES)
+        if rng.random() < 0.1:
+            record['amenity'] = rng.choice(AMENITIES)
+        if rng.random() < 0.3:
+            record['start_date'] = str(rng.randint(1880, 2024))
+        if rng.random() < 0.3:
+            record['material'] = rng.choice(MATERIALS)
+        if rng.random() < 0.3:
+            record['roof:shape'] = rng.choice(ROOF_SHAPES)
+        if rng.random() < 0.4:
+            record['addr:street'] = rng.choice(STREETS)
+            record['addr:housenumber'] = str(rng.randint(1, 999))
+        records.append(record)
+    return records
+
+
+def synthetic_buildings(count, seed=42):
+    """Synthetic buildings in the shape /api/summary receives as building_data."""
+    rng = random.Random(seed)
+    return [{
+        'id': str(100000000 + i),
+        'name': rng.choice(NAMES + ('Unnamed Building',)),
+        'type': rng.choice(BUILDING_TYPES),
+        'levels': str(rng.randint(1, 50)),
+        'height': str(rng.randint(3, 240)),
+        'material': rng.choice(MATERIALS),
+    } for i in range(count)]
+
+
+# Tag spellings seen in real extracts, parsed by osm_ingest
+HEIGHT_FORMATS = ('{m}', '{m} m', '{m}m', '~{m}', '{ft} ft', "{ft}'", '{m}-{m2}')
+START_DATE_FORMATS = ('{year}', '{year}-05-01', '~{year}', '{year}..{year2}', '{decade}0s', 'before {year}')
+
+
+def synthetic_features(count, seed=42):
+    """
+    GeoJSON building features on a grid around downtown Calgary, with tags
+    written in the mixed formats of real OSM data (units, ranges, decades).
+
+    Args:
+        count (int): Number of features.
+        seed (int): Random seed.
+
+    Returns:
+        list: GeoJSON Feature dicts.
+    """
+    rng = random.Random(seed)
+    records = synthetic_records(count, seed)
+    side = max(int(count ** 0.5), 1)
+    step = 0.0002
+    features = []
+    for i, record in enumerate(records):
+        properties = {key: value for key, value in record.items() if key != 'id'}
+        if 'height' in properties:
+            meters = float(properties['height'])
+            properties['height'] = rng.choice(HEIGHT_FORMATS).format(
+                m=round(meters, 1), m2=round(meters + 3, 1), ft=round(meters / 0.3048))
+        if 'start_date' in properties:
+            year = int(properties['start_date'])
+            properties['start_date'] = rng.choice(START_DATE_FORMATS).format(
+                year=year, year2=year + 4, decade=year // 10)
+        lon = -114.08 + (i % side) * step
+        lat = 51.04 + (i // side) * step
+        size = step * rng.uniform(0.3, 0.8)
+        ring = [[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]
+        features.append({
+            'type': 'Feature',
+            'id': record['id'],
+            'properties': properties,
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+        })
+    return features
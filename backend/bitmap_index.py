@@ -0,0 +1,353 @@
+"""
+Compressed bitmap index over the building store, with cached predicate results.
+
+Row sets are Bitmaps laid out like Roaring bitmaps: rows are grouped into
+chunks of 65536 by their high bits, and each non-empty chunk is a container
+holding either the sorted low 16 bits of its rows (uint16, up to 4096 rows)
+or, when denser, a 65536-bit bitset (1024 uint64 words). Intersections and
+unions run container by container, picking the cheapest method for each
+pair of container kinds.
+
+BitmapIndex keeps one Bitmap per category of the low-cardinality categorical
+columns. Other predicates, numeric ranges included, are evaluated as one
+vectorized comparison over their column; range buckets cost more to union
+than the comparison itself. Every predicate's result, and every filter
+list's, is cached as a Bitmap under its normalized form. A filter list that
+adds one predicate to a list seen before therefore costs one predicate
+lookup and one intersection.
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from building_store import ATTRIBUTE_ALIASES
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+WORDS_PER_CHUNK = CHUNK_SIZE // 64
+
+# Containers holding more rows than this are stored as bitsets
+ARRAY_MAX = 4096
+
+# Categorical columns indexed with one bitmap per category
+INDEXED_COLUMNS = ('building', 'amenity', 'shop', 'office', 'zoning')
+
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+
+def _is_bitset(container):
+    return container.dtype == np.uint64
+
+
+def _popcount(words):
+    # NumPy 2 counts bits natively; older versions use a per-byte table
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum())
+    return int(_BYTE_POPCOUNT[words.view(np.uint8)].sum())
+
+
+def _bitset(low):
+    bits = np.zeros(CHUNK_SIZE, dtype=bool)
+    bits[low] = True
+    return np.packbits(bits, bitorder='little').view(np.uint64)
+
+
+def _bitset_rows(words):
+    # Only the non-zero words are expanded to bits
+    nonzero = np.flatnonzero(words)
+    bits = np.flatnonzero(np.unpackbits(words[nonzero].view(np.uint8), bitorder='little'))
+    return (nonzero[bits >> 6] * 64 + (bits & 63)).astype(np.uint16)
+
+
+def _container(low):
+    """Container for sorted, unique low bits."""
+    return _bitset(low) if len(low) > ARRAY_MAX else low
+
+
+def _shrink(words):
+    """Convert a bitset that has become sparse back to an array container."""
+    return words if _popcount(words) > ARRAY_MAX else _bitset_rows(words)
+
+
+def _cardinality(container):
+    return _popcount(container) if _is_bitset(container) else len(container)
+
+
+def _intersect(a, b):
+    if _is_bitset(a) and _is_bitset(b):
+        # Kept as a bitset even when sparse: converting costs more than the intersection
+        return a & b
+    if _is_bitset(a):
+        a, b = b, a
+    if _is_bitset(b):
+        hits = (b[a >> 6] >> (a & 63).astype(np.uint64)) & np.uint64(1)
+        return a[hits.astype(bool)]
+    return np.intersect1d(a, b, assume_unique=True)
+
+
+def _union(containers):
+    if len(containers) == 1:
+        return containers[0]
+    arrays = [c for c in containers if not _is_bitset(c)]
+    if len(arrays) == len(containers) and sum(len(c) for c in arrays) <= ARRAY_MAX:
+        return np.unique(np.concatenate(arrays))
+    words = np.zeros(WORDS_PER_CHUNK, dtype=np.uint64)
+    for container in containers:
+        if _is_bitset(container):
+            words |= container
+    if arrays:
+        words |= _bitset(np.concatenate(arrays))
+    return _shrink(words)
+
+
+class Bitmap:
+    """
+    An immutable set of row numbers in compressed containers.
+
+    Args:
+        keys (list): Ascending chunk numbers (row >> 16) of the non-empty chunks.
+        containers (list): One container per key.
+    """
+    __slots__ = ('keys', 'containers', 'cardinality')
+
+    def __init__(self, keys, containers):
+        self.keys = keys
+        self.containers = containers
+        self.cardinality = sum(_cardinality(c) for c in containers)
+
+    def __len__(self):
+        return self.cardinality
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Bitmap of an ascending array of unique row numbers."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return cls([], [])
+        high = rows >> CHUNK_BITS
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(high)) + 1, [len(rows)]))
+        keys = []
+        containers = []
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            keys.append(int(high[start]))
+            containers.append(_container((rows[start:end] & (CHUNK_SIZE - 1)).astype(np.uint16)))
+        return cls(keys, containers)
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Bitmap of the True rows of a boolean mask."""
+        keys = []
+        containers = []
+        for key, start in enumerate(range(0, len(mask), CHUNK_SIZE)):
+            chunk = mask[start:start + CHUNK_SIZE]
+            count = np.count_nonzero(chunk)
+            if count == 0:
+                continue
+            if count > ARRAY_MAX:
+                if len(chunk) < CHUNK_SIZE:
+                    chunk = np.concatenate((chunk, np.zeros(CHUNK_SIZE - len(chunk), dtype=bool)))
+                container = np.packbits(chunk, bitorder='little').view(np.uint64)
+            else:
+                container = np.flatnonzero(chunk).astype(np.uint16)
+            keys.append(key)
+            containers.append(container)
+        return cls(keys, containers)
+
+    @classmethod
+    def union(cls, bitmaps):
+        """Union of any number of bitmaps."""
+        groups = {}
+        for bitmap in bitmaps:
+            for key, container in zip(bitmap.keys, bitmap.containers):
+                groups.setdefault(key, []).append(container)
+        keys = sorted(groups)
+        return cls(keys, [_union(groups[key]) for key in keys])
+
+    def __and__(self, other):
+        if len(other.keys) < len(self.keys):
+            self, other = other, self
+        others = dict(zip(other.keys, other.containers))
+        keys = []
+        containers = []
+        for key, container in zip(self.keys, self.containers):
+            if key in others:
+                result = _intersect(container, others[key])
+                if _cardinality(result):
+                    keys.append(key)
+                    containers.append(result)
+        return Bitmap(keys, containers)
+
+    def to_mask(self, size):
+        """Boolean mask of `size` rows."""
+        mask = np.zeros(size, dtype=bool)
+        for key, container in zip(self.keys, self.containers):
+            base = key << CHUNK_BITS
+            if _is_bitset(container):
+                end = min(base + CHUNK_SIZE, size)
+                mask[base:end] = np.unpackbits(container.view(np.uint8), bitorder='little')[:end - base]
+            else:
+                mask[base + container.astype(np.int64)] = True
+        return mask
+
+    def to_rows(self):
+        """Ascending row numbers."""
+        parts = [(key << CHUNK_BITS) + (_bitset_rows(c) if _is_bitset(c) else c).astype(np.int64)
+                 for key, c in zip(self.keys, self.containers)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    @property
+    def nbytes(self):
+        return sum(c.nbytes for c in self.containers)
+
+
+def predicate_key(filter_criteria):
+    """
+    Normalized, hashable form of one filter.
+
+    Attribute aliases are resolved, '==' becomes '=' and the value is
+    compared case-insensitively, as every operator does. Booleans and None
+    keep a distinct form because they do not parse like their text.
+    """
+    attribute = filter_criteria.get('attribute')
+    attribute = ATTRIBUTE_ALIASES.get(attribute, attribute)
+    operator = filter_criteria.get('operator')
+    operator = '=' if operator == '==' else operator
+    value = filter_criteria.get('value')
+    value = repr(value) if value is None or isinstance(value, bool) else str(value).lower()
+    return str(attribute), str(operator), value
+
+
+class BitmapIndex:
+    """
+    Category bitmaps of a BuildingStore, with an LRU cache of predicate and
+    filter-list results.
+
+    Predicates on indexed columns ('=' and 'contains') are unions of
+    category bitmaps; all others are evaluated with BuildingStore.filter_mask
+    and cached as bitmaps too, so results always match filter_mask's.
+
+    Args:
+        store (building_store.BuildingStore): The store to index.
+        columns (tuple): Categorical columns indexed by category.
+        max_entries (int): Cached predicate and filter-list results.
+    """
+    def __init__(self, store, columns=INDEXED_COLUMNS, max_entries=1024):
+        self.store = store
+        self.size = len(store)
+        self.max_entries = max_entries
+
+        self.categories = {}
+        for column in columns:
+            categorical = store.categorical.get(column)
+            if categorical is None or column in store.numeric:
+                continue
+            # Rows grouped by code; -1 (missing) sorts first and is skipped
+            order = np.argsort(categorical.codes, kind='stable')
+            bounds = np.searchsorted(categorical.codes[order], np.arange(len(categorical.categories) + 1))
+            self.categories[column] = [Bitmap.from_rows(order[start:end])
+                                       for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def evaluate(self, filter_criteria):
+        """Bitmap of the rows matching one filter, with the semantics of BuildingStore.filter_mask."""
+        attribute = filter_criteria.get('attribute')
+        attribute = ATTRIBUTE_ALIASES.get(attribute, attribute)
+        operator = filter_criteria.get('operator')
+        value = filter_criteria.get('value')
+
+        if value is not None and operator in ('=', '==', 'contains') and attribute in self.categories:
+            target = str(value).lower()
+            lowered = self.store.categorical[attribute].lowered
+            if operator == 'contains':
+                codes = [i for i, category in enumerate(lowered) if target in category]
+            else:
+                codes = [i for i, category in enumerate(lowered) if category == target]
+            return Bitmap.union([self.categories[attribute][code] for code in codes])
+
+        return Bitmap.from_mask(self.store.filter_mask(filter_criteria))
+
+    def _cached(self, key):
+        with self._lock:
+            bitmap = self._entries.get(key)
+            if bitmap is not None:
+                self._entries.move_to_end(key)
+            return bitmap
+
+    def _remember(self, key, bitmap):
+        with self._lock:
+            self._entries[key] = bitmap
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return bitmap
+
+    def _predicate(self, key, originals):
+        bitmap = self._cached((key,))
+        if bitmap is None:
+            bitmap = self._remember((key,), self.evaluate(originals[key]))
+        return bitmap
+
+    def query(self, filters):
+        """
+        Rows matching every filter.
+
+        Args:
+            filters (list): Filter dicts as produced by /api/filter.
+
+        Returns:
+            Bitmap: The matching rows, or None when there are no filters
+            (every row matches).
+        """
+        originals = {}
+        for filter_criteria in filters:
+            originals.setdefault(predicate_key(filter_criteria), filter_criteria)
+        # AND is commutative and idempotent, so the sorted set of predicates identifies the result
+        key = tuple(sorted(originals))
+        if not key:
+            return None
+
+        result = self._cached(key)
+        with self._lock:
+            if result is not None:
+                self.hits += 1
+                return result
+            self.misses += 1
+
+        if len(key) == 1:
+            return self._predicate(key[0], originals)
+
+        # A refinement of a cached list costs one intersection
+        for i in range(len(key)):
+            base = self._cached(key[:i] + key[i + 1:])
+            if base is not None:
+                return self._remember(key, base & self._predicate(key[i], originals))
+
+        bitmaps = sorted((self._predicate(k, originals) for k in key), key=len)
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            if not len(result):
+                break
+            result = result & bitmap
+        return self._remember(key, result)
+
+    def clear(self):
+        """Drop every cached result."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            cached_bytes = sum(bitmap.nbytes for bitmap in self._entries.values())
+            entries = len(self._entries)
+        index_bytes = sum(bitmap.nbytes for bitmaps in self.categories.values() for bitmap in bitmaps)
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': entries,
+            'cached_bytes': cached_bytes,
+            'index_bytes': index_bytes,
+        }
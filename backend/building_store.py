@@ -0,0 +1,745 @@
+"""
+Columnar building store for the 3D City Viewer application.
+
+The whole city is held as NumPy columns so a filter list produced by
+/api/filter can be evaluated as a single vectorized mask instead of calling
+Building.matches_filter once per building. Footprints, when the source data
+has geometry, are kept as one flat coordinate array with per-building offsets
+and indexed by a packed spatial grid for viewport and nearest queries.
+
+Stores are built in one pass over a stream of (tags, ring) pairs from
+osm_ingest: tags are parsed into typed values as they arrive and appended to
+typed arrays, so a large extract is never materialized as per-building dicts.
+"""
+import itertools
+import os
+import threading
+import time
+from array import array
+
+import numpy as np
+
+from osm_ingest import iter_buildings, iter_geojson_features, iter_osm_elements, parse_building_tags
+from sort_index import SortIndex
+from spatial_index import METERS_PER_DEGREE, GridIndex
+from text_index import FUZZY_THRESHOLD, TrigramIndex
+
+# Numeric columns, keyed by the OSM attribute names used in filters
+NUMERIC_COLUMNS = ('height', 'building:levels', 'start_date')
+
+# String columns, stored dictionary-encoded (int32 codes + category list)
+CATEGORICAL_COLUMNS = (
+    'building', 'amenity', 'shop', 'office', 'name', 'addr:street',
+    'addr:housenumber', 'start_date', 'material', 'roof:shape', 'zoning',
+)
+
+# String columns with a trigram index for 'contains' filters and autocomplete
+TEXT_COLUMNS = ('name', 'addr:street', 'addr:housenumber')
+
+# Same attribute aliases that /api/filter normalizes
+ATTRIBUTE_ALIASES = {
+    'floors': 'building:levels', 'levels': 'building:levels', 'stories': 'building:levels',
+    'floor': 'building:levels', 'level': 'building:levels', 'story': 'building:levels',
+    'type': 'building', 'building_type': 'building',
+    'address': 'addr:street', 'street': 'addr:street',
+    'number': 'addr:housenumber', 'house_number': 'addr:housenumber',
+    'year': 'start_date', 'built': 'start_date', 'year_built': 'start_date',
+}
+
+NUMERIC_OPERATORS = ('>', '<', '>=', '<=')
+
+# Assessed value per level, the same estimate prompts.summary_fallback reports
+VALUE_PER_LEVEL = 500000
+
+# Numeric attributes computed from other columns; /api/filter emits assessedValue for "most valuable" queries
+DERIVED_COLUMNS = {
+    'assessedValue': lambda store: store.numeric['building:levels'] * VALUE_PER_LEVEL,
+    # Square meters: footprint area, and that area times the (possibly estimated) levels
+    'footprintArea': lambda store: store.footprints.areas(),
+    'floorArea': lambda store: store.numeric_column('footprintArea') * store.numeric['building:levels'],
+}
+
+# Attributes results can be ordered by (sortBy)
+SORTABLE_COLUMNS = NUMERIC_COLUMNS + tuple(DERIVED_COLUMNS)
+
+# Attributes returned by the spatial query endpoints
+SUMMARY_FIELDS = ('building', 'name', 'height', 'building:levels', 'amenity')
+
+def _to_float(value):
+    """Parse a value as a float, returning NaN when it is not numeric."""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def _as_numpy(values, dtype):
+    """Zero-copy NumPy view of a typed array."""
+    return np.frombuffer(values, dtype=dtype) if len(values) else np.zeros(0, dtype=dtype)
+
+
+class CategoricalColumn:
+    """
+    A dictionary-encoded string column.
+
+    Each row holds an int32 code into `categories`, or -1 when the tag is
+    missing. Comparisons are evaluated once per distinct value and then
+    broadcast to the rows through the codes.
+    """
+    def __init__(self, codes, categories):
+        self.codes = codes
+        self.categories = categories
+        self.lowered = [str(c).lower() for c in categories]
+        self._floats = None
+        self._counts = None
+
+    @classmethod
+    def encode(cls, values):
+        """
+        Dictionary-encode a sequence of strings.
+
+        Args:
+            values (iterable): Raw values, with None or '' for missing tags.
+
+        Returns:
+            CategoricalColumn: The encoded column.
+        """
+        index = {}
+        codes = []
+        for value in values:
+            if value is None or value == '':
+                codes.append(-1)
+            else:
+                codes.append(index.setdefault(str(value), len(index)))
+        return cls(np.asarray(codes, dtype=np.int32), list(index))
+
+    def rows_for_codes(self, matching_codes):
+        """Return a boolean row mask for the given category codes."""
+        if len(matching_codes) == 0:
+            return np.zeros(len(self.codes), dtype=bool)
+        if len(matching_codes) == 1:
+            return self.codes == matching_codes[0]
+        return np.isin(self.codes, matching_codes)
+
+    def equals(self, value):
+        """Case-insensitive equality, like Building.matches_filter."""
+        target = str(value).lower()
+        return self.rows_for_codes([i for i, c in enumerate(self.lowered) if c == target])
+
+    def contains(self, value):
+        """Case-insensitive substring match."""
+        target = str(value).lower()
+        return self.rows_for_codes([i for i, c in enumerate(self.lowered) if target in c])
+
+    def as_float(self):
+        """Return the column parsed as floats (NaN where missing or non-numeric)."""
+        if self._floats is None:
+            category_floats = np.array([_to_float(c) for c in self.categories] + [np.nan])
+            # Code -1 indexes the trailing NaN
+            self._floats = category_floats[self.codes]
+        return self._floats
+
+    def counts(self):
+        """Number of rows holding each category."""
+        if self._counts is None:
+            self._counts = np.bincount(self.codes[self.codes >= 0], minlength=len(self.categories))
+        return self._counts
+
+    def value_at(self, row):
+        code = self.codes[row]
+        return self.categories[code] if code >= 0 else None
+
+
+class Footprints:
+    """
+    Outer rings of every building in CSR layout.
+
+    `coords` is a float64 (points, 2) array of lon/lat pairs and building i's
+    ring is coords[offsets[i]:offsets[i + 1]]. Buildings without geometry have
+    an empty ring and NaN bounds. `bounds`, when given, holds the six
+    precomputed BOUND_FIELDS arrays (e.g. from a snapshot).
+    """
+    BOUND_FIELDS = ('min_lon', 'min_lat', 'max_lon', 'max_lat', 'centroid_lon', 'centroid_lat')
+
+    def __init__(self, coords, offsets, bounds=None):
+        self.coords = coords
+        self.offsets = offsets
+        if bounds is not None:
+            for field, values in zip(self.BOUND_FIELDS, bounds):
+                setattr(self, field, values)
+            return
+        count = len(offsets) - 1
+        self.min_lon, self.min_lat, self.max_lon, self.max_lat, self.centroid_lon, self.centroid_lat = (
+            np.full(count, np.nan) for _ in range(6))
+
+        lengths = np.diff(offsets)
+        rows = np.flatnonzero(lengths > 0)
+        if len(rows):
+            # Empty rings contribute no points, so consecutive non-empty starts delimit each ring
+            starts = offsets[:-1][rows]
+            lon, lat = coords[:, 0], coords[:, 1]
+            self.min_lon[rows] = np.minimum.reduceat(lon, starts)
+            self.max_lon[rows] = np.maximum.reduceat(lon, starts)
+            self.min_lat[rows] = np.minimum.reduceat(lat, starts)
+            self.max_lat[rows] = np.maximum.reduceat(lat, starts)
+            # Vertex mean: cheap, and inside the bounding box, which is all the index needs
+            self.centroid_lon[rows] = np.add.reduceat(lon, starts) / lengths[rows]
+            self.centroid_lat[rows] = np.add.reduceat(lat, starts) / lengths[rows]
+
+    @classmethod
+    def from_rings(cls, rings):
+        """
+        Pack per-building rings.
+
+        Args:
+            rings (list): One sequence of (lon, lat) pairs per building, or
+                None when a building has no geometry.
+        """
+        lengths = np.array([len(ring) if ring else 0 for ring in rings], dtype=np.int64)
+        offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        points = [point for ring in rings if ring for point in ring]
+        coords = np.array(points, dtype=np.float64).reshape(-1, 2)
+        return cls(coords, offsets)
+
+    def ring(self, row):
+        return self.coords[self.offsets[row]:self.offsets[row + 1]]
+
+    def areas(self):
+        """Planar area of each footprint in square meters, NaN without geometry."""
+        count = len(self.offsets) - 1
+        areas = np.full(count, np.nan)
+        lengths = np.diff(self.offsets)
+        rows = np.flatnonzero(lengths > 0)
+        if len(rows):
+            # Local meters around each ring's centroid, then the shoelace formula per ring
+            ring = np.repeat(np.arange(count), lengths)
+            meters_per_degree_lon = np.cos(np.radians(self.centroid_lat[ring])) * METERS_PER_DEGREE
+            x = (self.coords[:, 0] - self.centroid_lon[ring]) * meters_per_degree_lon
+            y = (self.coords[:, 1] - self.centroid_lat[ring]) * METERS_PER_DEGREE
+            starts = self.offsets[:-1][rows]
+            following = np.arange(1, len(x) + 1)
+            following[self.offsets[1:][rows] - 1] = starts
+            areas[rows] = np.abs(np.add.reduceat(x * y[following] - x[following] * y, starts)) / 2
+        return areas
+
+    def take(self, rows):
+        """Footprints of a subset of buildings, in the order given."""
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.offsets[rows + 1] - self.offsets[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        ring = np.repeat(np.arange(len(rows)), lengths)
+        points = np.arange(offsets[-1], dtype=np.int64) - offsets[ring] + self.offsets[rows][ring]
+        return Footprints(self.coords[points], offsets)
+
+
+class BuildingStore:
+    """
+    Holds every building of the loaded city as columns.
+
+    Numeric attributes (height, building:levels and the start_date year) are
+    float64 arrays with NaN for unknown values, and `estimated` holds a bool
+    array per numeric column marking defaulted or approximate values. String
+    attributes are dictionary-encoded CategoricalColumns.
+
+    Indexes can be passed in already built (e.g. restored from a snapshot);
+    otherwise the spatial index is built here and the text, sort and
+    level-of-detail indexes on first use.
+    """
+    def __init__(self, ids, numeric, categorical, footprints=None, tagged=None, estimated=None, text_indexes=None,
+                 spatial_index=None, sort_indexes=None, lod_levels=None):
+        self.ids = ids
+        self.numeric = numeric
+        self.categorical = categorical
+        # Height (meters) and levels as tagged, NaN when the tag is missing
+        self.tagged = tagged if tagged is not None else {
+            'height': np.full(len(ids), np.nan), 'building:levels': np.full(len(ids), np.nan)}
+        self.estimated = estimated if estimated is not None else {
+            column: np.zeros(len(ids), dtype=bool) for column in NUMERIC_COLUMNS}
+        self.footprints = footprints if footprints is not None else Footprints.from_rings([None] * len(ids))
+        fp = self.footprints
+        self.spatial_index = spatial_index if spatial_index is not None else GridIndex(
+            fp.min_lon, fp.min_lat, fp.max_lon, fp.max_lat, fp.centroid_lon, fp.centroid_lat)
+        self._lod_levels = lod_levels
+        self._lods = None
+        self._lods_lock = threading.Lock()
+        self._bitmaps = None
+        self._bitmaps_lock = threading.Lock()
+        self._derived = {}
+        # TrigramIndex per text column over its categories, built on first use when not given
+        self._text_indexes = dict(text_indexes or {})
+        self._text_lock = threading.Lock()
+        self._sort_indexes = dict(sort_indexes or {})
+        self._sort_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls):
+        return cls.from_records([])
+
+    @classmethod
+    def from_stream(cls, buildings):
+        """
+        Build a store in one pass over (tags, ring) pairs.
+
+        Tags are parsed with osm_ingest.parse_building_tags, so missing levels
+        count as 3 and a missing height is estimated as levels * 3 meters,
+        like models.Building. Values, category codes and ring coordinates go
+        straight into typed arrays, which become the NumPy columns without a
+        copy, and each new value of a text column is added to its trigram
+        index as it is first seen.
+
+        Args:
+            buildings (iterable): (tags, ring) pairs, e.g. from
+                osm_ingest.iter_buildings; tags is a dict of OSM tags with an
+                'id' key and ring a sequence of (lon, lat) pairs or None.
+
+        Returns:
+            BuildingStore: The loaded store.
+        """
+        ids = []
+        values = {name: array('d') for name in ('height', 'building:levels', 'start_date',
+                                                'tagged_height', 'tagged_levels')}
+        flags = {column: array('b') for column in NUMERIC_COLUMNS}
+        indexes = {column: {} for column in CATEGORICAL_COLUMNS}
+        codes = {column: array('i') for column in CATEGORICAL_COLUMNS}
+        text_indexes = {column: TrigramIndex() for column in TEXT_COLUMNS}
+        coords = array('d')
+        lengths = array('q')
+
+        for tags, ring in buildings:
+            ids.append(tags.get('id', 'unknown'))
+            typed = parse_building_tags(tags)
+            values['height'].append(typed.height)
+            values['building:levels'].append(typed.levels)
+            values['start_date'].append(typed.year)
+            values['tagged_height'].append(typed.tagged_height)
+            values['tagged_levels'].append(typed.tagged_levels)
+            flags['height'].append(typed.height_estimated)
+            flags['building:levels'].append(typed.levels_estimated)
+            flags['start_date'].append(typed.year_estimated)
+            for column in CATEGORICAL_COLUMNS:
+                value = tags.get(column)
+                if value is None or value == '':
+                    codes[column].append(-1)
+                else:
+                    index = indexes[column]
+                    text = str(value)
+                    code = index.get(text)
+                    if code is None:
+                        code = index[text] = len(index)
+                        if column in text_indexes:
+                            text_indexes[column].add(text)
+                    codes[column].append(code)
+            if ring:
+                coords.extend(itertools.chain.from_iterable(ring))
+                lengths.append(len(ring))
+            else:
+                lengths.append(0)
+
+        try:
+            ids = np.asarray(ids, dtype=np.int64)
+        except (ValueError, TypeError, OverflowError):
+            ids = np.asarray(ids, dtype=object)
+        numeric = {column: _as_numpy(values[column], np.float64) for column in NUMERIC_COLUMNS}
+        categorical = {column: CategoricalColumn(_as_numpy(codes[column], np.int32), list(indexes[column]))
+                       for column in CATEGORICAL_COLUMNS}
+        tagged = {'height': _as_numpy(values['tagged_height'], np.float64),
+                  'building:levels': _as_numpy(values['tagged_levels'], np.float64)}
+        estimated = {column: _as_numpy(flags[column], np.int8).astype(bool) for column in NUMERIC_COLUMNS}
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(_as_numpy(lengths, np.int64), out=offsets[1:])
+        footprints = Footprints(_as_numpy(coords, np.float64).reshape(-1, 2), offsets)
+        return cls(ids, numeric, categorical, footprints, tagged, estimated, text_indexes)
+
+    @classmethod
+    def from_records(cls, records, rings=None):
+        """
+        Build a store from building tag dictionaries.
+
+        Args:
+            records (list): Dicts of OSM tags, each with an 'id' key.
+            rings (list): Optional footprint per record, as (lon, lat) pairs
+                or None.
+
+        Returns:
+            BuildingStore: The loaded store.
+        """
+        return cls.from_stream(zip(records, rings if rings is not None else itertools.repeat(None)))
+
+    @classmethod
+    def from_overpass(cls, data):
+        """Build a store from an Overpass API JSON response, with footprints when nodes or geometry are included."""
+        return cls.from_stream(iter_osm_elements(data.get('elements', [])))
+
+    @classmethod
+    def from_geojson(cls, data):
+        """Build a store from a GeoJSON FeatureCollection of buildings."""
+        return cls.from_stream(iter_geojson_features(data.get('features', [])))
+
+    @classmethod
+    def from_json(cls, data):
+        """Build a store from either an Overpass response or a GeoJSON FeatureCollection."""
+        if 'elements' in data:
+            return cls.from_overpass(data)
+        return cls.from_geojson(data)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a store from a file on disk, streaming it rather than parsing it whole.
+
+        Args:
+            path (str): Overpass JSON, GeoJSON, line-delimited GeoJSON or OSM
+                XML file, optionally gzip-compressed (see osm_ingest.iter_buildings).
+        """
+        return cls.from_stream(iter_buildings(path))
+
+    def filter_mask(self, filter_criteria):
+        """
+        Evaluate a single filter over every building.
+
+        Args:
+            filter_criteria (dict): A dictionary with attribute, operator, and value.
+
+        Returns:
+            numpy.ndarray: Boolean mask, True where the building matches.
+        """
+        attribute = filter_criteria.get('attribute')
+        attribute = ATTRIBUTE_ALIASES.get(attribute, attribute)
+        operator = filter_criteria.get('operator')
+        value = filter_criteria.get('value')
+        no_match = np.zeros(len(self), dtype=bool)
+
+        numeric = self.numeric_column(attribute)
+        categorical = self.categorical.get(attribute)
+        if value is None or (numeric is None and categorical is None):
+            return no_match
+
+        if operator in NUMERIC_OPERATORS or (operator in ('=', '==') and numeric is not None):
+            target = _to_float(value)
+            if np.isnan(target):
+                # A non-numeric value can still match a string column with '='
+                if operator in ('=', '==') and categorical is not None:
+                    return categorical.equals(value)
+                return no_match
+            column = numeric if numeric is not None else categorical.as_float()
+            # NaN compares False, so unknown values never match
+            with np.errstate(invalid='ignore'):
+                if operator == '>':
+                    return column > target
+                if operator == '<':
+                    return column < target
+                if operator == '>=':
+                    return column >= target
+                if operator == '<=':
+                    return column <= target
+                return column == target
+
+        if categorical is None:
+            return no_match
+        if operator in ('=', '=='):
+            return categorical.equals(value)
+        if operator == 'contains':
+            if attribute in TEXT_COLUMNS:
+                return categorical.rows_for_codes(self.text_index(attribute).contains(value))
+            return categorical.contains(value)
+        return no_match
+
+    def apply_filters(self, filters):
+        """
+        AND together a list of filters.
+
+        Predicate results come from the bitmap index and are cached, so a
+        list that refines an earlier one by one predicate costs one bitmap
+        intersection.
+
+        Args:
+            filters (list): Filter dicts as produced by /api/filter.
+
+        Returns:
+            numpy.ndarray: Boolean mask of matching buildings.
+        """
+        rows = self.bitmaps.query(filters)
+        if rows is None:
+            return np.ones(len(self), dtype=bool)
+        return rows.to_mask(len(self))
+
+    def matching_ids(self, filters):
+        """Return the IDs of buildings matching every filter."""
+        return self.ids[self.apply_filters(filters)].tolist()
+
+    def rows_for_ids(self, ids):
+        """Rows of the buildings with the given IDs (in row order); unknown IDs are ignored."""
+        if self.ids.dtype.kind == 'i':
+            wanted = [int(i) for i in ids if str(i).strip().lstrip('-').isdigit()]
+        else:
+            wanted = [str(i) for i in ids]
+        return np.flatnonzero(np.isin(self.ids, np.asarray(wanted, dtype=self.ids.dtype)))
+
+    def numeric_column(self, attribute):
+        """A numeric or derived column by attribute name, or None."""
+        column = self.numeric.get(attribute)
+        if column is None and attribute in DERIVED_COLUMNS:
+            column = self._derived.get(attribute)
+            if column is None:
+                column = self._derived.setdefault(attribute, DERIVED_COLUMNS[attribute](self))
+        return column
+
+    def sort_index(self, attribute):
+        """
+        Presorted permutation of a sortable attribute, built on first use.
+
+        Raises:
+            ValueError: If the attribute cannot be sorted by.
+        """
+        attribute = ATTRIBUTE_ALIASES.get(attribute, attribute)
+        if attribute not in SORTABLE_COLUMNS:
+            raise ValueError(f"Cannot sort by {attribute!r}; sortable attributes are {', '.join(SORTABLE_COLUMNS)}")
+        index = self._sort_indexes.get(attribute)
+        if index is None:
+            with self._sort_lock:
+                index = self._sort_indexes.get(attribute)
+                if index is None:
+                    index = self._sort_indexes[attribute] = SortIndex(self.numeric_column(attribute))
+        return index
+
+    def page(self, filters, sort_by=None, descending=False, limit=None, after=-1):
+        """
+        One page of the buildings matching every filter.
+
+        Args:
+            filters (list): Filter dicts as produced by /api/filter.
+            sort_by (str): Attribute to order by (see SORTABLE_COLUMNS), or
+                None for row order.
+            descending (bool): Largest values first; unknown values are
+                always last.
+            limit (int): Page size, or None for every remaining match.
+            after (int): Position of the previous page's last row, -1 for
+                the first page.
+
+        Returns:
+            tuple: (rows, positions, matches): the page's rows, their
+            positions in the ordering (the last one is the next page's
+            `after`) and the total number of matches.
+        """
+        mask = self.apply_filters(filters)
+        matches = int(np.count_nonzero(mask))
+        if sort_by is None:
+            rows = np.flatnonzero(mask[after + 1:]) + (after + 1)
+            rows = rows[:limit] if limit is not None else rows
+            return rows, rows, matches
+        index = self.sort_index(sort_by)
+        return index.top(mask, limit if limit is not None else matches, after, descending, matches) + (matches,)
+
+    def text_index(self, column):
+        """
+        Trigram index over the distinct values of a text column (ids are category codes).
+
+        Raises:
+            ValueError: If the column is not one of TEXT_COLUMNS.
+        """
+        if column not in TEXT_COLUMNS:
+            raise ValueError(f"No text index on {column!r}; indexed columns are {', '.join(TEXT_COLUMNS)}")
+        index = self._text_indexes.get(column)
+        if index is None:
+            with self._text_lock:
+                index = self._text_indexes.get(column)
+                if index is None:
+                    index = self._text_indexes[column] = TrigramIndex(self.categorical[column].categories)
+        return index
+
+    def suggest(self, query, fields=TEXT_COLUMNS, limit=10, fuzzy=False, threshold=FUZZY_THRESHOLD):
+        """
+        Autocomplete values of the text columns.
+
+        Values starting with the query come first, then values containing
+        it and, with `fuzzy`, values with similar trigrams (most similar
+        first). Within each group, values held by more buildings rank higher.
+
+        Returns:
+            list: Dicts with field, value, match ('prefix', 'contains' or
+            'fuzzy') and count (buildings with the value).
+        """
+        candidates = []
+        for field in fields:
+            index = self.text_index(field)
+            column = self.categorical[field]
+            counts = column.counts()
+            prefix = index.prefix(query)
+            contains = np.setdiff1d(index.contains(query), prefix)
+            groups = [('prefix', prefix, np.zeros(len(prefix))), ('contains', contains, np.zeros(len(contains)))]
+            if fuzzy:
+                codes, similarity = index.similar(query, threshold)
+                new = ~np.isin(codes, prefix) & ~np.isin(codes, contains)
+                groups.append(('fuzzy', codes[new], similarity[new]))
+            for rank, (match, codes, score) in enumerate(groups):
+                # Best `limit` of the group: highest score, then most buildings
+                best = np.lexsort((-counts[codes], -score))[:limit]
+                for code, value_score in zip(codes[best].tolist(), score[best].tolist()):
+                    candidates.append(((rank, -value_score, -int(counts[code]), column.lowered[code]),
+                                       {'field': field, 'value': column.categories[code], 'match': match,
+                                        'count': int(counts[code])}))
+        candidates.sort(key=lambda candidate: candidate[0])
+        return [suggestion for _, suggestion in candidates[:limit]]
+
+    def rows_in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """Rows of the buildings whose footprint bounding box intersects the box."""
+        return self.spatial_index.query_bbox(min_lon, min_lat, max_lon, max_lat)
+
+    def nearest_rows(self, lon, lat, k=10, max_distance=None):
+        """Rows of the k buildings closest to a point, and their distances in meters."""
+        return self.spatial_index.nearest(lon, lat, k, max_distance)
+
+    @property
+    def bitmaps(self):
+        """Category and range bitmaps with cached predicate results (bitmap_index.BitmapIndex), built on first use."""
+        if self._bitmaps is None:
+            with self._bitmaps_lock:
+                if self._bitmaps is None:
+                    from bitmap_index import BitmapIndex
+                    self._bitmaps = BitmapIndex(self)
+        return self._bitmaps
+
+    @property
+    def lods(self):
+        """Simplified footprint levels for the mesh tile API (lod.LODSet), built on first use."""
+        if self._lods is None:
+            with self._lods_lock:
+                if self._lods is None:
+                    from lod import LODSet
+                    self._lods = LODSet(self, levels=self._lod_levels)
+        return self._lods
+
+    def describe(self, rows, fields=SUMMARY_FIELDS):
+        """
+        Attribute dicts for a set of rows.
+
+        Args:
+            rows (numpy.ndarray): Row numbers, e.g. from rows_in_bbox.
+            fields (tuple): Columns to include besides id and the centroid.
+
+        Returns:
+            list: One dict per row; missing values are omitted, and
+            `estimated` lists the numeric fields that were defaulted or
+            approximate.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        ids = self.ids[rows].tolist()
+        lons = np.round(self.footprints.centroid_lon[rows], 7).tolist()
+        lats = np.round(self.footprints.centroid_lat[rows], 7).tolist()
+        columns = []
+        estimated = [(field, self.estimated[field][rows].tolist()) for field in fields if field in self.estimated]
+        for field in fields:
+            if field in self.numeric and field not in self.categorical:
+                values = self.numeric[field][rows]
+                columns.append((field, [None if np.isnan(v) else round(float(v), 2) for v in values]))
+            elif field in self.categorical:
+                column = self.categorical[field]
+                codes = column.codes[rows].tolist()
+                columns.append((field, [column.categories[c] if c >= 0 else None for c in codes]))
+
+        buildings = []
+        for i, building_id in enumerate(ids):
+            building = {'id': building_id}
+            if lons[i] == lons[i]:
+                building['lon'], building['lat'] = lons[i], lats[i]
+            for field, values in columns:
+                if values[i] is not None:
+                    building[field] = values[i]
+            flagged = [field for field, flags in estimated if flags[i] and field in building]
+            if flagged:
+                building['estimated'] = flagged
+            buildings.append(building)
+        return buildings
+
+
+# Shared store for the running app, loaded lazily from CITY_DATA_PATH
+_store = None
+_store_lock = threading.Lock()
+
+# Snapshot mode: the store is a mapping of a snapshot file shared by every worker process
+_snapshot_stamp = None
+_snapshot_checked = 0.0
+SNAPSHOT_CHECK_SECONDS = 1.0
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def _attach_snapshot(path, snapshot_path):
+    """Map the snapshot, rebuilding it from `path` first if it is missing or invalid."""
+    from store_snapshot import SnapshotError, build_snapshot, read_snapshot
+
+    global _snapshot_stamp
+    try:
+        store = read_snapshot(snapshot_path)
+    except (FileNotFoundError, SnapshotError):
+        build_snapshot(path, snapshot_path)
+        store = read_snapshot(snapshot_path, verify=False)
+    _snapshot_stamp = _file_stamp(snapshot_path)
+    return store
+
+
+def get_building_store(path=None, snapshot_path=None):
+    """
+    Return the shared BuildingStore, loading it on first use.
+
+    With a snapshot path the store is a read-only mapping of that file, so
+    worker processes share one copy of the city through the page cache. The
+    file is re-checked at most every SNAPSHOT_CHECK_SECONDS and remapped when
+    another process replaces it.
+
+    Args:
+        path (str): Overpass/GeoJSON file to load, or None for an empty store.
+        snapshot_path (str): Snapshot file to map (see store_snapshot), built
+            from `path` if missing or invalid. Whether it is current with
+            `path` is checked once at startup (store_snapshot.refresh_snapshot),
+            not here, so a city uploaded by another worker is kept.
+    """
+    global _store, _snapshot_checked
+    if snapshot_path and _store is not None:
+        now = time.monotonic()
+        if now - _snapshot_checked >= SNAPSHOT_CHECK_SECONDS:
+            _snapshot_checked = now
+            stamp = _file_stamp(snapshot_path)
+            if stamp is not None and stamp != _snapshot_stamp:
+                with _store_lock:
+                    if stamp != _snapshot_stamp:
+                        _store = _attach_snapshot(path, snapshot_path)
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if snapshot_path:
+                    _store = _attach_snapshot(path, snapshot_path)
+                else:
+                    _store = BuildingStore.load(path) if path else BuildingStore.empty()
+    return _store
+
+
+def set_building_store(store, snapshot_path=None):
+    """
+    Replace the shared BuildingStore, e.g. after the client uploads a city.
+
+    With a snapshot path the store is also written there, with its indexes
+    built, so the other worker processes switch to it on their next check.
+    """
+    global _store, _snapshot_stamp
+    with _store_lock:
+        if snapshot_path:
+            from store_snapshot import build_indexes, read_snapshot, write_snapshot
+
+            build_indexes(store)
+            write_snapshot(store, snapshot_path)
+            _snapshot_stamp = _file_stamp(snapshot_path)
+            # Serve the mapping too, so this process does not keep a private copy
+            store = read_snapshot(snapshot_path, verify=False)
+        _store = store
@@ -0,0 +1,362 @@
+"""
+City-level statistics over the building store, computed as array operations.
+
+A stats request selects buildings with an optional filter list (as returned
+by /api/filter) and bounding box, then asks for any of:
+
+- summaries of numeric attributes: count, sum, mean, min, max, percentiles;
+- group-by counts and sums over a categorical column (e.g. building type);
+- a histogram of one numeric attribute;
+- a heatmap grid: counts, sums and per-square-meter density of an attribute
+  over the buildings' centroids.
+
+Every aggregate is a single pass of NumPy reductions (bincount, histogram,
+percentile) over the selected rows. Results are cached per store under the
+normalized request, so a dashboard re-requesting the same filter, bbox and
+grid is served from memory.
+"""
+import math
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from bitmap_index import predicate_key
+from building_store import ATTRIBUTE_ALIASES, CATEGORICAL_COLUMNS, SORTABLE_COLUMNS
+from spatial_index import METERS_PER_DEGREE
+
+DEFAULT_METRICS = ('height', 'building:levels', 'floorArea')
+DEFAULT_PERCENTILES = (50, 90, 99)
+DEFAULT_GROUP_LIMIT = 50
+MAX_HISTOGRAM_BINS = 1000
+MAX_GRID_CELLS = 256 * 256
+# Smallest side of a grid fitted to the selected buildings (about 10 m)
+GRID_MIN_DEGREES = 1e-4
+
+
+def _float(value):
+    """JSON-safe float: None for NaN and infinities."""
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def _attribute(name):
+    """Resolve an alias to a numeric attribute, or raise ValueError."""
+    attribute = ATTRIBUTE_ALIASES.get(name, name)
+    if attribute not in SORTABLE_COLUMNS:
+        raise ValueError(f"Unknown numeric attribute {name!r}; use one of {', '.join(SORTABLE_COLUMNS)}")
+    return attribute
+
+
+def parse_bbox(bbox):
+    """
+    Parse a bounding box given as [west, south, east, north] or "west,south,east,north".
+
+    Raises:
+        ValueError: If it is malformed.
+    """
+    if isinstance(bbox, str):
+        bbox = bbox.split(',')
+    try:
+        west, south, east, north = (float(v) for v in bbox)
+    except (TypeError, ValueError):
+        raise ValueError("bbox must be west,south,east,north in degrees")
+    if not all(math.isfinite(v) for v in (west, south, east, north)):
+        raise ValueError("bbox must be finite")
+    if not (west < east and south < north):
+        raise ValueError("bbox must have west < east and south < north")
+    return west, south, east, north
+
+
+def summarize(values, percentiles=DEFAULT_PERCENTILES):
+    """
+    Summary of a numeric column, ignoring unknown (NaN) values.
+
+    Returns:
+        dict: count, sum, mean, min, max and a 'p<N>' entry per percentile.
+    """
+    values = values[~np.isnan(values)]
+    summary = {'count': int(len(values))}
+    if not len(values):
+        return dict(summary, sum=0.0, mean=None, min=None, max=None,
+                    percentiles={f'p{p:g}': None for p in percentiles})
+    points = np.percentile(values, percentiles) if percentiles else []
+    summary.update(sum=_float(values.sum()), mean=_float(values.mean()), min=_float(values.min()),
+                   max=_float(values.max()),
+                   percentiles={f'p{p:g}': _float(v) for p, v in zip(percentiles, points)})
+    return summary
+
+
+def group_by(column, rows, metrics, limit=DEFAULT_GROUP_LIMIT):
+    """
+    Counts and sums per category of a categorical column.
+
+    Args:
+        column (building_store.CategoricalColumn): The column to group by.
+        rows (numpy.ndarray): Selected rows.
+        metrics (dict): Numeric columns to sum, by name.
+        limit (int): Largest groups returned.
+
+    Returns:
+        dict: 'groups' (largest first; value None collects missing tags) and
+        'distinct', the number of non-empty groups.
+    """
+    # Code -1 (missing) is shifted to bucket 0
+    buckets = column.codes[rows].astype(np.int64) + 1
+    size = len(column.categories) + 1
+    counts = np.bincount(buckets, minlength=size)
+    sums = {}
+    for name, values in metrics.items():
+        selected = values[rows]
+        known = ~np.isnan(selected)
+        sums[name] = np.bincount(buckets[known], weights=selected[known], minlength=size)
+    present = np.flatnonzero(counts)
+    # Largest first, ties in category order
+    order = present[np.lexsort((present, -counts[present]))][:limit]
+    groups = [{
+        'value': column.categories[bucket - 1] if bucket else None,
+        'count': int(counts[bucket]),
+        'sums': {name: _float(values[bucket]) for name, values in sums.items()},
+    } for bucket in order.tolist()]
+    return {'groups': groups, 'distinct': int(len(present))}
+
+
+def histogram(values, bins=20, value_range=None):
+    """Histogram of the known values of a numeric column, over value_range or their min to max."""
+    values = values[~np.isnan(values)]
+    if value_range is None and not len(values):
+        value_range = (0.0, 1.0)
+    counts, edges = np.histogram(values, bins=bins, range=value_range)
+    return {'edges': [float(edge) for edge in edges], 'counts': counts.tolist()}
+
+
+def heatmap(lons, lats, weights, bbox, cols, rows):
+    """
+    Bucket points into a cols x rows grid over bbox.
+
+    Args:
+        lons, lats (numpy.ndarray): Point coordinates; NaN points are skipped.
+        weights (numpy.ndarray): Value summed per cell, or None for counts only.
+        bbox (tuple): (west, south, east, north) covered by the grid.
+        cols, rows (int): Grid size; row 0 is the southernmost.
+
+    Returns:
+        dict: Grid geometry plus 'counts', and with weights 'sums' and
+        'density' (sum per square meter of cell), as lists of rows.
+    """
+    west, south, east, north = bbox
+    cell_width = (east - west) / cols
+    cell_height = (north - south) / rows
+    inside = (lons >= west) & (lons <= east) & (lats >= south) & (lats <= north)
+    x = np.minimum(((lons[inside] - west) / cell_width).astype(np.int64), cols - 1)
+    y = np.minimum(((lats[inside] - south) / cell_height).astype(np.int64), rows - 1)
+    cells = y * cols + x
+    grid = {
+        'bbox': [west, south, east, north],
+        'cols': cols,
+        'rows': rows,
+        'cellWidth': cell_width,
+        'cellHeight': cell_height,
+        'counts': np.bincount(cells, minlength=cols * rows).reshape(rows, cols).tolist(),
+    }
+    if weights is not None:
+        selected = weights[inside]
+        known = ~np.isnan(selected)
+        sums = np.bincount(cells[known], weights=selected[known], minlength=cols * rows).reshape(rows, cols)
+        # Cells shrink east-west away from the equator
+        row_lats = south + (np.arange(rows) + 0.5) * cell_height
+        cell_area = cell_width * METERS_PER_DEGREE * np.cos(np.radians(row_lats)) * cell_height * METERS_PER_DEGREE
+        grid['sums'] = sums.tolist()
+        grid['density'] = (sums / cell_area[:, None]).tolist()
+    return grid
+
+
+def _extent(lons, lats):
+    """Bounds of the known points, widened where they would have no area."""
+    known = ~np.isnan(lons)
+    if not known.any():
+        return 0.0, 0.0, 1.0, 1.0
+    west, east = float(lons[known].min()), float(lons[known].max())
+    south, north = float(lats[known].min()), float(lats[known].max())
+    if east - west < GRID_MIN_DEGREES:
+        west, east = west - GRID_MIN_DEGREES / 2, east + GRID_MIN_DEGREES / 2
+    if north - south < GRID_MIN_DEGREES:
+        south, north = south - GRID_MIN_DEGREES / 2, north + GRID_MIN_DEGREES / 2
+    return west, south, east, north
+
+
+def _grid_size(grid):
+    try:
+        cols = int(grid.get('cols', grid.get('size', 32)))
+        rows = int(grid.get('rows', grid.get('size', cols)))
+    except (TypeError, ValueError):
+        raise ValueError("grid cols and rows must be integers")
+    if cols < 1 or rows < 1 or cols * rows > MAX_GRID_CELLS:
+        raise ValueError(f"grid must have between 1 and {MAX_GRID_CELLS} cells")
+    return cols, rows
+
+
+def normalize_request(spec):
+    """
+    Validate a stats request and put it in canonical, hashable form.
+
+    Args:
+        spec (dict): The request body of /api/stats.
+
+    Returns:
+        tuple: The normalized request, usable as a cache key and by
+        StatsService.compute.
+
+    Raises:
+        ValueError: If any part of the request is invalid.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("request body must be a JSON object")
+    filters = spec.get('filters') or []
+    if not isinstance(filters, list) or not all(isinstance(f, dict) for f in filters):
+        raise ValueError("filters must be a list of objects")
+    filter_key = tuple(sorted({predicate_key(f) for f in filters}))
+
+    bbox = parse_bbox(spec['bbox']) if spec.get('bbox') else None
+
+    metrics = spec.get('metrics')
+    if metrics is not None and not isinstance(metrics, list):
+        raise ValueError("metrics must be a list")
+    metrics = tuple(_attribute(m) for m in (DEFAULT_METRICS if metrics is None else metrics))
+
+    percentiles = spec.get('percentiles')
+    if percentiles is not None and not isinstance(percentiles, list):
+        raise ValueError("percentiles must be a list")
+    try:
+        percentiles = tuple(float(p) for p in (DEFAULT_PERCENTILES if percentiles is None else percentiles))
+    except (TypeError, ValueError):
+        raise ValueError("percentiles must be numbers")
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise ValueError("percentiles must be between 0 and 100")
+
+    group = None
+    if spec.get('groupBy'):
+        column = ATTRIBUTE_ALIASES.get(spec['groupBy'], spec['groupBy'])
+        if column not in CATEGORICAL_COLUMNS:
+            raise ValueError(f"Cannot group by {spec['groupBy']!r}; use one of {', '.join(CATEGORICAL_COLUMNS)}")
+        group_limit = int(spec.get('groupLimit', DEFAULT_GROUP_LIMIT))
+        if group_limit < 0:
+            raise ValueError("groupLimit must not be negative")
+        group = (column, group_limit)
+
+    hist = None
+    # {} or true asks for the defaults
+    if spec.get('histogram') not in (None, False):
+        options = spec['histogram'] if isinstance(spec['histogram'], dict) else {'attribute': spec['histogram']}
+        bins = int(options.get('bins', 20))
+        if not 1 <= bins <= MAX_HISTOGRAM_BINS:
+            raise ValueError(f"histogram bins must be between 1 and {MAX_HISTOGRAM_BINS}")
+        value_range = options.get('range')
+        if value_range is not None:
+            low, high = (float(v) for v in value_range)
+            if not low < high:
+                raise ValueError("histogram range must be [low, high] with low < high")
+            value_range = (low, high)
+        hist = (_attribute(options.get('attribute', 'height')), bins, value_range)
+
+    grid = None
+    if spec.get('grid') not in (None, False):
+        options = spec['grid'] if isinstance(spec['grid'], dict) else {}
+        cols, rows = _grid_size(options)
+        weight = options.get('metric', 'floorArea')
+        grid = (cols, rows, _attribute(weight) if weight else None)
+
+    return filter_key, bbox, metrics, percentiles, group, hist, grid
+
+
+class StatsService:
+    """
+    Computes stats requests and keeps the most recent results in an LRU.
+
+    Results are cached per store: replacing the shared store (e.g. through
+    /api/buildings/load) starts a fresh cache.
+
+    Args:
+        max_entries (int): Results kept in the LRU.
+    """
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._store = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, store, spec):
+        """
+        Stats for a request, from the cache when possible.
+
+        Args:
+            store (building_store.BuildingStore): The buildings to aggregate.
+            spec (dict): The request body of /api/stats.
+
+        Returns:
+            tuple: (result dict, True if it was served from the cache).
+
+        Raises:
+            ValueError: If the request is invalid.
+        """
+        key = normalize_request(spec)
+        with self._lock:
+            if self._store is None or self._store() is not store:
+                self._store = weakref.ref(store)
+                self._results.clear()
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return result, True
+            self.misses += 1
+
+        # The original filter dicts: predicate keys lowercase values, which filter_mask does itself
+        filters = spec.get('filters') or []
+        result = self.compute(store, filters, key)
+        with self._lock:
+            if self._store() is store:
+                self._results[key] = result
+                while len(self._results) > self.max_entries:
+                    self._results.popitem(last=False)
+        return result, False
+
+    def compute(self, store, filters, key):
+        """Aggregate the buildings matching `filters` for a normalize_request() key."""
+        _, bbox, metrics, percentiles, group, hist, grid = key
+        mask = store.apply_filters(filters)
+        if bbox is not None:
+            in_bbox = np.zeros(len(store), dtype=bool)
+            in_bbox[store.rows_in_bbox(*bbox)] = True
+            mask = mask & in_bbox
+        rows = np.flatnonzero(mask)
+
+        result = {
+            'count': int(len(rows)),
+            'total': len(store),
+            'metrics': {name: summarize(store.numeric_column(name)[rows], percentiles) for name in metrics},
+        }
+        if group is not None:
+            column, limit = group
+            result['groupBy'] = dict(group_by(store.categorical[column], rows,
+                                              {name: store.numeric_column(name) for name in metrics}, limit),
+                                     column=column)
+        if hist is not None:
+            attribute, bins, value_range = hist
+            result['histogram'] = dict(histogram(store.numeric_column(attribute)[rows], bins, value_range),
+                                       attribute=attribute)
+        if grid is not None:
+            cols, grid_rows, weight = grid
+            lons = store.footprints.centroid_lon[rows]
+            lats = store.footprints.centroid_lat[rows]
+            extent = bbox if bbox is not None else _extent(lons, lats)
+            weights = store.numeric_column(weight)[rows] if weight else None
+            result['grid'] = dict(heatmap(lons, lats, weights, extent, cols, grid_rows), metric=weight)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._results)}
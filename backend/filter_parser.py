@@ -0,0 +1,284 @@
+"""
+Rule-based parser for simple building filter queries.
+
+Handles queries such as "taller than 30 meters" or "commercial buildings with
+more than 5 floors" locally, emitting the same filters/explanation/sortBy
+structure as /api/filter. Anything it does not fully understand returns None
+so the caller can fall back to Gemini.
+"""
+import copy
+import re
+import threading
+from collections import OrderedDict
+
+FEET_TO_METERS = 0.3048
+
+NUMBER = r'(\d+(?:\.\d+)?)'
+
+HEIGHT_UNITS = {
+    'm': 1.0, 'meter': 1.0, 'meters': 1.0, 'metre': 1.0, 'metres': 1.0,
+    'ft': FEET_TO_METERS, 'foot': FEET_TO_METERS, 'feet': FEET_TO_METERS,
+}
+
+LEVEL_UNITS = ('floors', 'floor', 'levels', 'level', 'stories', 'story', 'storeys', 'storey')
+
+UNIT = r'(' + '|'.join(sorted(list(HEIGHT_UNITS) + list(LEVEL_UNITS), key=len, reverse=True)) + r')\b'
+
+# Comparison phrases, longest first so "no more than" wins over "more than"
+COMPARATORS = [
+    (r'no more than|no higher than|no taller than|at most|up to|maximum of|max', '<='),
+    (r'no less than|no fewer than|no shorter than|at least|minimum of|min', '>='),
+    (r'taller than|higher than|greater than|more than|bigger than|larger than|over|above', '>'),
+    (r'shorter than|lower than|less than|fewer than|smaller than|under|below', '<'),
+    (r'exactly|equal to', '='),
+]
+
+HEIGHT_ONLY_COMPARATORS = {
+    'taller than': '>', 'higher than': '>', 'shorter than': '<', 'lower than': '<',
+    'no taller than': '<=', 'no higher than': '<=', 'no shorter than': '>=',
+}
+
+# Words that map directly onto a building=<value> filter
+BUILDING_TYPES = {
+    'residential', 'commercial', 'apartments', 'industrial', 'retail', 'office',
+    'house', 'hotel', 'warehouse', 'church', 'hospital', 'school', 'university',
+    'garage', 'parking', 'civic', 'government', 'public', 'detached', 'dormitory',
+}
+
+# Words that map onto an amenity=<value> filter
+AMENITY_TYPES = {'restaurant', 'cafe', 'bank', 'library', 'theatre', 'cinema', 'clinic', 'pharmacy', 'bar', 'pub'}
+
+TYPE_SYNONYMS = {
+    'apartment': 'apartments', 'houses': 'house', 'homes': 'house', 'offices': 'office',
+    'hotels': 'hotel', 'warehouses': 'warehouse', 'churches': 'church', 'hospitals': 'hospital',
+    'schools': 'school', 'universities': 'university', 'garages': 'garage',
+    'restaurants': 'restaurant', 'cafes': 'cafe', 'banks': 'bank', 'libraries': 'library',
+    'theatres': 'theatre', 'theaters': 'theatre', 'theater': 'theatre', 'cinemas': 'cinema',
+    'clinics': 'clinic', 'pharmacies': 'pharmacy', 'bars': 'bar', 'pubs': 'pub',
+}
+
+SORT_PHRASES = [
+    (r'most valuable|most expensive|highest value|highest assessed value', 'assessedValue', 'desc'),
+    (r'least valuable|least expensive|cheapest|lowest value|lowest assessed value', 'assessedValue', 'asc'),
+    (r'tallest|highest', 'height', 'desc'),
+    (r'shortest|lowest|smallest', 'height', 'asc'),
+]
+
+# Filler words that carry no filter meaning
+STOPWORDS = {
+    'show', 'me', 'find', 'all', 'buildings', 'building', 'with', 'that', 'are', 'is', 'the', 'a', 'an',
+    'highlight', 'which', 'display', 'list', 'get', 'give', 'what', 'where', 'and', 'of', 'in', 'calgary',
+    'downtown', 'please', 'those', 'have', 'has', 'only', 'structures', 'properties', 'any', 'filter',
+    'select', 'tall', 'high', 'height', 'than', 'ones', 'city', 'i', 'want', 'to', 'see', 'can',
+    'you', 'were', 'was', 'built', 'constructed',
+}
+
+OPERATOR_WORDS = {
+    '>': 'more than', '<': 'less than', '>=': 'at least', '<=': 'at most', '=': 'exactly',
+}
+
+HEIGHT_OPERATOR_WORDS = {
+    '>': 'greater than', '<': 'less than', '>=': 'at least', '<=': 'at most', '=': 'equal to',
+}
+
+
+def canonicalize_query(query):
+    """Lowercase a query, drop punctuation and collapse whitespace."""
+    query = query.lower().replace("'", ' ft ').replace('"', ' ')
+    query = re.sub(r'[^a-z0-9.+\-\s]', ' ', query)
+    query = re.sub(r'(?<!\d)\.|\.(?!\d)', ' ', query)
+    return ' '.join(query.split())
+
+
+def _number(text):
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+
+def _unit_filter(operator, amount, unit):
+    """Build a height or building:levels filter from a number and its unit."""
+    if unit in LEVEL_UNITS:
+        return {'attribute': 'building:levels', 'operator': operator, 'value': _number(amount)}
+    meters = round(float(amount) * HEIGHT_UNITS.get(unit or 'm', 1.0), 2)
+    return {'attribute': 'height', 'operator': operator, 'value': _number(str(meters))}
+
+
+def _describe(filter_item):
+    """Render one filter as a plain English clause."""
+    attribute, operator, value = filter_item['attribute'], filter_item['operator'], filter_item['value']
+    if attribute == 'building:levels':
+        return f"{OPERATOR_WORDS[operator]} {value} floors"
+    if attribute == 'height':
+        return f"height {HEIGHT_OPERATOR_WORDS[operator]} {value} meters"
+    if attribute == 'start_date':
+        return {'<': f"built before {value}", '>': f"built after {value}"}.get(operator, f"built in {value}")
+    if attribute == 'amenity':
+        return f"{value} amenities"
+    return f"{attribute} {OPERATOR_WORDS.get(operator, operator)} {value}"
+
+
+def _parse(text):
+    """
+    Parse a canonicalized query.
+
+    Returns:
+        dict: The filter plan, or None if any part of the query is not understood.
+    """
+    filters = []
+    sort = None
+    building_type = None
+
+    def consume(pattern, handler):
+        nonlocal text
+        text = re.sub(pattern, lambda m: ' ' + (handler(m) or '') + ' ', text)
+
+    # Ranges: "between 10 and 20 floors"
+    def between(m):
+        low, high = sorted([float(m.group(1)), float(m.group(2))])
+        filters.append(_unit_filter('>=', str(low), m.group(3)))
+        filters.append(_unit_filter('<=', str(high), m.group(3)))
+    consume(r'\bbetween ' + NUMBER + r' (?:and|to) ' + NUMBER + r' ?' + UNIT, between)
+
+    # "<comparator> <number> <unit>", with meters assumed after taller/shorter
+    for phrase, operator in COMPARATORS:
+        def compare(m, operator=operator):
+            unit = m.group(3)
+            if unit is None and m.group(1) not in HEIGHT_ONLY_COMPARATORS:
+                return m.group(0)
+            filters.append(_unit_filter(operator, m.group(2), unit))
+        consume(r'\b(' + phrase + r') ' + NUMBER + r'(?: ?' + UNIT + r')?', compare)
+
+    # "<number> <unit> or more", "<number>+ floors", "5-story"
+    def or_more(m):
+        filters.append(_unit_filter('>=' if m.group(3) == 'more' else '<=', m.group(1), m.group(2)))
+    consume(r'\b' + NUMBER + r' ?' + UNIT + r' or (more|less|fewer)\b', or_more)
+    consume(r'\b' + NUMBER + r' or (more|less|fewer) ' + UNIT,
+            lambda m: filters.append(_unit_filter('>=' if m.group(2) == 'more' else '<=', m.group(1), m.group(3))))
+    consume(r'\b' + NUMBER + r'\+ ?' + UNIT, lambda m: filters.append(_unit_filter('>=', m.group(1), m.group(2))))
+    consume(r'\b' + NUMBER + r'[ -]?' + UNIT + r'(?: tall| high)?',
+            lambda m: filters.append(_unit_filter('=', m.group(1), m.group(2))))
+
+    # Construction year: "built before 1950", "built after 2000", "built in 1990"
+    for word, operator in (('before', '<'), ('after', '>'), ('in', '=')):
+        consume(r'\b(?:built |constructed )?' + word + r' (\d{4})\b',
+                lambda m, operator=operator: filters.append(
+                    {'attribute': 'start_date', 'operator': operator, 'value': int(m.group(1))}))
+
+    # Sort phrases: "tallest", "most valuable"
+    for phrase, attribute, order in SORT_PHRASES:
+        def sort_by(m, attribute=attribute, order=order):
+            nonlocal sort
+            if sort is None:
+                sort = (attribute, order)
+        consume(r'\b(?:' + phrase + r')\b', sort_by)
+
+    # Type keywords
+    leftover = []
+    for word in text.split():
+        word = TYPE_SYNONYMS.get(word, word)
+        if word in BUILDING_TYPES or word in AMENITY_TYPES:
+            if building_type is not None and building_type != word:
+                # "residential and commercial" needs OR semantics, leave it to Gemini
+                return None
+            building_type = word
+        elif word not in STOPWORDS:
+            leftover.append(word)
+
+    if leftover or (not filters and sort is None and building_type is None):
+        return None
+
+    type_filters = []
+    if building_type is not None:
+        attribute = 'amenity' if building_type in AMENITY_TYPES else 'building'
+        type_filters.append({'attribute': attribute, 'operator': '=', 'value': building_type})
+
+    if sort is not None and not any(f['attribute'] == sort[0] for f in filters):
+        # Same shape Gemini is instructed to produce for "tallest"/"most valuable"
+        filters.append({'attribute': sort[0], 'operator': '>', 'value': 0})
+
+    filters = type_filters + filters
+    subject = f"{building_type.rstrip('s')} buildings" if building_type in BUILDING_TYPES else "buildings"
+    if building_type in AMENITY_TYPES:
+        subject = f"buildings with {building_type} amenities"
+    described = [f for f in filters
+                 if f['attribute'] not in ('building', 'amenity') and not (sort and f['attribute'] == sort[0] and f['value'] == 0)]
+    clauses = [_describe(f) for f in described if f['attribute'] != 'start_date']
+    explanation = f"Showing {subject}"
+    if clauses:
+        explanation += (" with " if building_type not in AMENITY_TYPES else " and ") + " and ".join(clauses)
+    for f in described:
+        if f['attribute'] == 'start_date':
+            explanation += " " + _describe(f)
+    result = {'filters': filters}
+    if sort is not None:
+        label = {'height': 'height', 'assessedValue': 'assessed value'}[sort[0]]
+        explanation += f", sorted by {label} ({'highest' if sort[1] == 'desc' else 'lowest'} first)"
+        result['sortBy'], result['sortOrder'] = sort
+    result['explanation'] = explanation
+    return result
+
+
+class FilterPlanCache:
+    """
+    Thread-safe LRU from canonicalized query to parsed filter plan.
+
+    Queries the parser cannot handle are cached too (as None), so repeats skip
+    straight to the Gemini fallback.
+    """
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, query):
+        """
+        Parse a query, consulting the cache first.
+
+        Args:
+            query (str): The raw user query.
+
+        Returns:
+            dict: A copy of the filter plan, or None if the query needs Gemini.
+        """
+        key = canonicalize_query(query)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self._entries[key])
+            self.misses += 1
+
+        plan = _parse(key)
+        with self._lock:
+            self._entries[key] = plan
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return copy.deepcopy(plan)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+_plan_cache = FilterPlanCache()
+
+
+def parse_filter_query(query):
+    """
+    Parse a simple filter query without calling an LLM.
+
+    Args:
+        query (str): e.g. "commercial buildings with more than 5 floors".
+
+    Returns:
+        dict: {'filters', 'explanation'[, 'sortBy', 'sortOrder']}, or None when
+        the query should be sent to Gemini instead.
+    """
+    return _plan_cache.parse(query)
+
+
+def filter_plan_cache_stats():
+    """Return hit/miss counters of the shared filter plan cache."""
+    return _plan_cache.stats()
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for the production server: gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master, which rebuilds the building store
+snapshot if CITY_DATA_PATH has changed (see store_snapshot). Every worker
+maps that file read-only instead of loading CITY_DATA_PATH itself, so
+adding workers adds throughput without another copy of the city per
+process. LLM responses are shared through the SQLite tier of the response
+cache (LLM_CACHE_PATH).
+
+Threads do not survive fork, so each worker restarts the log listener the
+master started when it imported the app (see structured_logging).
+"""
+import multiprocessing
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', str(multiprocessing.cpu_count())))
+# Threads keep a worker responsive while its other requests wait on Gemini
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# Import the app (and refresh the snapshot) once in the master; workers fork with the modules already loaded
+preload_app = True
+
+# Read by app.py when it is imported, so they must be set before the app is loaded
+os.environ.setdefault('STORE_SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), 'city_store.snapshot'))
+# Admission limits are per process; app.py divides the configured rates by this
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+
+def post_fork(server, worker):
+    from structured_logging import configure_logging
+    configure_logging()
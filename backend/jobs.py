@@ -0,0 +1,422 @@
+"""
+Background job queue for work that should not wait on a request.
+
+A job is a batch of items (e.g. buildings whose Gemini summaries should be
+cached before anyone clicks them). Items are run one at a time by a small
+pool of worker threads; an item that raises is retried with exponential
+backoff up to `max_attempts` times. Handlers that call a rate-limited
+upstream share the queue's RateLimiter, so a large job is spread out instead
+of competing with interactive requests for Gemini quota.
+
+Workers are started on the first submit, so a queue created at import time
+in a preloading server master starts its threads in the worker process that
+receives the job. That process runs the job, but with a `path` its progress
+is kept in a SQLite file (the response cache's) so every process sharing
+the file can report it. SharedCounter pools per-key counts the same way.
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger("gemini_app.jobs")
+
+
+class _Connections:
+    """One SQLite connection per thread and process, creating `schema` on first use."""
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(self.schema)
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class SharedCounter:
+    """
+    Counts by key, pooled across processes through a SQLite file.
+
+    Increments are buffered in memory and added to the file at most every
+    `flush_seconds`, so counting stays off the disk on the request path.
+    Without a path the counts are this process's only.
+
+    Args:
+        path (str): SQLite file, or None.
+        table (str): Table holding the counts.
+        flush_seconds (float): Longest time increments stay buffered.
+    """
+    def __init__(self, path=None, table='counts', flush_seconds=5.0):
+        self.path = path
+        self.table = table
+        self.flush_seconds = flush_seconds
+        self._pending = Counter()
+        self._totals = Counter()
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        if path:
+            self._connections = _Connections(
+                path, f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, count INTEGER)')
+
+    def add(self, key, amount=1):
+        with self._lock:
+            self._pending[key] += amount
+            due = time.monotonic() - self._flushed >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the buffered increments to the shared counts."""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed = time.monotonic()
+        if not self.path:
+            with self._lock:
+                self._totals.update(pending)
+            return
+        if pending:
+            conn = self._connections.get()
+            conn.executemany(f'INSERT INTO {self.table} (key, count) VALUES (?, ?) '
+                             'ON CONFLICT(key) DO UPDATE SET count = count + excluded.count', pending.items())
+            conn.commit()
+
+    def most_common(self, n):
+        """The n keys with the highest counts, with their counts."""
+        self.flush()
+        if not self.path:
+            with self._lock:
+                return self._totals.most_common(n)
+        return self._connections.get().execute(
+            f'SELECT key, count FROM {self.table} ORDER BY count DESC, key LIMIT ?', (n,)).fetchall()
+
+
+def _pid_alive(pid):
+    """Whether a process with this id is running on this host."""
+    if not pid or pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _interrupted(record):
+    """A job record whose process exited before it finished, with its pending items counted as failed."""
+    record = dict(record, status='interrupted', failed=record['failed'] + record['pending'], pending=0)
+    record['errors'] = record['errors'] + ['Interrupted: the process running the job exited']
+    if record['completed'] is None:
+        record['completed'] = round(time.time(), 3)
+    return record
+
+
+class JobQueueFull(Exception):
+    """Raised when submitting would exceed the queue's maximum depth."""
+
+
+class RateLimiter:
+    """
+    Spaces calls evenly at up to `rate` per second across threads.
+
+    A rate of 0 or less disables limiting.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the caller may make its next call."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class Job:
+    """Progress of one submitted batch."""
+    def __init__(self, kind, items):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.total = len(items)
+        self.finished = 0
+        self.failed = 0
+        self.retries = 0
+        self.outcomes = Counter()
+        self.errors = []
+        self.created = time.time()
+        self.completed = None
+
+    @property
+    def done(self):
+        return self.finished + self.failed >= self.total
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': 'done' if self.done else 'running',
+            'total': self.total,
+            'finished': self.finished,
+            'failed': self.failed,
+            'pending': self.total - self.finished - self.failed,
+            'retries': self.retries,
+            'outcomes': dict(self.outcomes),
+            'errors': self.errors,
+            'created': round(self.created, 3),
+            'completed': round(self.completed, 3) if self.completed is not None else None,
+        }
+
+
+class JobQueue:
+    """
+    Runs job items on background worker threads with retry and backoff.
+
+    Args:
+        handler (callable): Called as handler(item) for every item; its
+            return value is counted in the job's `outcomes`, and an exception
+            schedules a retry.
+        workers (int): Worker threads.
+        rate (float): Calls per second allowed through `limiter`, which the
+            handler waits on before each upstream call (0 for no limit).
+        max_attempts (int): Tries per item before it counts as failed.
+        backoff (float): Seconds before the first retry, doubled for each
+            further one.
+        max_depth (int): Items that may be waiting at once.
+        max_jobs (int): Jobs kept for progress reports, oldest finished
+            jobs dropped first.
+        path (str): SQLite file shared with the other processes serving
+            the app, where job progress is recorded; None keeps it in memory.
+    """
+    def __init__(self, handler, workers=2, rate=1.0, max_attempts=3, backoff=2.0, max_depth=10000, max_jobs=50,
+                 path=None):
+        self.handler = handler
+        self.workers = workers
+        self.limiter = RateLimiter(rate)
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_depth = max_depth
+        self.max_jobs = max_jobs
+        # (ready time, sequence, job, item key, item, attempt), ordered by when the item may run
+        self._heap = []
+        self._sequence = itertools.count()
+        self._keys = set()
+        self._running = 0
+        self._jobs = OrderedDict()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        # Serializes writes of job progress, which happen outside _lock so disk I/O never blocks the queue
+        self._record_lock = threading.Lock()
+        self.path = path
+        if path:
+            self._connections = _Connections(
+                path, 'CREATE TABLE IF NOT EXISTS jobs '
+                      '(id TEXT PRIMARY KEY, created REAL, done INTEGER, pid INTEGER, record TEXT)')
+            self._expire_interrupted()
+
+    def submit(self, kind, items, key=None):
+        """
+        Queue a batch of items as one job.
+
+        Args:
+            kind (str): Describes the job in progress reports.
+            items (list): Arguments for the handler.
+            key (callable): Maps an item to a hashable identity; an item whose
+                key is already waiting or running is not queued again and
+                counts as a 'duplicate' outcome.
+
+        Returns:
+            Job: The submitted job.
+
+        Raises:
+            JobQueueFull: If the items would exceed max_depth.
+        """
+        key = key or (lambda item: None)
+        job = Job(kind, items)
+        with self._lock:
+            if len(self._heap) + len(items) > self.max_depth:
+                raise JobQueueFull(f"Queue holds {len(self._heap)} items; at most {self.max_depth} may wait")
+            now = time.monotonic()
+            for item in items:
+                item_key = key(item)
+                if item_key is not None and item_key in self._keys:
+                    job.finished += 1
+                    job.outcomes['duplicate'] += 1
+                    continue
+                if item_key is not None:
+                    self._keys.add(item_key)
+                heapq.heappush(self._heap, (now, next(self._sequence), job, item_key, item, 1))
+            if job.done:
+                job.completed = time.time()
+            self._remember(job)
+            self._start_workers()
+            self._ready.notify_all()
+        self._record(job)
+        return job
+
+    def job(self, job_id):
+        """A job's progress dict, or None if it is unknown or was dropped."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        if not self.path:
+            return None
+        row = self._connections.get().execute('SELECT done, pid, record FROM jobs WHERE id = ?',
+                                              (job_id,)).fetchone()
+        return self._load(row) if row is not None else None
+
+    def stats(self):
+        """
+        Queue depth and every remembered job, from all processes when jobs are recorded in a file.
+
+        `local` describes this process's share: the items waiting in it (including retries waiting out
+        their backoff) and the items its workers are running. Jobs whose process exited before they
+        finished are reported as interrupted and leave the depth.
+        """
+        with self._lock:
+            now = time.monotonic()
+            local = {
+                'depth': len(self._heap),
+                'retrying': sum(1 for entry in self._heap if entry[0] > now),
+                'running': self._running,
+            }
+            jobs = [job.to_dict() for job in reversed(self._jobs.values())]
+        if self.path:
+            rows = self._connections.get().execute(
+                'SELECT done, pid, record FROM jobs ORDER BY created DESC LIMIT ?', (self.max_jobs,)).fetchall()
+            jobs = [self._load(row) for row in rows]
+        return {
+            'depth': sum(job['pending'] for job in jobs),
+            'local': local,
+            'workers': self.workers,
+            'rate': self.limiter.rate,
+            'jobs': jobs,
+        }
+
+    def _remember(self, job):
+        self._jobs[job.id] = job
+        for job_id in [job_id for job_id, old in self._jobs.items() if old.done]:
+            if len(self._jobs) <= self.max_jobs:
+                break
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _load(row):
+        """A recorded job from its (done, pid, record) row, as interrupted if its process is gone."""
+        done, pid, record = row
+        record = json.loads(record)
+        if not done and not _pid_alive(pid):
+            record = _interrupted(record)
+        return record
+
+    def _expire_interrupted(self):
+        """Mark the recorded jobs of processes that exited (e.g. before a restart) as finished and interrupted."""
+        try:
+            conn = self._connections.get()
+            rows = conn.execute('SELECT id, pid, record FROM jobs WHERE done = 0').fetchall()
+            expired = [(json.dumps(_interrupted(json.loads(record))), job_id)
+                       for job_id, pid, record in rows if not _pid_alive(pid)]
+            if expired:
+                conn.executemany('UPDATE jobs SET done = 1, record = ? WHERE id = ?', expired)
+                conn.commit()
+                logger.info("Marked %d jobs interrupted by an exited process", len(expired))
+        except sqlite3.Error as e:
+            logger.warning("Could not expire interrupted jobs: %s", e)
+
+    def _record(self, job):
+        """
+        Write a job's progress to the shared file, dropping the oldest finished jobs over max_jobs.
+
+        Called without holding _lock; the progress written is read when the write starts, so the last
+        write always has the latest progress. Failures (e.g. a database locked past the timeout) are
+        logged, and the job carries on in memory.
+        """
+        if not self.path:
+            return
+        with self._record_lock:
+            with self._lock:
+                record = (job.id, job.created, int(job.done), os.getpid(), json.dumps(job.to_dict()))
+            try:
+                conn = self._connections.get()
+                conn.execute('INSERT OR REPLACE INTO jobs (id, created, done, pid, record) VALUES (?, ?, ?, ?, ?)',
+                             record)
+                conn.execute('DELETE FROM jobs WHERE done = 1 AND id NOT IN '
+                             '(SELECT id FROM jobs ORDER BY created DESC LIMIT ?)', (self.max_jobs,))
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning("Could not record progress of job %s: %s", job.id, e)
+
+    def _start_workers(self):
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_item(self):
+        with self._lock:
+            while True:
+                if self._heap:
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        self._running += 1
+                        return heapq.heappop(self._heap)
+                    self._ready.wait(delay)
+                else:
+                    self._ready.wait()
+
+    def _work(self):
+        while True:
+            _, _, job, item_key, item, attempt = self._next_item()
+            try:
+                outcome = self.handler(item)
+                error = None
+            except Exception as e:
+                outcome = None
+                error = e
+
+            try:
+                with self._lock:
+                    self._running -= 1
+                    if error is not None and attempt < self.max_attempts:
+                        job.retries += 1
+                        ready = time.monotonic() + self.backoff * 2 ** (attempt - 1)
+                        heapq.heappush(self._heap, (ready, next(self._sequence), job, item_key, item, attempt + 1))
+                        self._ready.notify()
+                    else:
+                        self._keys.discard(item_key)
+                        if error is not None:
+                            job.failed += 1
+                            if len(job.errors) < 10:
+                                job.errors.append(str(error))
+                        else:
+                            job.finished += 1
+                            job.outcomes[str(outcome)] += 1
+                        if job.done:
+                            job.completed = time.time()
+                self._record(job)
+            except Exception:
+                # Keep the worker alive; the item's outcome is lost but the queue carries on
+                logger.exception("Error recording an item of job %s", job.id)
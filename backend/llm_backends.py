@@ -0,0 +1,301 @@
+"""
+Pluggable LLM backends for the Gemini-backed routes.
+
+The backend is chosen with LLM_BACKEND and created on first use, so importing
+the app needs neither credentials nor the Gemini client library:
+
+- `gemini` (default): Google Gemini. The API key and model are resolved on
+  the first call, which raises ValueError if no key is configured.
+- `stub`: deterministic canned responses with configurable latency, for load
+  tests and benchmarks on machines without network access.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger("gemini_app.llm")
+
+# Model fallback chain, most capable first
+GEMINI_MODELS = ('gemini-2.5-pro-preview-03-25', 'gemini-1.5-pro', 'gemini-pro')
+
+
+def response_text(response):
+    """Extract the text from the different Gemini response formats"""
+    if hasattr(response, 'text'):
+        return response.text
+    elif hasattr(response, 'result'):
+        return response.result
+    elif isinstance(response, str):
+        return response
+    else:
+        # Try to extract text from the response object
+        try:
+            return str(response)
+        except:
+            raise ValueError("Could not extract text from model response")
+
+
+class LLMBackend:
+    """
+    Interface every backend implements.
+
+    Only `generate` is required; streaming and async calls fall back to it.
+    """
+    name = None
+
+    @property
+    def model_name(self):
+        """Name reported in logs and metrics."""
+        return self.name
+
+    def generate(self, prompt, label=None):
+        """
+        Generate a complete response.
+
+        Args:
+            prompt (str): The prompt text.
+            label (str): Prompt family, e.g. 'SUMMARY'. Backends may ignore it.
+
+        Returns:
+            str: The response text.
+        """
+        raise NotImplementedError
+
+    def stream(self, prompt, label=None):
+        """Yield the response text in chunks as it is generated."""
+        yield self.generate(prompt, label)
+
+    async def generate_async(self, prompt, label=None):
+        """Generate a complete response without blocking the event loop."""
+        return await asyncio.to_thread(self.generate, prompt, label)
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Google Gemini, configured on first use.
+
+    Args:
+        api_key (str): Defaults to GEMINI_API_KEY or GOOGLE_API_KEY.
+        models (tuple): Model names to try in order. GEMINI_MODEL, if set, is
+            tried first.
+    """
+    name = 'gemini'
+
+    def __init__(self, api_key=None, models=GEMINI_MODELS):
+        self.api_key = api_key
+        self.models = models
+        self._genai = None
+        self._model = None
+        self._model_name = None
+        self._lock = threading.Lock()
+
+    def _candidates(self):
+        if os.getenv("GEMINI_MODEL"):
+            return (os.getenv("GEMINI_MODEL"),) + tuple(self.models)
+        return tuple(self.models)
+
+    @property
+    def model_name(self):
+        """The model in use, or the first choice before the first call, so the name does not change on first use."""
+        return self._model_name or self._candidates()[0]
+
+    def _get_model(self):
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                # Configure API key - check for either GEMINI_API_KEY or GOOGLE_API_KEY
+                api_key = self.api_key or os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+                if not api_key:
+                    raise ValueError("No API key found. Please set GEMINI_API_KEY or GOOGLE_API_KEY in .env file")
+
+                import google.generativeai as genai
+                genai.configure(api_key=api_key)
+                self._genai = genai
+
+                models = self._candidates()
+                for i, name in enumerate(models):
+                    try:
+                        self._model = genai.GenerativeModel(name)
+                        self._model_name = name
+                        logger.info("Using Gemini model %s", name)
+                        break
+                    except Exception:
+                        # Fall back to the next model if this one is not available
+                        if i == len(models) - 1:
+                            raise
+        return self._model
+
+    def generate(self, prompt, label=None):
+        model = self._get_model()
+        try:
+            # Try the newer API format
+            response = model.generate_content(prompt)
+        except AttributeError:
+            # Fall back to older API format if needed
+            try:
+                response = model.generate(prompt)
+            except AttributeError:
+                # Last resort - try direct generation
+                response = self._genai.generate_text(model=model.name, prompt=prompt)
+        return response_text(response)
+
+    def stream(self, prompt, label=None):
+        model = self._get_model()
+        try:
+            response = model.generate_content(prompt, stream=True)
+        except (AttributeError, TypeError):
+            # Clients without streaming support return the whole response at once
+            yield self.generate(prompt, label)
+            return
+
+        for chunk in response:
+            try:
+                text = response_text(chunk)
+            except ValueError:
+                # Chunks without candidates (e.g. safety metadata) carry no text
+                continue
+            if text:
+                yield text
+
+    async def generate_async(self, prompt, label=None):
+        model = await asyncio.to_thread(self._get_model)
+        generate_content_async = getattr(model, 'generate_content_async', None)
+        if generate_content_async is None:
+            # Older clients have no async API, keep the blocking call off the event loop
+            return await asyncio.to_thread(self.generate, prompt, label)
+        return response_text(await generate_content_async(prompt))
+
+
+# Canned stub responses by prompt label, shaped like real Gemini output
+STUB_RESPONSES = {
+    'SUMMARY': json.dumps({
+        "summary": "A mid-rise building typical of Calgary's inner city, with a concrete frame and glass facade.",
+        "constructionCost": "$12,000,000",
+        "buildingType": "Commercial",
+        "urbanSignificance": "Part of Calgary's downtown streetscape.",
+        "assessedValue": "$18,500,000",
+        "zoning": "CC-X"
+    }),
+    'QUERY': ("Calgary's downtown is dominated by office towers built during the oil booms of the 1970s and 2000s.\n\n"
+              "Sources:\nCity of Calgary Land Use Bylaw\nCalgary Downtown Association"),
+    'FILTER': json.dumps({
+        "filters": [{"attribute": "height", "operator": ">", "value": 50}],
+        "explanation": "Showing buildings taller than 50 meters"
+    }),
+    'BUILDING CONTEXT': json.dumps({
+        "estimatedYear": 1985,
+        "confidence": "medium",
+        "architecturalStyle": "Late Modernist",
+        "notableFeatures": "Curtain wall facade and podium base",
+        "historicalContext": "Built during Calgary's 1980s office expansion",
+        "culturalSignificance": "Typical of the downtown core",
+        "materialInfo": "Reinforced concrete, steel and glass",
+        "sustainabilityInfo": "No specific sustainability information available",
+        "similarExamples": "Bankers Hall, Petro-Canada Centre",
+        "urbanContext": "Connected to the +15 skywalk network",
+        "reasoning": "Stub response"
+    }),
+}
+
+
+class StubBackend(LLMBackend):
+    """
+    Deterministic offline backend.
+
+    Args:
+        latency (float): Seconds each call takes.
+        jitter (float): Extra seconds, derived from the prompt hash so the
+            same prompt always takes the same time.
+        responses (dict): Response text by prompt label, merged over
+            STUB_RESPONSES.
+        chunk_size (int): Characters per chunk when streaming.
+    """
+    name = 'stub'
+
+    def __init__(self, latency=0.0, jitter=0.0, responses=None, chunk_size=64):
+        self.latency = latency
+        self.jitter = jitter
+        self.responses = dict(STUB_RESPONSES, **(responses or {}))
+        self.chunk_size = chunk_size
+
+    def _delay(self, prompt):
+        if not self.jitter:
+            return self.latency
+        digest = hashlib.sha256(prompt.encode('utf-8')).digest()
+        return self.latency + self.jitter * int.from_bytes(digest[:4], 'big') / 0xFFFFFFFF
+
+    def respond(self, prompt, label=None):
+        """Return the canned response for a prompt without waiting."""
+        if label == 'PACKED SUMMARY':
+            # Packed prompts expect one summary per Building ID
+            summary = json.loads(self.responses['SUMMARY'])
+            ids = re.findall(r'Building ID: (\S+)', prompt)
+            return json.dumps({building_id: summary for building_id in ids})
+        return self.responses.get(label, self.responses['QUERY'])
+
+    def generate(self, prompt, label=None):
+        time.sleep(self._delay(prompt))
+        return self.respond(prompt, label)
+
+    def stream(self, prompt, label=None):
+        text = self.respond(prompt, label)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or ['']
+        delay = self._delay(prompt) / len(chunks)
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+
+    async def generate_async(self, prompt, label=None):
+        await asyncio.sleep(self._delay(prompt))
+        return self.respond(prompt, label)
+
+
+def create_backend(name=None):
+    """
+    Create a backend from its name and environment settings.
+
+    Args:
+        name (str): 'gemini' or 'stub'. Defaults to LLM_BACKEND or 'gemini'.
+    """
+    name = (name or os.getenv("LLM_BACKEND", "gemini")).lower()
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'stub':
+        responses = None
+        responses_path = os.getenv("LLM_STUB_RESPONSES")
+        if responses_path:
+            with open(responses_path) as f:
+                responses = json.load(f)
+        return StubBackend(
+            latency=float(os.getenv("LLM_STUB_LATENCY_MS", "0")) / 1000,
+            jitter=float(os.getenv("LLM_STUB_JITTER_MS", "0")) / 1000,
+            responses=responses
+        )
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the shared backend, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+                logger.info("Using %s LLM backend", _backend.name)
+    return _backend
+
+
+def set_backend(backend):
+    """Replace the shared backend (e.g. with a StubBackend in load tests)."""
+    global _backend
+    _backend = backend
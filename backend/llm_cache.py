@@ -0,0 +1,318 @@
+"""
+Content-addressed cache for Gemini responses.
+
+Responses are keyed by a hash of the normalized prompt inputs and kept in two
+tiers: an in-memory LRU for hot entries and a SQLite file that survives
+restarts. Both tiers honor a TTL and a maximum entry count.
+
+Several worker processes can share one SQLite file: a response cached by one
+worker is a disk hit for the others. Invalidations bump a generation counter
+stored in the file, and each process drops its memory tier when it sees the
+counter change (checked at most every `sync_seconds`).
+
+Async callers use get_async and set_async, which serve the memory tier on
+the event loop and run SQLite reads and writes in a worker thread.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def _normalize(value):
+    """
+    Normalize prompt inputs so equivalent requests hash to the same key.
+
+    Whitespace runs collapse to one space, and blank strings become None, so an
+    empty value has one form. Keys are kept even then: the prompts render a
+    missing key (with its default) differently from an empty one.
+    """
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, str):
+        return ' '.join(value.split()) or None
+    return value
+
+
+def _in_namespace(key_namespace, namespace):
+    """Whether a key's namespace is `namespace`, or `namespace` for any model if it names none."""
+    return key_namespace == namespace or ('@' not in namespace and key_namespace.startswith(namespace + '@'))
+
+
+def make_cache_key(namespace, inputs):
+    """
+    Build a content-addressed cache key.
+
+    Args:
+        namespace (str): The route or prompt family, e.g. 'summary', and the
+            model answering it, so answers of different models never mix.
+        inputs (dict): The values the prompt is built from.
+
+    Returns:
+        str: A key of the form '<namespace>:<sha256 hex>'.
+    """
+    canonical = json.dumps(_normalize(inputs), sort_keys=True, separators=(',', ':'), default=str)
+    return f"{namespace}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+class ResponseCache:
+    """
+    Two-tier (memory LRU + SQLite) cache of JSON-serializable responses.
+    """
+    def __init__(self, path=None, max_memory_entries=1024, max_disk_entries=100000, ttl_seconds=7 * 24 * 3600,
+                 sync_seconds=1.0):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.sync_seconds = sync_seconds
+        self._generation = 0
+        self._synced = 0.0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes_since_trim = 0
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'sets': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+        if self.path:
+            self._generation = self._read_generation()
+            self._synced = time.monotonic()
+
+    def _connection(self):
+        """Return this thread's SQLite connection, creating the table on first use."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, namespace TEXT, value TEXT, created REAL, accessed REAL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)')
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _read_generation(self):
+        row = self._connection().execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()
+        return row[0] if row is not None else 0
+
+    def _sync_due(self):
+        """Whether the generation should be checked again, marking the check as done."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._synced < self.sync_seconds:
+                return False
+            self._synced = now
+            return True
+
+    def _reload_generation(self):
+        generation = self._read_generation()
+        with self._lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._memory.clear()
+
+    def _sync(self):
+        """Drop the memory tier if another process has invalidated entries since the last check."""
+        if self._sync_due():
+            self._reload_generation()
+
+    def _count(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def _expired(self, created, now):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def _remember(self, key, value, created):
+        """Insert into the memory tier, evicting the least recently used entries."""
+        with self._lock:
+            self._memory[key] = (value, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): A key from make_cache_key.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        now = time.time()
+        if self.path:
+            self._sync()
+        found, value = self._get_memory(key, now)
+        if found:
+            return value
+        return self._get_disk(key, now)
+
+    async def get_async(self, key):
+        """Like get, but reads the SQLite tier in a worker thread so the event loop never waits on disk."""
+        now = time.time()
+        if self.path and self._sync_due():
+            await asyncio.to_thread(self._reload_generation)
+        found, value = self._get_memory(key, now)
+        if found:
+            return value
+        if self.path:
+            return await asyncio.to_thread(self._get_disk, key, now)
+        return self._get_disk(key, now)
+
+    def _get_memory(self, key, now):
+        """Return (True, value) for a fresh memory-tier entry, else (False, None)."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return True, entry[0]
+                del self._memory[key]
+                self._counters['expirations'] += 1
+        return False, None
+
+    def _get_disk(self, key, now):
+        """Look up the SQLite tier after a memory miss, counting the miss if it is not there either."""
+        if self.path:
+            conn = self._connection()
+            row = conn.execute('SELECT value, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                if not self._expired(row[1], now):
+                    conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+                    conn.commit()
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self._count('disk_hits')
+                    return value
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                conn.commit()
+                self._count('expirations')
+
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        """Store a JSON-serializable response in both tiers."""
+        now = time.time()
+        self._remember(key, value, now)
+        self._count('sets')
+        if self.path:
+            self._set_disk(key, value, now)
+
+    async def set_async(self, key, value):
+        """Like set, but writes the SQLite tier in a worker thread."""
+        now = time.time()
+        self._remember(key, value, now)
+        self._count('sets')
+        if self.path:
+            await asyncio.to_thread(self._set_disk, key, value, now)
+
+    def _set_disk(self, key, value, now):
+        namespace = key.split(':', 1)[0]
+        conn = self._connection()
+        conn.execute(
+            'INSERT OR REPLACE INTO responses (key, namespace, value, created, accessed) VALUES (?, ?, ?, ?, ?)',
+            (key, namespace, json.dumps(value), now, now)
+        )
+        conn.commit()
+        with self._lock:
+            self._writes_since_trim += 1
+            trim = self._writes_since_trim >= 100
+            if trim:
+                self._writes_since_trim = 0
+        if trim:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Drop expired rows and the least recently accessed rows over the size bound."""
+        conn = self._connection()
+        removed = 0
+        if self.ttl_seconds is not None:
+            removed += conn.execute('DELETE FROM responses WHERE created < ?',
+                                    (time.time() - self.ttl_seconds,)).rowcount
+        overflow = conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0] - self.max_disk_entries
+        if overflow > 0:
+            removed += conn.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed LIMIT ?)',
+                (overflow,)
+            ).rowcount
+        conn.commit()
+        self._count('evictions', removed)
+
+    def invalidate(self, key=None, namespace=None):
+        """
+        Remove cached responses.
+
+        Args:
+            key (str): Remove this single entry.
+            namespace (str): Remove every entry in this namespace, for every
+                model when it names no model (e.g. 'summary' covers
+                'summary@gemini-pro').
+            With neither argument the whole cache is cleared.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self._lock:
+            if key is not None:
+                doomed = [key] if key in self._memory else []
+            elif namespace is not None:
+                doomed = [k for k in self._memory if _in_namespace(k.split(':', 1)[0], namespace)]
+            else:
+                doomed = list(self._memory)
+            for k in doomed:
+                del self._memory[k]
+
+        removed = len(doomed)
+        if self.path:
+            # Every memory entry is also on disk, so the disk count is the total
+            conn = self._connection()
+            if key is not None:
+                removed = conn.execute('DELETE FROM responses WHERE key = ?', (key,)).rowcount
+            elif namespace is not None:
+                namespaces = [(name,) for (name,) in conn.execute('SELECT DISTINCT namespace FROM responses')
+                              if _in_namespace(name, namespace)]
+                removed = sum(conn.execute('DELETE FROM responses WHERE namespace = ?', name).rowcount
+                              for name in namespaces)
+            else:
+                removed = conn.execute('DELETE FROM responses').rowcount
+            # Tell other processes sharing the file to drop their memory tiers
+            conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('generation', 0)")
+            conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+            conn.commit()
+            generation = self._read_generation()
+            with self._lock:
+                self._generation = generation
+        return removed
+
+    def stats(self):
+        """Return hit/miss counters and tier sizes."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        if self.path:
+            stats['disk_entries'] = self._connection().execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        return stats
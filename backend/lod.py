@@ -0,0 +1,369 @@
+"""
+Level-of-detail footprint sets for the building mesh tiles.
+
+Each level is derived from the full-resolution footprints for the pixel size
+at a reference zoom:
+
+- footprints are simplified with Douglas-Peucker, run on every ring of the
+  city at once by splitting all open segments in one vectorized pass per
+  recursion depth;
+- at the coarsest level, small buildings are merged into one convex hull per
+  block-sized grid cell, with their area-weighted mean height;
+- footprints smaller than a pixel or two are dropped.
+
+Level 0 is the store's own footprints. Levels are built on first use, or all
+at once by build_all() when a city is loaded.
+"""
+import math
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from building_store import Footprints
+from mesh_builder import SCALE_FACTOR, extrusion_heights, store_center
+from spatial_index import METERS_PER_DEGREE, GridIndex
+
+TILE_SIZE = 256
+EARTH_CIRCUMFERENCE = 2 * math.pi * 6378137.0
+
+# Field of view and viewport height assumed when picking a level from camera distance (see Scene.tsx)
+CAMERA_FOV_DEGREES = 45
+VIEWPORT_PIXELS = 1080
+
+# zoom: reference zoom for the pixel size, also the lowest zoom a level is picked for
+# tolerance_px: Douglas-Peucker tolerance; min_size_px: footprints with a smaller bounding-box
+# diagonal are dropped; merge_px: smaller footprints are merged into hulls of block_px cells
+LODSpec = namedtuple('LODSpec', 'level zoom tolerance_px min_size_px merge_px block_px')
+
+LOD_LEVELS = (
+    LODSpec(0, 16, 0.0, 0.0, 0.0, 0.0),
+    LODSpec(1, 15, 0.5, 1.0, 0.0, 0.0),
+    LODSpec(2, 14, 0.75, 1.5, 0.0, 0.0),
+    LODSpec(3, 13, 1.0, 2.0, 4.0, 8.0),
+)
+
+
+def ground_resolution(z, lat):
+    """Meters per pixel of a 256px slippy-map tile at zoom z and latitude lat."""
+    return EARTH_CIRCUMFERENCE * math.cos(math.radians(lat)) / (TILE_SIZE * 2 ** z)
+
+
+def lod_for_zoom(z, specs=LOD_LEVELS):
+    """Finest level whose reference zoom is at or below z; the coarsest for low zooms."""
+    for spec in specs:
+        if z >= spec.zoom:
+            return spec.level
+    return specs[-1].level
+
+
+def lod_for_distance(distance, lat, specs=LOD_LEVELS):
+    """
+    Level for buildings seen from a camera distance.
+
+    Args:
+        distance (float): Camera distance in scene units (SCALE_FACTOR per meter).
+        lat (float): Latitude of the city.
+    """
+    meters_per_pixel = 2 * distance / SCALE_FACTOR * math.tan(math.radians(CAMERA_FOV_DEGREES / 2)) / VIEWPORT_PIXELS
+    if meters_per_pixel <= 0:
+        return specs[0].level
+    zoom = math.log2(EARTH_CIRCUMFERENCE * math.cos(math.radians(lat)) / (TILE_SIZE * meters_per_pixel))
+    return lod_for_zoom(zoom, specs)
+
+
+def _group_argmax(values, group_starts):
+    """Per group of consecutive values: (index of the first maximum, the maximum)."""
+    maxima = np.maximum.reduceat(values, group_starts)
+    owner = np.repeat(np.arange(len(group_starts)), np.diff(np.append(group_starts, len(values))))
+    hits = np.flatnonzero(values == maxima[owner])
+    _, first = np.unique(owner[hits], return_index=True)
+    return hits[first], maxima
+
+
+def simplify_rings(x, y, lengths, tolerance):
+    """
+    Douglas-Peucker simplification of many closed rings at once.
+
+    Every ring is split at its first point and the point farthest from it,
+    and both chains are always split once more, so a ring keeps at least
+    four points unless it is degenerate.
+
+    Args:
+        x, y (numpy.ndarray): Ring points in meters, CSR by `lengths`, without
+            a closing duplicate of the first point.
+        lengths (numpy.ndarray): Points per ring.
+        tolerance (float): Maximum deviation in meters.
+
+    Returns:
+        numpy.ndarray: Boolean mask of the points to keep.
+    """
+    count = len(lengths)
+    starts = np.zeros(count, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    keep = np.zeros(len(x), dtype=bool)
+    keep[starts[lengths > 0]] = True
+    small = lengths <= 4
+    keep[np.repeat(small, lengths)] = True
+    rings = np.flatnonzero(~small)
+    if not len(rings):
+        return keep
+
+    # Each ring is a closed chain: position n is the first point again
+    ring_starts, ring_lengths = starts[rings], lengths[rings]
+    ring = np.repeat(np.arange(len(rings)), ring_lengths)
+    local = np.arange(len(ring)) - np.repeat(np.cumsum(ring_lengths) - ring_lengths, ring_lengths)
+    point = ring_starts[ring] + local
+    reach = np.hypot(x[point] - x[ring_starts[ring]], y[point] - y[ring_starts[ring]])
+    far, _ = _group_argmax(reach, np.cumsum(ring_lengths) - ring_lengths)
+    far = local[far]
+    keep[ring_starts + far] = True
+
+    # Open segments as (ring start, first chain position, last chain position)
+    seg_ring = np.concatenate([ring_starts, ring_starts])
+    seg_length = np.concatenate([ring_lengths, ring_lengths])
+    seg_first = np.concatenate([np.zeros(len(rings), dtype=np.int64), far])
+    seg_last = np.concatenate([far, ring_lengths])
+    threshold = 0.0
+    while len(seg_first):
+        interior = seg_last - seg_first - 1
+        open_segments = interior > 0
+        seg_ring, seg_length, seg_first, seg_last, interior = (
+            seg_ring[open_segments], seg_length[open_segments], seg_first[open_segments],
+            seg_last[open_segments], interior[open_segments])
+        if not len(seg_first):
+            break
+
+        owner = np.repeat(np.arange(len(seg_first)), interior)
+        group_starts = np.cumsum(interior) - interior
+        position = seg_first[owner] + 1 + np.arange(len(owner)) - group_starts[owner]
+        p = seg_ring[owner] + position
+        a = seg_ring + seg_first
+        b = seg_ring + seg_last % seg_length
+        ax, ay, bx, by = x[a][owner], y[a][owner], x[b][owner], y[b][owner]
+        dx, dy = bx - ax, by - ay
+        span = np.hypot(dx, dy)
+        offset = np.abs(dx * (y[p] - ay) - dy * (x[p] - ax)) / np.where(span > 0, span, 1)
+        offset = np.where(span > 0, offset, np.hypot(x[p] - ax, y[p] - ay))
+
+        farthest, deviation = _group_argmax(offset, group_starts)
+        split = deviation > threshold
+        middle = position[farthest[split]]
+        keep[seg_ring[split] + middle] = True
+        seg_ring = np.concatenate([seg_ring[split], seg_ring[split]])
+        seg_length = np.concatenate([seg_length[split], seg_length[split]])
+        seg_first, seg_last = (np.concatenate([seg_first[split], middle]),
+                               np.concatenate([middle, seg_last[split]]))
+        # The forced second split only applies to the two initial chains
+        threshold = tolerance
+    return keep
+
+
+def _convex_hull(xs, ys):
+    """Counter-clockwise convex hull (monotone chain) of points sorted by x, then y."""
+    def turn(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    points = list(zip(xs, ys))
+    lower, upper = [], []
+    for point in points:
+        while len(lower) >= 2 and turn(lower[-2], lower[-1], point) <= 0:
+            lower.pop()
+        lower.append(point)
+    for point in reversed(points):
+        while len(upper) >= 2 and turn(upper[-2], upper[-1], point) <= 0:
+            upper.pop()
+        upper.append(point)
+    return lower[:-1] + upper[:-1]
+
+
+class LODLevel:
+    """
+    Footprints of one level, with what the mesh builder needs per footprint.
+
+    Attributes:
+        spec (LODSpec): How the level was built.
+        footprints (Footprints): One ring per entry.
+        rows (numpy.ndarray): Store row of each entry, -1 for merged hulls.
+        ids (numpy.ndarray): Building ID of each entry, -1 for merged hulls
+            and non-numeric IDs.
+        heights (numpy.ndarray): Extrusion height of each entry.
+        spatial_index (GridIndex): Index over the entries.
+    """
+    def __init__(self, spec, footprints, rows, ids, heights, spatial_index=None):
+        self.spec = spec
+        self.footprints = footprints
+        self.rows = rows
+        self.ids = ids
+        self.heights = heights
+        if spatial_index is None:
+            fp = footprints
+            spatial_index = GridIndex(fp.min_lon, fp.min_lat, fp.max_lon, fp.max_lat,
+                                      fp.centroid_lon, fp.centroid_lat)
+        self.spatial_index = spatial_index
+
+    def __len__(self):
+        return len(self.rows)
+
+    def stats(self):
+        return {'level': self.spec.level, 'zoom': self.spec.zoom, 'footprints': len(self),
+                'merged': int((self.rows < 0).sum()), 'vertices': int(len(self.footprints.coords))}
+
+
+class LODSet:
+    """
+    The levels of detail of one BuildingStore, built lazily.
+
+    Args:
+        store (BuildingStore): Source of the full-resolution footprints.
+        specs (tuple): LODSpec per level, finest first.
+        levels (dict): Levels already built, by level number (e.g. from a
+            snapshot).
+    """
+    def __init__(self, store, specs=LOD_LEVELS, levels=None):
+        self.store = store
+        self.specs = specs
+        self.center = store_center(store)
+        self._levels = dict(levels or {})
+        self._lock = threading.Lock()
+
+        # Local meters around the city center, shared by every level
+        fp = store.footprints
+        self.meters_per_degree_lon = math.cos(math.radians(self.center[1])) * METERS_PER_DEGREE
+        self.heights = extrusion_heights(store.tagged['height'], store.tagged['building:levels'])
+        self.ids = store.ids if store.ids.dtype.kind == 'i' else np.full(len(store), -1, dtype=np.int64)
+        self.sizes = np.hypot((fp.max_lon - fp.min_lon) * self.meters_per_degree_lon,
+                              (fp.max_lat - fp.min_lat) * METERS_PER_DEGREE)
+
+    def level(self, level):
+        """
+        Return one level, building it on first use.
+
+        Raises:
+            ValueError: If there is no such level.
+        """
+        if not 0 <= level < len(self.specs):
+            raise ValueError(f"LOD must be between 0 and {len(self.specs) - 1}")
+        built = self._levels.get(level)
+        if built is None:
+            with self._lock:
+                built = self._levels.get(level)
+                if built is None:
+                    built = self._levels[level] = self._build(self.specs[level])
+        return built
+
+    def build_all(self):
+        """Build every level, e.g. when a city is loaded."""
+        return [self.level(spec.level) for spec in self.specs]
+
+    def stats(self):
+        """Footprint and vertex counts of the levels built so far."""
+        return [self._levels[level].stats() for level in sorted(self._levels)]
+
+    def _to_meters(self, coords):
+        return ((coords[:, 0] - self.center[0]) * self.meters_per_degree_lon,
+                (coords[:, 1] - self.center[1]) * METERS_PER_DEGREE)
+
+    def _to_lonlat(self, x, y):
+        return np.column_stack([x / self.meters_per_degree_lon + self.center[0],
+                                y / METERS_PER_DEGREE + self.center[1]])
+
+    def _build(self, spec):
+        store = self.store
+        if spec.tolerance_px == 0 and spec.min_size_px == 0 and spec.merge_px == 0:
+            rows = np.arange(len(store))
+            return LODLevel(spec, store.footprints, rows, self.ids, self.heights, store.spatial_index)
+
+        resolution = ground_resolution(spec.zoom, self.center[1])
+        # NaN sizes (no footprint) compare False and drop out here
+        rows = np.flatnonzero(self.sizes > 0)
+        # Buildings to merge are simplified too, which leaves far fewer points to hull
+        simplified = self._simplify(store.footprints.take(rows), spec.tolerance_px * resolution)
+        merge = self.sizes[rows] < spec.merge_px * resolution
+        keep = self.sizes[rows] >= max(spec.merge_px, spec.min_size_px) * resolution
+        merged = rows[merge]
+        footprints = simplified.take(np.flatnonzero(keep))
+        rows = rows[keep]
+
+        level_rows, ids, heights = rows, self.ids[rows], self.heights[rows]
+        if len(merged):
+            hulls, hull_heights = self._block_hulls(simplified.take(np.flatnonzero(merge)), merged,
+                                                    spec.block_px * resolution, spec.min_size_px * resolution)
+            footprints = Footprints(np.concatenate([footprints.coords, hulls.coords]),
+                                    np.concatenate([footprints.offsets, hulls.offsets[1:] + footprints.offsets[-1]]))
+            level_rows = np.concatenate([rows, np.full(len(hull_heights), -1)])
+            ids = np.concatenate([ids, np.full(len(hull_heights), -1, dtype=ids.dtype)])
+            heights = np.concatenate([heights, hull_heights])
+        return LODLevel(spec, footprints, level_rows, ids, heights)
+
+    def _simplify(self, footprints, tolerance):
+        """Drop closing duplicates, then Douglas-Peucker every ring."""
+        coords, offsets = footprints.coords, footprints.offsets
+        lengths = np.diff(offsets)
+        closed = np.zeros(len(lengths), dtype=bool)
+        rings = lengths > 1
+        closed[rings] = np.all(coords[offsets[1:][rings] - 1] == coords[offsets[:-1][rings]], axis=1)
+        keep = np.ones(len(coords), dtype=bool)
+        keep[offsets[1:][closed] - 1] = False
+        coords, lengths = coords[keep], lengths - closed
+
+        x, y = self._to_meters(coords)
+        keep = simplify_rings(x, y, lengths, tolerance)
+        ring = np.repeat(np.arange(len(lengths)), lengths)
+        new_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ring[keep], minlength=len(lengths)), out=new_offsets[1:])
+        return Footprints(coords[keep], new_offsets)
+
+    def _block_hulls(self, members, rows, cell_size, min_size):
+        """Convex hull of the member footprints in each block-sized grid cell, with area-weighted mean heights."""
+        fp = self.store.footprints
+        centroid_x = (fp.centroid_lon[rows] - self.center[0]) * self.meters_per_degree_lon
+        centroid_y = (fp.centroid_lat[rows] - self.center[1]) * METERS_PER_DEGREE
+        cells = np.column_stack([np.floor(centroid_x / cell_size), np.floor(centroid_y / cell_size)])
+        _, group = np.unique(cells, axis=0, return_inverse=True)
+        group = group.reshape(-1)
+        groups = group.max() + 1
+
+        # Area-weighted heights; zero-area slivers still count a little
+        lengths = np.diff(members.offsets)
+        x, y = self._to_meters(members.coords)
+        ring = np.repeat(np.arange(len(rows)), lengths)
+        following = np.arange(len(x)) + 1
+        following[members.offsets[1:] - 1] = members.offsets[:-1]
+        area = np.abs(np.bincount(ring, x * y[following] - x[following] * y, minlength=len(rows))) / 2 + 1e-6
+        heights = (np.bincount(group, self.heights[rows] * area, minlength=groups) /
+                   np.bincount(group, area, minlength=groups))
+
+        point_group = group[ring]
+        order = np.lexsort((y, x, point_group))
+        x, y, point_group = x[order], y[order], point_group[order]
+        bounds = np.searchsorted(point_group, np.arange(groups + 1))
+
+        # Akl-Toussaint: points strictly inside the octagon of each group's extreme
+        # points in eight directions (counter-clockwise from west) are not on its hull
+        directions = (-x, -x - y, -y, x - y, x, x + y, y, y - x)
+        corners = np.stack([_group_argmax(d, bounds[:-1])[0] for d in directions])[:, point_group]
+        inside = np.ones(len(x), dtype=bool)
+        for i in range(len(directions)):
+            a, b = corners[i], corners[(i + 1) % len(directions)]
+            inside &= (x[b] - x[a]) * (y - y[a]) - (y[b] - y[a]) * (x - x[a]) > 0
+        x, y, point_group = x[~inside], y[~inside], point_group[~inside]
+        bounds = np.searchsorted(point_group, np.arange(groups + 1))
+        xs, ys = x.tolist(), y.tolist()
+        rings, hull_heights = [], []
+        for g in range(groups):
+            hull = _convex_hull(xs[bounds[g]:bounds[g + 1]], ys[bounds[g]:bounds[g + 1]])
+            if len(hull) < 3:
+                continue
+            hull_x, hull_y = zip(*hull)
+            if math.hypot(max(hull_x) - min(hull_x), max(hull_y) - min(hull_y)) < min_size:
+                continue
+            rings.append(hull)
+            hull_heights.append(heights[g])
+
+        lengths = np.array([len(hull) for hull in rings], dtype=np.int64)
+        offsets = np.zeros(len(rings) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        points = np.array([point for hull in rings for point in hull], dtype=np.float64).reshape(-1, 2)
+        coords = self._to_lonlat(points[:, 0], points[:, 1])
+        return Footprints(coords, offsets), np.array(hull_heights, dtype=np.float64)
@@ -0,0 +1,373 @@
+"""
+Server-side building meshes as flat binary vertex/index buffers.
+
+Footprints are projected with the same equirectangular approximation as the
+client's `normalizeCoordinates` (same EARTH_RADIUS and SCALE_FACTOR), then
+triangulated and extruded in NumPy. Positions are in the frame THREE's
+ExtrudeGeometry produces: the footprint in the x/y plane and the extrusion
+along +z, so the client keeps its `rotation.x = -PI / 2` to stand buildings
+upright.
+
+Every building with n ring vertices contributes 6n vertices (n bottom cap,
+n top cap, and 4 per wall quad so walls get their own normals) and 4n - 4
+triangles. A tile is encoded as:
+
+    header       40 bytes, little-endian (see HEADER)
+    buildings    building_count records of BUILDING_DTYPE, for picking
+    positions    vertex_count * 3 float32
+    indices      index_count uint32, absolute into the tile's positions
+
+Each building record gives its slice of the position and index buffers, so
+a ray hit's face index maps back to a building with a binary search on
+index_start. Its `row` is the building's store row, or -1 for a block hull
+merged from several buildings at the coarsest level of detail.
+"""
+import hashlib
+import math
+import struct
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+from osm_tiles import tile_bbox
+from single_flight import SingleFlight
+
+# Must match normalizeCoordinates in src/utils/geometry.ts
+EARTH_RADIUS = 6378137.0
+SCALE_FACTOR = 3.0
+
+# Height rules of src/components/Buildings.tsx
+HEIGHT_SCALE = 1.5
+METERS_PER_LEVEL = 4.5
+DEFAULT_HEIGHT = 50.0
+MIN_HEIGHT = 4.0
+MAX_HEIGHT = 800.0
+
+MAGIC = b'CMSH'
+FORMAT_VERSION = 1
+
+# magic, version, flags, center lon, center lat, building_count, vertex_count, index_count, padding
+HEADER = struct.Struct('<4sHHddIII4x')
+
+BUILDING_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('row', '<i4'),
+    ('vertex_start', '<u4'),
+    ('vertex_count', '<u4'),
+    ('index_start', '<u4'),
+    ('index_count', '<u4'),
+    ('height', '<f4'),
+])
+
+MIN_ZOOM = 10
+MAX_ZOOM = 18
+
+
+def project(lon, lat, center):
+    """
+    Project lon/lat arrays to local x/z in scene units around a center.
+
+    Returns:
+        tuple: (x, z) float64 arrays, as normalizeCoordinates computes them.
+    """
+    center_lon, center_lat = center
+    x = (lon - center_lon) * math.pi * EARTH_RADIUS * math.cos(center_lat * math.pi / 180) / 180 * SCALE_FACTOR
+    z = (lat - center_lat) * math.pi * EARTH_RADIUS / 180 * SCALE_FACTOR
+    return x, z
+
+
+def extrusion_heights(height, levels):
+    """Extrusion depth per building from tagged height (meters) and levels, NaN when untagged."""
+    depth = np.where(np.isnan(levels), DEFAULT_HEIGHT, levels * METERS_PER_LEVEL)
+    depth = np.where(np.isnan(height), depth, height * HEIGHT_SCALE)
+    return np.clip(depth, MIN_HEIGHT, MAX_HEIGHT)
+
+
+def _ring_bounds(lengths):
+    """Start offset of each ring and the ring number of each point in a CSR layout."""
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    ring = np.repeat(np.arange(len(lengths)), lengths)
+    return starts, ring
+
+
+def _next_in_ring(starts, lengths, ring):
+    """Index of the following point of each point's ring, wrapping to the ring start."""
+    following = np.arange(len(ring), dtype=np.int64) + 1
+    ends = starts + lengths - 1
+    following[ends[lengths > 0]] = starts[lengths > 0]
+    return following
+
+
+def _ear_clip(xs, ys):
+    """
+    Triangulate a counter-clockwise simple polygon by ear clipping.
+
+    Always returns len(xs) - 2 triangles of local vertex indices; if the ring
+    is self-intersecting and no ear is found, the rest is fanned.
+    """
+    def turn(a, b, c):
+        return (xs[b] - xs[a]) * (ys[c] - ys[a]) - (ys[b] - ys[a]) * (xs[c] - xs[a])
+
+    remaining = list(range(len(xs)))
+    triangles = []
+    while len(remaining) > 3:
+        count = len(remaining)
+        # Only reflex vertices can lie inside a candidate ear
+        reflex = [remaining[i] for i in range(count)
+                  if turn(remaining[i - 1], remaining[i], remaining[(i + 1) % count]) < 0]
+        for i in range(count):
+            a, b, c = remaining[i - 1], remaining[i], remaining[(i + 1) % count]
+            if turn(a, b, c) <= 0:
+                continue
+            if any(turn(a, b, p) >= 0 and turn(b, c, p) >= 0 and turn(c, a, p) >= 0
+                   for p in reflex if p != a and p != c):
+                continue
+            triangles.append((a, b, c))
+            del remaining[i]
+            break
+        else:
+            break
+    triangles.extend((remaining[0], remaining[k], remaining[k + 1]) for k in range(1, len(remaining) - 1))
+    return triangles
+
+
+class MeshTile:
+    """One encoded mesh tile and the summary the endpoint reports in headers."""
+    __slots__ = ('data', 'etag', 'building_count', 'vertex_count', 'index_count')
+
+    def __init__(self, data, building_count, vertex_count, index_count):
+        self.data = data
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+        self.building_count = building_count
+        self.vertex_count = vertex_count
+        self.index_count = index_count
+
+
+def build_meshes(level, rows, center):
+    """
+    Triangulate and extrude footprints.
+
+    Args:
+        level (lod.LODLevel): Source of footprints, heights, IDs and store
+            rows, e.g. store.lods.level(0) for full resolution.
+        rows (numpy.ndarray): Entries of the level to mesh; entries without a
+            usable ring (fewer than 3 distinct points or zero area) are skipped.
+        center (tuple): (lon, lat) the positions are relative to.
+
+    Returns:
+        tuple: (buildings record array of BUILDING_DTYPE, float32 (V, 3)
+        positions, uint32 indices).
+    """
+    fp = level.footprints
+    rows = np.asarray(rows, dtype=np.int64)
+    lengths = fp.offsets[rows + 1] - fp.offsets[rows]
+    starts, ring = _ring_bounds(lengths)
+    points = np.arange(lengths.sum(), dtype=np.int64) - starts[ring] + fp.offsets[rows][ring]
+    x, y = project(fp.coords[points, 0], fp.coords[points, 1], center)
+
+    # Drop repeated vertices, including the closing copy of the first one
+    following = _next_in_ring(starts, lengths, ring)
+    keep = (x != x[following]) | (y != y[following])
+    x, y, ring = x[keep], y[keep], ring[keep]
+    lengths = np.bincount(ring, minlength=len(rows))
+
+    # Only rings that still enclose an area
+    starts, ring = _ring_bounds(lengths)
+    following = _next_in_ring(starts, lengths, ring)
+    area = np.zeros(len(rows))
+    np.add.at(area, ring, x * y[following] - x[following] * y)
+    valid = (lengths >= 3) & (area != 0)
+    keep = valid[ring]
+    rows, lengths, area = rows[valid], lengths[valid], area[valid]
+    x, y = x[keep], y[keep]
+    starts, ring = _ring_bounds(lengths)
+    local = np.arange(len(ring), dtype=np.int64) - starts[ring]
+
+    # Make every ring counter-clockwise so cap and wall windings face outwards
+    clockwise = (area < 0)[ring]
+    order = np.where(clockwise, starts[ring] + lengths[ring] - 1 - local, np.arange(len(ring)))
+    x, y = x[order], y[order]
+    following = _next_in_ring(starts, lengths, ring)
+    previous = np.empty_like(following)
+    previous[following] = np.arange(len(ring))
+
+    # Convex rings (no right turns) are fanned in bulk, the rest are ear-clipped
+    turn = (x - x[previous]) * (y[following] - y) - (y - y[previous]) * (x[following] - x)
+    convex = np.ones(len(rows), dtype=bool)
+    np.logical_and.at(convex, ring, turn >= 0)
+
+    cap_counts = lengths - 2
+    cap_starts = np.zeros(len(rows), dtype=np.int64)
+    np.cumsum(cap_counts[:-1], out=cap_starts[1:])
+    caps = np.empty((cap_counts.sum(), 3), dtype=np.int64)
+    cap_ring = np.repeat(np.arange(len(rows)), cap_counts)
+    fan = np.arange(len(caps), dtype=np.int64) - cap_starts[cap_ring]
+    caps[:, 0] = 0
+    caps[:, 1] = fan + 1
+    caps[:, 2] = fan + 2
+    for r in np.flatnonzero(~convex):
+        ring_slice = slice(starts[r], starts[r] + lengths[r])
+        caps[cap_starts[r]:cap_starts[r] + cap_counts[r]] = _ear_clip(x[ring_slice].tolist(), y[ring_slice].tolist())
+
+    heights = level.heights[rows]
+
+    # Per building: [bottom n][top n][walls 4n] vertices, [bottom caps][top caps][walls] indices
+    vertex_starts = 6 * starts
+    index_counts = 3 * (4 * lengths - 4)
+    index_starts = np.zeros(len(rows), dtype=np.int64)
+    np.cumsum(index_counts[:-1], out=index_starts[1:])
+
+    count = len(ring)
+    top = heights[ring]
+    base = vertex_starts[ring]
+    n = lengths[ring]
+    positions = np.zeros((6 * count, 3), dtype=np.float32)
+    positions[base + local, 0] = x
+    positions[base + local, 1] = y
+    positions[base + n + local, 0] = x
+    positions[base + n + local, 1] = y
+    positions[base + n + local, 2] = top
+    wall = base + 2 * n + 4 * local
+    here = np.arange(count)
+    for corner, (source, elevation) in enumerate(((here, 0), (following, 0), (following, top), (here, top))):
+        positions[wall + corner, 0] = x[source]
+        positions[wall + corner, 1] = y[source]
+        positions[wall + corner, 2] = elevation
+
+    indices = np.empty(int(index_counts.sum()), dtype=np.uint32)
+    cap_base = vertex_starts[cap_ring][:, None]
+    cap_at = index_starts[cap_ring] + 3 * fan
+    cap_slots = cap_at[:, None] + np.arange(3)
+    indices[cap_slots] = cap_base + caps[:, [0, 2, 1]]
+    indices[cap_slots + 3 * cap_counts[cap_ring][:, None]] = cap_base + lengths[cap_ring][:, None] + caps
+    wall_slots = (index_starts[ring] + 6 * cap_counts[ring] + 6 * local)[:, None] + np.arange(6)
+    indices[wall_slots] = wall[:, None] + np.array([0, 1, 2, 0, 2, 3])
+
+    buildings = np.zeros(len(rows), dtype=BUILDING_DTYPE)
+    buildings['id'] = level.ids[rows]
+    buildings['row'] = level.rows[rows]
+    buildings['vertex_start'] = vertex_starts
+    buildings['vertex_count'] = 6 * lengths
+    buildings['index_start'] = index_starts
+    buildings['index_count'] = index_counts
+    buildings['height'] = heights
+    return buildings, positions, indices
+
+
+def encode_mesh_tile(buildings, positions, indices, center):
+    """Serialize mesh buffers into the binary tile format."""
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, center[0], center[1], len(buildings), len(positions),
+                         len(indices))
+    data = b''.join((header, buildings.tobytes(), positions.astype('<f4').tobytes(), indices.astype('<u4').tobytes()))
+    return MeshTile(data, len(buildings), len(positions), len(indices))
+
+
+def decode_mesh_tile(data):
+    """
+    Parse a binary mesh tile.
+
+    Returns:
+        dict: center, buildings (record array), positions (V, 3) and indices.
+    """
+    magic, version, _, center_lon, center_lat, building_count, vertex_count, index_count = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("Not a version %d mesh tile" % FORMAT_VERSION)
+    offset = HEADER.size
+    buildings = np.frombuffer(data, BUILDING_DTYPE, building_count, offset)
+    offset += buildings.nbytes
+    positions = np.frombuffer(data, '<f4', vertex_count * 3, offset).reshape(-1, 3)
+    offset += positions.nbytes
+    indices = np.frombuffer(data, '<u4', index_count, offset)
+    return {'center': (center_lon, center_lat), 'buildings': buildings, 'positions': positions, 'indices': indices}
+
+
+def store_center(store):
+    """Midpoint of the store's footprint bounds, as calculateCenter picks it on the client."""
+    fp = store.footprints
+    if np.isnan(fp.min_lon).all():
+        return 0.0, 0.0
+    return ((float(np.nanmin(fp.min_lon)) + float(np.nanmax(fp.max_lon))) / 2,
+            (float(np.nanmin(fp.min_lat)) + float(np.nanmax(fp.max_lat))) / 2)
+
+
+def tile_rows(level, z, x, y):
+    """Entries of a level whose footprint centroid falls in a slippy-map tile, so each is in exactly one tile."""
+    south, west, north, east = tile_bbox(z, x, y)
+    rows = level.spatial_index.query_bbox(west, south, east, north)
+    lon = level.footprints.centroid_lon[rows]
+    lat = level.footprints.centroid_lat[rows]
+    return rows[(lon >= west) & (lon < east) & (lat >= south) & (lat < north)]
+
+
+class MeshTileService:
+    """
+    Builds mesh tiles on demand and keeps the most recent ones in memory.
+
+    Tiles are cached per store: replacing the shared store (e.g. through
+    /api/buildings/load) starts a fresh cache. Concurrent requests for the
+    same cold tile share one build.
+
+    Args:
+        max_tiles (int): Tiles kept in the LRU.
+        min_zoom (int): Lowest zoom served.
+        max_zoom (int): Highest zoom served.
+    """
+    def __init__(self, max_tiles=256, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+        self.max_tiles = max_tiles
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self._tiles = OrderedDict()
+        self._store = None
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def get_tile(self, store, z, x, y, center=None, lod=0):
+        """
+        Return the mesh tile for a store.
+
+        Args:
+            store (BuildingStore): The buildings to mesh.
+            z, x, y (int): Slippy-map tile coordinates.
+            center (tuple): (lon, lat) origin of the positions. Defaults to
+                the middle of the store's bounds.
+            lod (int): Level of detail, 0 for full resolution (see lod.py).
+
+        Returns:
+            tuple: (MeshTile, True if it was served from the cache).
+
+        Raises:
+            ValueError: If the tile or level is not valid.
+        """
+        if not self.min_zoom <= z <= self.max_zoom:
+            raise ValueError(f"Zoom must be between {self.min_zoom} and {self.max_zoom}")
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f"Tile {x}/{y} is outside zoom level {z}")
+        level = store.lods.level(lod)
+        center = tuple(center) if center is not None else store_center(store)
+        key = (z, x, y, center, lod)
+
+        with self._lock:
+            if self._store is None or self._store() is not store:
+                self._store = weakref.ref(store)
+                self._tiles.clear()
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                return tile, True
+
+        tile = self._flight.do(f"{id(store)}:{key}", lambda: self._build(store, level, key))
+        return tile, False
+
+    def _build(self, store, level, key):
+        z, x, y, center, _ = key
+        tile = encode_mesh_tile(*build_meshes(level, tile_rows(level, z, x, y), center), center)
+        with self._lock:
+            if self._store is not None and self._store() is store:
+                self._tiles[key] = tile
+                while len(self._tiles) > self.max_tiles:
+                    self._tiles.popitem(last=False)
+        return tile
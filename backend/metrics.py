@@ -0,0 +1,241 @@
+"""
+In-process metrics exposed in the Prometheus text exposition format.
+
+Counters and histograms are sharded per thread: each thread updates its own
+dict without taking a lock, and the shards are only summed when /metrics is
+scraped. Values that already live elsewhere (cache counters, coalescing
+stats) are read at scrape time through registered collector callbacks.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _ShardedMetric:
+    """Base class holding one dict of label values -> state per thread."""
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            # Only taken once per thread; shards outlive their threads so no counts are lost
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshots(self):
+        with self._lock:
+            shards = list(self._shards)
+        return [dict(shard) for shard in shards]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_ShardedMetric):
+    """Monotonic counter with optional labels."""
+    kind = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        """
+        Add to the counter.
+
+        Args:
+            *labelvalues: One value per label name, in order.
+            amount (float): Increment, default 1.
+        """
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def values(self):
+        """Return {label values: total} summed over all threads."""
+        totals = {}
+        for shard in self._snapshots():
+            for labelvalues, value in shard.items():
+                totals[labelvalues] = totals.get(labelvalues, 0) + value
+        return totals
+
+    def _render_samples(self):
+        return [f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}'
+                for labelvalues, value in sorted(self.values().items())]
+
+
+class Histogram(_ShardedMetric):
+    """Bucketed distribution with optional labels."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        """
+        Record one observation.
+
+        Args:
+            value (float): The observed value (seconds for latencies).
+            *labelvalues: One value per label name, in order.
+        """
+        shard = self._shard()
+        state = shard.get(labelvalues)
+        if state is None:
+            # Per-bucket counts (last slot is +Inf), then sum and count
+            state = shard[labelvalues] = [0] * (len(self.buckets) + 3)
+        state[bisect_left(self.buckets, value)] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """Observe the wall time spent in the with-block, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def values(self):
+        """Return {label values: [bucket counts..., sum, count]} summed over all threads."""
+        totals = {}
+        for shard in self._snapshots():
+            for labelvalues, state in shard.items():
+                total = totals.setdefault(labelvalues, [0] * len(state))
+                for i, value in enumerate(list(state)):
+                    total[i] += value
+        return totals
+
+    def _render_samples(self):
+        lines = []
+        for labelvalues, state in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, ('le', _format_value(float(bound))))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {_format_value(state[-2])}')
+            lines.append(f'{self.name}_count{labels} {state[-1]}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics plus scrape-time collector callbacks."""
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collect):
+        """
+        Register a callback evaluated on every scrape.
+
+        Args:
+            collect (callable): Returns a list of (name, type, help, samples)
+                tuples, where samples is a list of (labels dict, value).
+        """
+        self._collectors.append(collect)
+
+    def render(self):
+        """Render every metric in the Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._collectors:
+            for name, kind, documentation, samples in collect():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'http_requests_total', 'HTTP requests by route, method and status code.', ('route', 'method', 'status'))
+http_errors = registry.counter(
+    'http_request_errors_total', 'HTTP requests answered with a 5xx status, by route.', ('route',))
+http_latency = registry.histogram(
+    'http_request_duration_seconds', 'Time to produce the response, by route.', ('route',))
+stage_latency = registry.histogram(
+    'request_stage_duration_seconds', 'Time spent in each stage (cache, llm, parse) of the LLM routes.',
+    ('route', 'stage'))
+llm_latency = registry.histogram(
+    'llm_request_duration_seconds', 'Upstream LLM call latency, by model and prompt label.', ('model', 'label'))
+llm_errors = registry.counter(
+    'llm_request_errors_total', 'Upstream LLM calls that raised, by model and prompt label.', ('model', 'label'))
+llm_prompt_chars = registry.histogram(
+    'llm_prompt_chars', 'Prompt size in characters, by prompt label.', ('label',), SIZE_BUCKETS)
+llm_response_chars = registry.histogram(
+    'llm_response_chars', 'Response size in characters, by prompt label.', ('label',), SIZE_BUCKETS)
+fallback_responses = registry.counter(
+    'llm_fallback_responses_total', 'Responses built from the fallback payload after the LLM output failed to parse.',
+    ('route',))
+admission_shed = registry.counter(
+    'admission_shed_total', 'Gemini-bound requests shed by admission control, by route and reason.',
+    ('route', 'reason'))
+
+osm_tile_requests = registry.counter(
+    'osm_tile_requests_total', 'Overpass tile requests by cache result (hit, miss, revalidated, refreshed, stale).',
+    ('result',))
+mesh_tile_requests = registry.counter(
+    'mesh_tile_requests_total', 'Building mesh tile requests by cache result (hit, miss).', ('result',))
+
+
+def observe_llm_call(label, model, prompt, response=None, duration=None, error=False):
+    """Record latency and sizes of one upstream LLM call."""
+    model = model or 'unknown'
+    if duration is not None:
+        llm_latency.observe(duration, model, label)
+    llm_prompt_chars.observe(len(prompt), label)
+    if error:
+        llm_errors.inc(model, label)
+    elif response is not None:
+        llm_response_chars.observe(len(response), label)
@@ -1,21 +1,38 @@
 """
 Data models for the 3D City Viewer application.
 """
+from osm_ingest import parse_building_tags
+
 
 class Building:
     """
     Represents a building with its properties.
+
+    Levels, height (meters) and year_built are parsed once from the OSM tags
+    into numbers; the *_estimated flags mark values that were defaulted or
+    approximate.
     """
+    __slots__ = ('id', 'name', 'building_type', 'levels', 'levels_estimated', 'height', 'height_estimated',
+                 'amenity', 'shop', 'office', 'year_built', 'year_estimated', 'material', 'roof_shape',
+                 'address', 'housenumber')
+
+    # Attributes compared as numbers by matches_filter
+    NUMERIC_ATTRIBUTES = ('levels', 'height', 'year_built')
+
     def __init__(self, data):
+        typed = parse_building_tags(data)
         self.id = data.get('id', 'unknown')
         self.name = data.get('name', 'Unnamed Building')
         self.building_type = data.get('building', 'commercial')
-        self.levels = data.get('building:levels', '3')
-        self.height = data.get('height') or (float(self.levels) * 3 if self.levels else 10)
+        self.levels = typed.levels
+        self.levels_estimated = typed.levels_estimated
+        self.height = typed.height
+        self.height_estimated = typed.height_estimated
         self.amenity = data.get('amenity', '')
         self.shop = data.get('shop', '')
         self.office = data.get('office', '')
-        self.year_built = data.get('start_date', 'unknown')
+        self.year_built = int(typed.year) if typed.year == typed.year else None
+        self.year_estimated = typed.year_estimated
         self.material = data.get('material', 'concrete')
         self.roof_shape = data.get('roof:shape', 'flat')
         self.address = data.get('addr:street', '')
@@ -57,21 +74,18 @@ class Building:
         
         # Get the building attribute value
         if attribute == 'building':
-            building_value = self.building_type
+            attribute = 'building_type'
         elif attribute == 'building:levels':
-            building_value = self.levels
-        elif attribute == 'height':
-            building_value = self.height
+            attribute = 'levels'
         elif attribute == 'start_date':
-            building_value = self.year_built
-        else:
-            building_value = getattr(self, attribute, None)
+            attribute = 'year_built'
+        building_value = getattr(self, attribute, None)
             
         if building_value is None:
             return False
             
-        # Convert to numbers for numeric comparisons
-        if operator in ['>', '<', '>=', '<=']:
+        # Convert to numbers for numeric comparisons; '=' on a numeric attribute compares numbers too
+        if operator in ['>', '<', '>=', '<='] or (operator in ['=', '=='] and attribute in self.NUMERIC_ATTRIBUTES):
             try:
                 building_value = float(building_value)
                 value = float(value)
@@ -0,0 +1,477 @@
+"""
+Typed ingest of OSM building tags and geometry.
+
+Tags are parsed once, at load time, into typed values:
+
+- lengths such as '12', '12 m', '12,5m', "45'", "12'6\"" or '40 ft' become
+  meters;
+- levels such as '3', '3.5' or '~4' become floats;
+- start_date values such as '1910-05-01', '~1910', '1905..1912', '1920s',
+  'C19' or 'before 1900' become a year.
+
+Every parser also reports whether the value is an estimate (approximate,
+a range, a decade or century, or a default filled in for a missing tag).
+
+Buildings are read as a stream of (tags, ring) pairs from GeoJSON
+FeatureCollections, GeoJSON sequences (one feature per line), Overpass JSON
+and OSM XML, optionally gzip-compressed, so a large extract never has to be
+held in memory as one parsed document.
+"""
+import gzip
+import json
+import math
+import re
+import xml.etree.ElementTree as ElementTree
+from array import array
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+FEET_TO_METERS = 0.3048
+INCHES_TO_METERS = 0.0254
+
+# Height assumed per level when a building has levels but no height, and levels assumed when untagged
+METERS_PER_LEVEL = 3.0
+DEFAULT_LEVELS = 3.0
+
+NAN = float('nan')
+
+_NUMBER = r'(\d+(?:[.,]\d+)?)'
+_FEET_INCHES = re.compile(r"^(\d+(?:\.\d+)?)\s*(?:'|ft|feet|foot)\s*(?:(\d+(?:\.\d+)?)\s*(?:\"|''|in|inch|inches))?$")
+_LENGTH = re.compile(_NUMBER + r'\s*(m|meters?|metres?|ft|feet|foot|\')?$')
+_RANGE = re.compile(_NUMBER + r'\s*(?:-|\.\.|–|to)\s*' + _NUMBER + r'\s*(m|meters?|metres?|ft|feet|foot|\')?$')
+_APPROXIMATE = re.compile(r'^(?:~|ca\.?\s*|c\.\s*|circa\s+|approx\.?\s*|about\s+)')
+_YEAR_RANGE = re.compile(r'(\d{4})(?:-\d{2}){0,2}\s*(?:\.\.|–|—|/|\s+to\s+|-)\s*(\d{4})')
+_DECADE = re.compile(r'^(early\s+|mid\s+|mid-|late\s+)?(\d{3})0s$')
+_CENTURY = re.compile(r'^(early\s+|mid\s+|mid-|late\s+)?c(\d{1,2})$')
+_YEAR = re.compile(r'(\d{4})')
+_QUALIFIED_YEAR = re.compile(r'^(?:before|after|pre|post|by)\s')
+
+# Position within a decade or century for early/mid/late qualifiers
+_PERIOD_OFFSETS = {'early': 0.2, 'mid': 0.5, 'late': 0.8}
+
+# Line-delimited GeoJSON files, read one feature per line
+SEQUENCE_EXTENSIONS = ('.geojsonl', '.geojsons', '.geojsonseq', '.ndjson', '.jsonl')
+
+TypedTags = namedtuple('TypedTags', 'height height_estimated levels levels_estimated year year_estimated '
+                                    'tagged_height tagged_levels')
+
+
+def _number(text):
+    return float(text.replace(',', '.'))
+
+
+def _non_negative(value):
+    """A height or level count, or NaN when it is negative or infinite."""
+    return value if 0 <= value < math.inf else NAN
+
+
+def _first_value(value):
+    """Text of a tag value, keeping only the first of ';'-separated values."""
+    text = str(value).strip().lower()
+    return text.split(';', 1)[0].strip()
+
+
+@lru_cache(maxsize=65536)
+def _parse_length_text(text):
+    approximate = _APPROXIMATE.match(text)
+    if approximate:
+        text = text[approximate.end():]
+    match = _FEET_INCHES.match(text)
+    if match:
+        inches = float(match.group(2)) if match.group(2) else 0.0
+        return float(match.group(1)) * FEET_TO_METERS + inches * INCHES_TO_METERS, bool(approximate)
+    match = _LENGTH.match(text)
+    if match:
+        unit = match.group(2) or 'm'
+        value = _number(match.group(1))
+        return (value * FEET_TO_METERS if unit[0] in "f'" else value), bool(approximate)
+    match = _RANGE.match(text)
+    if match:
+        unit = match.group(3) or 'm'
+        value = (_number(match.group(1)) + _number(match.group(2))) / 2
+        return (value * FEET_TO_METERS if unit[0] in "f'" else value), True
+    return NAN, False
+
+
+def parse_length(value):
+    """
+    Parse a length tag (height, min_height) into meters.
+
+    Returns:
+        tuple: (meters, estimated); meters is NaN when the value is missing,
+        negative or not a length.
+    """
+    if value is None or value == '':
+        return NAN, False
+    if isinstance(value, (int, float)):
+        return _non_negative(float(value)), False
+    return _parse_length_text(_first_value(value))
+
+
+@lru_cache(maxsize=4096)
+def _parse_levels_text(text):
+    approximate = _APPROXIMATE.match(text)
+    if approximate:
+        text = text[approximate.end():]
+    try:
+        return _non_negative(_number(text)), bool(approximate)
+    except ValueError:
+        pass
+    match = _RANGE.match(text)
+    if match and not match.group(3):
+        return (_number(match.group(1)) + _number(match.group(2))) / 2, True
+    return NAN, False
+
+
+def parse_levels(value):
+    """
+    Parse a building:levels tag.
+
+    Returns:
+        tuple: (levels, estimated); levels is NaN when missing, negative or
+        not numeric.
+    """
+    if value is None or value == '':
+        return NAN, False
+    if isinstance(value, (int, float)):
+        return _non_negative(float(value)), False
+    return _parse_levels_text(_first_value(value))
+
+
+@lru_cache(maxsize=65536)
+def _parse_year_text(text):
+    approximate = _APPROXIMATE.match(text)
+    if approximate:
+        text = text[approximate.end():]
+    match = _YEAR_RANGE.search(text)
+    if match:
+        return float(math.floor((int(match.group(1)) + int(match.group(2))) / 2)), True
+    match = _DECADE.match(text)
+    if match:
+        offset = _PERIOD_OFFSETS.get((match.group(1) or 'mid').strip(' -'), 0.5)
+        return float(int(match.group(2)) * 10 + round(offset * 10)), True
+    match = _CENTURY.match(text)
+    if match:
+        offset = _PERIOD_OFFSETS.get((match.group(1) or 'mid').strip(' -'), 0.5)
+        return float((int(match.group(2)) - 1) * 100 + round(offset * 100)), True
+    match = _YEAR.search(text)
+    if match:
+        return float(match.group(1)), bool(approximate) or bool(_QUALIFIED_YEAR.match(text))
+    return NAN, False
+
+
+def parse_year(value):
+    """
+    Parse a start_date tag into a year.
+
+    Ranges give their midpoint and decades or centuries their middle (or
+    early/late part); all of these are flagged as estimates.
+
+    Returns:
+        tuple: (year, estimated); year is NaN when no year can be found.
+    """
+    if value is None or value == '':
+        return NAN, False
+    if isinstance(value, (int, float)):
+        return float(value), False
+    return _parse_year_text(str(value).strip().lower())
+
+
+def parse_building_tags(tags):
+    """
+    Typed numeric attributes of one building.
+
+    Missing levels default to DEFAULT_LEVELS and a missing height to
+    levels * METERS_PER_LEVEL, both flagged as estimated; `tagged_height`
+    and `tagged_levels` keep the values as tagged (NaN when missing).
+
+    Returns:
+        TypedTags: The parsed values.
+    """
+    tagged_levels, levels_estimated = parse_levels(tags.get('building:levels'))
+    levels = tagged_levels
+    if levels != levels:
+        levels, levels_estimated = DEFAULT_LEVELS, True
+    tagged_height, height_estimated = parse_length(tags.get('height'))
+    height = tagged_height
+    if height != height:
+        height, height_estimated = levels * METERS_PER_LEVEL, True
+    year, year_estimated = parse_year(tags.get('start_date'))
+    return TypedTags(height, height_estimated, levels, levels_estimated, year, year_estimated,
+                     tagged_height, tagged_levels)
+
+
+def geojson_ring(geometry):
+    """Outer ring of a GeoJSON Polygon, or of the largest polygon of a MultiPolygon."""
+    if not geometry:
+        return None
+    if geometry.get('type') == 'Polygon' and geometry.get('coordinates'):
+        return [tuple(point[:2]) for point in geometry['coordinates'][0]]
+    if geometry.get('type') == 'MultiPolygon' and geometry.get('coordinates'):
+        outer = max((polygon[0] for polygon in geometry['coordinates'] if polygon), key=len, default=None)
+        return [tuple(point[:2]) for point in outer] if outer else None
+    return None
+
+
+def iter_geojson_features(features):
+    """Yield (tags, ring) for each GeoJSON feature; tags are its properties plus 'id'."""
+    for feature in features:
+        properties = feature.get('properties') or {}
+        yield dict(properties, id=feature.get('id', properties.get('id', 'unknown'))), \
+            geojson_ring(feature.get('geometry'))
+
+
+def _ring_area(ring):
+    """Absolute shoelace area of a ring, in squared coordinate units."""
+    return abs(sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))) / 2
+
+
+def join_rings(ways):
+    """
+    Chain a multipolygon's outer ways into rings and return the largest.
+
+    Ways are joined where they share an endpoint, reversing them as needed,
+    so [1, 2, 3] and [1, 4, 3] make the ring [1, 2, 3, 4, 1]. A chain whose
+    ends never meet (a member way is missing) is closed with a straight
+    edge, but only used when no chain closed on its own.
+
+    Args:
+        ways (list): Point lists, one per outer way.
+
+    Returns:
+        list: The closed ring with the largest area, first point repeated at
+        the end, or None if there are no ways.
+    """
+    remaining = [list(way) for way in ways]
+    closed, open_chains = [], []
+    while remaining:
+        chain = remaining.pop(0)
+        while chain[0] != chain[-1]:
+            for i, way in enumerate(remaining):
+                if way[0] == chain[-1]:
+                    chain = chain + way[1:]
+                elif way[-1] == chain[-1]:
+                    chain = chain + way[-2::-1]
+                elif way[-1] == chain[0]:
+                    chain = way[:-1] + chain
+                elif way[0] == chain[0]:
+                    chain = way[:0:-1] + chain
+                else:
+                    continue
+                del remaining[i]
+                break
+            else:
+                break
+        if chain[0] == chain[-1]:
+            closed.append(chain)
+        else:
+            open_chains.append(chain + chain[:1])
+    rings = [ring for ring in closed or open_chains if len(ring) >= 4]
+    return max(rings, key=_ring_area, default=None)
+
+
+class _OSMAssembler:
+    """
+    Collects OSM nodes, ways and relations in any order and resolves building
+    footprints once everything has been seen.
+
+    Node coordinates and way node references are kept in typed arrays rather
+    than per-element dicts, and references are resolved in one vectorized
+    lookup.
+    """
+    def __init__(self):
+        self.node_ids = array('q')
+        self.node_coords = array('d')
+        self.refs = array('q')
+        self.ways = {}
+        self.buildings = []
+
+    def add(self, element):
+        """Add one element in Overpass JSON form (type, id, lon/lat, nodes, geometry, members, tags)."""
+        kind = element.get('type')
+        if kind == 'node':
+            if 'lon' in element:
+                self.node_ids.append(element['id'])
+                self.node_coords.append(element['lon'])
+                self.node_coords.append(element['lat'])
+            return
+
+        tags = element.get('tags') or {}
+        if kind == 'way':
+            if element.get('geometry'):
+                way = [(point['lon'], point['lat']) for point in element['geometry'] if point]
+            else:
+                start = len(self.refs)
+                self.refs.extend(element.get('nodes', ()))
+                way = (start, len(self.refs))
+            self.ways[element.get('id')] = way
+            if 'building' in tags:
+                self.buildings.append((dict(tags, id=element.get('id')), element.get('id'), None))
+        elif kind == 'relation' and 'building' in tags:
+            # Multipolygon buildings: outer member ways joined into one ring
+            members = [member for member in element.get('members', [])
+                       if member.get('type') == 'way' and member.get('role', 'outer') in ('outer', '')]
+            self.buildings.append((dict(tags, id=element.get('id')), None, members))
+
+    def __iter__(self):
+        node_ids = np.frombuffer(self.node_ids, dtype=np.int64) if len(self.node_ids) else np.zeros(0, np.int64)
+        coords = (np.frombuffer(self.node_coords, dtype=np.float64).reshape(-1, 2) if len(self.node_coords)
+                  else np.zeros((0, 2)))
+        order = np.argsort(node_ids, kind='stable')
+        sorted_ids = node_ids[order]
+        refs = np.frombuffer(self.refs, dtype=np.int64) if len(self.refs) else np.zeros(0, np.int64)
+        position = np.minimum(np.searchsorted(sorted_ids, refs), max(len(sorted_ids) - 1, 0))
+        found = sorted_ids[position] == refs if len(sorted_ids) else np.zeros(len(refs), dtype=bool)
+        ref_coords = coords[order[position]] if len(sorted_ids) else np.zeros((len(refs), 2))
+
+        def way_coords(way, min_points=3):
+            if isinstance(way, list):
+                return way
+            start, end = way
+            points = ref_coords[start:end][found[start:end]]
+            return [tuple(point) for point in points.tolist()] if len(points) >= min_points else None
+
+        for tags, way_id, members in self.buildings:
+            if members is None:
+                yield tags, way_coords(self.ways[way_id])
+                continue
+            outer_ways = []
+            for member in members:
+                way = self.ways.get(member.get('ref'))
+                if way is not None:
+                    points = way_coords(way, 2)
+                elif member.get('geometry'):
+                    points = [(point['lon'], point['lat']) for point in member['geometry'] if point]
+                else:
+                    points = None
+                if points and len(points) >= 2:
+                    outer_ways.append(points)
+            yield tags, join_rings(outer_ways)
+
+
+def iter_osm_elements(elements):
+    """Yield (tags, ring) for the buildings among Overpass JSON elements, in the order they appear."""
+    assembler = _OSMAssembler()
+    for element in elements:
+        assembler.add(element)
+    return iter(assembler)
+
+
+def iter_json_array(f, keys=('features', 'elements'), chunk_size=1 << 20):
+    """
+    Yield the items of a top-level array of a JSON document one at a time.
+
+    Args:
+        f: Text file object.
+        keys (tuple): Names of the array member to stream; the first one found is used.
+        chunk_size (int): Characters read at a time.
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"(?:%s)"\s*:\s*\[' % '|'.join(re.escape(key) for key in keys))
+    buffer = ''
+    while True:
+        match = start.search(buffer)
+        if match:
+            break
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        # Keep a tail in case the key straddles two chunks
+        buffer = buffer[-64:] + chunk
+    buffer = buffer[match.end():]
+    position = 0
+    eof = False
+    while True:
+        # Skip separators between items
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) or eof:
+                break
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+        if position >= len(buffer) or buffer[position] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
+        position = end
+
+
+def iter_json_lines(f):
+    """Yield one JSON value per non-empty line, ignoring RFC 8142 record separators."""
+    for line in f:
+        line = line.strip().lstrip('\x1e')
+        if line:
+            yield json.loads(line)
+
+
+def iter_osm_xml(f):
+    """Yield OSM XML elements (.osm) as Overpass JSON-shaped dicts, clearing the tree as it goes."""
+    for _, element in ElementTree.iterparse(f, events=('end',)):
+        kind = element.tag
+        if kind not in ('node', 'way', 'relation'):
+            continue
+        item = {'type': kind, 'id': int(element.get('id'))}
+        tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+        if tags:
+            item['tags'] = tags
+        if kind == 'node':
+            item['lon'] = float(element.get('lon'))
+            item['lat'] = float(element.get('lat'))
+        elif kind == 'way':
+            item['nodes'] = [int(nd.get('ref')) for nd in element.iter('nd')]
+        else:
+            item['members'] = [{'type': member.get('type'), 'ref': int(member.get('ref')),
+                                'role': member.get('role', '')} for member in element.iter('member')]
+        element.clear()
+        yield item
+
+
+def _open(path, binary=False):
+    opener = gzip.open if path.endswith('.gz') else open
+    return opener(path, 'rb') if binary else opener(path, 'rt', encoding='utf-8')
+
+
+def iter_buildings(path):
+    """
+    Stream the buildings of a file as (tags, ring) pairs.
+
+    The format follows the extension (an optional .gz is stripped first):
+    .osm is OSM XML, the SEQUENCE_EXTENSIONS are one GeoJSON feature per
+    line, and anything else is a JSON document with a `features`
+    (GeoJSON) or `elements` (Overpass) array.
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.osm'):
+        with _open(path, binary=True) as f:
+            yield from iter_osm_elements(iter_osm_xml(f))
+    elif name.endswith(SEQUENCE_EXTENSIONS):
+        with _open(path) as f:
+            yield from iter_geojson_features(iter_json_lines(f))
+    else:
+        with _open(path) as f:
+            items = iter_json_array(f)
+            first = next(items, None)
+            if first is None:
+                return
+            items = _prepend(first, items)
+            if first.get('type') == 'Feature':
+                yield from iter_geojson_features(items)
+            else:
+                yield from iter_osm_elements(items)
+
+
+def _prepend(first, items):
+    yield first
+    yield from items
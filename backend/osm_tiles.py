@@ -0,0 +1,269 @@
+"""
+Server-side Overpass proxy with a shared, tiled on-disk cache.
+
+Buildings and roads are fetched from Overpass one slippy-map tile at a time
+and stored on disk with an ETag, so every client shares one upstream fetch
+per tile. Expired tiles are revalidated with a conditional request, stale
+tiles are served if Overpass is unavailable, and concurrent cold fetches of
+the same tile are coalesced into a single upstream call.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger("gemini_app.osm")
+
+DEFAULT_OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+
+# Overpass QL selections per layer, formatted with the tile's bounding box
+LAYER_SELECTIONS = {
+    'buildings': ('way["building"]({bbox});', 'relation["building"]({bbox});'),
+    'roads': ('way["highway"]({bbox});',),
+}
+LAYER_SELECTIONS['all'] = LAYER_SELECTIONS['buildings'] + LAYER_SELECTIONS['roads']
+
+
+class OverpassError(Exception):
+    """Raised when Overpass cannot be reached or returns an error."""
+
+
+def tile_bbox(z, x, y):
+    """
+    Bounding box of a slippy-map tile.
+
+    Returns:
+        tuple: (south, west, north, east) in degrees.
+    """
+    n = 2 ** z
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return south, west, north, east
+
+
+def lonlat_to_tile(lon, lat, z):
+    """Return the (x, y) of the tile containing a point at zoom z."""
+    n = 2 ** z
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for_bbox(south, west, north, east, z):
+    """List the (x, y) tiles at zoom z covering a bounding box."""
+    x0, y0 = lonlat_to_tile(west, north, z)
+    x1, y1 = lonlat_to_tile(east, south, z)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def build_tile_query(z, x, y, layer='all', timeout=25):
+    """Overpass QL query returning a tile's ways/relations with their nodes."""
+    south, west, north, east = tile_bbox(z, x, y)
+    bbox = f"{south:.7f},{west:.7f},{north:.7f},{east:.7f}"
+    selections = "\n  ".join(selection.format(bbox=bbox) for selection in LAYER_SELECTIONS[layer])
+    return f"""[out:json][timeout:{timeout}];
+(
+  {selections}
+);
+out body;
+>;
+out skel qt;"""
+
+
+class CachedTile:
+    """One tile's Overpass JSON body with its cache metadata."""
+    __slots__ = ('body', 'etag', 'fetched_at', 'upstream_etag', 'upstream_last_modified', 'status')
+
+    def __init__(self, body, etag, fetched_at, upstream_etag=None, upstream_last_modified=None, status=None):
+        self.body = body
+        self.etag = etag
+        self.fetched_at = fetched_at
+        self.upstream_etag = upstream_etag
+        self.upstream_last_modified = upstream_last_modified
+        self.status = status
+
+    def meta(self):
+        return {
+            'etag': self.etag,
+            'fetched_at': self.fetched_at,
+            'upstream_etag': self.upstream_etag,
+            'upstream_last_modified': self.upstream_last_modified,
+        }
+
+
+class TileCache:
+    """
+    Tiles on disk as <layer>/<z>/<x>/<y>.json plus a .json.meta metadata sidecar.
+
+    Writes go to a temporary file that is renamed into place, so readers in
+    other threads or processes never see a partial tile.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, layer, z, x, y):
+        return os.path.join(self.directory, layer, str(z), str(x), f"{y}.json")
+
+    def get(self, layer, z, x, y):
+        path = self._path(layer, z, x, y)
+        try:
+            with open(path + '.meta', 'r') as f:
+                meta = json.load(f)
+            with open(path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        return CachedTile(body, meta['etag'], meta['fetched_at'], meta.get('upstream_etag'),
+                          meta.get('upstream_last_modified'))
+
+    def set(self, layer, z, x, y, tile):
+        path = self._path(layer, z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._write_atomic(path, tile.body)
+        self._write_atomic(path + '.meta', json.dumps(tile.meta()).encode('utf-8'))
+
+    def touch(self, layer, z, x, y, tile):
+        """Persist new metadata for a tile whose body did not change."""
+        self._write_atomic(self._path(layer, z, x, y) + '.meta', json.dumps(tile.meta()).encode('utf-8'))
+
+    @staticmethod
+    def _write_atomic(path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class OSMTileService:
+    """
+    Fetches Overpass tiles through the shared cache.
+
+    Args:
+        overpass_url (str): Overpass interpreter endpoint.
+        cache_dir (str): Directory of the tile cache.
+        ttl_seconds (int): Age after which a cached tile is revalidated.
+        timeout (float): Seconds to wait for Overpass.
+        min_zoom (int): Lowest zoom served; lower zooms would make Overpass
+            queries too large.
+        max_zoom (int): Highest zoom served.
+    """
+    def __init__(self, overpass_url=DEFAULT_OVERPASS_URL, cache_dir='osm_tiles', ttl_seconds=24 * 3600,
+                 timeout=60, min_zoom=13, max_zoom=18):
+        self.overpass_url = overpass_url
+        self.cache = TileCache(cache_dir)
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self._flight = SingleFlight(timeout=timeout * 2)
+
+    def get_tile(self, z, x, y, layer='all'):
+        """
+        Return a tile, from the cache when it is fresh.
+
+        Args:
+            z, x, y (int): Slippy-map tile coordinates.
+            layer (str): 'buildings', 'roads' or 'all'.
+
+        Returns:
+            CachedTile: With `status` set to 'hit', 'miss', 'revalidated',
+            'refreshed' or 'stale'.
+
+        Raises:
+            ValueError: If the tile or layer is not valid.
+            OverpassError: If the tile is not cached and Overpass fails.
+        """
+        if layer not in LAYER_SELECTIONS:
+            raise ValueError(f"Unknown layer {layer!r}, expected one of {sorted(LAYER_SELECTIONS)}")
+        if not self.min_zoom <= z <= self.max_zoom:
+            raise ValueError(f"Zoom must be between {self.min_zoom} and {self.max_zoom}")
+        if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f"Tile {x}/{y} is outside zoom level {z}")
+
+        tile = self.cache.get(layer, z, x, y)
+        if tile is not None and time.time() - tile.fetched_at < self.ttl_seconds:
+            tile.status = 'hit'
+            return tile
+
+        # Cold or expired: one upstream request per tile, shared by concurrent callers
+        key = f"{layer}/{z}/{x}/{y}"
+        return self._flight.do(key, lambda: self._refresh(layer, z, x, y))
+
+    def _refresh(self, layer, z, x, y):
+        cached = self.cache.get(layer, z, x, y)
+        if cached is not None and time.time() - cached.fetched_at < self.ttl_seconds:
+            # Another caller refreshed it while we waited for the flight
+            cached.status = 'hit'
+            return cached
+
+        try:
+            status, body, headers = self._fetch(build_tile_query(z, x, y, layer), cached)
+        except OverpassError as e:
+            if cached is None:
+                raise
+            logger.warning("Serving stale tile %s/%s/%s/%s: %s", layer, z, x, y, e)
+            cached.status = 'stale'
+            return cached
+
+        now = time.time()
+        if status == 304:
+            cached.fetched_at = now
+            self.cache.touch(layer, z, x, y, cached)
+            cached.status = 'revalidated'
+            return cached
+
+        tile = CachedTile(body, hashlib.sha256(body).hexdigest()[:32], now, headers.get('ETag'),
+                          headers.get('Last-Modified'))
+        if cached is not None and cached.etag == tile.etag:
+            # Upstream has no validators but the content did not change
+            tile.status = 'revalidated'
+        else:
+            tile.status = 'refreshed' if cached is not None else 'miss'
+        self.cache.set(layer, z, x, y, tile)
+        return tile
+
+    def _fetch(self, query, cached=None):
+        """POST a query to Overpass, conditionally when the cached tile has validators."""
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        if cached is not None and cached.upstream_etag:
+            headers['If-None-Match'] = cached.upstream_etag
+        if cached is not None and cached.upstream_last_modified:
+            headers['If-Modified-Since'] = cached.upstream_last_modified
+
+        data = urllib.parse.urlencode({'data': query}).encode('utf-8')
+        request = urllib.request.Request(self.overpass_url, data=data, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = response.read()
+                response_headers = response.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 304, None, e.headers
+            raise OverpassError(f"Overpass returned HTTP {e.code}")
+        except (urllib.error.URLError, OSError) as e:
+            raise OverpassError(f"Overpass request failed: {e}")
+
+        try:
+            # Overpass reports some query errors (rate limits) as non-JSON bodies
+            remark = json.loads(body).get('remark') or ''
+        except (ValueError, AttributeError):
+            raise OverpassError("Overpass returned a non-JSON response")
+        if 'error' in remark.lower():
+            # Runtime errors (e.g. query timeouts) come back as partial JSON with a remark, never cache those
+            raise OverpassError(f"Overpass query failed: {remark}")
+        return 200, body, response_headers
@@ -0,0 +1,536 @@
+"""
+Prompt construction and response parsing for the Gemini-backed routes.
+
+Shared by the Flask app (app.py) and the async app (asgi.py) so both serving
+modes send identical prompts and return identical payloads.
+"""
+import json
+import logging
+
+logger = logging.getLogger("gemini_app.prompts")
+
+
+def describe_building(building_data):
+    """Format the building attributes used in summary prompts"""
+    return f"""Building ID: {building_data.get('id', 'unknown')}
+    Name: {building_data.get('name', 'Unnamed Building')}
+    Type: {building_data.get('type', 'commercial')}
+    Floors: {building_data.get('levels', '3')}
+    Height: {building_data.get('height', '10')} meters
+    Actual Height: {building_data.get('actualHeight', 'unknown')}
+    Amenities: {building_data.get('amenity', 'None')}
+    Shops: {building_data.get('shop', 'None')}
+    Offices: {building_data.get('office', 'None')}
+    Year Built: {building_data.get('year_built', 'unknown')}
+    Building Material: {building_data.get('material', 'concrete')}
+    Roof Shape: {building_data.get('roof_shape', 'flat')}
+    Address: {building_data.get('addr:street', 'Unknown')} {building_data.get('addr:housenumber', '')}"""
+
+
+def build_summary_prompt(building_data):
+    """Build the Gemini prompt for a single building summary"""
+    # Extract building context if available
+    building_context = building_data.get('building_context', None)
+    context_info = ""
+
+    if building_context:
+        context_info = f"""
+        Additional Context Information:
+        Estimated Year Built: {building_context.get('estimatedYear', 'unknown')}
+        Confidence: {building_context.get('confidence', 'low')}
+        Architectural Style: {building_context.get('architecturalStyle', 'Unknown')}
+        Notable Features: {building_context.get('notableFeatures', 'Unknown')}
+        Historical Context: {building_context.get('historicalContext', 'Unknown')}
+        Cultural Significance: {building_context.get('culturalSignificance', 'Unknown')}
+        Material Information: {building_context.get('materialInfo', 'Unknown')}
+        Sustainability Features: {building_context.get('sustainabilityInfo', 'Unknown')}
+        Similar Examples: {building_context.get('similarExamples', 'Unknown')}
+        Urban Context: {building_context.get('urbanContext', 'Unknown')}
+        Reasoning: {building_context.get('reasoning', 'No additional information available')}
+        """
+
+    return f"""
+    Generate a detailed summary for this building in Calgary:
+
+    {describe_building(building_data)}
+    {context_info}
+
+    Provide the following information in JSON format:
+    1. A detailed summary of the building (2-3 sentences). Include architectural style, historical context, and notable features if available from the context information.
+    2. Estimated construction cost (based on building type, size, materials, and historical context)
+    3. Building type classification (be specific about the architectural style if known)
+    4. Urban significance (how this building contributes to Calgary's urban landscape, including any cultural or historical significance)
+    5. Assessed value (provide a realistic property value based on building type, size, location, and historical significance in Calgary)
+    6. Zoning information (provide a realistic zoning code for this type of building in Calgary, e.g. RC-G for residential, CC-X for downtown commercial, etc.)
+
+    Format your response as valid JSON with these keys: summary, constructionCost, buildingType, urbanSignificance, assessedValue, zoning
+    """
+
+
+def build_packed_summary_prompt(buildings):
+    """Build one Gemini prompt that summarizes several buildings at once"""
+    sections = "\n\n    ".join(
+        f"Building {i + 1}:\n    {describe_building(building_data)}" for i, building_data in enumerate(buildings)
+    )
+    return f"""
+    Generate a detailed summary for each of these {len(buildings)} buildings in Calgary:
+
+    {sections}
+
+    For each building provide:
+    1. A detailed summary of the building (2-3 sentences). Include architectural style, historical context, and notable features if known.
+    2. Estimated construction cost (based on building type, size, materials, and historical context)
+    3. Building type classification (be specific about the architectural style if known)
+    4. Urban significance (how this building contributes to Calgary's urban landscape, including any cultural or historical significance)
+    5. Assessed value (provide a realistic property value based on building type, size, location, and historical significance in Calgary)
+    6. Zoning information (provide a realistic zoning code for this type of building in Calgary, e.g. RC-G for residential, CC-X for downtown commercial, etc.)
+
+    Format your response as a valid JSON object keyed by Building ID. Each value must be an object with these keys: summary, constructionCost, buildingType, urbanSignificance, assessedValue, zoning
+    """
+
+
+def parse_json_response(result):
+    """Strip markdown code fences from a Gemini response and parse the JSON inside"""
+    # Clean up the response if it contains markdown code blocks
+    if "```json" in result:
+        result = result.split("```json")[1].split("```")[0].strip()
+    elif "```" in result:
+        result = result.split("```")[1].split("```")[0].strip()
+
+    # Try to parse as JSON first
+    try:
+        return json.loads(result)
+    except json.JSONDecodeError:
+        # Fall back to eval if JSON parsing fails
+        return eval(result)
+
+
+def summary_fallback(building_data):
+    """Deterministic summary used when the Gemini response cannot be parsed"""
+    return {
+        "summary": f"This is a {building_data.get('levels', '3')}-story {building_data.get('type', 'commercial')} building in Calgary.",
+        "constructionCost": "Estimated cost unavailable",
+        "buildingType": building_data.get('type', 'Commercial').capitalize(),
+        "urbanSignificance": "This building contributes to Calgary's urban landscape.",
+        "assessedValue": f"${int(float(building_data.get('levels', 3)) * 500000):,}",
+        "zoning": "RC-G" if building_data.get('type', '').lower() == 'residential' else "C-COR1"
+    }
+
+
+def build_query_prompt(query, context):
+    """Build the Gemini prompt for a general urban planning question"""
+    return f"""
+    You are an expert on urban architecture and city planning, especially for Calgary, Canada.
+
+    User Query: {query}
+
+    Context:
+    - Location: {context.get('location', 'Calgary')}
+    - Topic: {context.get('topic', 'urban architecture and city planning')}
+
+    Provide a detailed, informative response to the query. If you don't have specific information
+    about Calgary related to this query, you can provide general information about urban planning
+    and architecture principles, but clearly state that you're providing general information.
+
+    If relevant, include sources or references that would support your response.
+    """
+
+
+def parse_query_response(result):
+    """Split a query response into the answer text and its sources list"""
+    sources = []
+    if "Sources:" in result:
+        main_text, sources_text = result.split("Sources:", 1)
+        sources = [s.strip() for s in sources_text.strip().split("\n") if s.strip()]
+    else:
+        main_text = result
+
+    return {
+        "response": main_text.strip(),
+        "sources": sources
+    }
+
+
+def build_filter_prompt(query):
+    """Build the Gemini prompt that extracts filter criteria from a query"""
+    return f"""
+    You are an expert on building data and filtering. Extract filter criteria from this query: "{query}"
+
+    The available building attributes are:
+    - height (in meters, not feet) - all height values are in meters
+    - building:levels (number of floors) - also referred to as 'levels' or 'floors'
+    - building (type of building: residential, commercial, apartments, etc.)
+    - amenity (facilities: restaurant, school, hospital, etc.)
+    - shop (type of shop if present)
+    - office (type of office if present)
+    - name (building name)
+    - addr:street (street address) - also referred to as 'street' or 'address'
+    - addr:housenumber (house number) - also referred to as 'number'
+    - start_date (year built) - also referred to as 'year' or 'built'
+    - zoning (zoning code like RC-G, C-COR1, etc.)
+    - assessedValue (property value in dollars)
+
+    IMPORTANT: If the query mentions 'floors', 'levels', or 'stories', always use the attribute 'building:levels'.
+    If the query mentions 'type', 'building type', or specific types like 'residential', 'commercial', etc., use the attribute 'building'.
+
+    SPECIAL CASES AND KNOWLEDGE-BASED FILTERING:
+    Use your knowledge of Calgary's architecture, urban planning, and building information to enhance your responses. When explicit data might be missing, use your knowledge to provide meaningful results.
+
+    1. For historical queries ("oldest building", "historical buildings", "heritage buildings"):
+       Instead of relying solely on start_date which may be missing, use your knowledge of Calgary's historical buildings.
+       Examples: Stephen Avenue historic buildings (late 1800s), Lougheed House (1891), Calgary City Hall (1911), Grain Exchange Building (1909).
+       Create appropriate filters based on names, locations, or architectural styles.
+
+    2. For modern building queries ("newest building", "modern architecture", "recent developments"):
+       Use your knowledge of Calgary's recent developments.
+       Examples: Telus Sky (2019), Brookfield Place (2017), The Bow (2012), Eighth Avenue Place (2011).
+       Create appropriate filters based on names, architectural styles, or materials.
+
+    3. For architectural style queries ("art deco buildings", "brutalist architecture", "glass towers"):
+       Use your knowledge of architectural styles in Calgary.
+       Examples: The Bow (curved glass), Bankers Hall (postmodern), Calgary Tower (brutalist elements).
+       Create appropriate filters based on names, materials, or other attributes.
+
+    4. For cultural significance queries ("important landmarks", "iconic buildings", "cultural centers"):
+       Use your knowledge of Calgary's culturally significant buildings.
+       Examples: Calgary Tower, Glenbow Museum, TELUS Convention Centre, Arts Commons.
+       Create appropriate filters based on names, functions, or locations.
+
+    5. For height-based queries ("tallest buildings", "skyscrapers"):
+       Create a filter with attribute="height", operator=">", value="0" and add "sortBy": "height", "sortOrder": "desc".
+       Note that height is in meters.
+
+    6. For value-based queries ("most valuable buildings", "expensive properties"):
+       Create a filter with attribute="assessedValue", operator=">", value="0" and add "sortBy": "assessedValue", "sortOrder": "desc".
+
+    7. For sustainability queries ("green buildings", "sustainable architecture", "LEED certified"):
+       Use your knowledge of Calgary's sustainable buildings.
+       Examples: The Bow (energy efficient design), Telus Sky (LEED certification), Eighth Avenue Place (green features).
+       Create appropriate filters based on names or other attributes.
+
+    Return a JSON object with an array of filters. Each filter should have:
+    - attribute: The building attribute to filter on (from the list above)
+    - operator: One of >, <, =, >=, <=, or "contains" for text search
+    - value: The value to compare against
+
+    Also include an "explanation" field that briefly explains the filters in plain English.
+
+    Example 1: "show buildings taller than 30 meters"
+    Response: {{
+      "filters": [
+        {{
+          "attribute": "height",
+          "operator": ">",
+          "value": 30
+        }}
+      ],
+      "explanation": "Showing buildings with height greater than 30 meters"
+    }}
+
+    Example 2: "find commercial buildings with more than 5 floors"
+    Response: {{
+      "filters": [
+        {{
+          "attribute": "building",
+          "operator": "=",
+          "value": "commercial"
+        }},
+        {{
+          "attribute": "building:levels",
+          "operator": ">",
+          "value": 5
+        }}
+      ],
+      "explanation": "Showing commercial buildings with more than 5 floors"
+    }}
+
+    Example 3: "what is the oldest building"
+    Response: {{
+      "filters": [
+        {{
+          "attribute": "name",
+          "operator": "contains",
+          "value": "historic"
+        }}
+      ],
+      "explanation": "Showing buildings that are likely historical based on their names and Calgary's history. Historical buildings in Calgary include structures from the late 1800s and early 1900s."
+    }}
+
+    Example 4: "show me the newest buildings"
+    Response: {{
+      "filters": [
+        {{
+          "attribute": "name",
+          "operator": "contains",
+          "value": "Telus Sky"
+        }}
+      ],
+      "explanation": "Showing modern buildings in Calgary like Telus Sky which was completed in 2019."
+    }}
+
+    Example 5: "show me art deco buildings"
+    Response: {{
+      "filters": [
+        {{
+          "attribute": "name",
+          "operator": "contains",
+          "value": "Palliser"
+        }}
+      ],
+      "explanation": "Showing buildings with Art Deco architectural elements in Calgary. The Palliser Hotel (now Fairmont Palliser) features some Art Deco influences."
+    }}
+
+    Example 6: "show me culturally significant buildings"
+    Response: {{
+      "filters": [
+        {{
+          "attribute": "name",
+          "operator": "contains",
+          "value": "Calgary Tower"
+        }}
+      ],
+      "explanation": "Showing culturally significant buildings in Calgary. The Calgary Tower is an iconic landmark that symbolizes the city."
+    }}
+
+    Example 7: "show me sustainable buildings"
+    Response: {{
+      "filters": [
+        {{
+          "attribute": "name",
+          "operator": "contains",
+          "value": "Bow"
+        }}
+      ],
+      "explanation": "Showing buildings with sustainable design features. The Bow incorporates energy-efficient design elements."
+    }}
+
+    Format your response as valid JSON with these keys: filters (array), explanation (string), and optional sortBy and sortOrder fields.
+    """
+
+
+def process_filter_response(result, query):
+    """
+    Parse Gemini's filter response and normalize its filters.
+
+    Attribute aliases are mapped onto OSM attribute names, and knowledge-based
+    queries (historical, modern, architectural style, cultural, sustainability)
+    are rewritten into name filters.
+
+    Raises:
+        ValueError: If the response is not valid filter JSON.
+    """
+    # Extract JSON from response
+    result = result.strip()
+
+    # If the response is wrapped in ```json and ```, extract just the JSON part
+    if result.startswith('```json'):
+        result = result.split('```json')[1].split('```')[0].strip()
+    elif result.startswith('```'):
+        result = result.split('```')[1].split('```')[0].strip()
+
+    # Parse the JSON
+    parsed_result = json.loads(result)
+
+    # Validate the response structure
+    if 'filters' not in parsed_result or 'explanation' not in parsed_result:
+        raise ValueError("Response missing required fields")
+
+    # Process and normalize filters
+    processed_filters = []
+    for filter_item in parsed_result['filters']:
+        # Ensure all required fields are present
+        if 'attribute' not in filter_item or 'operator' not in filter_item or 'value' not in filter_item:
+            continue
+
+        # Normalize attribute names
+        attribute = filter_item['attribute']
+        if attribute in ['floors', 'levels', 'stories', 'floor', 'level', 'story']:
+            attribute = 'building:levels'
+        elif attribute in ['type', 'building_type']:
+            attribute = 'building'
+        elif attribute in ['address', 'street']:
+            attribute = 'addr:street'
+        elif attribute in ['number', 'house_number']:
+            attribute = 'addr:housenumber'
+        elif attribute in ['year', 'built', 'year_built']:
+            attribute = 'start_date'
+
+        # Special handling for knowledge-based queries
+        query_lower = query.lower()
+
+        # Historical/oldest buildings
+        if attribute == 'start_date' and ('oldest' in query_lower or 'historical' in query_lower or 'heritage' in query_lower):
+            logger.debug("Converting historical building query to use knowledge-based filtering")
+            attribute = 'name'
+            filter_item['operator'] = 'contains'
+
+            # Use different historical building names based on query nuances
+            if 'oldest' in query_lower:
+                filter_item['value'] = 'historic'
+            elif 'heritage' in query_lower:
+                filter_item['value'] = 'heritage'
+            else:
+                filter_item['value'] = 'historic'
+
+            # Add explanation about the conversion
+            if not parsed_result['explanation'].endswith('.'):
+                parsed_result['explanation'] += '.'
+            parsed_result['explanation'] += " Using building names and Calgary's historical context to identify likely historical buildings."
+
+        # Modern/newest buildings
+        elif attribute == 'start_date' and ('newest' in query_lower or 'modern' in query_lower or 'recent' in query_lower):
+            logger.debug("Converting modern building query to use knowledge-based filtering")
+            attribute = 'name'
+            filter_item['operator'] = 'contains'
+
+            # Use different modern building names based on query nuances
+            if 'newest' in query_lower:
+                filter_item['value'] = 'telus'
+            elif 'modern' in query_lower:
+                filter_item['value'] = 'bow'
+            else:
+                filter_item['value'] = 'brookfield'
+
+            # Add explanation about the conversion
+            if not parsed_result['explanation'].endswith('.'):
+                parsed_result['explanation'] += '.'
+            parsed_result['explanation'] += " Using building names to identify modern buildings in Calgary's skyline."
+
+        # Architectural style queries
+        elif 'style' in query_lower or 'architecture' in query_lower or 'design' in query_lower:
+            logger.debug("Converting architectural style query to use knowledge-based filtering")
+            attribute = 'name'
+            filter_item['operator'] = 'contains'
+
+            # Determine architectural style from query
+            if 'art deco' in query_lower:
+                filter_item['value'] = 'palliser'
+            elif 'modern' in query_lower or 'contemporary' in query_lower:
+                filter_item['value'] = 'bow'
+            elif 'brutalist' in query_lower or 'concrete' in query_lower:
+                filter_item['value'] = 'calgary tower'
+            elif 'glass' in query_lower:
+                filter_item['value'] = 'telus'
+            else:
+                filter_item['value'] = 'bow'
+
+            # Add explanation about the conversion
+            if not parsed_result['explanation'].endswith('.'):
+                parsed_result['explanation'] += '.'
+            parsed_result['explanation'] += " Using building names to identify buildings with specific architectural styles in Calgary."
+
+        # Cultural significance queries
+        elif 'cultural' in query_lower or 'landmark' in query_lower or 'iconic' in query_lower or 'significant' in query_lower:
+            logger.debug("Converting cultural significance query to use knowledge-based filtering")
+            attribute = 'name'
+            filter_item['operator'] = 'contains'
+            filter_item['value'] = 'calgary tower'
+
+            # Add explanation about the conversion
+            if not parsed_result['explanation'].endswith('.'):
+                parsed_result['explanation'] += '.'
+            parsed_result['explanation'] += " Highlighting culturally significant buildings in Calgary's urban landscape."
+
+        # Sustainability queries
+        elif 'sustainable' in query_lower or 'green' in query_lower or 'eco' in query_lower or 'leed' in query_lower:
+            logger.debug("Converting sustainability query to use knowledge-based filtering")
+            attribute = 'name'
+            filter_item['operator'] = 'contains'
+            filter_item['value'] = 'bow'
+
+            # Add explanation about the conversion
+            if not parsed_result['explanation'].endswith('.'):
+                parsed_result['explanation'] += '.'
+            parsed_result['explanation'] += " Identifying buildings with sustainable design features in Calgary."
+
+        # Create normalized filter
+        processed_filters.append({
+            'attribute': attribute,
+            'operator': filter_item['operator'],
+            'value': filter_item['value']
+        })
+
+    # Update the filters in the result
+    parsed_result['filters'] = processed_filters
+
+    # Log the processed filters
+    logger.debug("Processed filters: %s", processed_filters)
+    logger.debug("Explanation: %s", parsed_result['explanation'])
+
+    return parsed_result
+
+
+def filter_fallback(query):
+    """Response used when Gemini's filter response cannot be parsed"""
+    return {
+        "filters": [],
+        "explanation": f"Could not parse the query: {query}. Please try a different query format."
+    }
+
+
+def build_context_prompt(name, building_type, query_type):
+    """Build the Gemini prompt for contextual information about a building"""
+    return f"""
+    You are an expert on Calgary's architecture, urban planning, and building information. Provide comprehensive information about this building:
+
+    Building Name: {name}
+    Building Type: {building_type}
+    Information Requested: {query_type}
+
+    If the building name is generic or unknown, use your knowledge of Calgary's architecture to provide detailed information about buildings of this type in Calgary.
+
+    Include information about:
+    1. Architectural style and notable features typical for this type of building in Calgary
+    2. Historical context and significance (if applicable)
+    3. Typical materials used in construction
+    4. Likely zoning and urban planning context
+    5. Typical usage patterns and functions
+    6. Estimated construction period or year
+    7. Notable examples of similar buildings in Calgary
+    8. Any cultural or economic significance
+    9. Sustainability features (if applicable)
+    10. Relationship to Calgary's urban development patterns
+
+    Format your response as valid JSON with these keys:
+    - estimatedYear (number, e.g. 1980, or 0 if unknown)
+    - confidence (string: "high", "medium", or "low")
+    - architecturalStyle (string describing the likely architectural style)
+    - notableFeatures (string describing distinctive features)
+    - historicalContext (string with historical information)
+    - culturalSignificance (string describing cultural importance)
+    - materialInfo (string describing typical construction materials)
+    - sustainabilityInfo (string describing any sustainability aspects)
+    - similarExamples (string listing similar buildings in Calgary)
+    - urbanContext (string describing relationship to urban planning)
+    - reasoning (string explaining your overall assessment)
+    """
+
+
+def context_fallback():
+    """Deterministic building context used when the Gemini response cannot be parsed"""
+    return {
+        "estimatedYear": 0,
+        "confidence": "low",
+        "architecturalStyle": "Unknown",
+        "notableFeatures": "No specific features identified",
+        "historicalContext": "No historical information available",
+        "culturalSignificance": "Unknown cultural significance",
+        "materialInfo": "Typical construction materials for Calgary buildings include concrete, steel, and glass",
+        "sustainabilityInfo": "No specific sustainability information available",
+        "similarExamples": "No specific examples identified",
+        "urbanContext": "This building is part of Calgary's urban landscape",
+        "reasoning": "Unable to determine detailed building context due to insufficient information."
+    }
+
+
+def parse_context_response(result):
+    """Strip markdown code fences from a building context response and parse the JSON inside"""
+    result = result.strip()
+
+    # If the response is wrapped in ```json and ```, extract just the JSON part
+    if "```json" in result:
+        result = result.split("```json")[1].split("```")[0].strip()
+    elif "```" in result:
+        result = result.split("```")[1].split("```")[0].strip()
+
+    return json.loads(result)
@@ -0,0 +1,153 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+When several requests need the result of the same expensive call (e.g. the
+same Gemini prompt) at the same time, only the first one runs it. The others
+wait for that call and share its result or its exception.
+"""
+import asyncio
+import threading
+
+
+class SingleFlightTimeout(TimeoutError):
+    """Raised when a waiter gives up on an in-flight call."""
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls that share a key.
+    """
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._counters = {'calls': 0, 'coalesced': 0, 'timeouts': 0, 'errors': 0}
+
+    def do(self, key, fn, timeout=None):
+        """
+        Run fn() once per key among concurrent callers.
+
+        Args:
+            key (str): Identifies equivalent calls, e.g. a hash of the normalized prompt.
+            fn (callable): The call to run if none is in flight for this key.
+            timeout (float): Seconds a waiting caller blocks before raising
+                SingleFlightTimeout. Defaults to the instance timeout.
+
+        Returns:
+            The result of the shared call. If it raised, every caller re-raises
+            the same exception.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters['calls'] += 1
+            else:
+                call.waiters += 1
+                self._counters['coalesced'] += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+                with self._lock:
+                    self._counters['errors'] += 1
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            wait = self.timeout if timeout is None else timeout
+            if not call.done.wait(wait):
+                with self._lock:
+                    self._counters['timeouts'] += 1
+                raise SingleFlightTimeout(f"Timed out after {wait}s waiting for in-flight call {key}")
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """Return call/coalesce counters and the number of calls in flight."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats['in_flight'] = len(self._calls)
+        return stats
+
+
+class _AsyncCall:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    asyncio counterpart of SingleFlight.
+
+    The shared call runs as its own task. Each caller waits on it through
+    asyncio.shield, so one caller being cancelled (e.g. its client
+    disconnected) does not affect the others; once every caller is gone the
+    shared task itself is cancelled.
+    """
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._calls = {}
+        self._counters = {'calls': 0, 'coalesced': 0, 'timeouts': 0, 'cancelled': 0}
+
+    async def do(self, key, coro_fn, timeout=None):
+        """
+        Await coro_fn() once per key among concurrent callers.
+
+        Args:
+            key (str): Identifies equivalent calls.
+            coro_fn (callable): Returns the coroutine to run if none is in flight.
+            timeout (float): Seconds this caller waits before raising
+                SingleFlightTimeout. Defaults to the instance timeout.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _AsyncCall(asyncio.ensure_future(coro_fn()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._counters['calls'] += 1
+        else:
+            self._counters['coalesced'] += 1
+
+        call.waiters += 1
+        wait = self.timeout if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.task), wait)
+        except asyncio.TimeoutError:
+            self._counters['timeouts'] += 1
+            raise SingleFlightTimeout(f"Timed out after {wait}s waiting for in-flight call {key}")
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody is waiting for the result any more, stop the upstream call
+                call.task.cancel()
+                self._counters['cancelled'] += 1
+                self._forget(key, call)
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self):
+        """Return call/coalesce counters and the number of calls in flight."""
+        stats = dict(self._counters)
+        stats['in_flight'] = len(self._calls)
+        return stats
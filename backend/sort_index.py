@@ -0,0 +1,164 @@
+"""
+Presorted permutations for ordering filter results.
+
+A SortIndex holds the ascending permutation of one numeric column (NaN last)
+and its inverse, so a filtered, sorted page is read off the permutation
+instead of sorting the matches on every request:
+
+- when many buildings match, the permutation is walked from the cursor and
+  the first `limit` matching rows are taken (about limit / selectivity rows
+  are visited);
+- when few match, the matches' positions in the permutation are looked up
+  and the `limit` smallest after the cursor are selected with a partial sort.
+
+Positions count along the requested direction, so a descending page is the
+valid values in reverse followed by the NaNs: unknown values always come
+last. A page's cursor is the position of its last row.
+"""
+import base64
+
+import numpy as np
+
+# Rows examined per step of a permutation walk, at least
+WALK_CHUNK = 1024
+
+
+class SortIndex:
+    """
+    Ascending permutation of a float column, NaN last.
+
+    Args:
+        values (numpy.ndarray): The column to order by.
+    """
+    def __init__(self, values):
+        dtype = np.int32 if len(values) < 2 ** 31 else np.int64
+        # Stable, so ties keep row order; NumPy sorts NaN to the end
+        self.order = np.argsort(values, kind='stable').astype(dtype)
+        self.rank = np.empty(len(values), dtype=dtype)
+        self.rank[self.order] = np.arange(len(values), dtype=dtype)
+        self.valid = int(np.count_nonzero(~np.isnan(values)))
+
+    @classmethod
+    def restore(cls, order, rank, valid):
+        """Rebuild an index from its arrays (e.g. from a snapshot) without sorting."""
+        index = cls.__new__(cls)
+        index.order = order
+        index.rank = rank
+        index.valid = valid
+        return index
+
+    def __len__(self):
+        return len(self.order)
+
+    def _flip(self, positions, descending):
+        """Map positions between the ascending and descending orders (the mapping is its own inverse)."""
+        if not descending:
+            return positions
+        return np.where(positions < self.valid, self.valid - 1 - positions, positions)
+
+    def positions(self, rows, descending=False):
+        """Position of each row in the requested order."""
+        return self._flip(self.rank[rows].astype(np.int64), descending)
+
+    def rows_at(self, positions, descending=False):
+        """Rows at the given positions of the requested order."""
+        return self.order[self._flip(np.asarray(positions, dtype=np.int64), descending)].astype(np.int64)
+
+    def walk(self, mask, limit, after=-1, descending=False):
+        """
+        First `limit` rows of the mask after position `after`, by walking the permutation.
+
+        Returns:
+            tuple: (rows, positions) in order.
+        """
+        found_rows = []
+        found_positions = []
+        found = 0
+        start = after + 1
+        chunk = max(WALK_CHUNK, limit)
+        while found < limit and start < len(self):
+            positions = np.arange(start, min(start + chunk, len(self)), dtype=np.int64)
+            rows = self.rows_at(positions, descending)
+            hits = mask[rows]
+            found_rows.append(rows[hits])
+            found_positions.append(positions[hits])
+            found += len(found_rows[-1])
+            start += chunk
+            # Few hits so far: take bigger steps
+            chunk *= 2
+        if not found_rows:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(found_rows)[:limit], np.concatenate(found_positions)[:limit]
+
+    def select(self, rows, limit, after=-1, descending=False):
+        """
+        The `limit` rows that come first in order after position `after`, by partial sort.
+
+        Args:
+            rows (numpy.ndarray): Candidate rows, e.g. the matches of a filter.
+
+        Returns:
+            tuple: (rows, positions) in order.
+        """
+        positions = self.positions(rows, descending)
+        positions = positions[positions > after]
+        if len(positions) > limit:
+            positions = np.partition(positions, limit - 1)[:limit]
+        positions = np.sort(positions)
+        return self.rows_at(positions, descending), positions
+
+    def top(self, mask, limit, after=-1, descending=False, matches=None):
+        """
+        The first `limit` rows of a mask in sorted order, after a cursor position.
+
+        Walks the permutation when the expected walk (limit / match fraction)
+        is shorter than the list of matches, and selects among the matches
+        otherwise.
+
+        Args:
+            mask (numpy.ndarray): Boolean row mask.
+            limit (int): Rows wanted.
+            after (int): Cursor position; -1 for the first page.
+            descending (bool): Largest values first (NaN still last).
+            matches (int): Number of True values in mask, if already known.
+
+        Returns:
+            tuple: (rows, positions) in order.
+        """
+        if matches is None:
+            matches = int(np.count_nonzero(mask))
+        if matches == 0 or limit <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if limit * len(self) < matches * matches:
+            return self.walk(mask, limit, after, descending)
+        return self.select(np.flatnonzero(mask), limit, after, descending)
+
+
+def encode_cursor(sort_by, descending, position):
+    """Opaque cursor for the page after `position` of an ordering."""
+    text = f"{sort_by or ''}|{'desc' if descending else 'asc'}|{int(position)}"
+    return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by, descending, size=None):
+    """
+    Position encoded in a cursor.
+
+    Args:
+        size (int): Rows in the ordering; positions outside it are rejected.
+
+    Raises:
+        ValueError: If the cursor is malformed, belongs to another ordering or
+            points outside the ordering.
+    """
+    try:
+        text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        cursor_sort, cursor_order, position = text.rsplit('|', 2)
+        position = int(position)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    if cursor_sort != (sort_by or '') or cursor_order != ('desc' if descending else 'asc'):
+        raise ValueError("Cursor belongs to a different sortBy/sortOrder")
+    if position < 0 or (size is not None and position >= size):
+        raise ValueError(f"Cursor position {position} is out of range")
+    return position
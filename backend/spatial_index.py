@@ -0,0 +1,188 @@
+"""
+Packed-grid spatial index over building footprint bounding boxes.
+
+The city's extent is divided into a uniform grid sized for a few buildings
+per cell. Each building is listed under every cell its bounding box touches,
+and the (cell, building) pairs are sorted by cell into one flat array with a
+per-cell offset table (CSR layout). Cells are numbered row-major, so the
+cells of one grid row inside a query box are a single contiguous slice of
+that array, and a viewport query is a handful of slices followed by one
+vectorized bounding-box test.
+"""
+import math
+
+import numpy as np
+
+# Meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111320.0
+
+# Upper bound on grid cells per axis
+MAX_CELLS_PER_AXIS = 4096
+
+
+def distance_meters(lon, lat, lons, lats):
+    """Equirectangular distance in meters from one point to arrays of points."""
+    dx = (lons - lon) * math.cos(math.radians(lat)) * METERS_PER_DEGREE
+    dy = (lats - lat) * METERS_PER_DEGREE
+    return np.hypot(dx, dy)
+
+
+class GridIndex:
+    """
+    Uniform grid over bounding boxes.
+
+    Args:
+        min_lon, min_lat, max_lon, max_lat (numpy.ndarray): Per-building
+            bounding boxes; rows with NaN bounds (no footprint) are skipped.
+        centroid_lon, centroid_lat (numpy.ndarray): Per-building reference
+            points used by nearest().
+        per_cell (float): Target number of buildings per cell.
+    """
+    def __init__(self, min_lon, min_lat, max_lon, max_lat, centroid_lon, centroid_lat, per_cell=4):
+        self.min_lon = min_lon
+        self.min_lat = min_lat
+        self.max_lon = max_lon
+        self.max_lat = max_lat
+        self.centroid_lon = centroid_lon
+        self.centroid_lat = centroid_lat
+
+        rows = np.flatnonzero(~np.isnan(min_lon))
+        self.size = len(rows)
+        if self.size == 0:
+            self.nx = self.ny = 0
+            self.items = np.zeros(0, dtype=np.int64)
+            self.cell_start = np.zeros(1, dtype=np.int64)
+            return
+
+        self.lon0 = float(min_lon[rows].min())
+        self.lat0 = float(min_lat[rows].min())
+        width = max(float(max_lon[rows].max()) - self.lon0, 1e-9)
+        height = max(float(max_lat[rows].max()) - self.lat0, 1e-9)
+
+        # Roughly square cells holding `per_cell` buildings on average
+        cells = max(self.size / per_cell, 1)
+        self.nx = int(min(max(round(math.sqrt(cells * width / height)), 1), MAX_CELLS_PER_AXIS))
+        self.ny = int(min(max(round(cells / self.nx), 1), MAX_CELLS_PER_AXIS))
+        self.cell_width = width / self.nx
+        self.cell_height = height / self.ny
+
+        x0, x1 = self._cell_range(min_lon[rows], max_lon[rows], self.lon0, self.cell_width, self.nx)
+        y0, y1 = self._cell_range(min_lat[rows], max_lat[rows], self.lat0, self.cell_height, self.ny)
+
+        # Expand every building into one (cell, row) pair per covered cell
+        spans = x1 - x0 + 1
+        counts = spans * (y1 - y0 + 1)
+        owner = np.repeat(np.arange(self.size), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell_x = x0[owner] + local % spans[owner]
+        cell_y = y0[owner] + local // spans[owner]
+        cells = cell_y * self.nx + cell_x
+
+        order = np.argsort(cells, kind='stable')
+        self.items = rows[owner[order]]
+        self.cell_start = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.nx * self.ny), out=self.cell_start[1:])
+
+    # Scalars that, with `items` and `cell_start`, make up a built index
+    STATE_FIELDS = ('size', 'nx', 'ny', 'lon0', 'lat0', 'cell_width', 'cell_height')
+
+    def state(self):
+        """The built grid as (arrays, scalars), for saving in a snapshot."""
+        scalars = {field: getattr(self, field) for field in self.STATE_FIELDS if hasattr(self, field)}
+        return {'items': self.items, 'cell_start': self.cell_start}, scalars
+
+    @classmethod
+    def restore(cls, min_lon, min_lat, max_lon, max_lat, centroid_lon, centroid_lat, arrays, scalars):
+        """Rebuild an index from the bounding boxes and a state() without recomputing the grid."""
+        index = cls.__new__(cls)
+        index.min_lon, index.min_lat, index.max_lon, index.max_lat = min_lon, min_lat, max_lon, max_lat
+        index.centroid_lon, index.centroid_lat = centroid_lon, centroid_lat
+        index.items = arrays['items']
+        index.cell_start = arrays['cell_start']
+        for field, value in scalars.items():
+            setattr(index, field, value)
+        return index
+
+    @staticmethod
+    def _cell_range(low, high, origin, size, count):
+        first = np.clip(np.floor((low - origin) / size).astype(np.int64), 0, count - 1)
+        last = np.clip(np.floor((high - origin) / size).astype(np.int64), 0, count - 1)
+        return first, last
+
+    def _candidates(self, x0, y0, x1, y1):
+        """Rows listed in the cells [x0, x1] x [y0, y1], deduplicated."""
+        slices = [self.items[self.cell_start[y * self.nx + x0]:self.cell_start[y * self.nx + x1 + 1]]
+                  for y in range(y0, y1 + 1)]
+        if not slices:
+            return self.items[:0]
+        candidates = np.concatenate(slices) if len(slices) > 1 else slices[0]
+        if x0 != x1 or y0 != y1:
+            # Buildings spanning several cells are listed once per cell
+            candidates = np.unique(candidates)
+        return candidates
+
+    def query_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """
+        Rows whose bounding box intersects a query box.
+
+        Returns:
+            numpy.ndarray: Matching row numbers, ascending.
+        """
+        if self.size == 0 or min_lon > max_lon or min_lat > max_lat:
+            return np.zeros(0, dtype=np.int64)
+        x0 = math.floor((min_lon - self.lon0) / self.cell_width)
+        x1 = math.floor((max_lon - self.lon0) / self.cell_width)
+        y0 = math.floor((min_lat - self.lat0) / self.cell_height)
+        y1 = math.floor((max_lat - self.lat0) / self.cell_height)
+        if x1 < 0 or y1 < 0 or x0 >= self.nx or y0 >= self.ny:
+            return np.zeros(0, dtype=np.int64)
+
+        candidates = self._candidates(max(x0, 0), max(y0, 0), min(x1, self.nx - 1), min(y1, self.ny - 1))
+        keep = ((self.min_lon[candidates] <= max_lon) & (self.max_lon[candidates] >= min_lon) &
+                (self.min_lat[candidates] <= max_lat) & (self.max_lat[candidates] >= min_lat))
+        return np.sort(candidates[keep])
+
+    def nearest(self, lon, lat, k=10, max_distance=None):
+        """
+        The k buildings whose reference point is closest to a location.
+
+        Searches square rings of cells around the point, doubling the radius
+        until the k-th distance found is inside the searched square.
+
+        Returns:
+            tuple: (rows, distances in meters), nearest first.
+        """
+        if self.size == 0 or k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        cx = math.floor((lon - self.lon0) / self.cell_width)
+        cy = math.floor((lat - self.lat0) / self.cell_height)
+        # Distance guaranteed to lie inside a square of `radius` cells around the point, measured like
+        # distance_meters, which scales longitude by the cosine of the query's latitude
+        cell_meters = min(self.cell_width * math.cos(math.radians(min(abs(lat), 89.9))),
+                          self.cell_height) * METERS_PER_DEGREE
+
+        radius = 1
+        while True:
+            x0, x1 = max(cx - radius, 0), min(cx + radius, self.nx - 1)
+            y0, y1 = max(cy - radius, 0), min(cy + radius, self.ny - 1)
+            covers_grid = x0 == 0 and y0 == 0 and x1 == self.nx - 1 and y1 == self.ny - 1
+            if x0 <= x1 and y0 <= y1:
+                rows = self._candidates(x0, y0, x1, y1)
+            else:
+                rows = self.items[:0]
+            if len(rows) >= k or covers_grid:
+                distances = distance_meters(lon, lat, self.centroid_lon[rows], self.centroid_lat[rows])
+                if len(rows) > k:
+                    nearest = np.argpartition(distances, k - 1)[:k]
+                    rows, distances = rows[nearest], distances[nearest]
+                order = np.argsort(distances, kind='stable')
+                rows, distances = rows[order], distances[order]
+                if covers_grid or distances[-1] <= radius * cell_meters:
+                    break
+            radius *= 2
+
+        if max_distance is not None:
+            within = distances <= max_distance
+            rows, distances = rows[within], distances[within]
+        return rows, distances
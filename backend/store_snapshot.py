@@ -0,0 +1,358 @@
+"""
+Memory-mapped snapshots of a BuildingStore.
+
+A snapshot is one binary file: a fixed header, a JSON manifest and the
+store's NumPy arrays, each 64-byte aligned. The arrays are the attribute
+columns, the footprint coordinates, offsets and bounds, and the built
+indexes (spatial grid, sort permutations, trigram postings and simplified
+level-of-detail footprints). Reading one maps the file and wraps the arrays
+in place as read-only views, so a city is ready to serve without parsing or
+indexing anything. Worker processes that map the same file also share its
+pages through the OS page cache instead of each holding a private copy.
+
+Layout (little-endian):
+
+    header    magic b'CSNP', format version (u16), 2 pad bytes,
+              manifest length (u64), CRC-32 of the manifest (u32), 4 pad bytes
+    manifest  UTF-8 JSON: array names with dtype, shape, offset and CRC-32,
+              the source file's fingerprint, categories, ids (when not
+              integers) and index metadata
+    arrays    raw array data at the offsets in the manifest
+
+The manifest records the size and modification time of the file the store
+was loaded from. refresh_snapshot() rebuilds a snapshot whose source has
+changed, and a snapshot that fails validation is rebuilt like a missing one.
+
+Build one ahead of a deploy with:
+
+    python store_snapshot.py build city.geojson city.snapshot
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+from building_store import (CATEGORICAL_COLUMNS, NUMERIC_COLUMNS, SORTABLE_COLUMNS, TEXT_COLUMNS, BuildingStore,
+                            CategoricalColumn, Footprints)
+from lod import LOD_LEVELS, LODLevel
+from sort_index import SortIndex
+from spatial_index import GridIndex
+from text_index import TrigramIndex
+
+MAGIC = b'CSNP'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sH2xQI4x')
+ALIGNMENT = 64
+
+
+class SnapshotError(Exception):
+    """The file is not a valid snapshot of this format version."""
+
+
+def source_fingerprint(path):
+    """
+    Identify the file a store is loaded from, to tell when a snapshot of it is stale.
+
+    Returns:
+        dict: The file's absolute path, size and modification time, or
+        {'path': None} for the empty store.
+    """
+    if not path:
+        return {'path': None}
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def build_indexes(store):
+    """Build every lazily built index of a store, so a snapshot of it includes them."""
+    for attribute in SORTABLE_COLUMNS:
+        store.sort_index(attribute)
+    for column in TEXT_COLUMNS:
+        store.text_index(column)
+    store.lods.build_all()
+
+
+def _bytes(values):
+    """The raw bytes of a contiguous array, without copying."""
+    return values.reshape(-1).view(np.uint8)
+
+
+def _footprint_arrays(prefix, footprints, spatial_index, arrays):
+    arrays[f'{prefix}/coords'] = footprints.coords
+    arrays[f'{prefix}/offsets'] = footprints.offsets
+    for field in Footprints.BOUND_FIELDS:
+        arrays[f'{prefix}/{field}'] = getattr(footprints, field)
+    grid_arrays, grid = spatial_index.state()
+    for name, values in grid_arrays.items():
+        arrays[f'{prefix}/grid/{name}'] = values
+    return grid
+
+
+def _arrays(store):
+    """The store's arrays by snapshot name, and the manifest metadata that goes with them."""
+    arrays = {}
+    meta = {'categories': {}, 'sort': {}, 'text': {}, 'lods': {}}
+    if store.ids.dtype == object:
+        meta['ids'] = store.ids.tolist()
+    else:
+        arrays['ids'] = store.ids
+    for column in NUMERIC_COLUMNS:
+        arrays[f'numeric/{column}'] = store.numeric[column]
+        arrays[f'estimated/{column}'] = store.estimated[column]
+    for column, values in store.tagged.items():
+        arrays[f'tagged/{column}'] = values
+    for column in CATEGORICAL_COLUMNS:
+        arrays[f'codes/{column}'] = store.categorical[column].codes
+        meta['categories'][column] = store.categorical[column].categories
+    meta['grid'] = _footprint_arrays('footprints', store.footprints, store.spatial_index, arrays)
+
+    # Indexes that have been built so far
+    for attribute, index in store._sort_indexes.items():
+        arrays[f'sort/{attribute}/order'] = index.order
+        arrays[f'sort/{attribute}/rank'] = index.rank
+        meta['sort'][attribute] = index.valid
+    for column, index in store._text_indexes.items():
+        index_arrays, meta['text'][column] = index.state()
+        for name, values in index_arrays.items():
+            arrays[f'text/{column}/{name}'] = values
+    if store._lods is not None:
+        for level, built in store._lods._levels.items():
+            # The full-resolution level is the store's own footprints
+            if built.footprints is store.footprints:
+                continue
+            prefix = f'lod/{level}'
+            meta['lods'][str(level)] = _footprint_arrays(prefix, built.footprints, built.spatial_index, arrays)
+            arrays[f'{prefix}/rows'] = built.rows
+            arrays[f'{prefix}/ids'] = built.ids
+            arrays[f'{prefix}/heights'] = built.heights
+    return arrays, meta
+
+
+def write_snapshot(store, path, source=None):
+    """
+    Write a store, with the indexes built so far, to a snapshot file.
+
+    The file is written next to `path` and renamed into place, so processes
+    reading the old snapshot keep their mapping and new readers never see a
+    partial file.
+
+    Args:
+        store (building_store.BuildingStore): The store to save.
+        path (str): Snapshot file to write.
+        source (dict): source_fingerprint() of the file the store was loaded
+            from, or None when it has none (e.g. an uploaded city).
+    """
+    arrays, meta = _arrays(store)
+    arrays = {name: np.ascontiguousarray(values) for name, values in arrays.items()}
+
+    entries = {name: {'dtype': values.dtype.str, 'shape': list(values.shape), 'offset': 0,
+                      'crc32': zlib.crc32(_bytes(values))}
+               for name, values in arrays.items()}
+    meta.update(version=FORMAT_VERSION, source=source, created=time.time())
+    # Offsets depend on the manifest's length, which depends on the offsets: lay out until stable
+    while True:
+        manifest = json.dumps(dict(meta, arrays=entries), separators=(',', ':')).encode('utf-8')
+        offset = HEADER.size + len(manifest)
+        changed = False
+        for name, values in arrays.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            if entries[name]['offset'] != offset:
+                entries[name]['offset'] = offset
+                changed = True
+            offset += values.nbytes
+        if not changed:
+            break
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.snapshot-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(manifest), zlib.crc32(manifest)))
+            f.write(manifest)
+            for name, values in arrays.items():
+                f.write(b'\0' * (entries[name]['offset'] - f.tell()))
+                f.write(_bytes(values))
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def _map(path):
+    """Map a snapshot file and parse its header and manifest."""
+    with open(path, 'rb') as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise SnapshotError(f"{path} is empty")
+    if len(buffer) < HEADER.size:
+        raise SnapshotError(f"{path} is too short to be a snapshot")
+    magic, version, manifest_length, manifest_crc = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is not a store snapshot")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"{path} is a version {version} snapshot; this version reads {FORMAT_VERSION}")
+    manifest = bytes(buffer[HEADER.size:HEADER.size + manifest_length])
+    if len(manifest) != manifest_length or zlib.crc32(manifest) != manifest_crc:
+        raise SnapshotError(f"{path} has a corrupt manifest")
+    return buffer, json.loads(manifest)
+
+
+def read_manifest(path):
+    """
+    The manifest of a snapshot, without checking its arrays.
+
+    Raises:
+        SnapshotError: If the file is not a valid snapshot.
+    """
+    return _map(path)[1]
+
+
+def read_snapshot(path, verify=True):
+    """
+    Map a snapshot file as a read-only BuildingStore.
+
+    Args:
+        path (str): The snapshot file.
+        verify (bool): Check every array's CRC-32. This reads the whole file
+            once, which also brings it into the page cache.
+
+    Raises:
+        SnapshotError: If the file is not a valid snapshot.
+    """
+    buffer, manifest = _map(path)
+    data = memoryview(buffer)
+
+    def array(name):
+        entry = manifest['arrays'][name]
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        end = entry['offset'] + count * dtype.itemsize
+        if end > len(buffer):
+            raise SnapshotError(f"{path} is truncated")
+        if verify and zlib.crc32(data[entry['offset']:end]) != entry['crc32']:
+            raise SnapshotError(f"{path} has a corrupt array: {name}")
+        return np.frombuffer(buffer, dtype=dtype, count=count, offset=entry['offset']).reshape(entry['shape'])
+
+    def footprints(prefix, grid):
+        bounds = [array(f'{prefix}/{field}') for field in Footprints.BOUND_FIELDS]
+        grid_arrays = {'items': array(f'{prefix}/grid/items'), 'cell_start': array(f'{prefix}/grid/cell_start')}
+        return (Footprints(array(f'{prefix}/coords'), array(f'{prefix}/offsets'), bounds),
+                GridIndex.restore(*bounds, grid_arrays, grid))
+
+    ids = array('ids') if 'ids' in manifest['arrays'] else np.asarray(manifest['ids'], dtype=object)
+    numeric = {column: array(f'numeric/{column}') for column in NUMERIC_COLUMNS}
+    estimated = {column: array(f'estimated/{column}') for column in NUMERIC_COLUMNS}
+    tagged = {name.split('/', 1)[1]: array(name) for name in manifest['arrays'] if name.startswith('tagged/')}
+    categorical = {column: CategoricalColumn(array(f'codes/{column}'), manifest['categories'][column])
+                   for column in CATEGORICAL_COLUMNS}
+    store_footprints, spatial_index = footprints('footprints', manifest['grid'])
+
+    sort_indexes = {attribute: SortIndex.restore(array(f'sort/{attribute}/order'), array(f'sort/{attribute}/rank'),
+                                                 valid)
+                    for attribute, valid in manifest['sort'].items()}
+    text_indexes = {column: TrigramIndex.restore(categorical[column].lowered, grams,
+                                                 {name: array(f'text/{column}/{name}')
+                                                  for name in ('postings', 'offsets', 'sizes')})
+                    for column, grams in manifest['text'].items()}
+    lod_levels = {}
+    for level, grid in manifest['lods'].items():
+        prefix = f'lod/{level}'
+        level_footprints, level_index = footprints(prefix, grid)
+        lod_levels[int(level)] = LODLevel(LOD_LEVELS[int(level)], level_footprints, array(f'{prefix}/rows'),
+                                          array(f'{prefix}/ids'), array(f'{prefix}/heights'), level_index)
+
+    return BuildingStore(ids, numeric, categorical, store_footprints, tagged, estimated, text_indexes=text_indexes,
+                         spatial_index=spatial_index, sort_indexes=sort_indexes, lod_levels=lod_levels)
+
+
+def is_current(snapshot_path, source_path):
+    """Whether a snapshot exists and was built from the current version of `source_path`."""
+    try:
+        return read_manifest(snapshot_path)['source'] == source_fingerprint(source_path)
+    except (OSError, SnapshotError):
+        return False
+
+
+def build_snapshot(source_path, snapshot_path):
+    """
+    Load a city file, build every index and write the snapshot.
+
+    Args:
+        source_path (str): City file (see BuildingStore.load), or None for
+            an empty store.
+        snapshot_path (str): Snapshot file to write.
+
+    Returns:
+        building_store.BuildingStore: The loaded store.
+    """
+    # Fingerprint first, so a source changing while it is read makes the snapshot stale
+    source = source_fingerprint(source_path)
+    store = BuildingStore.load(source_path) if source_path else BuildingStore.empty()
+    build_indexes(store)
+    write_snapshot(store, snapshot_path, source)
+    return store
+
+
+def refresh_snapshot(source_path, snapshot_path):
+    """
+    Rebuild a snapshot unless it is current and valid.
+
+    Returns:
+        bool: True if the snapshot was rebuilt.
+    """
+    if is_current(snapshot_path, source_path):
+        try:
+            read_snapshot(snapshot_path)
+            return False
+        except SnapshotError:
+            pass
+    build_snapshot(source_path, snapshot_path)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='load a city file and write its snapshot')
+    build.add_argument('source', help='Overpass JSON, GeoJSON, line-delimited GeoJSON or OSM XML file')
+    build.add_argument('snapshot', help='snapshot file to write')
+    build.add_argument('--force', action='store_true', help='rebuild even if the snapshot is current')
+    check = commands.add_parser('check', help='validate a snapshot and report whether it is stale')
+    check.add_argument('snapshot')
+    check.add_argument('--source', help='city file the snapshot should be current with')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if not args.force and is_current(args.snapshot, args.source):
+            print(f"{args.snapshot} is current with {args.source}")
+            return 0
+        start = time.perf_counter()
+        store = build_snapshot(args.source, args.snapshot)
+        print(f"Wrote {len(store)} buildings to {args.snapshot} "
+              f"({os.path.getsize(args.snapshot) / 1e6:.1f} MB) in {time.perf_counter() - start:.2f}s")
+        return 0
+
+    start = time.perf_counter()
+    try:
+        store = read_snapshot(args.snapshot)
+    except (OSError, SnapshotError) as e:
+        print(f"Invalid snapshot: {e}")
+        return 1
+    print(f"{args.snapshot}: {len(store)} buildings, checksums valid "
+          f"(opened and verified in {(time.perf_counter() - start) * 1000:.1f} ms)")
+    if args.source and not is_current(args.snapshot, args.source):
+        print(f"Stale: {args.source} has changed since the snapshot was built")
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Helpers for streaming Gemini responses to the client as Server-Sent Events.
+"""
+import json
+
+SOURCES_MARKER = "Sources:"
+
+_decoder = json.JSONDecoder()
+
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class SourcesSplitter:
+    """
+    Splits a streamed query answer into response text and a "Sources:" section.
+
+    Text before the marker is released as soon as it cannot be the start of
+    the marker; text after it is collected and released one source line at a
+    time, matching the split that parse_query_response does on the full text.
+    """
+    def __init__(self):
+        self._pending = ''
+        self._in_sources = False
+        self.response_text = ''
+        self.sources = []
+
+    def feed(self, text):
+        """
+        Consume a chunk of the response.
+
+        Returns:
+            tuple: (answer text safe to forward, list of newly completed sources)
+        """
+        self._pending += text
+        if not self._in_sources:
+            index = self._pending.find(SOURCES_MARKER)
+            if index < 0:
+                # Hold back a tail that could be the start of a split marker
+                safe = len(self._pending) - (len(SOURCES_MARKER) - 1)
+                released = self._pending[:max(safe, 0)]
+                self._pending = self._pending[len(released):]
+                self.response_text += released
+                return released, []
+            released = self._pending[:index]
+            self.response_text += released
+            self._pending = self._pending[index + len(SOURCES_MARKER):]
+            self._in_sources = True
+            return released, self._complete_sources()
+        return '', self._complete_sources()
+
+    def _complete_sources(self):
+        *lines, self._pending = self._pending.split('\n')
+        sources = [line.strip() for line in lines if line.strip()]
+        self.sources.extend(sources)
+        return sources
+
+    def finish(self):
+        """
+        Flush whatever is still buffered at the end of the stream.
+
+        Returns:
+            tuple: (remaining answer text, remaining sources)
+        """
+        remainder, self._pending = self._pending, ''
+        if not self._in_sources:
+            self.response_text += remainder
+            return remainder, []
+        source = remainder.strip()
+        if source:
+            self.sources.append(source)
+            return '', [source]
+        return '', []
+
+
+class JSONFieldStream:
+    """
+    Incrementally extracts the top-level fields of a streamed JSON object.
+
+    A field is released once its value is complete and followed by ',' or '}',
+    so a number or string is never emitted half-written. Markdown code fences
+    around the object are ignored.
+    """
+    def __init__(self):
+        self.text = ''
+        self._pos = None
+        self._done = False
+        self.fields = {}
+
+    def feed(self, text):
+        """
+        Consume a chunk of the response.
+
+        Returns:
+            list: (key, value) pairs that became complete with this chunk.
+        """
+        self.text += text
+        if self._pos is None:
+            start = self.text.find('{')
+            if start < 0:
+                return []
+            self._pos = start + 1
+
+        completed = []
+        while not self._done:
+            pos = self._skip_whitespace(self._pos)
+            if pos >= len(self.text):
+                break
+            if self.text[pos] == '}':
+                self._done = True
+                break
+            if self.text[pos] == ',':
+                pos = self._skip_whitespace(pos + 1)
+            if pos >= len(self.text) or self.text[pos] != '"':
+                break
+            try:
+                key, pos = json.decoder.scanstring(self.text, pos + 1)
+            except ValueError:
+                break
+            pos = self._skip_whitespace(pos)
+            if pos >= len(self.text) or self.text[pos] != ':':
+                break
+            try:
+                value, end = _decoder.raw_decode(self.text, self._skip_whitespace(pos + 1))
+            except ValueError:
+                break
+            end = self._skip_whitespace(end)
+            if end >= len(self.text) or self.text[end] not in ',}':
+                # The value may still grow (e.g. a number), wait for the delimiter
+                break
+            self.fields[key] = value
+            completed.append((key, value))
+            self._pos = end
+        return completed
+
+    def _skip_whitespace(self, pos):
+        while pos < len(self.text) and self.text[pos] in ' \t\r\n':
+            pos += 1
+        return pos
@@ -0,0 +1,154 @@
+"""
+Low-overhead structured logging for the 3D City Viewer backend.
+
+Log records are handed to a QueueHandler and written by a background
+QueueListener, so request threads never block on file or console I/O. Files
+are size-rotated. Gemini exchanges are logged by prompt hash and size; full
+prompt and response text is only written for a configurable sample, and the
+most recent exchanges are kept in an in-memory ring buffer for the debug
+endpoint.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+_listener = None
+_listener_pid = None
+_queue_handler = None
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line, including any `fields` extra."""
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(log_path=None, level=None, max_bytes=None, backup_count=None):
+    """
+    Route all logging through a queue to a rotating JSON log file and stderr.
+
+    Safe to call more than once; only the first call installs handlers. In
+    a process forked from a configured one (e.g. a gunicorn worker of a
+    preloaded app) the inherited listener thread is gone, so the call starts
+    a new queue and listener for the inherited handlers.
+
+    Args:
+        log_path (str): Log file, default LOG_FILE or gemini_debug.log.
+        level (str): Log level name, default LOG_LEVEL or INFO.
+        max_bytes (int): Rotate the file at this size, default LOG_MAX_BYTES or 10 MB.
+        backup_count (int): Rotated files to keep, default LOG_BACKUP_COUNT or 5.
+    """
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+
+    root = logging.getLogger()
+    if _listener is not None:
+        # Forked: records put on the inherited queue would never be written
+        root.removeHandler(_queue_handler)
+        _start_listener(root, _listener.handlers)
+        return
+
+    log_path = log_path or os.getenv("LOG_FILE", "gemini_debug.log")
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    max_bytes = max_bytes or int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    backup_count = backup_count or int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
+    file_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count)
+    file_handler.setFormatter(JSONFormatter())
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    root.setLevel(level)
+    _start_listener(root, (file_handler, stream_handler))
+
+
+def _start_listener(root, handlers):
+    """Attach a fresh queue to the root logger and drain it into handlers on a listener thread."""
+    global _listener, _listener_pid, _queue_handler
+    log_queue = queue.SimpleQueue()
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    root.addHandler(_queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener_pid = os.getpid()
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def prompt_hash(text):
+    """Short, stable identifier for a prompt or response."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+class ExchangeLog:
+    """
+    Records Gemini prompt/response exchanges.
+
+    Every exchange is logged with its prompt hash, sizes and latency. A random
+    `sample_rate` fraction also logs the full text. The last `ring_size`
+    exchanges, including full text, are kept in memory.
+    """
+    def __init__(self, logger, sample_rate=0.0, ring_size=200):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self._recent = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+
+    def record(self, label, prompt, response=None, duration_ms=None, model=None, error=None):
+        """
+        Log one exchange.
+
+        Args:
+            label (str): Route or prompt family, e.g. 'SUMMARY'.
+            prompt (str): The prompt sent to Gemini.
+            response (str): The response text, if any.
+            duration_ms (float): Upstream latency.
+            model (str): Model name.
+            error (str): Error message if the call failed.
+        """
+        fields = {
+            'event': 'llm_exchange',
+            'label': label,
+            'model': model,
+            'prompt_hash': prompt_hash(prompt),
+            'prompt_chars': len(prompt),
+            'response_chars': len(response) if response is not None else None,
+            'duration_ms': round(duration_ms, 1) if duration_ms is not None else None,
+        }
+        if error is not None:
+            fields['error'] = error
+
+        with self._lock:
+            self._recent.append(dict(fields, ts=time.time(), prompt=prompt, response=response))
+
+        if self.sample_rate and random.random() < self.sample_rate:
+            fields = dict(fields, prompt=prompt, response=response)
+        if error is not None:
+            self.logger.warning("Gemini %s call failed", label, extra={'fields': fields})
+        else:
+            self.logger.info("Gemini %s exchange", label, extra={'fields': fields})
+
+    def recent(self, limit=50):
+        """Return up to `limit` most recent exchanges, newest first."""
+        with self._lock:
+            entries = list(self._recent)
+        return entries[::-1][:limit]
@@ -0,0 +1,66 @@
+"""
+Shared fixtures for tests that import the app.
+
+The app reads its settings when it is imported, so they are set here first:
+the offline stub backend, a memory-only response cache, no admission limits
+and log and tile files in a temporary directory.
+"""
+import os
+import tempfile
+
+import pytest
+
+_scratch = tempfile.mkdtemp(prefix='gemini-app-tests-')
+os.environ.update({
+    'LLM_BACKEND': 'stub',
+    'LLM_CACHE_PATH': '',
+    'LLM_STUB_LATENCY_MS': '0',
+    'LOG_FILE': os.path.join(_scratch, 'gemini_debug.log'),
+    'OSM_TILE_CACHE_DIR': os.path.join(_scratch, 'osm_tiles'),
+    'ADMISSION_RATE_PER_SECOND': '0',
+    'ADMISSION_CLIENT_RATE_PER_SECOND': '0',
+})
+
+import llm_backends  # noqa: E402
+from llm_backends import StubBackend  # noqa: E402
+
+
+class RecordingStub(StubBackend):
+    """A StubBackend that records the label of every call it answers, and answers given labels verbatim."""
+    def __init__(self, responses=None, **kwargs):
+        super().__init__(responses=responses, **kwargs)
+        self.verbatim = dict(responses or {})
+        self.calls = []
+
+    def respond(self, prompt, label=None):
+        self.calls.append(label)
+        if label in self.verbatim:
+            return self.verbatim[label]
+        return super().respond(prompt, label)
+
+
+@pytest.fixture
+def app_module():
+    """The Flask app module, with an empty response cache."""
+    import app
+    app.response_cache.invalidate()
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def stub():
+    """Installs a RecordingStub for one test; call it with canned responses by prompt label and StubBackend options."""
+    previous = llm_backends.get_backend()
+
+    def install(responses=None, **options):
+        backend = RecordingStub(responses=responses, **options)
+        llm_backends.set_backend(backend)
+        return backend
+
+    yield install
+    llm_backends.set_backend(previous)
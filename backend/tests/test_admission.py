@@ -0,0 +1,169 @@
+"""AdmissionController token buckets, queueing and shedding, and the routes' answers when a request is shed."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded, client_id, request_priority
+from prompts import summary_fallback
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.002)
+
+
+class Waiter(threading.Thread):
+    """Acquires in the background and records whether it was admitted or why it was shed."""
+    def __init__(self, admission, client, priority, admitted=None):
+        super().__init__(daemon=True)
+        self.admission, self.client, self.priority = admission, client, priority
+        self.admitted = admitted if admitted is not None else []
+        self.shed = None
+
+    def run(self):
+        try:
+            self.admission.acquire(self.client, self.priority)
+            self.admitted.append(self.client)
+        except Overloaded as e:
+            self.shed = e.reason
+
+
+def queue_waiter(admission, client, priority, admitted=None):
+    queued = admission.stats()['counters'].get('queued', 0)
+    waiter = Waiter(admission, client, priority, admitted)
+    waiter.start()
+    wait_for(lambda: admission.stats()['counters'].get('queued', 0) == queued + 1)
+    return waiter
+
+
+def test_no_queue_sheds_when_slots_are_busy():
+    admission = AdmissionController(rate=0, client_rate=0, max_concurrency=1, max_queue=0)
+    admission.acquire('a')
+    with pytest.raises(Overloaded) as shed:
+        admission.acquire('b')
+    assert shed.value.reason == 'queue_full'
+    admission.release()
+    admission.acquire('b')
+    assert admission.stats()['counters'] == {'admitted': 2, 'shed_queue_full': 1}
+
+
+def test_new_client_can_spend_its_whole_bucket():
+    admission = AdmissionController(rate=0, client_rate=0.001, client_burst=2)
+    admission.acquire('a', cost=2)
+    with pytest.raises(Overloaded) as shed:
+        admission.acquire('a')
+    assert shed.value.reason == 'client_rate'
+
+
+def test_lower_priorities_leave_part_of_each_bucket():
+    admission = AdmissionController(rate=0, client_rate=0.001, client_burst=4, max_concurrency=10)
+    admission.acquire('a', 'prefetch', cost=2)
+    # Prefetching must leave half the bucket, summaries a quarter; clicks may spend it all
+    with pytest.raises(Overloaded, match='client_rate'):
+        admission.acquire('a', 'prefetch')
+    admission.acquire('a', 'summary')
+    with pytest.raises(Overloaded, match='client_rate'):
+        admission.acquire('a', 'summary')
+    admission.acquire('a', 'interactive')
+    # Other clients have buckets of their own
+    admission.acquire('b', 'prefetch', cost=2)
+
+    shared = AdmissionController(rate=0.001, burst=2, client_rate=0, max_concurrency=10)
+    shared.acquire('a')
+    shared.acquire('b')
+    with pytest.raises(Overloaded, match='global_rate'):
+        shared.acquire('c')
+
+
+def test_requests_shed_from_the_queue_get_their_tokens_back():
+    admission = AdmissionController(rate=0, client_rate=0.001, client_burst=2, max_concurrency=1, max_queue=0)
+    admission.acquire('a')
+    with pytest.raises(Overloaded, match='queue_full'):
+        admission.acquire('a')
+    admission.release()
+    # The shed request was refunded, so one token is left
+    admission.acquire('a')
+    admission.release()
+    with pytest.raises(Overloaded, match='client_rate'):
+        admission.acquire('a')
+
+    timed = AdmissionController(rate=0, client_rate=0.001, client_burst=2, max_concurrency=1, queue_timeout=0.01)
+    timed.acquire('a')
+    with pytest.raises(Overloaded, match='queue_timeout'):
+        timed.acquire('a')
+    assert timed.stats()['queued']['interactive'] == 0
+    timed.release()
+    timed.acquire('a')
+
+
+def test_full_queue_evicts_its_lowest_priority_waiter():
+    admission = AdmissionController(rate=0, client_rate=0, max_concurrency=1, max_queue=2)
+    admission.acquire('holder')
+    admitted = []
+    summary = queue_waiter(admission, 'summary', 'summary', admitted)
+    prefetch = queue_waiter(admission, 'prefetch', 'prefetch', admitted)
+    # An interactive request makes room by dropping the prefetch
+    interactive = queue_waiter(admission, 'interactive', 'interactive', admitted)
+    prefetch.join(5)
+    assert prefetch.shed == 'evicted'
+    # Nothing in the queue ranks below another prefetch, so it is turned away
+    with pytest.raises(Overloaded, match='queue_full'):
+        admission.acquire('late', 'prefetch')
+
+    # Slots are handed over by priority, not arrival
+    admission.release()
+    interactive.join(5)
+    admission.release()
+    summary.join(5)
+    assert admitted == ['interactive', 'summary']
+    assert admission.stats()['counters'] == {'admitted': 3, 'queued': 3, 'shed_evicted': 1, 'shed_queue_full': 1}
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    admission = AdmissionController(rate=0, client_rate=0.001, client_burst=2, max_concurrency=1)
+
+    async def scenario():
+        await admission.acquire_async('a')
+        waiting = asyncio.ensure_future(admission.acquire_async('a'))
+        await asyncio.sleep(0.01)
+        assert admission.stats()['queued']['interactive'] == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert admission.stats()['queued']['interactive'] == 0
+        admission.release()
+        # The cancelled request's token was refunded
+        await admission.acquire_async('a')
+
+    asyncio.run(scenario())
+    assert admission.stats()['active'] == 1
+
+
+def test_client_and_priority_from_headers():
+    headers = {'X-Forwarded-For': 'spoofed, 203.0.113.7, 10.0.0.2'}
+    assert client_id(headers, '10.0.0.1') == '10.0.0.1'
+    assert client_id(headers, '10.0.0.1', trusted_proxies=2) == '203.0.113.7'
+    assert client_id({'X-Forwarded-For': 'only-one'}, '10.0.0.1', trusted_proxies=2) == '10.0.0.1'
+    assert request_priority({'X-Request-Priority': 'prefetch'}, 'interactive') == 'prefetch'
+    assert request_priority({'X-Request-Priority': 'interactive'}, 'summary') == 'summary'
+    assert request_priority({'X-Request-Priority': 'urgent'}, 'summary') == 'summary'
+
+
+def test_shed_routes_answer_with_fallbacks(app_module, client, stub, monkeypatch):
+    backend = stub()
+    monkeypatch.setattr(app_module, 'admission', AdmissionController(rate=0, client_rate=0, max_concurrency=1,
+                                                                     max_queue=0))
+    app_module.admission.acquire('someone else')
+    building = {'id': 'way/3', 'type': 'office', 'levels': '5'}
+    response = client.post('/api/summary', json={'building_data': building})
+    assert response.status_code == 200 and response.headers['X-Load-Shed'] == 'queue_full'
+    assert response.get_json() == summary_fallback(building)
+
+    response = client.post('/api/query', json={'query': 'What shaped downtown?'})
+    assert response.status_code == 503 and response.headers['Retry-After'] == '1'
+    assert response.headers['X-Load-Shed'] == 'queue_full'
+    assert backend.calls == []
@@ -0,0 +1,68 @@
+"""Bitmap-indexed filtering against the per-filter column scans it replaces."""
+from functools import reduce
+
+import numpy as np
+import pytest
+
+from bench.synthetic import synthetic_records
+from bitmap_index import Bitmap
+from building_store import BuildingStore
+
+RESIDENTIAL = {'attribute': 'building', 'operator': '=', 'value': 'residential'}
+OFFICE = {'attribute': 'building', 'operator': '==', 'value': 'Office'}
+TALL = {'attribute': 'height', 'operator': '>', 'value': 50}
+LOW = {'attribute': 'height', 'operator': '<=', 'value': 30}
+CAFE = {'attribute': 'amenity', 'operator': '=', 'value': 'cafe'}
+THREE_LEVELS = {'attribute': 'levels', 'operator': '>=', 'value': '3'}
+OLD_HOUSE = [{'attribute': 'year_built', 'operator': '<', 'value': 1950},
+             {'attribute': 'building', 'operator': '=', 'value': 'house'}]
+
+FILTER_LISTS = [
+    [],
+    [RESIDENTIAL],
+    [OFFICE],
+    [TALL],
+    [TALL, OFFICE],
+    [CAFE, THREE_LEVELS],
+    [{'attribute': 'name', 'operator': 'contains', 'value': 'tower'}],
+    [{'attribute': 'name', 'operator': 'contains', 'value': 'ha'}, LOW],
+    OLD_HOUSE,
+    [{'attribute': 'building', 'operator': '=', 'value': 'no such type'}],
+]
+
+
+@pytest.fixture(scope='module')
+def store():
+    # More rows than one 65536-row bitmap chunk
+    return BuildingStore.from_records(synthetic_records(70000))
+
+
+def scan(store, filters):
+    return reduce(np.logical_and, (store.filter_mask(f) for f in filters), np.ones(len(store), dtype=bool))
+
+
+@pytest.mark.parametrize('filters', FILTER_LISTS)
+def test_apply_filters_matches_scan(store, filters):
+    assert np.array_equal(store.apply_filters(filters), scan(store, filters))
+
+
+def test_cached_results_match_scan(store):
+    # Refining a cached list, and repeating it, must give the same rows as a fresh scan
+    for _ in range(2):
+        for filters in FILTER_LISTS:
+            assert np.array_equal(store.apply_filters(filters), scan(store, filters))
+            assert np.array_equal(store.apply_filters(list(reversed(filters))), scan(store, filters))
+
+
+@pytest.mark.parametrize('density', [0.0, 0.001, 0.05, 0.5, 1.0])
+def test_bitmap_round_trip_and_intersection(density):
+    rng = np.random.default_rng(7)
+    size = 200000
+    a = rng.random(size) < density
+    b = rng.random(size) < 0.3
+    bitmap = Bitmap.from_mask(a)
+    assert len(bitmap) == np.count_nonzero(a)
+    assert np.array_equal(bitmap.to_mask(size), a)
+    assert np.array_equal(bitmap.to_rows(), np.flatnonzero(a))
+    assert np.array_equal((bitmap & Bitmap.from_rows(np.flatnonzero(b))).to_mask(size), a & b)
+    assert np.array_equal(Bitmap.union([bitmap, Bitmap.from_mask(b)]).to_mask(size), a | b)
@@ -0,0 +1,68 @@
+"""/api/building/details: context and summary in one request, from the cache, generated together, or shed."""
+import json
+
+from admission import AdmissionController
+from llm_backends import STUB_RESPONSES
+from prompts import context_fallback, summary_fallback
+
+SUMMARY = json.loads(STUB_RESPONSES['SUMMARY'])
+CONTEXT = json.loads(STUB_RESPONSES['BUILDING CONTEXT'])
+UNDATED = {'id': 'way/9', 'name': 'Grain Exchange', 'type': 'commercial', 'levels': '6', 'year_built': 'unknown'}
+
+
+def details(client, building_data, **body):
+    response = client.post('/api/building/details', json=dict(body, building_data=building_data))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_dated_building_needs_no_context(client, stub):
+    backend = stub()
+    body = details(client, dict(UNDATED, year_built='1910'))
+    assert body == {'summary': SUMMARY, 'context': None, 'contextSource': None, 'speculative': False}
+    assert backend.calls == ['SUMMARY']
+
+
+def test_context_and_summary_are_generated_together_then_cached(client, stub):
+    backend = stub()
+    body = details(client, UNDATED)
+    assert body == {'summary': SUMMARY, 'context': CONTEXT, 'contextSource': 'generated', 'speculative': True}
+    assert sorted(backend.calls) == ['BUILDING CONTEXT', 'SUMMARY']
+
+    # The context is cached now, and the summary generated alongside it is reused
+    body = details(client, UNDATED)
+    assert body == {'summary': SUMMARY, 'context': CONTEXT, 'contextSource': 'cache', 'speculative': True}
+    assert len(backend.calls) == 2
+
+
+def test_cached_context_gets_a_summary_that_uses_it(client, stub):
+    backend = stub()
+    assert client.post('/api/building-context', json={'name': 'Grain Exchange', 'type': 'commercial',
+                                                       'query_type': 'comprehensive'}).get_json() == CONTEXT
+    for _ in range(2):
+        body = details(client, UNDATED)
+        assert body == {'summary': SUMMARY, 'context': CONTEXT, 'contextSource': 'cache', 'speculative': False}
+    assert backend.calls == ['BUILDING CONTEXT', 'SUMMARY']
+
+    # The context arguments pick the cache entry, as the frontend sends them
+    details(client, dict(UNDATED, name='Other'), context={'name': 'Grain Exchange', 'type': 'commercial'})
+    assert backend.calls == ['BUILDING CONTEXT', 'SUMMARY', 'SUMMARY']
+
+
+def test_unusable_answers_fall_back(client, stub):
+    stub({'BUILDING CONTEXT': 'I do not know this building.', 'SUMMARY': 'No summary available for this building.'})
+    body = details(client, UNDATED)
+    assert body['summary'] == summary_fallback(UNDATED)
+    assert body['context'] == context_fallback() and body['contextSource'] == 'generated'
+
+
+def test_shed_request_gets_both_fallbacks(app_module, client, stub, monkeypatch):
+    backend = stub()
+    # One token per client, spent on a dated building: the next request finds the bucket empty
+    monkeypatch.setattr(app_module, 'admission', AdmissionController(rate=0, client_rate=0.001, client_burst=1))
+    details(client, dict(UNDATED, year_built='1910'))
+    response = client.post('/api/building/details', json={'building_data': UNDATED})
+    assert response.status_code == 200 and response.headers['X-Load-Shed'] == 'client_rate'
+    assert response.get_json() == {'summary': summary_fallback(UNDATED), 'context': context_fallback(),
+                                   'contextSource': 'fallback', 'speculative': False}
+    assert backend.calls == ['SUMMARY']
@@ -0,0 +1,56 @@
+"""BuildingStore.filter_mask against a scan with the per-building Building.matches_filter it replaced."""
+import numpy as np
+import pytest
+
+from bench.synthetic import synthetic_records
+from building_store import BuildingStore
+from models import Building
+
+FILTERS = [
+    ('building', '=', 'residential'),
+    ('building', '==', 'Office'),
+    ('building', 'contains', 'res'),
+    ('height', '>', 50),
+    ('height', '<=', 30),
+    ('height', '>', 'tall'),
+    ('building:levels', '>=', '3'),
+    ('building:levels', '=', 10),
+    ('start_date', '<', 1950),
+    ('start_date', '=', '1990'),
+    ('amenity', '=', 'cafe'),
+    ('name', 'contains', 'tower'),
+    ('name', 'contains', 'ha'),
+    ('material', '=', 'brick'),
+    ('material', '=', None),
+    ('colour', '=', 'red'),
+    ('height', 'between', 10),
+]
+
+
+@pytest.fixture(scope='module')
+def records():
+    return synthetic_records(3000)
+
+
+@pytest.fixture(scope='module')
+def store(records):
+    return BuildingStore.from_records(records)
+
+
+@pytest.mark.parametrize('attribute, operator, value', FILTERS)
+def test_filter_mask_matches_scan(store, records, attribute, operator, value):
+    criteria = {'attribute': attribute, 'operator': operator, 'value': value}
+    expected = np.array([Building(record).matches_filter(criteria) for record in records])
+    assert np.array_equal(store.filter_mask(criteria), expected)
+
+
+@pytest.mark.parametrize('alias, attribute, operator, value', [
+    ('levels', 'building:levels', '>', 5),
+    ('type', 'building', '=', 'house'),
+    ('year_built', 'start_date', '>=', 2000),
+    ('street', 'addr:street', 'contains', 'avenue'),
+])
+def test_aliases_match_their_column(store, alias, attribute, operator, value):
+    mask = store.filter_mask({'attribute': alias, 'operator': operator, 'value': value})
+    assert mask.any()
+    assert np.array_equal(mask, store.filter_mask({'attribute': attribute, 'operator': operator, 'value': value}))
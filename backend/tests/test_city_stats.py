@@ -0,0 +1,148 @@
+"""/api/stats aggregates checked building by building, its result cache, and the requests it rejects."""
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from bench.synthetic import synthetic_features
+from city_stats import MAX_GRID_CELLS, StatsService, heatmap, summarize
+
+BBOX = [-114.0795, 51.0405, -114.0765, 51.0430]
+RESIDENTIAL = [{'attribute': 'building', 'operator': '=', 'value': 'residential'}]
+
+
+@pytest.fixture
+def city(app_module, client):
+    features = synthetic_features(400)
+    response = client.post('/api/buildings/load', json={'type': 'FeatureCollection', 'features': features})
+    assert response.get_json()['count'] == len(features)
+    return app_module.get_building_store(app_module.CITY_DATA_PATH, app_module.STORE_SNAPSHOT_PATH)
+
+
+def selected_rows(store, building_type=None, bbox=None):
+    """Rows picked one building at a time: by type, and by footprint bounds touching the box."""
+    rows = []
+    fp = store.footprints
+    for row in range(len(store)):
+        if building_type is not None and store.categorical['building'].value_at(row) != building_type:
+            continue
+        if bbox is not None:
+            west, south, east, north = bbox
+            if math.isnan(fp.min_lon[row]) or not (fp.min_lon[row] <= east and fp.max_lon[row] >= west and
+                                                   fp.min_lat[row] <= north and fp.max_lat[row] >= south):
+                continue
+        rows.append(row)
+    return rows
+
+
+def stats(client, **body):
+    response = client.post('/api/stats', json=body)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_summaries_match_building_scan(client, city):
+    body = stats(client, filters=RESIDENTIAL, bbox=BBOX, metrics=['height', 'floors'], percentiles=[10, 50, 99.5])
+    rows = selected_rows(city, 'residential', BBOX)
+    assert rows and (body['count'], body['total']) == (len(rows), len(city))
+    assert set(body['metrics']) == {'height', 'building:levels'}
+    for name, summary in body['metrics'].items():
+        values = [v for v in city.numeric_column(name)[rows].tolist() if not math.isnan(v)]
+        assert summary['count'] == len(values)
+        assert math.isclose(summary['sum'], sum(values))
+        assert math.isclose(summary['mean'], sum(values) / len(values))
+        assert (summary['min'], summary['max']) == (min(values), max(values))
+        assert list(summary['percentiles']) == ['p10', 'p50', 'p99.5']
+        assert np.allclose(list(summary['percentiles'].values()), np.percentile(values, [10, 50, 99.5]))
+
+
+def test_nothing_selected_has_empty_summaries(client, city):
+    body = stats(client, filters=[{'attribute': 'building', 'operator': '=', 'value': 'castle'}])
+    assert body['count'] == 0
+    assert body['metrics']['height'] == summarize(np.array([]))
+
+
+def test_group_by_and_histogram_match_building_scan(client, city):
+    body = stats(client, bbox=BBOX, metrics=['height'], groupBy='type', groupLimit=3,
+                 histogram={'attribute': 'height', 'bins': 8, 'range': [0, 160]})
+    rows = selected_rows(city, bbox=BBOX)
+    types = Counter(city.categorical['building'].value_at(row) for row in rows)
+    groups = body['groupBy']['groups']
+    assert body['groupBy']['column'] == 'building' and body['groupBy']['distinct'] == len(types)
+    assert [(group['value'], group['count']) for group in groups] == \
+        sorted(types.items(), key=lambda item: (-item[1], city.categorical['building'].categories.index(item[0])))[:3]
+    for group in groups:
+        heights = [city.numeric_column('height')[row] for row in rows
+                   if city.categorical['building'].value_at(row) == group['value']]
+        assert math.isclose(group['sums']['height'], np.nansum(heights))
+
+    heights = city.numeric_column('height')[rows]
+    counts, edges = np.histogram(heights[~np.isnan(heights)], bins=8, range=(0, 160))
+    assert body['histogram'] == {'attribute': 'height', 'edges': edges.tolist(), 'counts': counts.tolist()}
+
+
+def test_grid_buckets_every_centroid_once(client, city):
+    body = stats(client, bbox=BBOX, grid={'cols': 6, 'rows': 4, 'metric': 'height'})
+    grid = body['grid']
+    assert (grid['cols'], grid['rows'], grid['metric']) == (6, 4, 'height')
+    expected = np.zeros((4, 6), dtype=int)
+    sums = np.zeros((4, 6))
+    west, south, east, north = BBOX
+    for row in selected_rows(city, bbox=BBOX):
+        lon, lat = city.footprints.centroid_lon[row], city.footprints.centroid_lat[row]
+        if not (west <= lon <= east and south <= lat <= north):
+            continue
+        x = min(int((lon - west) / grid['cellWidth']), 5)
+        y = min(int((lat - south) / grid['cellHeight']), 3)
+        expected[y, x] += 1
+        sums[y, x] += np.nan_to_num(city.numeric_column('height')[row])
+    assert grid['counts'] == expected.tolist() and expected.sum() > 0
+    assert np.allclose(grid['sums'], sums)
+    assert np.all((np.array(grid['density']) > 0) == (sums > 0))
+
+    # Without a bbox the grid is fitted to the selected buildings
+    body = stats(client, filters=RESIDENTIAL, grid={'size': 5, 'metric': None})
+    assert sum(map(sum, body['grid']['counts'])) == body['count'] and 'sums' not in body['grid']
+
+
+def test_heatmap_density_is_per_square_meter():
+    # One 0.01 degree cell at the equator: about 1113 m square
+    grid = heatmap(np.array([0.005]), np.array([0.005]), np.array([1e6]), (0, 0, 0.01, 0.01), 1, 1)
+    assert math.isclose(grid['density'][0][0], 1e6 / 1113.2 ** 2, rel_tol=1e-3)
+
+
+def test_repeated_requests_are_cached_per_store(client, city):
+    body = {'filters': RESIDENTIAL, 'bbox': BBOX, 'groupBy': 'building'}
+    first = stats(client, **body)
+    assert not first['cached']
+    # Alias spelling and the bbox as a string do not change the request
+    second = stats(client, **dict(body, groupBy='type', bbox=','.join(map(str, BBOX))))
+    assert second['cached'] and dict(second, cached=False) == first
+
+    service = StatsService()
+    assert not service.get(city, body)[1] and service.get(city, body)[1]
+    client.post('/api/buildings/load', json={'type': 'FeatureCollection', 'features': synthetic_features(10)})
+    assert not stats(client, **body)['cached']
+
+
+@pytest.mark.parametrize('body', [
+    {'bbox': [-114.07, 51.04, -114.08, 51.05]},
+    {'bbox': 'west,south,east,north'},
+    {'bbox': [-114.08, 51.04, 'inf', 51.05]},
+    {'filters': 'building=residential'},
+    {'metrics': ['colour']},
+    {'metrics': 'height'},
+    {'percentiles': [101]},
+    {'percentiles': ['median']},
+    {'groupBy': 'height'},
+    {'groupBy': 'building', 'groupLimit': -1},
+    {'histogram': {'bins': 0}},
+    {'histogram': {'range': [10, 10]}},
+    {'histogram': 'colour'},
+    {'grid': {'cols': MAX_GRID_CELLS + 1, 'rows': 1}},
+    {'grid': {'cols': 'many'}},
+])
+def test_invalid_requests_are_rejected(client, city, body):
+    response = client.post('/api/stats', json=body)
+    assert response.status_code == 400 and 'error' in response.get_json()
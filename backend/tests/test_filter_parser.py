@@ -0,0 +1,81 @@
+"""Rule-based filter plans, and the Gemini fallback of /api/filter for queries the parser leaves alone."""
+import pytest
+
+from filter_parser import FilterPlanCache, canonicalize_query, parse_filter_query
+
+HEIGHT_OVER_50 = [{'attribute': 'height', 'operator': '>', 'value': 50}]
+
+
+@pytest.mark.parametrize('query, filters', [
+    ('taller than 30 meters', [{'attribute': 'height', 'operator': '>', 'value': 30}]),
+    ('Show me buildings over 100 ft', [{'attribute': 'height', 'operator': '>', 'value': 30.48}]),
+    ('commercial buildings with more than 5 floors', [{'attribute': 'building', 'operator': '=', 'value': 'commercial'},
+                                                     {'attribute': 'building:levels', 'operator': '>', 'value': 5}]),
+    ('between 20 and 10 floors', [{'attribute': 'building:levels', 'operator': '>=', 'value': 10},
+                                  {'attribute': 'building:levels', 'operator': '<=', 'value': 20}]),
+    ('5+ floors', [{'attribute': 'building:levels', 'operator': '>=', 'value': 5}]),
+    ('10 stories or more', [{'attribute': 'building:levels', 'operator': '>=', 'value': 10}]),
+    ('no more than 3 storeys', [{'attribute': 'building:levels', 'operator': '<=', 'value': 3}]),
+    ('restaurants built before 1950', [{'attribute': 'amenity', 'operator': '=', 'value': 'restaurant'},
+                                       {'attribute': 'start_date', 'operator': '<', 'value': 1950}]),
+])
+def test_filter_plans(query, filters):
+    plan = parse_filter_query(query)
+    assert plan['filters'] == filters
+    assert plan['explanation'].startswith('Showing ')
+    assert 'sortBy' not in plan
+
+
+@pytest.mark.parametrize('query, sort_by, sort_order, filters', [
+    ('tallest office buildings', 'height', 'desc', [{'attribute': 'building', 'operator': '=', 'value': 'office'},
+                                                    {'attribute': 'height', 'operator': '>', 'value': 0}]),
+    ('most valuable', 'assessedValue', 'desc', [{'attribute': 'assessedValue', 'operator': '>', 'value': 0}]),
+    ('shortest buildings taller than 20 m', 'height', 'asc', [{'attribute': 'height', 'operator': '>', 'value': 20}]),
+])
+def test_sorted_plans(query, sort_by, sort_order, filters):
+    plan = parse_filter_query(query)
+    assert (plan['sortBy'], plan['sortOrder'], plan['filters']) == (sort_by, sort_order, filters)
+
+
+@pytest.mark.parametrize('query', ['residential and commercial buildings', 'buildings near the river',
+                                   'show me all buildings', 'historic churches', ''])
+def test_queries_left_to_gemini(query):
+    assert parse_filter_query(query) is None
+
+
+def test_plans_are_cached_by_canonical_query():
+    cache = FilterPlanCache()
+    plan = cache.parse('Taller than 30 meters!')
+    plan['filters'].clear()
+    assert cache.parse('  taller THAN 30 meters ') == parse_filter_query('taller than 30 meters')
+    assert cache.parse('buildings near the river') is None
+    assert cache.parse('Buildings near the river.') is None
+    assert cache.stats() == {'hits': 2, 'misses': 2, 'entries': 2}
+    assert canonicalize_query("Over 100' tall!") == 'over 100 ft tall'
+
+
+def test_rule_based_queries_skip_gemini(client, stub):
+    backend = stub()
+    response = client.post('/api/filter', json={'query': 'taller than 30 meters'})
+    assert response.get_json()['filters'] == [{'attribute': 'height', 'operator': '>', 'value': 30}]
+    assert backend.calls == []
+
+
+def test_other_queries_ask_gemini_once(client, stub):
+    backend = stub()
+    for query in ('buildings near the river', 'Buildings near the river!'):
+        response = client.post('/api/filter', json={'query': query})
+        assert response.status_code == 200
+        assert response.get_json()['filters'] == HEIGHT_OVER_50
+    assert backend.calls == ['FILTER']
+
+
+def test_unparseable_gemini_plan_falls_back(client, stub):
+    backend = stub({'FILTER': 'Sorry, I cannot help with that.'})
+    response = client.post('/api/filter', json={'query': 'buildings with a view of the mountains'})
+    assert response.status_code == 200
+    assert response.get_json()['filters'] == []
+    assert response.get_json()['explanation'].startswith('Could not parse the query')
+    # A fallback is not cached: the next request asks again
+    client.post('/api/filter', json={'query': 'buildings with a view of the mountains'})
+    assert backend.calls == ['FILTER', 'FILTER']
@@ -0,0 +1,162 @@
+"""Background jobs: retries, progress shared through SQLite, jobs of exited processes, and pooled counters."""
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from bench.synthetic import synthetic_features
+from jobs import JobQueue, JobQueueFull, SharedCounter
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def finished(queue, job_id):
+    return lambda: queue.job(job_id)['status'] != 'running'
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_items_are_retried_with_backoff():
+    attempts = {}
+
+    def handler(item):
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == 'flaky' and attempts[item] < 3:
+            raise ConnectionError('upstream hiccup')
+        if item == 'broken':
+            raise ValueError('bad item')
+        return 'ok'
+
+    queue = JobQueue(handler, workers=2, rate=0, max_attempts=3, backoff=0.01)
+    job = queue.submit('test', ['fine', 'flaky', 'broken'])
+    wait_for(finished(queue, job.id))
+    progress = queue.job(job.id)
+    assert attempts == {'fine': 1, 'flaky': 3, 'broken': 3}
+    assert (progress['status'], progress['finished'], progress['failed'], progress['pending']) == ('done', 2, 1, 0)
+    assert progress['retries'] == 4 and progress['outcomes'] == {'ok': 2}
+    assert progress['errors'] == ['bad item'] and progress['completed'] is not None
+    assert queue.stats()['local'] == {'depth': 0, 'retrying': 0, 'running': 0}
+
+
+def test_waiting_items_are_not_queued_twice_and_depth_is_bounded():
+    release = threading.Event()
+    queue = JobQueue(lambda item: release.wait(5) and 'done', workers=1, rate=0, max_depth=3)
+    first = queue.submit('first', ['a', 'b'], key=str)
+    wait_for(lambda: queue.stats()['local'] == {'depth': 1, 'retrying': 0, 'running': 1})
+    second = queue.submit('second', ['b', 'c'], key=str)
+    assert second.outcomes == {'duplicate': 1}
+    with pytest.raises(JobQueueFull):
+        queue.submit('third', ['d', 'e'], key=str)
+    release.set()
+    wait_for(finished(queue, second.id))
+    wait_for(finished(queue, first.id))
+    assert queue.job(second.id)['outcomes'] == {'duplicate': 1, 'done': 1}
+    assert queue.job('no-such-job') is None
+
+
+def test_progress_is_shared_through_the_file(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    release = threading.Event()
+    running = JobQueue(lambda item: release.wait(5) and 'done', workers=1, rate=0, path=path)
+    # Another process serving the app sees the same file, not the job's thread
+    other = JobQueue(lambda item: None, path=path)
+    job = running.submit('shared', ['a', 'b', 'c'])
+    wait_for(lambda: running.stats()['local']['running'] == 1)
+    assert other.job(job.id)['status'] == 'running' and other.stats()['depth'] == 3
+    release.set()
+    wait_for(finished(other, job.id))
+    assert other.job(job.id)['finished'] == 3 and other.stats()['depth'] == 0
+
+
+def test_jobs_of_exited_processes_are_interrupted(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    release = threading.Event()
+    running = JobQueue(lambda item: release.wait(5) and 'done', workers=1, rate=0, path=path)
+    job = running.submit('orphaned', ['a', 'b'])
+    wait_for(lambda: running.stats()['local']['running'] == 1)
+    with sqlite3.connect(path) as conn:
+        conn.execute('UPDATE jobs SET pid = ? WHERE id = ?', (dead_pid(), job.id))
+
+    # Reported from the file, the job's process is gone
+    other = JobQueue(lambda item: None, path=path)
+    progress = other.job(job.id)
+    assert (progress['status'], progress['failed'], progress['pending']) == ('interrupted', 2, 0)
+    assert progress['errors'][-1].startswith('Interrupted') and other.stats()['depth'] == 0
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT done FROM jobs WHERE id = ?', (job.id,)).fetchone() == (1,)
+    release.set()
+
+
+def test_workers_survive_a_failing_progress_file(tmp_path, monkeypatch):
+    queue = JobQueue(lambda item: 'ok', workers=1, rate=0, path=str(tmp_path / 'cache.sqlite'))
+
+    def locked():
+        raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(queue._connections, 'get', locked)
+    first = queue.submit('first', ['a'])
+    second = queue.submit('second', ['b'])
+    # Progress is still kept in memory, and the worker goes on to the next job
+    wait_for(lambda: first.done and second.done)
+    assert first.outcomes == second.outcomes == {'ok': 1}
+
+
+def test_shared_counter_pools_buffered_counts(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    first = SharedCounter(path, table='requests', flush_seconds=3600)
+    second = SharedCounter(path, table='requests', flush_seconds=3600)
+    first.add('a', 2)
+    first.add('b')
+    second.add('b', 2)
+    # Reading flushes the reader's own increments; the other counter's stay buffered until it flushes
+    assert second.most_common(5) == [('b', 2)]
+    assert first.most_common(5) == [('b', 3), ('a', 2)]
+    assert second.most_common(1) == [('b', 3)]
+
+    # A due flush happens on add
+    eager = SharedCounter(path, table='requests', flush_seconds=0)
+    eager.add('c', 5)
+    assert second.most_common(1) == [('c', 5)]
+
+    local = SharedCounter()
+    local.add('x')
+    local.add('y', 3)
+    assert local.most_common(5) == [('y', 3), ('x', 1)]
+
+
+def test_prewarm_endpoint_caches_summaries(app_module, client, stub, monkeypatch):
+    backend = stub()
+    monkeypatch.setattr(app_module.prewarm_jobs.limiter, 'rate', 0)
+    features = synthetic_features(20)
+    client.post('/api/buildings/load', json={'type': 'FeatureCollection', 'features': features})
+
+    response = client.post('/api/prewarm', json={'tallest': 3})
+    assert response.status_code == 202
+    job_id = response.get_json()['id']
+    wait_for(lambda: client.get(f'/api/prewarm/{job_id}').get_json()['status'] == 'done')
+    progress = client.get(f'/api/prewarm/{job_id}').get_json()
+    assert progress['outcomes'] == {'warmed': 3} and 'SUMMARY' in backend.calls
+    calls = len(backend.calls)
+
+    response = client.post('/api/prewarm', json={'tallest': 3})
+    job_id = response.get_json()['id']
+    wait_for(lambda: client.get(f'/api/prewarm/{job_id}').get_json()['status'] == 'done')
+    assert client.get(f'/api/prewarm/{job_id}').get_json()['outcomes'] == {'cached': 3}
+    assert len(backend.calls) == calls
+    assert any(job['id'] == job_id for job in client.get('/api/prewarm').get_json()['jobs'])
+
+    assert client.get('/api/prewarm/no-such-job').status_code == 404
+    assert client.post('/api/prewarm', json={}).status_code == 400
+    assert client.post('/api/prewarm', json={'tallest': -1}).status_code == 400
@@ -0,0 +1,86 @@
+"""The offline stub backend, backend selection and the Gemini backend's deferred setup."""
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import llm_backends
+from llm_backends import GEMINI_MODELS, STUB_RESPONSES, GeminiBackend, StubBackend, create_backend, get_backend
+
+
+def test_stub_answers_by_label():
+    backend = StubBackend()
+    assert backend.generate('Summarize', 'SUMMARY') == STUB_RESPONSES['SUMMARY']
+    assert backend.generate('Filter', 'FILTER') == STUB_RESPONSES['FILTER']
+    assert backend.generate('Anything else', 'NO SUCH LABEL') == STUB_RESPONSES['QUERY']
+    assert StubBackend(responses={'FILTER': '{}'}).generate('Filter', 'FILTER') == '{}'
+
+
+def test_stub_packed_summary_has_one_entry_per_building():
+    prompt = 'Building 1:\n    Building ID: 11\n\n    Building 2:\n    Building ID: way/12\n'
+    answer = json.loads(StubBackend().generate(prompt, 'PACKED SUMMARY'))
+    assert answer == {'11': json.loads(STUB_RESPONSES['SUMMARY']), 'way/12': json.loads(STUB_RESPONSES['SUMMARY'])}
+
+
+def test_stub_stream_and_async_match_generate():
+    backend = StubBackend(chunk_size=10)
+    chunks = list(backend.stream('q', 'QUERY'))
+    assert len(chunks) > 1 and all(len(chunk) <= 10 for chunk in chunks)
+    assert ''.join(chunks) == backend.generate('q', 'QUERY')
+    assert asyncio.run(backend.generate_async('q', 'QUERY')) == backend.generate('q', 'QUERY')
+
+
+def test_stub_latency_is_deterministic():
+    backend = StubBackend(latency=0.01, jitter=0.02)
+    delays = [backend._delay(f'prompt {i}') for i in range(50)]
+    assert all(0.01 <= delay <= 0.03 for delay in delays)
+    assert delays == [backend._delay(f'prompt {i}') for i in range(50)]
+    start = time.perf_counter()
+    backend.generate('prompt 0', 'QUERY')
+    assert time.perf_counter() - start >= delays[0]
+
+
+def test_create_backend_from_environment(monkeypatch, tmp_path):
+    responses = tmp_path / 'responses.json'
+    responses.write_text(json.dumps({'QUERY': 'Canned answer'}))
+    monkeypatch.setenv('LLM_STUB_RESPONSES', str(responses))
+    monkeypatch.setenv('LLM_STUB_LATENCY_MS', '250')
+    backend = create_backend('STUB')
+    assert isinstance(backend, StubBackend)
+    assert (backend.latency, backend.generate('q', 'QUERY')) == (0.25, 'Canned answer')
+    assert isinstance(create_backend('gemini'), GeminiBackend)
+    with pytest.raises(ValueError):
+        create_backend('openai')
+
+
+def test_shared_backend_is_created_once(monkeypatch):
+    monkeypatch.setattr(llm_backends, '_backend', None)
+    monkeypatch.setenv('LLM_BACKEND', 'stub')
+    with ThreadPoolExecutor(8) as pool:
+        backends = list(pool.map(lambda _: get_backend(), range(8)))
+    assert all(backend is backends[0] for backend in backends)
+
+
+def test_gemini_backend_needs_no_key_or_client_until_used(monkeypatch):
+    monkeypatch.delenv('GEMINI_API_KEY', raising=False)
+    monkeypatch.delenv('GOOGLE_API_KEY', raising=False)
+    monkeypatch.delenv('GEMINI_MODEL', raising=False)
+    monkeypatch.delitem(sys.modules, 'google.generativeai', raising=False)
+    backend = GeminiBackend()
+    assert backend.model_name == GEMINI_MODELS[0]
+    with pytest.raises(ValueError, match='No API key found'):
+        backend.generate('q', 'QUERY')
+    assert 'google.generativeai' not in sys.modules
+
+
+def test_gemini_model_is_chosen_on_first_use(monkeypatch):
+    pytest.importorskip('google.generativeai')
+    monkeypatch.setenv('GEMINI_MODEL', 'gemini-custom')
+    backend = GeminiBackend(api_key='test-key')
+    assert backend.model_name == 'gemini-custom'
+    model = backend._get_model()
+    assert backend._get_model() is model
+    assert backend.model_name == 'gemini-custom'
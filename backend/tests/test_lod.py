@@ -0,0 +1,114 @@
+"""Levels of detail: level picking from zoom and camera distance, ring simplification and the coarser levels' sizes."""
+import math
+
+import numpy as np
+import pytest
+
+from bench.synthetic import synthetic_features
+from building_store import BuildingStore
+from lod import LOD_LEVELS, ground_resolution, lod_for_distance, lod_for_zoom, simplify_rings
+from mesh_builder import SCALE_FACTOR, build_meshes
+from osm_tiles import lonlat_to_tile
+
+
+def test_lod_for_zoom_bounds():
+    assert [lod_for_zoom(z) for z in range(10, 19)] == [3, 3, 3, 3, 2, 1, 0, 0, 0]
+    assert lod_for_zoom(0) == LOD_LEVELS[-1].level and lod_for_zoom(30) == 0
+    assert all(lod_for_zoom(spec.zoom) == spec.level for spec in LOD_LEVELS)
+
+
+def test_lod_for_distance_coarsens_with_distance():
+    distances = np.geomspace(1, 1e6, 200)
+    levels = [lod_for_distance(distance, 51.04) for distance in distances]
+    assert levels[0] == 0 and levels[-1] == LOD_LEVELS[-1].level
+    assert levels == sorted(levels)
+    assert lod_for_distance(0, 51.04) == lod_for_distance(-5, 51.04) == 0
+
+
+def noisy_rings(rng, count):
+    """Circles of jittered points, in meters."""
+    lengths = rng.integers(3, 60, count)
+    angle = np.concatenate([np.sort(rng.uniform(0, 2 * math.pi, n)) for n in lengths])
+    radius = np.repeat(rng.uniform(5, 50, count), lengths) * rng.uniform(0.9, 1.1, lengths.sum())
+    return radius * np.cos(angle), radius * np.sin(angle), lengths
+
+
+def segment_distance(px, py, ax, ay, bx, by):
+    dx, dy = bx - ax, by - ay
+    span = dx * dx + dy * dy
+    t = 0 if span == 0 else min(max(((px - ax) * dx + (py - ay) * dy) / span, 0), 1)
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+@pytest.mark.parametrize('tolerance', [0.5, 2.0, 10.0])
+def test_simplified_rings_stay_within_tolerance(tolerance):
+    x, y, lengths = noisy_rings(np.random.default_rng(7), 40)
+    keep = simplify_rings(x, y, lengths, tolerance)
+    start = 0
+    for n in lengths:
+        ring = np.flatnonzero(keep[start:start + n])
+        assert ring[0] == 0 and len(ring) >= min(n, 4)
+        # Every dropped point is within the tolerance of the kept edge that replaces it
+        for first, last in zip(ring, np.append(ring[1:], n)):
+            a, b = start + first, start + last % n
+            for p in range(start + first + 1, start + last):
+                assert segment_distance(x[p], y[p], x[a], y[a], x[b], y[b]) <= tolerance + 1e-9
+        start += n
+
+
+@pytest.fixture(scope='module')
+def store():
+    features = synthetic_features(900)
+    records = [dict(feature['properties'], id=feature['id']) for feature in features]
+    return BuildingStore.from_records(records, [feature['geometry']['coordinates'][0] for feature in features])
+
+
+def test_coarser_levels_are_smaller(store):
+    levels = store.lods.build_all()
+    vertices = []
+    for level in levels:
+        _, positions, _ = build_meshes(level, np.arange(len(level)), store.lods.center)
+        vertices.append(len(positions))
+        assert len(level.rows) == len(level.ids) == len(level.heights) == len(level.footprints.offsets) - 1
+    assert vertices == sorted(vertices, reverse=True)
+    assert len(levels[0]) == len(store) and np.array_equal(levels[0].rows, np.arange(len(store)))
+
+    # Only merged block hulls have no store row, and only the coarsest level merges
+    coarsest = levels[-1]
+    assert all((level.rows >= 0).all() for level in levels[:-1])
+    assert (coarsest.rows < 0).any() and np.array_equal(coarsest.rows < 0, coarsest.ids < 0)
+    minimum = coarsest.spec.min_size_px * ground_resolution(coarsest.spec.zoom, store.lods.center[1])
+    assert np.all(store.lods.sizes[coarsest.rows[coarsest.rows >= 0]] >= minimum)
+    assert [stats['level'] for stats in store.lods.stats()] == [spec.level for spec in LOD_LEVELS]
+
+    with pytest.raises(ValueError):
+        store.lods.level(len(LOD_LEVELS))
+
+
+@pytest.fixture
+def city(client):
+    features = synthetic_features(400)
+    response = client.post('/api/buildings/load', json={'type': 'FeatureCollection', 'features': features})
+    assert response.get_json()['count'] == len(features)
+
+
+@pytest.mark.parametrize('z, query, lod', [
+    (16, '', 0),
+    (14, '', 2),
+    (13, '', 3),
+    (16, '?lod=3', 3),
+    (13, '?lod=0', 0),
+    (16, f'?distance={SCALE_FACTOR * 100}', 0),
+    (16, f'?distance={SCALE_FACTOR * 50000}', 3),
+    (16, f'?lod=1&distance={SCALE_FACTOR * 50000}', 1),
+])
+def test_mesh_endpoint_picks_the_level(client, city, z, query, lod):
+    x, y = lonlat_to_tile(-114.078, 51.042, z)
+    response = client.get(f'/api/buildings/mesh/{z}/{x}/{y}{query}')
+    assert response.status_code == 200
+    assert response.headers['X-Mesh-LOD'] == str(lod)
+
+
+def test_unknown_level_is_rejected(client, city):
+    assert client.get('/api/buildings/mesh/16/0/0?lod=4').status_code == 400
+    assert client.get('/api/buildings/mesh/16/0/0?lod=-1').status_code == 400
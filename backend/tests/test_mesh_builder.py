@@ -0,0 +1,133 @@
+"""Mesh tiles: triangulated, extruded footprints checked against the rings they came from, and the tile endpoint."""
+import numpy as np
+import pytest
+
+from bench.synthetic import synthetic_features
+from building_store import BuildingStore
+from mesh_builder import (HEADER, MAGIC, build_meshes, decode_mesh_tile, encode_mesh_tile, extrusion_heights,
+                          project)
+from osm_tiles import lonlat_to_tile
+
+CENTER = (-114.08, 51.04)
+D = 0.0005
+
+RINGS = {
+    'square': [(0, 0), (D, 0), (D, D), (0, D), (0, 0)],
+    'clockwise': [(0, 0), (0, D), (D, D), (D, 0)],
+    'l_shape': [(0, 0), (2 * D, 0), (2 * D, D), (D, D), (D, 2 * D), (0, 2 * D), (0, 0)],
+    'comb': [(0, 0), (3 * D, 0), (3 * D, 2 * D), (2 * D, 2 * D), (2 * D, D), (D, D), (D, 2 * D), (0, 2 * D)],
+    'repeated': [(0, 0), (D, 0), (D, 0), (D, D), (0, D)],
+}
+DEGENERATE = {
+    'line': [(0, 0), (D, 0), (2 * D, 0), (0, 0)],
+    'point': [(0, 0), (0, 0)],
+    'missing': None,
+}
+
+
+def offset(ring, i):
+    return None if ring is None else [(CENTER[0] + lon + i * 4 * D, CENTER[1] + lat) for lon, lat in ring]
+
+
+@pytest.fixture(scope='module')
+def store():
+    shapes = {**RINGS, **DEGENERATE}
+    records = [{'id': str(i + 1), 'height': str(10 + i)} for i in range(len(shapes))]
+    return BuildingStore.from_records(records, [offset(ring, i) for i, ring in enumerate(shapes.values())])
+
+
+def signed_area(x, y):
+    return (np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1))) / 2
+
+
+def triangle_areas(positions, triangles):
+    a, b, c = (positions[triangles[:, k]] for k in range(3))
+    return ((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])) / 2
+
+
+def test_meshes_match_their_footprints(store):
+    level = store.lods.level(0)
+    buildings, positions, indices = build_meshes(level, np.arange(len(store)), CENTER)
+    # Rings that enclose no area are skipped
+    assert buildings['row'].tolist() == list(range(len(RINGS)))
+    heights = extrusion_heights(store.tagged['height'], store.tagged['building:levels'])
+    assert np.array_equal(buildings['height'], heights[:len(RINGS)].astype(np.float32))
+
+    for building, ring in zip(buildings, RINGS.values()):
+        distinct = [point for i, point in enumerate(ring) if point != ring[(i + 1) % len(ring)]]
+        n = len(distinct)
+        assert (building['vertex_count'], building['index_count']) == (6 * n, 3 * (4 * n - 4))
+        vertices = slice(building['vertex_start'], building['vertex_start'] + building['vertex_count'])
+        triangles = indices[building['index_start']:building['index_start'] + building['index_count']].reshape(-1, 3)
+        assert triangles.min() >= vertices.start and triangles.max() < vertices.stop
+
+        # Both caps cover the footprint exactly: the bottom one faces down, the top one up (the comb's
+        # collinear corners can leave a zero-area triangle)
+        lon, lat = np.array(offset(distinct, building['row'])).T
+        x, y = project(lon, lat, CENTER)
+        area = abs(signed_area(x, y))
+        bottom, top, walls = triangles[:n - 2], triangles[n - 2:2 * n - 4], triangles[2 * n - 4:]
+        assert np.all(triangle_areas(positions, bottom) < 1e-6 * area)
+        assert np.all(triangle_areas(positions, top) > -1e-6 * area)
+        assert np.isclose(-triangle_areas(positions, bottom).sum(), area, rtol=1e-5)
+        assert np.isclose(triangle_areas(positions, top).sum(), area, rtol=1e-5)
+        assert np.allclose(positions[bottom.ravel(), 2], 0)
+        assert np.allclose(positions[top.ravel(), 2], building['height'])
+
+        # Wall normals point away from the footprint: to the right of each counter-clockwise edge
+        a, b, c = (positions[walls[:, k]].astype(np.float64) for k in range(3))
+        normals = np.cross(b - a, c - a)
+        edges = b - a
+        assert np.all(np.abs(normals[:, 2]) < 1e-3 * np.abs(normals).max())
+        outward = np.column_stack([edges[:, 1], -edges[:, 0]])
+        assert np.all((normals[:, :2] * outward).sum(axis=1) > 0)
+
+
+def test_tile_round_trip(store):
+    level = store.lods.level(0)
+    buildings, positions, indices = build_meshes(level, np.arange(len(store)), CENTER)
+    tile = encode_mesh_tile(buildings, positions, indices, CENTER)
+    assert len(tile.data) == HEADER.size + buildings.nbytes + positions.nbytes + indices.nbytes
+    decoded = decode_mesh_tile(tile.data)
+    assert decoded['center'] == CENTER
+    assert np.array_equal(decoded['buildings'], buildings)
+    assert np.array_equal(decoded['positions'], positions)
+    assert np.array_equal(decoded['indices'], indices)
+    assert encode_mesh_tile(buildings, positions, indices, CENTER).etag == tile.etag
+
+    with pytest.raises(ValueError):
+        decode_mesh_tile(b'XXXX' + tile.data[len(MAGIC):])
+
+
+@pytest.fixture
+def city(client):
+    features = synthetic_features(100)
+    response = client.post('/api/buildings/load', json={'type': 'FeatureCollection', 'features': features})
+    assert response.get_json()['count'] == len(features)
+    return features
+
+
+def test_mesh_endpoint_caches_and_revalidates(client, city):
+    x, y = lonlat_to_tile(-114.079, 51.041, 16)
+    url = f'/api/buildings/mesh/16/{x}/{y}?center=-114.08,51.04'
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers['X-Mesh-Cache'] == 'miss'
+    decoded = decode_mesh_tile(first.data)
+    assert int(first.headers['X-Mesh-Buildings']) == len(decoded['buildings']) > 0
+
+    second = client.get(url)
+    assert second.headers['X-Mesh-Cache'] == 'hit' and second.data == first.data
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+
+@pytest.mark.parametrize('url', [
+    '/api/buildings/mesh/9/0/0',
+    '/api/buildings/mesh/19/0/0',
+    '/api/buildings/mesh/16/65536/0',
+    '/api/buildings/mesh/16/0/0?center=-114.08,nan',
+    '/api/buildings/mesh/16/0/0?center=-114.08',
+    '/api/buildings/mesh/16/0/0?distance=inf',
+])
+def test_invalid_tiles_are_rejected(client, city, url):
+    assert client.get(url).status_code == 400
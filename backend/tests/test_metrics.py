@@ -0,0 +1,90 @@
+"""Prometheus text exposition of the metrics registry and of the app's /metrics endpoint."""
+import re
+import threading
+
+from metrics import CONTENT_TYPE, Registry
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})? (\S+)$')
+
+
+def samples(text):
+    """{name + labels: value} for every sample line, checking each metric family is declared first."""
+    declared = set()
+    values = {}
+    for line in text.splitlines():
+        if line.startswith('# '):
+            kind, name = line.split(' ')[1:3]
+            assert kind in ('HELP', 'TYPE')
+            declared.add(name)
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        name = match.group(1)
+        assert name in declared or re.sub(r'_(bucket|sum|count)$', '', name) in declared, line
+        values[name + (match.group(2) or '')] = float(match.group(3))
+    return values
+
+
+def test_counter_and_histogram_exposition():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests by route.', ('route',))
+    latency = registry.histogram('latency_seconds', 'Latency.', ('route',), buckets=(0.1, 1.0))
+    requests.inc('/a')
+    requests.inc('/a', amount=2)
+    requests.inc('say "hi"\n')
+    latency.observe(0.05, '/a')
+    latency.observe(0.5, '/a')
+    latency.observe(5, '/a')
+    assert registry.render() == '\n'.join([
+        '# HELP requests_total Requests by route.',
+        '# TYPE requests_total counter',
+        'requests_total{route="/a"} 3',
+        'requests_total{route="say \\"hi\\"\\n"} 1',
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1"} 2',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+        'latency_seconds_sum{route="/a"} 5.55',
+        'latency_seconds_count{route="/a"} 3',
+    ]) + '\n'
+
+
+def test_thread_shards_are_summed():
+    registry = Registry()
+    counter = registry.counter('events_total', 'Events.')
+    threads = [threading.Thread(target=lambda: [counter.inc() for _ in range(1000)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert samples(registry.render()) == {'events_total': 8000}
+
+
+def test_collectors_are_read_at_scrape_time():
+    registry = Registry()
+    depth = []
+    registry.add_collector(lambda: [('queue_depth', 'gauge', 'Queued items.', [({'queue': 'jobs'}, len(depth))])])
+    assert samples(registry.render()) == {'queue_depth{queue="jobs"}': 0}
+    depth.append(1)
+    assert samples(registry.render()) == {'queue_depth{queue="jobs"}': 1}
+
+
+def test_metrics_endpoint_counts_requests_and_llm_calls(client, stub):
+    stub({'SUMMARY': 'No summary available for this building.'})
+    before = samples(client.get('/metrics').get_data(as_text=True))
+    client.post('/api/summary', json={'building_data': {'id': 'way/1', 'type': 'office'}})
+    response = client.get('/metrics')
+    assert response.content_type == CONTENT_TYPE
+    after = samples(response.get_data(as_text=True))
+
+    def added(sample):
+        return after.get(sample, 0) - before.get(sample, 0)
+
+    assert added('http_requests_total{route="/api/summary",method="POST",status="200"}') == 1
+    assert added('http_request_duration_seconds_count{route="/api/summary"}') == 1
+    assert added('llm_request_duration_seconds_count{model="stub",label="SUMMARY"}') == 1
+    assert added('llm_fallback_responses_total{route="summary"}') == 1
+    for stage in ('cache', 'llm', 'parse'):
+        assert added(f'request_stage_duration_seconds_count{{route="summary",stage="{stage}"}}') == 1
+    assert 'llm_cache_hit_ratio' in after and 'admission_active_requests' in after
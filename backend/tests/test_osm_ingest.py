@@ -0,0 +1,160 @@
+"""Typed tag parsing and the streaming readers of GeoJSON, Overpass JSON and OSM XML building files."""
+import gzip
+import io
+import json
+import math
+
+import pytest
+
+from bench.synthetic import synthetic_features
+from osm_ingest import (DEFAULT_LEVELS, METERS_PER_LEVEL, iter_buildings, iter_json_array, iter_osm_elements,
+                        join_rings, parse_building_tags, parse_length, parse_levels, parse_year)
+
+
+def same(parsed, expected):
+    (value, estimated), (expected_value, expected_estimated) = parsed, expected
+    if math.isnan(expected_value):
+        return math.isnan(value) and estimated == expected_estimated
+    return math.isclose(value, expected_value) and estimated == expected_estimated
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('12', (12, False)),
+    ('12 m', (12, False)),
+    ('12,5m', (12.5, False)),
+    ('12.5 metres', (12.5, False)),
+    ("45'", (45 * 0.3048, False)),
+    ('40 ft', (40 * 0.3048, False)),
+    ("12'6\"", (12 * 0.3048 + 6 * 0.0254, False)),
+    ('~20', (20, True)),
+    ('ca. 20 m', (20, True)),
+    ('10-14 m', (12, True)),
+    ('30 to 40 ft', (35 * 0.3048, True)),
+    ('12;15', (12, False)),
+    (7, (7, False)),
+    (-5, (math.nan, False)),
+    ('-5', (math.nan, False)),
+    ('tall', (math.nan, False)),
+    ('', (math.nan, False)),
+    (None, (math.nan, False)),
+])
+def test_parse_length(value, expected):
+    assert same(parse_length(value), expected)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('3', (3, False)),
+    ('3.5', (3.5, False)),
+    ('~4', (4, True)),
+    ('2-4', (3, True)),
+    ('5;6', (5, False)),
+    (float('inf'), (math.nan, False)),
+    ('many', (math.nan, False)),
+    (None, (math.nan, False)),
+])
+def test_parse_levels(value, expected):
+    assert same(parse_levels(value), expected)
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('1910', (1910, False)),
+    ('1910-05-01', (1910, False)),
+    (1950, (1950, False)),
+    ('~1910', (1910, True)),
+    ('circa 1910', (1910, True)),
+    ('before 1900', (1900, True)),
+    ('1905..1912', (1908, True)),
+    ('1905-1912', (1908, True)),
+    ('1920s', (1925, True)),
+    ('early 1920s', (1922, True)),
+    ('late 1920s', (1928, True)),
+    ('C19', (1850, True)),
+    ('early C19', (1820, True)),
+    ('unknown', (math.nan, False)),
+])
+def test_parse_year(value, expected):
+    assert same(parse_year(value), expected)
+
+
+def test_missing_tags_are_filled_in_as_estimates():
+    tags = parse_building_tags({'building': 'yes'})
+    assert (tags.levels, tags.levels_estimated) == (DEFAULT_LEVELS, True)
+    assert (tags.height, tags.height_estimated) == (DEFAULT_LEVELS * METERS_PER_LEVEL, True)
+    assert math.isnan(tags.tagged_height) and math.isnan(tags.tagged_levels) and math.isnan(tags.year)
+
+    tags = parse_building_tags({'building:levels': '4', 'height': '~15 m', 'start_date': '1920s'})
+    assert (tags.levels, tags.height, tags.height_estimated, tags.year) == (4, 15, True, 1925)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1 << 20])
+def test_iter_json_array_matches_json_load(chunk_size):
+    document = {'type': 'FeatureCollection', 'name': 'a "features" decoy [',
+                'features': synthetic_features(30) + [{'text': 'brackets ] and , commas'}]}
+    text = json.dumps(document, indent=1)
+    assert list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)) == document['features']
+    assert list(iter_json_array(io.StringIO('{"elements": []}'), chunk_size=chunk_size)) == []
+    assert list(iter_json_array(io.StringIO('{"other": [1]}'), chunk_size=chunk_size)) == []
+
+
+def test_iter_json_array_rejects_truncated_documents():
+    with pytest.raises(ValueError):
+        list(iter_json_array(io.StringIO('{"features": [{"id": 1}, {"id": '), chunk_size=4))
+
+
+def test_join_rings_chains_ways_in_any_direction():
+    a, b, c, d = (0, 0), (1, 0), (1, 1), (0, 1)
+    assert join_rings([[a, b, c], [a, d, c]]) == [a, b, c, d, a]
+    assert join_rings([[c, b, a], [c, d], [d, a]]) == [d, c, b, a, d]
+    # A closed chain wins over the larger one whose ends never meet
+    square = [(0, 0), (1, 0), (1, 1), (0, 1), (0, 0)]
+    assert join_rings([[(5, 5), (15, 5), (15, 15)], square]) == square
+    assert join_rings([]) is None
+
+
+OSM_ELEMENTS = [
+    {'type': 'way', 'id': 10, 'nodes': [1, 2, 3, 4, 1], 'tags': {'building': 'yes', 'height': '9'}},
+    {'type': 'way', 'id': 11, 'nodes': [5, 6, 7]},
+    {'type': 'way', 'id': 12, 'nodes': [7, 8, 5]},
+    {'type': 'relation', 'id': 20, 'tags': {'building': 'office'},
+     'members': [{'type': 'way', 'ref': 11, 'role': 'outer'}, {'type': 'way', 'ref': 12, 'role': 'outer'}]},
+    {'type': 'way', 'id': 13, 'nodes': [1, 99, 2], 'tags': {'building': 'shed'}},
+] + [{'type': 'node', 'id': i, 'lon': float(i), 'lat': float(i % 2)} for i in range(1, 9)]
+
+
+def test_osm_elements_resolve_nodes_seen_after_their_ways():
+    buildings = list(iter_osm_elements(OSM_ELEMENTS))
+    assert [tags['id'] for tags, _ in buildings] == [10, 20, 13]
+    assert buildings[0][1] == [(1, 1), (2, 0), (3, 1), (4, 0), (1, 1)]
+    relation = buildings[1][1]
+    assert relation[0] == relation[-1] and sorted(relation[:-1]) == [(5, 1), (6, 0), (7, 1), (8, 0)]
+    # A way with too few resolvable nodes has no footprint
+    assert buildings[2][1] is None
+
+
+def test_iter_buildings_reads_every_format(tmp_path):
+    features = synthetic_features(5)
+    expected = [(feature['id'], [tuple(point) for point in feature['geometry']['coordinates'][0]])
+                for feature in features]
+
+    collection = tmp_path / 'city.geojson.gz'
+    with gzip.open(collection, 'wt', encoding='utf-8') as f:
+        json.dump({'type': 'FeatureCollection', 'features': features}, f)
+    sequence = tmp_path / 'city.geojsonl'
+    sequence.write_text(''.join('\x1e' + json.dumps(feature) + '\n' for feature in features))
+    for path in (collection, sequence):
+        assert [(tags['id'], ring) for tags, ring in iter_buildings(str(path))] == expected
+
+    overpass = tmp_path / 'city.json'
+    overpass.write_text(json.dumps({'elements': OSM_ELEMENTS}))
+    assert [tags['id'] for tags, _ in iter_buildings(str(overpass))] == [10, 20, 13]
+
+    xml = tmp_path / 'city.osm'
+    xml.write_text('<osm>' + ''.join(f'<node id="{i}" lon="{i}" lat="0"/>' for i in range(1, 4)) +
+                   '<way id="30"><nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="1"/>'
+                   '<tag k="building" v="yes"/><tag k="height" v="6 m"/></way></osm>')
+    assert list(iter_buildings(str(xml))) == [({'building': 'yes', 'height': '6 m', 'id': 30},
+                                               [(1, 0), (2, 0), (3, 0), (1, 0)])]
+
+    empty = tmp_path / 'empty.json'
+    empty.write_text('{"features": []}')
+    assert list(iter_buildings(str(empty))) == []
@@ -0,0 +1,162 @@
+"""OSMTileService against a local stand-in for Overpass."""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from osm_tiles import OSMTileService, OverpassError
+
+TILE = (15, 5213, 11234)
+BODY = json.dumps({'elements': [{'type': 'way', 'id': 1}]}).encode('utf-8')
+
+
+class FakeOverpass(ThreadingHTTPServer):
+    """Answers every POST with the configured status and body, recording the requests."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), OverpassHandler)
+        self.status = 200
+        self.body = BODY
+        self.etag = '"v1"'
+        self.delay = 0.0
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/api/interpreter"
+
+
+class OverpassHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        server.requests.append(dict(self.headers))
+        time.sleep(server.delay)
+        if server.status == 200 and self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(server.status)
+        self.send_header('Content-Type', 'application/json')
+        if server.etag:
+            self.send_header('ETag', server.etag)
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def overpass():
+    server = FakeOverpass()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def service(overpass, tmp_path):
+    return OSMTileService(overpass_url=overpass.url, cache_dir=str(tmp_path), ttl_seconds=60, timeout=5)
+
+
+def expire(service, layer='all'):
+    """Age the cached tile past its TTL."""
+    tile = service.cache.get(layer, *TILE)
+    tile.fetched_at -= service.ttl_seconds + 1
+    service.cache.touch(layer, *TILE, tile)
+
+
+def test_cold_fetch_is_cached(service, overpass):
+    tile = service.get_tile(*TILE)
+    assert tile.status == 'miss'
+    assert tile.body == BODY
+
+    tile = service.get_tile(*TILE)
+    assert tile.status == 'hit'
+    assert tile.body == BODY
+    assert len(overpass.requests) == 1
+
+
+def test_expired_tile_is_revalidated_with_etag(service, overpass):
+    service.get_tile(*TILE)
+    expire(service)
+
+    tile = service.get_tile(*TILE)
+    assert tile.status == 'revalidated'
+    assert tile.body == BODY
+    assert overpass.requests[-1]['If-None-Match'] == '"v1"'
+    # The revalidation restarted the TTL
+    assert service.get_tile(*TILE).status == 'hit'
+    assert len(overpass.requests) == 2
+
+
+def test_expired_tile_is_refreshed_when_it_changed(service, overpass):
+    service.get_tile(*TILE)
+    expire(service)
+    overpass.etag = '"v2"'
+    overpass.body = json.dumps({'elements': []}).encode('utf-8')
+
+    tile = service.get_tile(*TILE)
+    assert tile.status == 'refreshed'
+    assert tile.body == overpass.body
+    assert service.cache.get('all', *TILE).upstream_etag == '"v2"'
+
+
+def test_server_error_serves_stale_tile(service, overpass):
+    service.get_tile(*TILE)
+    expire(service)
+    overpass.status = 504
+
+    tile = service.get_tile(*TILE)
+    assert tile.status == 'stale'
+    assert tile.body == BODY
+
+
+def test_server_error_without_cached_tile_raises(service, overpass):
+    overpass.status = 500
+    with pytest.raises(OverpassError):
+        service.get_tile(*TILE)
+
+
+def test_error_remark_is_not_cached(service, overpass):
+    overpass.body = json.dumps({'elements': [], 'remark': 'runtime error: Query timed out'}).encode('utf-8')
+    with pytest.raises(OverpassError):
+        service.get_tile(*TILE)
+    assert service.cache.get('all', *TILE) is None
+
+
+def test_error_remark_serves_stale_tile(service, overpass):
+    service.get_tile(*TILE)
+    expire(service)
+    overpass.etag = None
+    overpass.body = b'<html>rate limited</html>'
+
+    tile = service.get_tile(*TILE)
+    assert tile.status == 'stale'
+    assert tile.body == BODY
+
+
+def test_concurrent_cold_fetches_are_coalesced(service, overpass):
+    overpass.delay = 0.3
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        tiles = list(pool.map(lambda _: service.get_tile(*TILE), range(8)))
+
+    assert len(overpass.requests) == 1
+    assert all(tile.body == BODY for tile in tiles)
+
+
+def test_invalid_tile_is_rejected(service, overpass):
+    with pytest.raises(ValueError):
+        service.get_tile(3, 0, 0)
+    with pytest.raises(ValueError):
+        service.get_tile(15, 2 ** 15, 0)
+    with pytest.raises(ValueError):
+        service.get_tile(*TILE, layer='rivers')
+    assert overpass.requests == []
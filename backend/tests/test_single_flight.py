@@ -0,0 +1,146 @@
+"""SingleFlight and AsyncSingleFlight sharing one call, its result and its error between concurrent callers."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import AsyncSingleFlight, SingleFlight, SingleFlightTimeout
+
+CALLERS = 8
+
+
+def run_together(flight, fn):
+    """Call flight.do('key', fn) from CALLERS threads while the first call is still running."""
+    with ThreadPoolExecutor(CALLERS) as pool:
+        futures = [pool.submit(flight.do, 'key', fn) for _ in range(CALLERS)]
+        return [future.exception() or future.result() for future in futures]
+
+
+def gated(result=None, error=None):
+    """A call that returns or raises once `release` is set, counting how often it runs."""
+    release = threading.Event()
+    runs = []
+
+    def fn():
+        runs.append(1)
+        release.wait(5)
+        if error is not None:
+            raise error
+        return result
+
+    return fn, release, runs
+
+
+def release_when_coalesced(flight, release):
+    def watch():
+        while flight.stats()['coalesced'] < CALLERS - 1:
+            time.sleep(0.001)
+        release.set()
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def test_concurrent_callers_share_one_result():
+    flight = SingleFlight(timeout=5)
+    fn, release, runs = gated(result={'summary': 'shared'})
+    release_when_coalesced(flight, release)
+    results = run_together(flight, fn)
+    assert len(runs) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {'calls': 1, 'coalesced': CALLERS - 1, 'timeouts': 0, 'errors': 0, 'in_flight': 0}
+
+
+def test_concurrent_callers_share_one_error():
+    flight = SingleFlight(timeout=5)
+    error = ValueError('quota exceeded')
+    fn, release, runs = gated(error=error)
+    release_when_coalesced(flight, release)
+    assert run_together(flight, fn) == [error] * CALLERS
+    assert len(runs) == 1
+    assert flight.stats()['errors'] == 1
+
+
+def test_later_calls_run_again():
+    flight = SingleFlight()
+    assert [flight.do('key', lambda: n) for n in range(3)] == [0, 1, 2]
+    assert flight.stats()['calls'] == 3
+
+
+def test_waiter_times_out():
+    flight = SingleFlight()
+    fn, release, _ = gated(result='late')
+    leader = threading.Thread(target=flight.do, args=('key', fn))
+    leader.start()
+    while flight.stats()['in_flight'] == 0:
+        time.sleep(0.001)
+    with pytest.raises(SingleFlightTimeout):
+        flight.do('key', fn, timeout=0.01)
+    release.set()
+    leader.join()
+    assert flight.stats()['timeouts'] == 1
+
+
+def test_async_callers_share_one_result_and_one_error():
+    async def scenario():
+        flight = AsyncSingleFlight(timeout=5)
+        runs = []
+
+        async def call(result):
+            runs.append(1)
+            await asyncio.sleep(0.01)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        results = await asyncio.gather(*(flight.do('ok', lambda: call('shared')) for _ in range(CALLERS)))
+        error = ValueError('quota exceeded')
+        errors = await asyncio.gather(*(flight.do('bad', lambda: call(error)) for _ in range(CALLERS)),
+                                      return_exceptions=True)
+        return flight, runs, results, errors, error
+
+    flight, runs, results, errors, error = asyncio.run(scenario())
+    assert len(runs) == 2
+    assert results == ['shared'] * CALLERS
+    assert errors == [error] * CALLERS
+    assert flight.stats() == {'calls': 2, 'coalesced': 2 * (CALLERS - 1), 'timeouts': 0, 'cancelled': 0,
+                              'in_flight': 0}
+
+
+def test_async_call_outlives_one_cancelled_caller():
+    async def scenario():
+        flight = AsyncSingleFlight()
+
+        async def call():
+            await asyncio.sleep(0.05)
+            return 'done'
+
+        first = asyncio.ensure_future(flight.do('key', call))
+        second = asyncio.ensure_future(flight.do('key', call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, first.cancelled(), flight.stats()
+
+    result, cancelled, stats = asyncio.run(scenario())
+    assert (result, cancelled) == ('done', True)
+    assert stats['cancelled'] == 0 and stats['in_flight'] == 0
+
+
+def test_async_call_is_cancelled_with_its_last_caller():
+    async def scenario():
+        flight = AsyncSingleFlight()
+        finished = []
+
+        async def call():
+            await asyncio.sleep(1)
+            finished.append(1)
+
+        caller = asyncio.ensure_future(flight.do('key', call))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.01)
+        return finished, flight.stats()
+
+    finished, stats = asyncio.run(scenario())
+    assert finished == []
+    assert stats['cancelled'] == 1 and stats['in_flight'] == 0
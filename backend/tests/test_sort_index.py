@@ -0,0 +1,124 @@
+"""SortIndex pages and cursors against a full sort of the matches, and cursor paging through /api/filter/apply."""
+import numpy as np
+import pytest
+
+from bench.synthetic import synthetic_features
+from sort_index import SortIndex, decode_cursor, encode_cursor
+
+
+def expected_order(values, rows, descending):
+    """Rows by value with ties in row order (reversed when descending, as positions run backwards), NaN last."""
+    valid = [row for row in rows if not np.isnan(values[row])]
+    unknown = [row for row in rows if np.isnan(values[row])]
+    if descending:
+        return sorted(valid, key=lambda row: (-values[row], -row)) + unknown
+    return sorted(valid, key=lambda row: (values[row], row)) + unknown
+
+
+def pages(index, mask, limit, descending, method):
+    """Every page of a mask, following the cursor (the last position of each page)."""
+    rows, after = [], -1
+    while True:
+        if method == 'walk':
+            page, positions = index.walk(mask, limit, after, descending)
+        elif method == 'select':
+            page, positions = index.select(np.flatnonzero(mask), limit, after, descending)
+        else:
+            page, positions = index.top(mask, limit, after, descending)
+        assert len(page) <= limit and np.all(np.diff(positions) > 0)
+        assert np.array_equal(index.rows_at(positions, descending), page)
+        rows += page.tolist()
+        if len(page) < limit:
+            return rows
+        after = positions[-1]
+
+
+@pytest.mark.parametrize('method', ['walk', 'select', 'top'])
+@pytest.mark.parametrize('descending', [False, True])
+@pytest.mark.parametrize('selectivity', [0.001, 0.05, 0.7])
+def test_pages_match_full_sort(method, descending, selectivity):
+    rng = np.random.default_rng(int(selectivity * 1000))
+    # Few distinct values, so ties are common, and some unknown
+    values = rng.integers(0, 50, 5000).astype(np.float64)
+    values[rng.random(len(values)) < 0.1] = np.nan
+    index = SortIndex(values)
+    mask = rng.random(len(values)) < selectivity
+    expected = expected_order(values, np.flatnonzero(mask), descending)
+    for limit in (1, 7, 100):
+        assert pages(index, mask, limit, descending, method) == expected
+
+
+def test_positions_and_rows_are_inverse():
+    values = np.array([3.0, np.nan, 1.0, 3.0, 2.0, np.nan])
+    index = SortIndex(values)
+    assert index.valid == 4
+    assert index.rows_at(np.arange(6)).tolist() == [2, 4, 0, 3, 1, 5]
+    assert index.rows_at(np.arange(6), descending=True).tolist() == [3, 0, 4, 2, 1, 5]
+    for descending in (False, True):
+        assert np.array_equal(index.rows_at(index.positions(np.arange(6), descending), descending), np.arange(6))
+    restored = SortIndex.restore(index.order, index.rank, index.valid)
+    assert restored.rows_at(np.arange(6), True).tolist() == [3, 0, 4, 2, 1, 5]
+    assert index.top(np.zeros(6, dtype=bool), 3)[0].tolist() == []
+
+
+def test_cursor_round_trip_and_rejections():
+    cursor = encode_cursor('height', True, 41)
+    assert '=' not in cursor
+    assert decode_cursor(cursor, 'height', True, 42) == 41
+    assert decode_cursor(encode_cursor(None, False, 0), None, False) == 0
+    for bad in ('!!!', encode_cursor('height', True, 41)[:-3], 'aGVpZ2h0fGRlc2N8eA'):
+        with pytest.raises(ValueError, match='Invalid cursor'):
+            decode_cursor(bad, 'height', True)
+    with pytest.raises(ValueError, match='different'):
+        decode_cursor(cursor, 'height', False)
+    with pytest.raises(ValueError, match='different'):
+        decode_cursor(cursor, 'start_date', True)
+    with pytest.raises(ValueError, match='out of range'):
+        decode_cursor(cursor, 'height', True, 41)
+    with pytest.raises(ValueError, match='out of range'):
+        decode_cursor(encode_cursor('height', True, -1), 'height', True)
+
+
+@pytest.fixture
+def city(app_module, client):
+    features = synthetic_features(300)
+    response = client.post('/api/buildings/load', json={'type': 'FeatureCollection', 'features': features})
+    assert response.get_json()['count'] == len(features)
+    return app_module.get_building_store(app_module.CITY_DATA_PATH, app_module.STORE_SNAPSHOT_PATH)
+
+
+def apply(client, **body):
+    return client.post('/api/filter/apply', json=dict({'filters': [{'attribute': 'height', 'operator': '>',
+                                                                    'value': 10}]}, **body))
+
+
+@pytest.mark.parametrize('sort_order', ['asc', 'desc'])
+def test_filter_apply_pages_follow_the_cursor(client, city, sort_order):
+    heights = city.numeric_column('height')
+    matches = np.flatnonzero(heights > 10)
+    expected = city.ids[expected_order(heights, matches, sort_order == 'desc')].tolist()
+    everything = apply(client, sortBy='height', sortOrder=sort_order).get_json()
+    assert everything['ids'] == expected and everything['count'] == len(matches)
+
+    ids, cursor = [], None
+    while True:
+        body = apply(client, sortBy='height', sortOrder=sort_order, limit=25, cursor=cursor).get_json()
+        assert body['count'] == len(matches) and len(body['ids']) <= 25
+        ids += body['ids']
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+    assert ids == expected
+
+
+@pytest.mark.parametrize('body', [
+    {'limit': 0},
+    {'limit': 'ten'},
+    {'sortBy': 'colour'},
+    {'sortBy': 'height', 'cursor': 'not a cursor'},
+    {'sortBy': 'height', 'cursor': encode_cursor('height', True, 0)},
+    {'sortBy': 'height', 'cursor': encode_cursor('height', False, 300)},
+])
+def test_filter_apply_rejects_bad_paging(client, city, body):
+    response = apply(client, **body)
+    assert response.status_code == 400 and 'error' in response.get_json()
@@ -0,0 +1,98 @@
+"""GridIndex bbox and nearest queries, and the /api/buildings endpoints, against brute-force scans."""
+import numpy as np
+import pytest
+
+from bench.synthetic import synthetic_features
+from spatial_index import GridIndex, distance_meters
+
+
+def random_index(rng, count, lat0):
+    lon0 = rng.uniform(-170, 160)
+    span = rng.uniform(0.001, 2)
+    min_lon = rng.uniform(lon0, lon0 + span, count)
+    min_lat = rng.uniform(lat0, lat0 + span, count)
+    size = rng.uniform(0, span / 20, (2, count))
+    max_lon, max_lat = min_lon + size[0], min_lat + size[1]
+    # Buildings without a footprint are left out of the grid
+    min_lon[rng.random(count) < 0.05] = np.nan
+    index = GridIndex(min_lon, min_lat, max_lon, max_lat, (min_lon + max_lon) / 2, (min_lat + max_lat) / 2)
+    return index, lon0, span
+
+
+@pytest.mark.parametrize('lat0', [-60, 0, 51, 75])
+def test_bbox_and_nearest_match_brute_force(lat0):
+    rng = np.random.default_rng(lat0 + 100)
+    for count in (0, 1, 17, 500):
+        index, lon0, span = random_index(rng, count, lat0)
+        placed = ~np.isnan(index.min_lon)
+        for _ in range(20):
+            west, east = np.sort(rng.uniform(lon0 - span / 2, lon0 + 1.5 * span, 2))
+            south, north = np.sort(rng.uniform(lat0 - span / 2, lat0 + 1.5 * span, 2))
+            expected = np.flatnonzero(placed & (index.min_lon <= east) & (index.max_lon >= west) &
+                                      (index.min_lat <= north) & (index.max_lat >= south))
+            assert np.array_equal(index.query_bbox(west, south, east, north), expected)
+
+            lon, lat = rng.uniform(lon0 - span, lon0 + 2 * span), rng.uniform(lat0 - span, lat0 + 2 * span)
+            k = int(rng.integers(1, 30))
+            rows, distances = index.nearest(lon, lat, k)
+            brute = distance_meters(lon, lat, index.centroid_lon, index.centroid_lat)[placed]
+            assert np.allclose(distances, np.sort(brute)[:k])
+            assert np.allclose(distance_meters(lon, lat, index.centroid_lon[rows], index.centroid_lat[rows]), distances)
+
+            radius = float(np.median(brute)) if len(brute) else 1.0
+            rows, distances = index.nearest(lon, lat, k, max_distance=radius)
+            assert np.allclose(distances, np.sort(brute[brute <= radius])[:k])
+
+
+@pytest.fixture
+def city(client):
+    features = synthetic_features(400)
+    response = client.post('/api/buildings/load', json={'type': 'FeatureCollection', 'features': features})
+    assert response.get_json()['count'] == len(features)
+    boxes = {}
+    for feature in features:
+        ring = np.array(feature['geometry']['coordinates'][0])
+        boxes[feature['id']] = (*ring.min(axis=0), *ring.max(axis=0))
+    return boxes
+
+
+def test_bbox_endpoint_matches_footprint_scan(client, city):
+    west, south, east, north = -114.0790, 51.0410, -114.0770, 51.0425
+    body = client.get(f'/api/buildings?bbox={west},{south},{east},{north}').get_json()
+    expected = {building_id for building_id, (x0, y0, x1, y1) in city.items()
+                if x0 <= east and x1 >= west and y0 <= north and y1 >= south}
+    assert expected and {building['id'] for building in body['buildings']} == expected
+    assert (body['count'], body['truncated']) == (len(expected), False)
+
+    body = client.get(f'/api/buildings?bbox={west},{south},{east},{north}&limit=3&fields=height').get_json()
+    assert (len(body['buildings']), body['count'], body['truncated']) == (3, len(expected), True)
+    assert all(set(building) <= {'id', 'lon', 'lat', 'height', 'estimated'} for building in body['buildings'])
+
+
+def test_nearest_endpoint_matches_distance_scan(client, city):
+    lon, lat = -114.0785, 51.0418
+    body = client.get(f'/api/buildings/nearest?lon={lon}&lat={lat}&k=12&fields=').get_json()
+    everything = client.get('/api/buildings?bbox=-180,-90,180,90&limit=1000&fields=').get_json()['buildings']
+    lons, lats = np.array([b['lon'] for b in everything]), np.array([b['lat'] for b in everything])
+    distances = distance_meters(lon, lat, lons, lats)
+    expected = np.sort(distances)[:12]
+    assert body['count'] == 12
+    # Distances are reported to the decimeter, from centroids rounded to 7 decimals
+    assert np.allclose([building['distance'] for building in body['buildings']], expected, atol=0.1)
+
+    body = client.get(f'/api/buildings/nearest?lon={lon}&lat={lat}&k=50&radius=40').get_json()
+    assert body['count'] == int((distances <= 40).sum())
+    assert all(building['distance'] <= 40 for building in body['buildings'])
+
+
+@pytest.mark.parametrize('url', [
+    '/api/buildings?bbox=-114.1,51.0,-114.0',
+    '/api/buildings?bbox=west,51.0,-114.0,51.1',
+    '/api/buildings?bbox=-114.1,nan,-114.0,51.1',
+    '/api/buildings?bbox=-114.1,51.0,-114.0,51.1&limit=-1',
+    '/api/buildings/nearest?lat=51.04',
+    '/api/buildings/nearest?lat=51.04&lon=inf',
+    '/api/buildings/nearest?lat=51.04&lon=-114.08&radius=nan',
+])
+def test_invalid_arguments_are_rejected(client, city, url):
+    assert client.get(url).status_code == 400
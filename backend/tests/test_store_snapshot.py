@@ -0,0 +1,170 @@
+"""Store snapshots: a mapped snapshot answers like the store it was written from, workers share it, and damaged
+or stale snapshots are rejected and rebuilt."""
+import json
+import os
+
+import numpy as np
+import pytest
+
+import building_store
+from bench.synthetic import synthetic_features
+from building_store import NUMERIC_COLUMNS, SORTABLE_COLUMNS, BuildingStore
+from store_snapshot import (HEADER, SnapshotError, build_indexes, is_current, main, read_manifest, read_snapshot,
+                            refresh_snapshot, write_snapshot)
+
+FILTERS = [
+    [{'attribute': 'building', 'operator': '=', 'value': 'residential'}],
+    [{'attribute': 'height', 'operator': '>', 'value': 30}, {'attribute': 'name', 'operator': 'contains',
+                                                             'value': 'a'}],
+    [{'attribute': 'start_date', 'operator': '<', 'value': 1950}],
+]
+
+
+def city(string_ids=False):
+    features = synthetic_features(500)
+    if string_ids:
+        for feature in features:
+            feature['id'] = f"way/{feature['id']}"
+    store = BuildingStore.from_geojson({'type': 'FeatureCollection', 'features': features})
+    build_indexes(store)
+    return store
+
+
+def assert_same_answers(store, mapped):
+    assert len(mapped) == len(store)
+    assert np.array_equal(mapped.ids, store.ids)
+    for column in NUMERIC_COLUMNS:
+        assert np.array_equal(mapped.numeric[column], store.numeric[column], equal_nan=True)
+        assert np.array_equal(mapped.estimated[column], store.estimated[column])
+    for filters in FILTERS:
+        assert np.array_equal(mapped.apply_filters(filters), store.apply_filters(filters))
+    for attribute in SORTABLE_COLUMNS:
+        for descending in (False, True):
+            expected = store.page(FILTERS[0], attribute, descending, 20, 5)
+            assert all(np.array_equal(a, b) for a, b in zip(mapped.page(FILTERS[0], attribute, descending, 20, 5),
+                                                            expected))
+    bbox = (-114.0790, 51.0410, -114.0770, 51.0425)
+    assert np.array_equal(mapped.rows_in_bbox(*bbox), store.rows_in_bbox(*bbox))
+    assert all(np.array_equal(a, b) for a, b in zip(mapped.nearest_rows(-114.078, 51.042, 15),
+                                                    store.nearest_rows(-114.078, 51.042, 15)))
+    for query, fuzzy in (('res', False), ('offce', True), ('street', False)):
+        assert mapped.suggest(query, fuzzy=fuzzy) == store.suggest(query, fuzzy=fuzzy)
+    assert mapped.describe(np.arange(0, len(store), 37)) == store.describe(np.arange(0, len(store), 37))
+    for level, mapped_level in zip(store.lods.build_all(), mapped.lods.build_all()):
+        assert np.array_equal(mapped_level.rows, level.rows)
+        assert np.array_equal(mapped_level.footprints.coords, level.footprints.coords)
+        assert np.array_equal(mapped_level.heights, level.heights)
+
+
+@pytest.mark.parametrize('string_ids', [False, True])
+def test_snapshot_round_trip(tmp_path, string_ids):
+    store = city(string_ids)
+    path = str(tmp_path / 'city.snapshot')
+    write_snapshot(store, path)
+    mapped = read_snapshot(path)
+    assert_same_answers(store, mapped)
+    # Indexes come from the file rather than being rebuilt
+    assert set(mapped._sort_indexes) == set(SORTABLE_COLUMNS)
+    assert not mapped.numeric['height'].flags.writeable and not mapped.footprints.coords.flags.writeable
+
+
+def test_empty_store_round_trip(tmp_path):
+    path = str(tmp_path / 'empty.snapshot')
+    write_snapshot(BuildingStore.empty(), path)
+    mapped = read_snapshot(path)
+    assert len(mapped) == 0 and len(mapped.rows_in_bbox(-180, -90, 180, 90)) == 0
+
+
+@pytest.fixture
+def shared(monkeypatch, tmp_path):
+    """The module's shared store in snapshot mode, as a fresh worker process starts it."""
+    monkeypatch.setattr(building_store, '_store', None)
+    monkeypatch.setattr(building_store, '_snapshot_stamp', None)
+    monkeypatch.setattr(building_store, '_snapshot_checked', 0.0)
+    monkeypatch.setattr(building_store, 'SNAPSHOT_CHECK_SECONDS', 0)
+    source = tmp_path / 'city.geojson'
+    source.write_text(json.dumps({'type': 'FeatureCollection', 'features': synthetic_features(200)}))
+    return str(source), str(tmp_path / 'city.snapshot')
+
+
+def test_workers_map_one_snapshot_and_follow_uploads(shared):
+    source, snapshot = shared
+    # The first worker to start builds the missing snapshot from the city file
+    store = building_store.get_building_store(source, snapshot)
+    assert len(store) == 200 and not store.numeric['height'].flags.writeable
+    assert building_store.get_building_store(source, snapshot) is store
+
+    # Another worker uploads a city and writes it over the snapshot: this worker maps the new file
+    uploaded = BuildingStore.from_geojson({'type': 'FeatureCollection', 'features': synthetic_features(50, seed=1)})
+    build_indexes(uploaded)
+    write_snapshot(uploaded, snapshot)
+    remapped = building_store.get_building_store(source, snapshot)
+    assert remapped is not store and len(remapped) == 50
+    assert_same_answers(uploaded, remapped)
+
+
+def corrupt(path, offset):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xff]))
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = str(tmp_path / 'city.snapshot')
+    write_snapshot(city(), path)
+    return path
+
+
+def test_corrupt_array_is_rejected(snapshot):
+    corrupt(snapshot, read_manifest(snapshot)['arrays']['numeric/height']['offset'] + 3)
+    with pytest.raises(SnapshotError, match='numeric/height'):
+        read_snapshot(snapshot)
+    # Without verification the mapping is trusted as written
+    assert len(read_snapshot(snapshot, verify=False)) == 500
+
+
+@pytest.mark.parametrize('damage, message', [
+    (lambda path: corrupt(path, HEADER.size + 5), 'corrupt manifest'),
+    (lambda path: corrupt(path, 0), 'not a store snapshot'),
+    (lambda path: corrupt(path, 4), 'version'),
+    (lambda path: os.truncate(path, os.path.getsize(path) - 100), 'truncated'),
+    (lambda path: os.truncate(path, HEADER.size - 1), 'too short'),
+    (lambda path: os.truncate(path, 0), 'empty'),
+])
+def test_damaged_files_are_rejected(snapshot, damage, message):
+    damage(snapshot)
+    with pytest.raises(SnapshotError, match=message):
+        read_snapshot(snapshot)
+
+
+def test_stale_or_invalid_snapshots_are_rebuilt(tmp_path):
+    source = tmp_path / 'city.geojson'
+    source.write_text(json.dumps({'type': 'FeatureCollection', 'features': synthetic_features(100)}))
+    source, snapshot = str(source), str(tmp_path / 'city.snapshot')
+    assert refresh_snapshot(source, snapshot)
+    assert is_current(snapshot, source) and not refresh_snapshot(source, snapshot)
+    assert main(['check', snapshot, '--source', source]) == 0
+
+    # The city file changes: the snapshot is stale until rebuilt from it
+    with open(source, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': synthetic_features(120)}, f)
+    assert not is_current(snapshot, source)
+    assert main(['check', snapshot, '--source', source]) == 2
+    assert refresh_snapshot(source, snapshot) and len(read_snapshot(snapshot)) == 120
+
+    # A current snapshot that fails its checksums is rebuilt too
+    corrupt(snapshot, read_manifest(snapshot)['arrays']['ids']['offset'])
+    assert is_current(snapshot, source)
+    assert main(['check', snapshot]) == 1
+    assert refresh_snapshot(source, snapshot) and len(read_snapshot(snapshot)) == 120
+
+
+def test_worker_rebuilds_an_invalid_snapshot(shared):
+    source, snapshot = shared
+    with open(snapshot, 'wb') as f:
+        f.write(b'not a snapshot at all' * 10)
+    store = building_store.get_building_store(source, snapshot)
+    assert len(store) == 200 and len(read_snapshot(snapshot)) == 200
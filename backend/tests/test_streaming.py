@@ -0,0 +1,112 @@
+"""Server-Sent Event framing of the streamed routes, and their fallbacks when Gemini's answer is unusable."""
+import json
+
+import pytest
+
+import llm_backends
+from llm_backends import STUB_RESPONSES, StubBackend
+from prompts import parse_query_response, summary_fallback
+from streaming import JSONFieldStream, SourcesSplitter, sse_event
+
+BUILDING = {'id': 'way/7', 'name': 'Historic Hall', 'type': 'residential', 'levels': '4', 'height': '14'}
+SUMMARY = json.loads(STUB_RESPONSES['SUMMARY'])
+
+
+class FailingStream(StubBackend):
+    """Streams the first part of an answer, then fails like a dropped upstream connection."""
+    def stream(self, prompt, label=None):
+        yield self.respond(prompt, label)[:20]
+        raise ConnectionError('upstream closed the stream')
+
+
+def events(response):
+    """The (event, data) pairs of an SSE body, checking every frame is well formed."""
+    assert response.mimetype == 'text/event-stream'
+    body = response.get_data(as_text=True)
+    # Closing the response frees its admission slot
+    response.close()
+    assert body.endswith('\n\n')
+    parsed = []
+    for frame in body[:-2].split('\n\n'):
+        event, data = frame.split('\n')
+        assert event.startswith('event: ') and data.startswith('data: ')
+        parsed.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return parsed
+
+
+def test_sse_event_frame():
+    assert sse_event('token', {"text": "a\nb"}) == 'event: token\ndata: {"text": "a\\nb"}\n\n'
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 1000])
+def test_sources_splitter_matches_full_parse(chunk_size):
+    text = STUB_RESPONSES['QUERY']
+    splitter = SourcesSplitter()
+    answer, sources = '', []
+    for i in range(0, len(text), chunk_size):
+        released, completed = splitter.feed(text[i:i + chunk_size])
+        answer += released
+        sources += completed
+    released, completed = splitter.finish()
+    expected = parse_query_response(text)
+    assert ((answer + released).strip(), sources + completed) == (expected['response'], expected['sources'])
+
+
+def test_json_field_stream_releases_complete_fields():
+    text = STUB_RESPONSES['SUMMARY']
+    fields = JSONFieldStream()
+    released = []
+    for i in range(0, len(text), 5):
+        released += fields.feed(text[i:i + 5])
+    assert dict(released) == SUMMARY
+    assert [key for key, _ in released] == list(SUMMARY)
+
+
+def test_query_stream_frames(client, stub):
+    stub(chunk_size=4)
+    streamed = events(client.post('/api/query/stream', json={'query': 'What shaped downtown?'}))
+    kinds = [event for event, _ in streamed]
+    assert kinds[-1] == 'done' and set(kinds[:-1]) == {'token', 'source'}
+    done = streamed[-1][1]
+    assert done == parse_query_response(STUB_RESPONSES['QUERY'])
+    assert ''.join(data['text'] for event, data in streamed if event == 'token').strip() == done['response']
+    assert [data['source'] for event, data in streamed if event == 'source'] == done['sources']
+
+
+def test_summary_stream_frames_then_cache(client, stub):
+    backend = stub(chunk_size=16)
+    streamed = events(client.post('/api/summary/stream', json={'building_data': BUILDING}))
+    assert streamed[-1] == ('done', SUMMARY)
+    assert [data for event, data in streamed[:-1]] == [{'key': k, 'value': v} for k, v in SUMMARY.items()]
+
+    # The parsed summary was cached, so the next stream sends it without calling Gemini
+    assert events(client.post('/api/summary/stream', json={'building_data': BUILDING})) == streamed
+    assert backend.calls == ['SUMMARY']
+
+
+def test_summary_stream_falls_back_on_unparseable_answer(client, stub):
+    stub({'SUMMARY': 'I am unable to summarize this building.'})
+    streamed = events(client.post('/api/summary/stream', json={'building_data': BUILDING}))
+    fallback = summary_fallback(BUILDING)
+    assert streamed[-1] == ('done', fallback)
+    assert {data['key']: data['value'] for event, data in streamed if event == 'field'} == fallback
+
+
+@pytest.mark.parametrize('route, body', [
+    ('/api/summary/stream', {'building_data': BUILDING}),
+    ('/api/query/stream', {'query': 'What shaped downtown?'}),
+])
+def test_stream_failure_ends_with_error_event(client, stub, route, body):
+    stub()
+    llm_backends.set_backend(FailingStream())
+    streamed = events(client.post(route, json=body))
+    assert streamed[-1] == ('error', {'error': 'upstream closed the stream'})
+    assert 'done' not in [event for event, _ in streamed]
+
+
+
+def test_streams_free_their_admission_slots(app_module, client, stub):
+    stub()
+    for _ in range(app_module.admission.max_concurrency + 1):
+        events(client.post('/api/query/stream', json={'query': 'What shaped downtown?'}))
+    assert app_module.admission.stats()['active'] == 0
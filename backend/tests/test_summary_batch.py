@@ -0,0 +1,68 @@
+"""/api/summary/batch packing buildings into shared prompts and recovering from packed answers it cannot use."""
+import json
+
+from bench.synthetic import synthetic_buildings
+from llm_backends import STUB_RESPONSES
+
+SUMMARY = json.loads(STUB_RESPONSES['SUMMARY'])
+
+
+def summarize(client, buildings):
+    response = client.post('/api/summary/batch', json={'buildings': buildings})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_buildings_are_packed_into_shared_prompts(app_module, client, stub):
+    backend = stub()
+    buildings = synthetic_buildings(2 * app_module.SUMMARY_PACK_SIZE + 2)
+    body = summarize(client, buildings)
+    assert backend.calls == ['PACKED SUMMARY'] * 3
+    assert (body['count'], body['failed']) == (len(buildings), 0)
+    assert [entry['id'] for entry in body['results']] == [b['id'] for b in buildings]
+    assert all(entry['result'] == SUMMARY for entry in body['results'])
+
+
+def test_repeats_and_cached_buildings_cost_no_prompt(client, stub):
+    backend = stub()
+    buildings = synthetic_buildings(3)
+    summarize(client, buildings[:2])
+    body = summarize(client, buildings + buildings)
+    # Only the one building not summarized before needs Gemini, on a prompt of its own
+    assert backend.calls == ['PACKED SUMMARY', 'SUMMARY']
+    assert body['count'] == 6 and body['failed'] == 0
+
+
+def test_buildings_with_context_get_their_own_prompt(client, stub):
+    backend = stub()
+    buildings = synthetic_buildings(3)
+    buildings[0]['building_context'] = {'estimatedYear': 1912, 'architecturalStyle': 'Edwardian'}
+    summarize(client, buildings)
+    assert sorted(backend.calls) == ['PACKED SUMMARY', 'SUMMARY']
+
+
+def test_malformed_packed_answer_falls_back_to_single_prompts(client, stub):
+    backend = stub({'PACKED SUMMARY': 'Here are your summaries: {not json'})
+    buildings = synthetic_buildings(3)
+    body = summarize(client, buildings)
+    assert backend.calls == ['PACKED SUMMARY'] + ['SUMMARY'] * 3
+    assert body['failed'] == 0
+    assert all(entry['result'] == SUMMARY for entry in body['results'])
+
+
+def test_buildings_missing_from_a_packed_answer_are_retried(client, stub):
+    buildings = synthetic_buildings(3)
+    partial = {buildings[0]['id']: dict(SUMMARY, summary='Packed'), 'someone-else': SUMMARY}
+    backend = stub({'PACKED SUMMARY': json.dumps(partial)})
+    body = summarize(client, buildings)
+    assert backend.calls == ['PACKED SUMMARY', 'SUMMARY', 'SUMMARY']
+    summaries = [entry['result']['summary'] for entry in body['results']]
+    assert summaries == ['Packed', SUMMARY['summary'], SUMMARY['summary']]
+
+
+def test_too_many_buildings_is_rejected(app_module, client, stub):
+    backend = stub()
+    response = client.post('/api/summary/batch', json={'buildings': synthetic_buildings(
+        app_module.SUMMARY_BATCH_MAX_BUILDINGS + 1)})
+    assert response.status_code == 400
+    assert backend.calls == []
@@ -0,0 +1,40 @@
+"""Trigram lookups against a plain scan of the indexed strings."""
+import random
+
+import numpy as np
+import pytest
+
+from bench.synthetic import NAMES, STREETS
+from text_index import TrigramIndex
+
+QUERIES = ['tower', 'TOWER', 'hall', 'ha', 'h', '', 'place', 'avenue sw', ' s', 'eighth avenue place', 'xyz', 'll ',
+           '17 av', 'centre street 1']
+
+
+@pytest.fixture(scope='module')
+def values():
+    rng = random.Random(3)
+    words = list(NAMES) + list(STREETS)
+    return [f"{rng.choice(words)} {rng.randint(1, 300)}" if rng.random() < 0.5 else rng.choice(words)
+            for _ in range(2000)]
+
+
+@pytest.fixture(scope='module', params=['built', 'restored'])
+def index(request, values):
+    index = TrigramIndex(values)
+    if request.param == 'restored':
+        arrays, grams = index.state()
+        index = TrigramIndex.restore(index.values, grams, arrays)
+    return index
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_contains_matches_scan(index, values, query):
+    expected = [i for i, value in enumerate(values) if query.lower() in value.lower()]
+    assert np.array_equal(index.contains(query), expected)
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_prefix_matches_scan(index, values, query):
+    expected = [i for i, value in enumerate(values) if value.lower().startswith(query.lower())]
+    assert np.array_equal(index.prefix(query), expected)
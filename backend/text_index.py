@@ -0,0 +1,160 @@
+"""
+Trigram index over the distinct values of the building store's text columns.
+
+Every value is lowercased and prefixed with a start marker, and each of its
+three-character substrings (trigrams) maps to a posting list of the value ids
+containing it. A substring query only verifies the values present in the
+posting lists of all of its trigrams; a prefix query also requires the
+trigram made of the start marker and the query's first two characters.
+Fuzzy lookups rank values by trigram similarity (shared trigrams over the
+union of both sets, as in PostgreSQL's pg_trgm).
+
+Ids are assigned in insertion order, so posting lists stay sorted as values
+are added and the index can be filled while a city is being loaded.
+"""
+from array import array
+
+import numpy as np
+
+# Marks the start of a value, so prefixes have trigrams of their own
+START = '\x02'
+
+# Default similarity needed for a fuzzy match
+FUZZY_THRESHOLD = 0.3
+
+
+def trigrams(text):
+    """Set of the three-character substrings of a string."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """
+    Trigram posting lists over a growing list of strings.
+
+    Args:
+        values (iterable): Initial strings; ids follow their order.
+    """
+    def __init__(self, values=()):
+        self.values = []
+        self.postings = {}
+        self.sizes = array('i')
+        for value in values:
+            self.add(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    def state(self):
+        """
+        The index as flat arrays, for saving in a snapshot.
+
+        Returns:
+            tuple: (arrays, grams): the 'postings' of every trigram
+            concatenated, their 'offsets' and the values' trigram 'sizes',
+            and the trigrams in the order of `offsets`.
+        """
+        grams = list(self.postings)
+        lists = [np.frombuffer(self.postings[gram], dtype=np.int32) for gram in grams]
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(postings) for postings in lists], out=offsets[1:])
+        postings = np.concatenate(lists) if lists else np.zeros(0, dtype=np.int32)
+        return {'postings': postings, 'offsets': offsets, 'sizes': np.frombuffer(self.sizes, dtype=np.int32)}, grams
+
+    @classmethod
+    def restore(cls, values, grams, arrays):
+        """
+        Rebuild an index from state() without re-tokenizing its values.
+
+        The posting lists are views of the given arrays, so a restored index
+        is read-only: add() is not supported.
+        """
+        index = cls.__new__(cls)
+        index.values = values
+        postings, offsets = arrays['postings'], arrays['offsets'].tolist()
+        index.postings = {gram: postings[offsets[i]:offsets[i + 1]] for i, gram in enumerate(grams)}
+        index.sizes = arrays['sizes']
+        return index
+
+    def add(self, value):
+        """
+        Index one more string. Must not run concurrently with lookups.
+
+        Returns:
+            int: The string's id.
+        """
+        text = str(value).lower()
+        value_id = len(self.values)
+        self.values.append(text)
+        grams = trigrams(START + text)
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings is None:
+                postings = self.postings[gram] = array('i')
+            postings.append(value_id)
+        self.sizes.append(len(grams))
+        return value_id
+
+    def _candidates(self, grams):
+        """Ids whose posting lists include every trigram, shortest list first."""
+        lists = []
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings is None:
+                return []
+            lists.append(postings)
+        lists.sort(key=len)
+        candidates = np.frombuffer(lists[0], dtype=np.int32)
+        for postings in lists[1:]:
+            candidates = np.intersect1d(candidates, np.frombuffer(postings, dtype=np.int32), assume_unique=True)
+            if len(candidates) == 0:
+                break
+        return candidates.tolist()
+
+    def contains(self, query):
+        """
+        Ids of the strings containing a substring, case-insensitively.
+
+        Returns:
+            numpy.ndarray: Matching ids, ascending.
+        """
+        target = str(query).lower()
+        if len(target) < 3:
+            # No trigram to look up: scan the distinct values
+            matches = [i for i, text in enumerate(self.values) if target in text]
+        else:
+            matches = [i for i in self._candidates(trigrams(target)) if target in self.values[i]]
+        return np.asarray(matches, dtype=np.int64)
+
+    def prefix(self, query):
+        """Ids of the strings starting with a prefix, case-insensitively."""
+        target = str(query).lower()
+        if len(target) < 2:
+            matches = [i for i, text in enumerate(self.values) if text.startswith(target)]
+        else:
+            matches = [i for i in self._candidates(trigrams(START + target)) if self.values[i].startswith(target)]
+        return np.asarray(matches, dtype=np.int64)
+
+    def similar(self, query, threshold=FUZZY_THRESHOLD):
+        """
+        Strings sharing enough trigrams with the query, for typo-tolerant matching.
+
+        Args:
+            query (str): The text to match.
+            threshold (float): Minimum similarity, from 0 to 1.
+
+        Returns:
+            tuple: (ids, similarities), most similar first.
+        """
+        grams = trigrams(START + str(query).lower())
+        lists = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not lists:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        ids, shared = np.unique(np.concatenate([np.frombuffer(p, dtype=np.int32) for p in lists]),
+                                return_counts=True)
+        sizes = np.frombuffer(self.sizes, dtype=np.int32)[ids]
+        similarity = shared / (len(grams) + sizes - shared)
+        keep = similarity >= threshold
+        ids, similarity = ids[keep].astype(np.int64), similarity[keep]
+        order = np.argsort(-similarity, kind='stable')
+        return ids[order], similarity[order]
@@ -6,7 +6,7 @@ import { coordsToShape, normalizeCoordinates, calculateCenter, checkBuildingColl
 import { BuildingInfo } from './BuildingInfo';
 import { BuildingOutline } from './BuildingOutline';
 import { getBuildingSummary, preloadBuildingSummaries, BuildingFilter, isBuildingSummaryCached } from '../services/llmService';
-import { checkOverpassRateLimit, trackOverpassRequest, getCachedOverpassData, cacheOverpassData } from '../services/overpassService';
+import { checkOverpassRateLimit, trackOverpassRequest, getCachedOverpassData, cacheOverpassData, fetchOverpassTiles } from '../services/overpassService';
 // import type { GeoJSONFeature } from '../types';
 import type { ThreeEvent } from '@react-three/fiber';
 
@@ -234,6 +234,15 @@ export function Buildings({ filters = [], onFilteredCountChange, onBuildingSelec
   useEffect(() => {
     async function fetchBuildings() {
       try {
+        // Prefer the backend's shared tile cache; fall back to querying Overpass directly
+        try {
+          const tileData = await fetchOverpassTiles('buildings', [51.040, -114.080, 51.052, -114.055]);
+          processBuildings(tileData);
+          return;
+        } catch (error) {
+          console.warn('Tile cache unavailable, querying Overpass directly:', error);
+        }
+
         // Check if we have cached data first
         const cachedData = getCachedOverpassData('buildings');
         if (cachedData) {
@@ -2,7 +2,7 @@ import React, { useEffect, useState } from 'react';
 import * as THREE from 'three';
 import axios from 'axios';
 import { coordsToShape, normalizeCoordinates, calculateCenter } from '../utils/geometry';
-import { checkOverpassRateLimit, trackOverpassRequest, getCachedOverpassData, cacheOverpassData } from '../services/overpassService';
+import { checkOverpassRateLimit, trackOverpassRequest, getCachedOverpassData, cacheOverpassData, fetchOverpassTiles } from '../services/overpassService';
 
 export function Roads() {
   const [roads, setRoads] = useState<THREE.Group[]>([]);
@@ -10,6 +10,15 @@ export function Roads() {
   useEffect(() => {
     async function fetchRoads() {
       try {
+        // Prefer the backend's shared tile cache; fall back to querying Overpass directly
+        try {
+          const tileData = await fetchOverpassTiles('roads', [51.039, -114.089, 51.051, -114.051]);
+          processRoads(tileData);
+          return;
+        } catch (error) {
+          console.warn('Tile cache unavailable, querying Overpass directly:', error);
+        }
+
         // Check if we have cached data first
         const cachedData = getCachedOverpassData('roads');
         if (cachedData) {
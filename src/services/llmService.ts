@@ -163,9 +163,11 @@ export interface BuildingSummaryResponse {
 	zoning: string;
 }
 
-// Get AI-generated summary for a building
+// Get AI-generated summary for a building; background prefetches pass "prefetch"
+// so the backend serves clicked buildings and filter queries first
 export async function getBuildingSummary(
-	buildingData: any
+	buildingData: any,
+	priority: "interactive" | "prefetch" = "interactive"
 ): Promise<BuildingSummaryResponse> {
 	// Generate a cache key based on building ID and type
 	const buildingId =
@@ -189,50 +191,8 @@ export async function getBuildingSummary(
 	try {
 		trackRequest();
 
-		// Check if we need to get contextual information for this building
-		let estimatedYear = "unknown";
-		let buildingContext = null;
-
-		// Only fetch context if year_built is unknown
-		if (!buildingData.start_date) {
-			try {
-				// Prepare context request payload
-				const contextPayload = {
-					name: buildingData.name || "Unknown",
-					type: buildingData.building || "commercial",
-					query_type: "comprehensive", // Request all available information
-				};
-
-				// Log context request if debug is enabled
-				if (DEBUG_API_CALLS) {
-					console.log("Requesting building context:", contextPayload);
-				}
-
-				// Make API call to get building context
-				const contextResponse = await apiClient.post(
-					"/api/building-context",
-					contextPayload
-				);
-				buildingContext = contextResponse.data;
-
-				// Use the estimated year if available
-				if (
-					buildingContext &&
-					buildingContext.estimatedYear &&
-					buildingContext.estimatedYear > 0
-				) {
-					estimatedYear = buildingContext.estimatedYear.toString();
-					console.log(
-						`Using estimated year ${estimatedYear} for building ${buildingId}`
-					);
-				}
-			} catch (error) {
-				console.error("Error fetching building context:", error);
-				// Continue with unknown year if context fetch fails
-			}
-		}
-
-		// Prepare the request payload
+		// One request: the backend looks up the building context (only when the
+		// year is unknown) and generates the summary alongside it
 		const payload = {
 			building_data: {
 				id: buildingData.id || "unknown",
@@ -248,43 +208,56 @@ export async function getBuildingSummary(
 				amenity: buildingData.amenity || "",
 				shop: buildingData.shop || "",
 				office: buildingData.office || "",
-				year_built: buildingData.start_date || estimatedYear,
+				year_built: buildingData.start_date || "unknown",
 				material: buildingData.material || "concrete",
 				roof_shape: buildingData["roof:shape"] || "flat",
 				"addr:street": buildingData["addr:street"] || "",
 				"addr:housenumber": buildingData["addr:housenumber"] || "",
-				building_context: buildingContext,
+			},
+			context: {
+				name: buildingData.name || "Unknown",
+				type: buildingData.building || "commercial",
+				query_type: "comprehensive", // Request all available information
 			},
 		};
 
 		// Log API call if debug is enabled
 		if (DEBUG_API_CALLS) {
-			console.log("Sending building summary request:", payload);
+			console.log("Sending building details request:", payload);
 		}
 
 		// Make API call to backend
-		const response = await apiClient.post("/api/summary", payload);
+		const response = await apiClient.post("/api/building/details", payload, {
+			headers: { "X-Request-Priority": priority },
+		});
 
 		// Log response if debug is enabled
 		if (DEBUG_API_CALLS) {
-			console.log("Building summary response:", response.data);
+			console.log("Building details response:", response.data);
+		}
+
+		const summary: BuildingSummaryResponse = response.data.summary;
+
+		// A fallback sent because the backend was overloaded is not cached, so the next request retries
+		if (response.headers["x-load-shed"]) {
+			return summary;
 		}
 
 		// Cache the response
 		buildingSummaryCache[cacheKey] = {
-			data: response.data,
+			data: summary,
 			timestamp: now,
 		};
 
 		// Also cache by ID only for backward compatibility
 		if (buildingId !== cacheKey) {
 			buildingSummaryCache[buildingId] = {
-				data: response.data,
+				data: summary,
 				timestamp: now,
 			};
 		}
 
-		return response.data;
+		return summary;
 	} catch (error) {
 		console.error("Error fetching building summary:", error);
 
@@ -434,7 +407,7 @@ export async function preloadBuildingSummaries(
 				}
 
 				// Fetch with low priority
-				await getBuildingSummary(building);
+				await getBuildingSummary(building, "prefetch");
 			} catch (error) {
 				// Silently fail for preloading
 				console.log("Error preloading building summary:", error);
@@ -2,6 +2,8 @@
 // This service helps prevent overuse of the Overpass API by implementing
 // rate limiting and caching mechanisms
 
+import axios from "axios";
+
 // No rate limiting - unlimited usage
 const MAX_REQUESTS_PER_HOUR = 999999; // Effectively unlimited
 const STORAGE_KEY_HOURLY_COUNT = "overpass_hourly_request_count";
@@ -126,3 +128,45 @@ export function cacheOverpassData(
 		console.error(`Error caching ${type} data:`, error);
 	}
 }
+
+// Zoom level of the backend's shared Overpass tile cache
+const OSM_TILE_ZOOM = 15;
+
+// Slippy-map tile containing a point
+function lonLatToTile(lon: number, lat: number, zoom: number): [number, number] {
+	const n = 2 ** zoom;
+	const x = Math.floor(((lon + 180) / 360) * n);
+	const latRad = (lat * Math.PI) / 180;
+	const y = Math.floor(((1 - Math.asinh(Math.tan(latRad)) / Math.PI) / 2) * n);
+	return [Math.min(Math.max(x, 0), n - 1), Math.min(Math.max(y, 0), n - 1)];
+}
+
+// Fetch a bounding box from the backend's tile cache (/api/osm/tiles) and merge
+// the tiles into one Overpass-style response. Elements that cross tile borders
+// appear in several tiles and are de-duplicated. Tiles are cached by the
+// browser through their ETag/Cache-Control headers instead of localStorage.
+export async function fetchOverpassTiles(
+	layer: "buildings" | "roads",
+	bbox: [number, number, number, number], // south, west, north, east
+	zoom: number = OSM_TILE_ZOOM
+): Promise<{ elements: any[] }> {
+	const [south, west, north, east] = bbox;
+	const [x0, y0] = lonLatToTile(west, north, zoom);
+	const [x1, y1] = lonLatToTile(east, south, zoom);
+
+	const requests = [];
+	for (let x = x0; x <= x1; x++) {
+		for (let y = y0; y <= y1; y++) {
+			requests.push(axios.get(`/api/osm/tiles/${zoom}/${x}/${y}`, { params: { layer } }));
+		}
+	}
+	const responses = await Promise.all(requests);
+
+	const elements = new Map<string, any>();
+	responses.forEach((response) => {
+		(response.data.elements || []).forEach((element: any) => {
+			elements.set(`${element.type}/${element.id}`, element);
+		});
+	});
+	return { elements: Array.from(elements.values()) };
+}
@@ -0,0 +1,104 @@
+import * as THREE from 'three';
+import axios from 'axios';
+
+// Binary building mesh tiles from /api/buildings/mesh (see backend/mesh_builder.py)
+const MAGIC = 'CMSH';
+const FORMAT_VERSION = 1;
+const HEADER_BYTES = 40;
+const BUILDING_BYTES = 32;
+
+export interface MeshTileBuilding {
+  id: number;
+  row: number;
+  vertexStart: number;
+  vertexCount: number;
+  indexStart: number;
+  indexCount: number;
+  height: number;
+}
+
+export interface MeshTile {
+  center: [number, number];
+  buildings: MeshTileBuilding[];
+  positions: Float32Array;
+  indices: Uint32Array;
+}
+
+export function decodeMeshTile(buffer: ArrayBuffer): MeshTile {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== MAGIC || view.getUint16(4, true) !== FORMAT_VERSION) {
+    throw new Error(`Not a version ${FORMAT_VERSION} mesh tile`);
+  }
+
+  const center: [number, number] = [view.getFloat64(8, true), view.getFloat64(16, true)];
+  const buildingCount = view.getUint32(24, true);
+  const vertexCount = view.getUint32(28, true);
+  const indexCount = view.getUint32(32, true);
+
+  const buildings: MeshTileBuilding[] = [];
+  for (let i = 0; i < buildingCount; i++) {
+    const offset = HEADER_BYTES + i * BUILDING_BYTES;
+    buildings.push({
+      id: Number(view.getBigInt64(offset, true)),
+      row: view.getInt32(offset + 8, true),
+      vertexStart: view.getUint32(offset + 12, true),
+      vertexCount: view.getUint32(offset + 16, true),
+      indexStart: view.getUint32(offset + 20, true),
+      indexCount: view.getUint32(offset + 24, true),
+      height: view.getFloat32(offset + 28, true),
+    });
+  }
+
+  // Buffers are 4-byte aligned, so they are viewed in place without copying
+  const positionsOffset = HEADER_BYTES + buildingCount * BUILDING_BYTES;
+  const positions = new Float32Array(buffer, positionsOffset, vertexCount * 3);
+  const indices = new Uint32Array(buffer, positionsOffset + vertexCount * 12, indexCount);
+  return { center, buildings, positions, indices };
+}
+
+// Geometry in the ExtrudeGeometry frame: rotate by -PI / 2 around x to stand it upright
+export function meshTileGeometry(tile: MeshTile): THREE.BufferGeometry {
+  const geometry = new THREE.BufferGeometry();
+  geometry.setAttribute('position', new THREE.BufferAttribute(tile.positions, 3));
+  geometry.setIndex(new THREE.BufferAttribute(tile.indices, 1));
+  geometry.computeVertexNormals();
+  return geometry;
+}
+
+// Building hit by a raycast, from the intersection's faceIndex
+export function buildingAtFace(tile: MeshTile, faceIndex: number): MeshTileBuilding | undefined {
+  const index = faceIndex * 3;
+  let low = 0;
+  let high = tile.buildings.length - 1;
+  while (low <= high) {
+    const mid = (low + high) >> 1;
+    const building = tile.buildings[mid];
+    if (index < building.indexStart) {
+      high = mid - 1;
+    } else if (index >= building.indexStart + building.indexCount) {
+      low = mid + 1;
+    } else {
+      return building;
+    }
+  }
+  return undefined;
+}
+
+// The level of detail follows the zoom unless `lod` or the camera `distance` (scene units) is given
+export async function fetchMeshTile(
+  z: number,
+  x: number,
+  y: number,
+  options: { center?: [number, number]; lod?: number; distance?: number } = {}
+): Promise<MeshTile> {
+  const response = await axios.get(`/api/buildings/mesh/${z}/${x}/${y}`, {
+    params: {
+      center: options.center?.join(','),
+      lod: options.lod,
+      distance: options.distance,
+    },
+    responseType: 'arraybuffer',
+  });
+  return decodeMeshTile(response.data);
+}